@@ -375,13 +375,10 @@ def clear_perm_cache(_env, _req):
   r"""Ensure that cache policies will not prevent test cases from 
   altering user permissions right away.
   """
-  from trac.perm import PermissionSystem, DefaultPermissionPolicy
+  from trac.perm import PermissionSystem
 
   _req.perm._cache.clear()            # Clear permission cache
-  for policy in PermissionSystem(_env).policies :
-    if isinstance(policy, DefaultPermissionPolicy):
-      policy.permission_cache.clear() # Clear policy cache
-      break
+  PermissionSystem(_env).invalidate_cache() # Clear shared policy cache
 
 #------------------------------------------------------
 #    Global test data
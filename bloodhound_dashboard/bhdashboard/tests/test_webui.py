@@ -124,3 +124,154 @@ __test__ = {
       """,
   }
 
+#------------------------------------------------------
+#    Concurrent rendering and widgets cache
+#------------------------------------------------------
+
+import threading
+import unittest
+
+from genshi.core import Markup
+from trac.test import EnvironmentStub, Mock, MockPerm
+from trac.util.datefmt import utc
+from trac.web.href import Href
+
+from bhdashboard.web_ui import WidgetRenderCache
+
+class DummyWidget(object):
+  r"""Widget provider recording the threads rendering its widgets.
+  """
+  def __init__(self, delay=None):
+    self.threads = set()
+    self.delay = delay
+    self.calls = 0
+    self.release = threading.Event()
+
+  def render_widget(self, name, context, options):
+    self.calls += 1
+    self.threads.add(threading.currentThread().getName())
+    if self.delay is not None:
+      self.release.wait(self.delay)
+    return 'widget.html', {'title': name, 'data': {'text': name}}, context
+
+class WidgetRenderingTestCase(unittest.TestCase):
+  def setUp(self):
+    self.env = EnvironmentStub(enable=['trac.*', 'bhdashboard.web_ui.*'])
+    self.dbm = DashboardModule(self.env)
+    self.dbm._render_markup = lambda req, template, data: \
+        Markup(data.get('text', template))
+
+  def tearDown(self):
+    if self.dbm._pool is not None:
+      self.dbm._pool.terminate()
+    self.env.reset_db()
+
+  def _request(self, authname='anonymous', sid='sid1', token='token1'):
+    return Mock(authname=authname, perm=MockPerm(), href=Href('/trac'),
+                abs_href=Href('http://example.org/trac'), chrome={}, 
+                session=Mock(sid=sid), tz=utc, locale=None, 
+                form_token=token)
+
+  def test_render_in_pool(self):
+    wp = DummyWidget()
+    results = self.dbm._render_widgets(self._request(), 
+                                       [('w1', wp, {}), ('w2', wp, {})])
+    self.assertEqual(['w1', 'w2'], [r['content'] for r in results])
+    self.assertTrue(threading.currentThread().getName() not in wp.threads)
+
+  def test_render_sequentially(self):
+    self.env.config.set('widgets', 'render_threads', '0')
+    wp = DummyWidget()
+    results = self.dbm._render_widgets(self._request(), 
+                                       [('w1', wp, {}), ('w2', wp, {})])
+    self.assertEqual(['w1', 'w2'], [r['content'] for r in results])
+    self.assertEqual(set([threading.currentThread().getName()]), 
+                     wp.threads)
+    self.assertEqual(None, self.dbm._pool)
+
+  def test_pool_resized(self):
+    wp = DummyWidget()
+    self.dbm._render_widgets(self._request(), [('w1', wp, {}), 
+                                               ('w2', wp, {})])
+    pool = self.dbm._pool
+    self.env.config.set('widgets', 'render_threads', '2')
+    self.dbm._render_widgets(self._request(), [('w1', wp, {}), 
+                                               ('w2', wp, {})])
+    self.assertNotEqual(pool, self.dbm._pool)
+    self.assertEqual(2, self.dbm._pool_size)
+
+  def test_timeout(self):
+    self.env.config.set('widgets', 'render_timeout', '0.1')
+    slow = DummyWidget(delay=10)
+    try:
+      results = self.dbm._render_widgets(self._request(), 
+                                         [('w1', slow, {}), 
+                                          ('w2', DummyWidget(), {})])
+      self.assertEqual(Markup('widget_alert.html'), results[0]['content'])
+      self.assertEqual('w2', results[1]['content'])
+      # Widgets rendered afterwards do not wait for the slow one
+      results = self.dbm._render_widgets(self._request(), 
+                                         [('w3', DummyWidget(), {}), 
+                                          ('w4', DummyWidget(), {})])
+      self.assertEqual(['w3', 'w4'], [r['content'] for r in results])
+    finally:
+      slow.release.set()
+
+  def test_stuck_widget_bounded_threads(self):
+    self.env.config.set('widgets', 'render_threads', '2')
+    self.env.config.set('widgets', 'render_timeout', '0.05')
+    stuck = DummyWidget(delay=10)
+    threads = threading.activeCount()
+    try:
+      for i in range(5):
+        results = self.dbm._render_widgets(self._request(), 
+                                           [('w1', stuck, {}), 
+                                            ('w2', stuck, {}), 
+                                            ('w3', DummyWidget(), {})])
+        self.assertEqual(Markup('widget_alert.html'), results[0]['content'])
+      # The stuck widgets occupy the two threads of the single pool, 
+      # further widgets are not submitted while it is saturated
+      self.assertEqual(2, stuck.calls)
+      self.assertEqual(Markup('widget_alert.html'), results[2]['content'])
+      self.assertTrue(threading.activeCount() <= threads + 2 + 3)
+    finally:
+      stuck.release.set()
+    self.dbm._pool.close()
+    self.dbm._pool.join()
+    self.assertEqual(0, self.dbm._pool_busy)
+
+  def test_cache(self):
+    cache = WidgetRenderCache(self.env).get_cache()
+    wp = DummyWidget()
+    req = self._request('joe')
+    self.dbm._render_widgets(req, [('w1', wp, {}), ('w2', wp, {})], cache)
+    self.dbm._render_widgets(req, [('w1', wp, {}), ('w2', wp, {})], cache)
+    self.assertEqual(2, wp.calls)
+    WidgetRenderCache(self.env).invalidate()
+    cache = WidgetRenderCache(self.env).get_cache()
+    self.dbm._render_widgets(req, [('w1', wp, {})], cache)
+    self.assertEqual(3, wp.calls)
+
+  def test_cache_per_session(self):
+    rc = WidgetRenderCache(self.env)
+    key = rc.make_key(self._request('joe'), 'w1', {})
+    self.assertNotEqual(key, 
+        rc.make_key(self._request('jim'), 'w1', {}))
+    self.assertNotEqual(key, 
+        rc.make_key(self._request('joe', token='token2'), 'w1', {}))
+    self.assertEqual(key, rc.make_key(self._request('joe'), 'w1', {}))
+    # Anonymous users are not cached
+    self.assertEqual(None, rc.make_key(self._request(), 'w1', {}))
+
+  def test_cache_lru(self):
+    rc = WidgetRenderCache(self.env)
+    rc.MAX_ENTRIES = 2
+    cache = rc.get_cache()
+    rc.store(cache, 'k1', 'r1')
+    rc.store(cache, 'k2', 'r2')
+    self.assertEqual('r1', rc.lookup(cache, 'k1'))
+    rc.store(cache, 'k3', 'r3')
+    # The least recently used entry is evicted
+    self.assertEqual(None, rc.lookup(cache, 'k2'))
+    self.assertEqual('r1', rc.lookup(cache, 'k1'))
+    self.assertEqual('r3', rc.lookup(cache, 'k3'))
@@ -26,24 +26,34 @@ Implementing dashboard user interface.
 
 __metaclass__ = type
 
+from collections import OrderedDict
 from itertools import izip
+from multiprocessing.pool import ThreadPool
+from multiprocessing import TimeoutError
 import pkg_resources
 import re
+from time import time
 from uuid import uuid4
 
 from genshi.builder import tag
-from genshi.core import Stream
+from genshi.core import Markup, Stream
+from trac.cache import cached
 from trac.core import Component, implements
-from trac.config import Option, IntOption
+from trac.config import Option, IntOption, FloatOption
 from trac.mimeview.api import Context
-from trac.util.translation import _
+from trac.ticket.api import IMilestoneChangeListener, \
+                           ITicketBatchChangeListener, ITicketChangeListener
 from trac.ticket.query import QueryModule
 from trac.ticket.report import ReportModule
+from trac.util import translation
 from trac.util.compat import groupby
+from trac.util.concurrency import threading
 from trac.util.translation import _
+from trac.versioncontrol.api import IRepositoryChangeListener
 from trac.web.api import IRequestHandler, IRequestFilter
-from trac.web.chrome import add_ctxtnav, add_stylesheet, Chrome, \
+from trac.web.chrome import add_ctxtnav, add_link, add_stylesheet, Chrome, \
                             INavigationContributor, ITemplateProvider
+from trac.wiki.api import IWikiChangeListener
 
 from bhdashboard.api import DashboardSystem, InvalidIdentifier
 from bhdashboard import _json
@@ -58,6 +68,24 @@ class DashboardModule(Component):
                             """Dashboard label in mainnav""")
     default_widget_height = IntOption('widgets', 'default_height', 320, \
                             """Default widget height in pixels""")
+    render_threads = IntOption('widgets', 'render_threads', 4, \
+                            """Maximum number of widgets rendered
+                            concurrently. Set to 0 so as to render widgets
+                            one after the other in the request thread.""")
+    render_timeout = FloatOption('widgets', 'render_timeout', 10, \
+                            """Number of seconds to wait for a widget to be
+                            rendered before displaying an error message
+                            in its place. Widgets taking longer keep on
+                            running in the background, occupying one of
+                            the render threads. An error message is also
+                            displayed for widgets submitted while all the
+                            render threads are busy.""")
+
+    def __init__(self):
+        self._pool = None
+        self._pool_size = None
+        self._pool_busy = 0
+        self._pool_lock = threading.Lock()
 
     # IRequestFilter methods
 
@@ -235,24 +263,149 @@ class DashboardModule(Component):
                 raise InvalidIdentifier("Unknown widget ID")
             return wp.render_widget(name, ctx, options)
         except Exception, exc:
-            log_entry = str(uuid4())
-            exccls = exc.__class__
+            return self._widget_error(name, ctx, options, exc)
+
+    def _widget_error(self, name, ctx, options, exc=None):
+        """Data needed to render an alert in place of a broken widget.
+        A missing `exc` means that the widget timed out.
+        """
+        log_entry = str(uuid4())
+        if exc is None:
+            self.log.error("- %s - Timeout rendering widget %s with options %s",
+                    log_entry, name, options)
+            msgbody = _('Widget took too long to render. '
+                        'Contact your administrator for further details.')
+            details = []
+        else:
             self.log.exception("- %s - Error rendering widget %s with options %s",
                     log_entry, name, options)
-            data = {
-                    'msgtype' : 'error',
-                    'msglabel' : 'Error',
-                    'msgbody' : _('Exception raised while rendering widget. '
-                        'Contact your administrator for further details.'),
-                    'msgdetails' : [
-                            ('Widget name', name),
-                            ('Exception type', tag.code(exccls.__name__)),
-                            ('Log entry ID', log_entry),
-                        ],
-                }
-            return 'widget_alert.html', \
-                    { 'title' : _('Widget error'), 'data' : data}, \
-                    ctx
+            msgbody = _('Exception raised while rendering widget. '
+                        'Contact your administrator for further details.')
+            details = [('Exception type', tag.code(exc.__class__.__name__))]
+        data = {
+                'msgtype' : 'error',
+                'msglabel' : 'Error',
+                'msgbody' : msgbody,
+                'msgdetails' : [('Widget name', name)] + details + \
+                        [('Log entry ID', log_entry)],
+            }
+        return 'widget_alert.html', \
+                { 'title' : _('Widget error'), 'data' : data}, \
+                ctx
+
+    def _render_markup(self, req, template, data):
+        """Render widget template. Markup is generated right away so that
+        the (potentially expensive) template evaluation happens in the
+        thread rendering the widget.
+        """
+        stream = Chrome(self.env).render_template(req, template, data, 
+                                                  fragment=True)
+        return Markup(stream.render('xhtml', encoding=None))
+
+    def _expand_widget(self, req, name, wp, options, cache=None):
+        """Render a single widget (i.e. run widget provider and template)
+        and return the resulting markup along with chrome data added 
+        while rendering it. Successful results are stored in `cache` .
+        """
+        if cache is not None:
+            key = WidgetRenderCache(self.env).make_key(req, name, options)
+            result = WidgetRenderCache(self.env).lookup(cache, key)
+            if result is not None:
+                return result
+        wreq = WidgetRequest(req)
+        ctx = Context.from_request(wreq)
+        template, data, wctx = self._render_widget(wp, name, ctx, options)
+        failed = template == 'widget_alert.html'
+        try:
+            content = self._render_markup(wctx.req, template, data['data'])
+        except Exception, exc:
+            template, data, wctx = self._widget_error(name, ctx, options, exc)
+            content = self._render_markup(wctx.req, template, data['data'])
+            failed = True
+        result = {'title' : data['title'],
+                  'content' : content,
+                  'ctxtnav' : data.get('ctxtnav'),
+                  'altlinks' : data.get('altlinks'),
+                  'chrome' : wreq.recorded_chrome()}
+        if cache is not None and not failed:
+            WidgetRenderCache(self.env).store(cache, key, result)
+        return result
+
+    def _expand_widget_async(self, req, name, wp, options, cache=None):
+        """Render a single widget in a worker thread.
+        """
+        translation.make_activable(lambda: req.locale, self.env.path)
+        try:
+            return self._expand_widget(req, name, wp, options, cache)
+        finally:
+            translation.deactivate()
+            with self._pool_lock:
+                self._pool_busy -= 1
+
+    def _get_pool(self):
+        """Thread pool shared by all dashboard requests in this process.
+        A new pool is created whenever `[widgets] render_threads` changes.
+        """
+        size = self.render_threads
+        with self._pool_lock:
+            if self._pool is None or self._pool_size != size:
+                if self._pool is not None:
+                    self._pool.close()
+                self._pool = ThreadPool(size)
+                self._pool_size = size
+            return self._pool
+
+    def _submit(self, pool, req, name, wp, options, cache):
+        """Submit a widget to `pool` and return its `AsyncResult`, or 
+        `None` if all the threads of the pool are busy, e.g. with widgets
+        which timed out.
+        """
+        with self._pool_lock:
+            if self._pool_busy >= self._pool_size:
+                return None
+            self._pool_busy += 1
+        return pool.apply_async(self._expand_widget_async, 
+                                (req, name, wp, options, cache))
+
+    def _timeout_result(self, req, name, options):
+        """Error message displayed in place of a widget which could not be
+        rendered in time.
+        """
+        ctx = Context.from_request(req)
+        template, data, ctx = self._widget_error(name, ctx, options)
+        return {'title' : data['title'],
+                'content' : self._render_markup(req, template, data['data']),
+                'ctxtnav' : None, 'altlinks' : None, 'chrome' : {}}
+
+    def _render_widgets(self, req, widgets, cache=None):
+        """Render `(name, widget provider, options)` triplets and return
+        the results in the same order.
+        """
+        if self.render_threads <= 0 or len(widgets) <= 1:
+            return [self._expand_widget(req, name, wp, options, cache) \
+                    for name, wp, options in widgets]
+        # Resolve lazy request attributes before sharing `req`
+        # with worker threads
+        for attr in ('authname', 'perm', 'session', 'chrome', 'tz',
+                     'locale', 'form_token'):
+            getattr(req, attr)
+        pool = self._get_pool()
+        pending = [(name, options, 
+                    self._submit(pool, req, name, wp, options, cache)) \
+                   for name, wp, options in widgets]
+        deadline = time() + self.render_timeout
+        results = []
+        for name, options, async_result in pending:
+            result = None
+            if async_result is not None:
+                try:
+                    result = async_result.get(max(deadline - time(), 0))
+                except TimeoutError:
+                    pass
+            if result is None:
+                result = self._timeout_result(req, name, options)
+            results.append(result)
+        return results
 
     def expand_widget_data(self, req, schema):
         """Expand raw widget data and format it for use in template
@@ -264,20 +417,178 @@ class DashboardModule(Component):
                 for wnm in wp.get_widgets()
             )
         self.log.debug("Bloodhound: Widget index %s" % (widgets_index,))
-        ctx = Context.from_request(req)
-        for w in widgets_spec.itervalues():
-            w['c'] = widgets_index.get(w['args'][0])
-            w['args'][1] = ctx
         self.log.debug("Bloodhound: Widget specs %s" % (widgets_spec,))
-        chrome = Chrome(self.env)
-        render = chrome.render_template
-        data_strm = ( (k, w, self._render_widget(w['c'], *w['args'])) \
-                for k,w in widgets_spec.iteritems())
-        return dict([k, {'title' : data['title'], 
-                'content' : render(wctx.req, template, data['data'], fragment=True),
-                'ctxtnav' : w.get('ctxtnav', True) and data.get('ctxtnav') or None, 
-                'altlinks' : w.get('altlinks', True) and data.get('altlinks') or None}] \
-                for k, w, (template, data, wctx) in data_strm)
+        cache = WidgetRenderCache(self.env).get_cache()
+        specs = widgets_spec.items()
+        results = self._render_widgets(req, 
+                [(w['args'][0], widgets_index.get(w['args'][0]), 
+                  w['args'][2]) for k, w in specs], cache)
+        for result in results:
+            WidgetRequest.replay_chrome(req, result['chrome'])
+        return dict([k, {'title' : result['title'], 
+                'content' : result['content'],
+                'ctxtnav' : w.get('ctxtnav', True) and result['ctxtnav'] or None, 
+                'altlinks' : w.get('altlinks', True) and result['altlinks'] or None}] \
+                for (k, w), result in izip(specs, results))
+
+
+class WidgetRequest(object):
+    """Request wrapper used while rendering a single widget. Links and 
+    scripts added by the widget are recorded rather than added to the 
+    original request. That way widgets may be rendered concurrently and
+    their chrome data may be replayed if they are served from cache.
+    """
+    def __init__(self, req):
+        self._req = req
+        self.chrome = dict(req.chrome)
+        self.chrome.update({'links' : {}, 'linkset' : set(), 
+                            'scripts' : [], 'scriptset' : set(),
+                            'script_data' : {}})
+
+    def __getattr__(self, name):
+        return getattr(self._req, name)
+
+    def recorded_chrome(self):
+        """Links, scripts and script data added while rendering the widget.
+        """
+        return dict((k, self.chrome[k]) 
+                    for k in ('links', 'scripts', 'script_data'))
+
+    @staticmethod
+    def replay_chrome(req, recorded):
+        """Add recorded links and scripts to the target request.
+        """
+        for rel, links in recorded.get('links', {}).iteritems():
+            for link in links:
+                add_link(req, rel, **link)
+        scripts = req.chrome.setdefault('scripts', [])
+        hrefs = set(s['href'] for s in scripts)
+        for script in recorded.get('scripts', []):
+            if script['href'] not in hrefs:
+                scripts.append(script)
+                hrefs.add(script['href'])
+        req.chrome.setdefault('script_data', {}).update(
+                recorded.get('script_data', {}))
+
+
+class WidgetRenderCache(Component):
+    """Cache rendered widgets per widget, options, session and language.
+    Cached entries are discarded whenever tickets, milestones, wiki pages or 
+    changesets are modified.
+    """
+    implements(IMilestoneChangeListener, IRepositoryChangeListener,
+               ITicketBatchChangeListener, ITicketChangeListener, 
+               IWikiChangeListener)
+
+    ttl = IntOption('widgets', 'cache_ttl', 300, \
+                    """Number of seconds rendered widgets will be reused.
+                    Set to 0 so as to disable widgets cache.""")
+
+    MAX_ENTRIES = 1000
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    @cached
+    def entries(self):
+        """Rendered widgets since last relevant change, least recently
+        used first"""
+        return OrderedDict()
+
+    # Public API
+    def get_cache(self):
+        """Return the mapping used to store rendered widgets or `None` 
+        if widgets cache is disabled.
+        """
+        if self.ttl > 0:
+            return self.entries
+
+    def make_key(self, req, name, options):
+        """Cache key for widget `name` rendered with `options` for the 
+        user performing `req`. Rendered markup may embed the form token
+        and session data, so entries are never shared between browsers.
+        `None` is returned for anonymous users, whose sessions are mostly
+        short-lived, and if options can not be serialized.
+        """
+        if req.authname == 'anonymous':
+            return None
+        try:
+            options = _json.dumps(options, sort_keys=True)
+        except (TypeError, ValueError):
+            return None
+        return (name, options, req.authname, req.form_token, 
+                str(req.locale))
+
+    def lookup(self, cache, key):
+        if key is not None:
+            with self._lock:
+                try:
+                    timestamp, result = cache.pop(key)
+                except KeyError:
+                    return None
+                if time() - timestamp < self.ttl:
+                    cache[key] = (timestamp, result)
+                    return result
+
+    def store(self, cache, key, result):
+        """Store `result`, discarding the least recently used entries
+        once the cache is full."""
+        if key is not None:
+            with self._lock:
+                cache.pop(key, None)
+                cache[key] = (time(), result)
+                while len(cache) > self.MAX_ENTRIES:
+                    cache.popitem(last=False)
+
+    def invalidate(self):
+        del self.entries
+
+    # ITicketChangeListener methods
+    def ticket_created(self, ticket):
+        self.invalidate()
+
+    def ticket_changed(self, ticket, comment, author, old_values):
+        self.invalidate()
+
+    def ticket_deleted(self, ticket):
+        self.invalidate()
+
+    # ITicketBatchChangeListener methods
+    def tickets_changed(self, changes, comment, author):
+        self.invalidate()
+
+    # IMilestoneChangeListener methods
+    def milestone_created(self, milestone):
+        self.invalidate()
+
+    def milestone_changed(self, milestone, old_values):
+        self.invalidate()
+
+    def milestone_deleted(self, milestone):
+        self.invalidate()
+
+    # IWikiChangeListener methods
+    def wiki_page_added(self, page):
+        self.invalidate()
+
+    def wiki_page_changed(self, page, version, t, comment, author, ipnr):
+        self.invalidate()
+
+    def wiki_page_deleted(self, page):
+        self.invalidate()
+
+    def wiki_page_version_deleted(self, page):
+        self.invalidate()
+
+    def wiki_page_renamed(self, page, old_name):
+        self.invalidate()
+
+    # IRepositoryChangeListener methods
+    def changeset_added(self, repos, changeset):
+        self.invalidate()
+
+    def changeset_modified(self, repos, changeset, old_changeset):
+        self.invalidate()
 
 #------------------------------------------------------
 #    Dashboard Helpers to be used in templates
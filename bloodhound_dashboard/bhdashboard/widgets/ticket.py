@@ -107,10 +107,8 @@ class TicketFieldValuesWidget(WidgetBase):
             tsys = self.env[TicketSystem]
             if tsys is None:
                 raise TracError(_('Error loading ticket system (disabled?)'))
-            for field in tsys.get_ticket_fields():
-                if field['name'] == fieldnm:
-                    break
-            else:
+            field = tsys.get_frozen_ticket_fields().get(fieldnm)
+            if field is None:
                 field_maps = {'type': {'admin_url': 'type',
                                        'title': 'Types',
                                        },
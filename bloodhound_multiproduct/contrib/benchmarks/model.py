@@ -0,0 +1,67 @@
+#!/usr/bin/python
+"""Measure the cost of loading multiproduct models from the database.
+
+A number of product resource mappings are created with `insert_many` and
+then selected back, both with `ModelBase.select` and with one instance
+per row as `__init__` does. The time taken by each method is reported.
+
+Usage: model.py [rows]
+"""
+
+from __future__ import with_statement
+
+import shutil
+import sys
+import tempfile
+import time
+
+from trac.env import Environment
+
+from multiproduct.api import MultiProductSystem
+from multiproduct.model import ProductResourceMap
+
+REPEAT = 5
+
+
+def best_of(fn):
+    times = []
+    for i in xrange(REPEAT):
+        start = time.time()
+        fn()
+        times.append(time.time() - start)
+    return min(times)
+
+
+def main(nrows=10000):
+    path = tempfile.mkdtemp(prefix='bh-model-bench-')
+    try:
+        env = Environment(path, create=True,
+                          options=[('components', 'multiproduct.*',
+                                    'enabled')])
+        MultiProductSystem(env).upgrade_environment()
+        start = time.time()
+        ProductResourceMap.insert_many(env, [{'id':i,
+                                              'product_id':'p%d' % (i % 10),
+                                              'resource_type':'ticket',
+                                              'resource_id':str(i)}
+                                             for i in xrange(1, nrows + 1)])
+        insert = time.time() - start
+
+        def select():
+            assert len(ProductResourceMap.select(env)) == nrows
+        def get_rows():
+            for i in xrange(1, nrows + 1):
+                ProductResourceMap(env, {'id':i})
+
+        print '%-28s %10s' % ('operation', 'seconds')
+        print '%-28s %10.3f' % ('insert_many %d rows' % nrows, insert)
+        print '%-28s %10.3f' % ('select %d rows' % nrows, best_of(select))
+        print '%-28s %10.3f' % ('load %d rows by key' % nrows,
+                                best_of(get_rows))
+        env.shutdown()
+    finally:
+        shutil.rmtree(path)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:2]])
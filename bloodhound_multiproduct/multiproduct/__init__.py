@@ -19,5 +19,6 @@
 """multiproduct module"""
 from multiproduct.api import MultiProductSystem
 from multiproduct.product_admin import ProductAdminPanel
+from multiproduct.search import SearchIndex
 import multiproduct.ticket
 from multiproduct.web_ui import ProductModule
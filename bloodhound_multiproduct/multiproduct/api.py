@@ -20,6 +20,7 @@
 from datetime import datetime
 
 from pkg_resources import resource_filename
+from trac.cache import cached
 from trac.core import Component, TracError, implements
 from trac.db import Table, Column, DatabaseManager
 from trac.env import IEnvironmentSetupParticipant
@@ -55,6 +56,27 @@ class MultiProductSystem(Component):
             ]
         ]
     
+    @cached
+    def _product_index(self):
+        """Products indexed by prefix and by name"""
+        products = Product.select(self.env)
+        return (dict((p.prefix, p) for p in products),
+                dict((p.name, p) for p in products))
+
+    def get_product(self, prefix=None, name=None):
+        """Retrieve the product with the given prefix (or name) without
+        querying the database, or `None` if there is no such product.
+        The product object is shared and must not be modified.
+        """
+        by_prefix, by_name = self._product_index
+        if prefix is not None:
+            return by_prefix.get(prefix)
+        return by_name.get(name)
+
+    def reset_product_index(self):
+        """Discard products index after products have been modified."""
+        del self._product_index
+
     def get_version(self):
         """Finds the current version of the bloodhound database schema"""
         rows = self.env.db_query("""
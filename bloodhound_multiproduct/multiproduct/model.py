@@ -27,7 +27,7 @@ from trac.resource import Resource
 from trac.ticket.api import TicketSystem
 from trac.ticket.model import Ticket
 from trac.ticket.query import Query
-from trac.util.datefmt import utc
+from trac.util.datefmt import to_utimestamp, utc
 
 def dict_to_kv_str(data=None, sep=' AND '):
     """Converts a dictionary into a string and a list suitable for using as part
@@ -57,22 +57,67 @@ class ModelBase(object):
              }
     """
     
+    # SQL statements of each model class, built on first use
+    _sql_templates = {}
+    
     def __init__(self, env, keys=None):
         """Initialisation requires an environment to be specified.
         If keys are provided, the Model will initialise from the database
         """
         # make this impossible to instantiate without telling the class details
         # about itself in the self.meta dictionary
+        self._init(env)
+        if keys is not None:
+            self._get_row(keys)
+        else:
+            self._update_from_row(None)
+    
+    def _init(self, env):
         self._old_data = {}
         self._data = {}
         self._exists = False
         self._env = env
         self._all_fields = self._meta['key_fields'] + \
                            self._meta['non_key_fields']
-        if keys is not None:
-            self._get_row(keys)
-        else:
-            self._update_from_row(None)
+    
+    @classmethod
+    def _from_row(cls, env, row):
+        """Build a model from a row selected from the database, without
+        querying the database again"""
+        model = cls.__new__(cls)
+        model._init(env)
+        model._update_from_row(row)
+        return model
+    
+    @classmethod
+    def _sql(cls):
+        """SQL statements for this model class, built once per class"""
+        try:
+            return cls._sql_templates[cls]
+        except KeyError:
+            pass
+        meta = cls._meta
+        fields = meta['key_fields'] + meta['non_key_fields']
+        # placeholders follow the order of the fields in the meta data
+        sdata = {'fields':','.join(fields),
+                 'values':','.join(['%s'] * len(fields)),
+                 'where':' AND '.join(['%s=%%s' % k
+                                       for k in meta['key_fields']]),
+                 'set':','.join(['%s=%%s' % k
+                                 for k in meta['non_key_fields']])}
+        sdata.update(meta)
+        sql = {
+            'select':"""SELECT %(fields)s FROM %(table_name)s""" % sdata,
+            'get_row':"""SELECT %(fields)s FROM %(table_name)s
+                         WHERE %(where)s""" % sdata,
+            'insert':"""INSERT INTO %(table_name)s (%(fields)s)
+                        VALUES (%(values)s)""" % sdata,
+            'update':"""UPDATE %(table_name)s SET %(set)s
+                        WHERE %(where)s""" % sdata,
+            'delete':"""DELETE FROM %(table_name)s
+                        WHERE %(where)s""" % sdata,
+        }
+        return cls._sql_templates.setdefault(cls, sql)
     
     def update_field_dict(self, field_dict):
         """Updates the object's copy of the db fields (no db transaction)"""
@@ -100,44 +145,60 @@ class ModelBase(object):
     
     def _update_from_row(self, row = None):
         """uses a provided database row to update the model"""
-        fields = self._meta['key_fields']+self._meta['non_key_fields']
+        fields = self._all_fields
         self._exists = row is not None
         if row is None:
             row = [None]*len(fields)
-        self._data = dict([(fields[i], row[i]) for i in range(len(row))])
-        self._old_data = {}
-        self._old_data.update(self._data)
+        self._data = dict(zip(fields, row))
+        self._old_data = dict(self._data)
     
     def _get_row(self, keys):
         """queries the database and stores the result in the model"""
-        row = None
-        where, values = fields_to_kv_str(self._meta['key_fields'], keys)
-        fields = ','.join(self._meta['key_fields']+self._meta['non_key_fields'])
-        sdata = {'fields':fields,
-                 'where':where}
-        sdata.update(self._meta)
-        
-        sql = """SELECT %(fields)s FROM %(table_name)s
-                 WHERE %(where)s""" % sdata
+        values = [keys[k] for k in self._meta['key_fields']]
         with self._env.db_query as db:
-            for row in db(sql, values):
+            for row in db(self._sql()['get_row'], values):
                 self._update_from_row(row)
                 break
             else:
+                where, values = fields_to_kv_str(self._meta['key_fields'],
+                                                 keys)
+                sdata = {'where':where}
+                sdata.update(self._meta)
                 raise ResourceNotFound('No %(object_name)s with %(where)s' %
                                 sdata)
     
+    def _find_conflict(self, db, fieldsets):
+        """Return the first list of fields in `fieldsets` whose values are
+        already used by a record, or `None`. A single query is needed."""
+        fieldsets = [fields for fields in fieldsets if fields]
+        if not fieldsets:
+            return None
+        clauses = []
+        values = []
+        for fields in fieldsets:
+            where, vals = fields_to_kv_str(fields, self._data)
+            clauses.append('(%s)' % where)
+            values.extend(vals)
+        columns = sorted(set(f for fields in fieldsets for f in fields))
+        sdata = {'fields':','.join(columns),
+                 'where':' OR '.join(clauses)}
+        sdata.update(self._meta)
+        sql = """SELECT %(fields)s FROM %(table_name)s
+                 WHERE %(where)s""" % sdata
+        for row in db(sql, values):
+            row = dict(zip(columns, row))
+            for fields in fieldsets:
+                if all(row[f] == self._data[f] for f in fields):
+                    return fields
+        return None
+    
     def delete(self):
         """Deletes the matching record from the database"""
         if not self._exists:
             raise TracError('%(object_name)s does not exist' % self._meta)
-        where, values = fields_to_kv_str(self._meta['key_fields'], self._data)
-        sdata = {'where': where}
-        sdata.update(self._meta)
-        sql = """DELETE FROM %(table_name)s
-                 WHERE %(where)s""" % sdata
+        values = [self._data[k] for k in self._meta['key_fields']]
         with self._env.db_transaction as db:
-            db(sql, values)
+            db(self._sql()['delete'], values)
             self._exists = False
             self._data = dict([(k, None) for k in self._data.keys()])
             self._old_data.update(self._data)
@@ -145,47 +206,37 @@ class ModelBase(object):
     
     def insert(self):
         """Create new record in the database"""
-        sdata = None
-        if self._exists or len(self.select(self._env, where =
-                                dict([(k,self._data[k])
-                                      for k in self._meta['key_fields']]))):
-            sdata = {'keys':','.join(["%s='%s'" % (k, self._data[k])
-                                     for k in self._meta['key_fields']])}
-        elif len(self.select(self._env, where =
-                                dict([(k,self._data[k])
-                                      for k in self._meta['unique_fields']]))):
-            sdata = {'keys':','.join(["%s='%s'" % (k, self._data[k])
-                                     for k in self._meta['unique_fields']])}
-        if sdata:
-            sdata.update(self._meta)
-            raise TracError('%(object_name)s %(keys)s already exists' %
-                            sdata)
-            
-        for key in self._meta['key_fields']:
-            if not self._data[key]:
-                sdata = {'key':key}
+        with self._env.db_transaction as db:
+            conflict = self._meta['key_fields'] if self._exists else \
+                       self._find_conflict(db, [self._meta['key_fields'],
+                                                self._meta['unique_fields']])
+            if conflict:
+                sdata = {'keys':','.join(["%s='%s'" % (k, self._data[k])
+                                         for k in conflict])}
                 sdata.update(self._meta)
-                raise TracError('%(key)s required for %(object_name)s' %
+                raise TracError('%(object_name)s %(keys)s already exists' %
                                 sdata)
-        fields = self._meta['key_fields']+self._meta['non_key_fields']
-        sdata = {'fields':','.join(fields),
-                 'values':','.join(['%s'] * len(fields))}
-        sdata.update(self._meta)
-        
-        sql = """INSERT INTO %(table_name)s (%(fields)s)
-                 VALUES (%(values)s)""" % sdata
-        with self._env.db_transaction as db:
-            db(sql, [self._data[f] for f in fields])
+            
+            for key in self._meta['key_fields']:
+                if not self._data[key]:
+                    sdata = {'key':key}
+                    sdata.update(self._meta)
+                    raise TracError('%(key)s required for %(object_name)s' %
+                                    sdata)
+            
+            db(self._sql()['insert'], [self._data[f] 
+                                       for f in self._all_fields])
             self._exists = True
             self._old_data.update(self._data)
             TicketSystem(self._env).reset_ticket_fields()
 
-    def _update_relations(self, db):
+    def _update_relations(self, db, **kwargs):
         """Extra actions due to update"""
         pass
     
-    def update(self):
-        """Update the matching record in the database"""
+    def update(self, **kwargs):
+        """Update the matching record in the database. Keyword arguments are
+        passed on to `_update_relations`."""
         if self._old_data == self._data:
             return 
         if not self._exists:
@@ -193,45 +244,69 @@ class ModelBase(object):
         for key in self._meta['no_change_fields']:
             if self._data[key] != self._old_data[key]:
                 raise TracError('%s cannot be changed' % key)
-        for key in self._meta['key_fields'] + self._meta['unique_fields']:
-            if self._data[key] != self._old_data[key]:
-                if len(self.select(self._env, where = {key:self._data[key]})):
-                    raise TracError('%s already exists' % key)
-        
-        setsql, setvalues = fields_to_kv_str(self._meta['non_key_fields'],
-                                             self._data, sep=',')
-        where, values = fields_to_kv_str(self._meta['key_fields'], self._data)
-        
-        sdata = {'where': where,
-                 'values': setsql}
-        sdata.update(self._meta)
-        sql = """UPDATE %(table_name)s SET %(values)s
-                 WHERE %(where)s""" % sdata
         with self._env.db_transaction as db:
-            db(sql, setvalues + values)
-            self._update_relations(db)
+            conflict = self._find_conflict(db, [[key] for key in 
+                           self._meta['key_fields'] + 
+                           self._meta['unique_fields']
+                           if self._data[key] != self._old_data[key]])
+            if conflict:
+                raise TracError('%s already exists' % conflict[0])
+            
+            values = [self._data[f] for f in self._meta['non_key_fields']] + \
+                     [self._data[k] for k in self._meta['key_fields']]
+            db(self._sql()['update'], values)
+            self._update_relations(db, **kwargs)
             self._old_data.update(self._data)
             TicketSystem(self._env).reset_ticket_fields()
     
     @classmethod
     def select(cls, env, db=None, where=None):
         """Query the database to get a set of records back"""
-        rows = []
-        fields = cls._meta['key_fields']+cls._meta['non_key_fields']
-        
-        sdata = {'fields':','.join(fields),}
-        sdata.update(cls._meta)
-        sql = r'SELECT %(fields)s FROM %(table_name)s' % sdata
+        sql = cls._sql()['select']
         wherestr, values = dict_to_kv_str(where)
         if wherestr:
-            wherestr = ' WHERE ' + wherestr
-        for row in env.db_query(sql + wherestr, values):
-            # we won't know which class we need until called
-            model = cls.__new__(cls)
-            data = dict([(fields[i], row[i]) for i in range(len(fields))])
-            model.__init__(env, data)
-            rows.append(model)
-        return rows
+            sql += ' WHERE ' + wherestr
+        return [cls._from_row(env, row) for row in env.db_query(sql, values)]
+    
+    @classmethod
+    def insert_many(cls, env, records):
+        """Create new records in the database with a single `executemany`.
+        
+        `records` is an iterable of dictionaries holding field values. 
+        Unlike `insert`, no query is done to check that the records do not
+        exist yet, this is left to the constraints of the database table.
+        """
+        fields = cls._meta['key_fields'] + cls._meta['non_key_fields']
+        with env.db_transaction as db:
+            db.executemany(cls._sql()['insert'],
+                           [[data.get(f) for f in fields] for data in records])
+            TicketSystem(env).reset_ticket_fields()
+    
+    @classmethod
+    def update_many(cls, env, records):
+        """Update records in the database with a single `executemany`.
+        
+        `records` is an iterable of dictionaries holding the values of all
+        the fields, keys included. Relations are not updated.
+        """
+        fields = cls._meta['non_key_fields'] + cls._meta['key_fields']
+        with env.db_transaction as db:
+            db.executemany(cls._sql()['update'],
+                           [[data[f] for f in fields] for data in records])
+            TicketSystem(env).reset_ticket_fields()
+    
+    @classmethod
+    def delete_many(cls, env, keys):
+        """Delete records from the database with a single `executemany`.
+        
+        `keys` is an iterable of dictionaries holding the values of the key
+        fields of each record to delete.
+        """
+        fields = cls._meta['key_fields']
+        with env.db_transaction as db:
+            db.executemany(cls._sql()['delete'],
+                           [[data[f] for f in fields] for data in keys])
+            TicketSystem(env).reset_ticket_fields()
 
 class Product(ModelBase):
     """The Product table"""
@@ -243,29 +318,89 @@ class Product(ModelBase):
             'unique_fields':['name'],
             }
     
+    # number of tickets written with a single `executemany`
+    CHUNK_SIZE = 1000
+    
     @property
     def resource(self):
         """Allow Product to be treated as a Resource"""
         return Resource('product', self.name)
     
+    @classmethod
+    def _reset_product_index(cls, env):
+        """Products index needs to be rebuilt after products change"""
+        from multiproduct.api import MultiProductSystem
+        MultiProductSystem(env).reset_product_index()
+    
+    def insert(self):
+        """Create new record in the database"""
+        super(Product, self).insert()
+        self._reset_product_index(self._env)
+    
+    def update(self, author=None, progress=None):
+        """Update the matching record in the database. 
+        
+        When the product is renamed, its tickets are moved to the new name
+        on behalf of `author`. `progress` is an optional callable receiving
+        the number of tickets updated so far and the total number of
+        tickets to update.
+        """
+        super(Product, self).update(author=author, progress=progress)
+        self._reset_product_index(self._env)
+    
     def delete(self, resources_to=None):
         """ override the delete method so that we can move references to this
         object to a new product """
         if resources_to is not None:
-            new_product = Product(self._env, resources_to)
+            new_product = Product(self._env, {'prefix':resources_to})
             if not new_product._exists:
                 sdata = {'new_table':resources_to}
                 sdata.update(self._meta)
                 raise TracError('%(object_name)s %(new_table)s does not exist' %
                                 sdata)
-        super(Product, self).delete()
-        #find and update all resources that should move
-        where = {'product_id':self._data['prefix']}
-        for prm in ProductResourceMap.select(self._env, where=where):
-            prm._data['product_id'] = resources_to
-            prm.update()
-    
-    def _update_relations(self, db=None, author=None):
+        prefix = self._data['prefix']
+        with self._env.db_transaction:
+            super(Product, self).delete()
+            #move all resources to the new product at once
+            ProductResourceMap.reparent_resources(self._env, prefix,
+                                                  resources_to)
+        self._reset_product_index(self._env)
+    
+    @classmethod
+    def insert_many(cls, env, records):
+        """Create new products in the database"""
+        super(Product, cls).insert_many(env, records)
+        cls._reset_product_index(env)
+    
+    @classmethod
+    def update_many(cls, env, records, author=None):
+        """Update products in the database. As with `update`, the tickets
+        of renamed products are moved to the new name on behalf of 
+        `author`."""
+        records = list(records)
+        now = datetime.now(utc)
+        with env.db_transaction as db:
+            old_names = dict(db("SELECT prefix, name FROM %s"
+                                % cls._meta['table_name']))
+            super(Product, cls).update_many(env, records)
+            for data in records:
+                old_name = old_names.get(data['prefix'])
+                new_name = data['name']
+                if old_name is not None and old_name != new_name:
+                    comment = 'Product %s renamed to %s' % (old_name, 
+                                                            new_name)
+                    cls.retarget_tickets(env, old_name, new_name, author,
+                                         comment, now)
+        cls._reset_product_index(env)
+    
+    @classmethod
+    def delete_many(cls, env, keys):
+        """Delete products from the database. Resources of the deleted
+        products are left untouched."""
+        super(Product, cls).delete_many(env, keys)
+        cls._reset_product_index(env)
+    
+    def _update_relations(self, db=None, author=None, progress=None):
         """Extra actions due to update"""
         # tickets need to be updated
         old_name = self._old_data['name']
@@ -273,10 +408,78 @@ class Product(ModelBase):
         now = datetime.now(utc)
         comment = 'Product %s renamed to %s' % (old_name, new_name)
         if old_name != new_name:
-            for t in Product.get_tickets(self._env, old_name):
-                ticket = Ticket(self._env, t['id'], db)
-                ticket['product'] = new_name
-                ticket.save_changes(author, comment, now)
+            Product.retarget_tickets(self._env, old_name, new_name, author,
+                                     comment, now, progress)
+    
+    @classmethod
+    def retarget_tickets(cls, env, old_name, new_name, author=None,
+                         comment=None, when=None, progress=None):
+        """Move all tickets of product `old_name` to product `new_name`.
+        
+        Ticket changes are recorded the same way as `Ticket.save_changes`
+        would do, but with a fixed number of queries whatever the number
+        of tickets. The `ITicketBatchChangeListener`s (e.g. the search
+        index and the cached query counts) are then notified of the moved
+        tickets, a chunk at a time; the other ticket change listeners are
+        not notified. Returns the number of updated tickets.
+        """
+        if when is None:
+            when = datetime.now(utc)
+        when_ts = to_utimestamp(when)
+        with env.db_transaction as db:
+            # find the comment number of the next change of each ticket
+            # (see `Ticket.save_changes`)
+            cnums = {}
+            done = set()
+            for id, in db("SELECT id FROM ticket WHERE product=%s", 
+                          (old_name,)):
+                cnums[id] = 0
+            for id, ts, old in db("""
+                    SELECT DISTINCT tc1.ticket, tc1.time,
+                                    COALESCE(tc2.oldvalue,'')
+                    FROM ticket_change AS tc1
+                    LEFT OUTER JOIN ticket_change AS tc2
+                    ON tc2.ticket=tc1.ticket AND tc2.time=tc1.time
+                       AND tc2.field='comment'
+                    WHERE tc1.ticket IN (SELECT id FROM ticket 
+                                         WHERE product=%s)
+                    ORDER BY tc1.ticket, tc1.time DESC
+                    """, (old_name,)):
+                if id in done:
+                    continue
+                try:
+                    cnums[id] += int(old.rsplit('.', 1)[-1])
+                    done.add(id)
+                except ValueError:
+                    cnums[id] += 1
+            total = len(cnums)
+            if not total:
+                return 0
+            db("UPDATE ticket SET product=%s, changetime=%s WHERE product=%s",
+               (new_name, when_ts, old_name))
+            ids = sorted(cnums)
+            for start in xrange(0, total, cls.CHUNK_SIZE):
+                chunk = ids[start:start + cls.CHUNK_SIZE]
+                db.executemany("""
+                    INSERT INTO ticket_change
+                        (ticket,time,author,field,oldvalue,newvalue)
+                    VALUES (%s,%s,%s,%s,%s,%s)
+                    """, [(id, when_ts, author, 'product', old_name, new_name)
+                          for id in chunk] +
+                         [(id, when_ts, author, 'comment', 
+                           str(cnums[id] + 1), comment) for id in chunk])
+                if progress is not None:
+                    progress(start + len(chunk), total)
+        listeners = TicketSystem(env).batch_change_listeners
+        if listeners:
+            for start in xrange(0, total, cls.CHUNK_SIZE):
+                tickets = Ticket.select_many(env,
+                                             ids[start:start + cls.CHUNK_SIZE])
+                changes = [(ticket, {'product': old_name})
+                           for ticket in tickets]
+                for listener in listeners:
+                    listener.tickets_changed(changes, comment, author)
+        return total
     
     @classmethod
     def get_tickets(cls, env, product=''):
@@ -305,4 +508,14 @@ class ProductResourceMap(ModelBase):
                                 sdata)
         self._data['product_id'] = product
         self.update()
+    
+    @classmethod
+    def reparent_resources(cls, env, product, new_product=None):
+        """Move all resources of `product` to `new_product` with a single
+        query."""
+        sdata = {}
+        sdata.update(cls._meta)
+        sql = """UPDATE %(table_name)s SET product_id=%%s
+                 WHERE product_id=%%s""" % sdata
+        env.db_transaction(sql, (new_product, product))
 
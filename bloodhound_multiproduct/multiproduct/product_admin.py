@@ -21,10 +21,12 @@
 from trac.core import *
 from trac.config import *
 from trac.perm import PermissionSystem
-from trac.admin.api import IAdminPanelProvider
+from trac.admin.api import AdminCommandError, IAdminPanelProvider
 from trac.ticket.admin import TicketAdminPanel, _save_config
 from trac.resource import ResourceNotFound
 from model import Product
+from trac.util import getuser
+from trac.util.text import print_table, printout
 from trac.util.translation import _, N_, gettext
 from trac.web.chrome import Chrome, add_notice, add_warning
 
@@ -34,7 +36,54 @@ class ProductAdminPanel(TicketAdminPanel):
     _label = ('Product','Products')
     
     def get_admin_commands(self): 
-        return None
+        yield ('product list', '',
+               'Show available products',
+               None, self._do_list)
+        yield ('product rename', '<prefix> <newname>',
+               """Rename a product
+               
+               Tickets of the product are moved to the new name.
+               """,
+               self._complete_prefix, self._do_rename)
+        yield ('product remove', '<prefix> [newprefix]',
+               """Remove a product
+               
+               Resources of the product are moved to the product identified
+               by <newprefix>, if specified.
+               """,
+               self._complete_prefix, self._do_remove)
+    
+    def get_product_list(self):
+        return [p.prefix for p in Product.select(self.env)]
+    
+    def _complete_prefix(self, args):
+        if len(args) in (1, 2):
+            return self.get_product_list()
+    
+    def _get_product(self, prefix):
+        try:
+            return Product(self.env, {'prefix':prefix})
+        except ResourceNotFound:
+            raise AdminCommandError(_("Product %(id)s does not exist.",
+                                      id=prefix))
+    
+    def _do_list(self):
+        print_table([(p.prefix, p.name, p.owner)
+                     for p in Product.select(self.env)],
+                    [_('Prefix'), _('Name'), _('Owner')])
+    
+    def _do_rename(self, prefix, newname):
+        product = self._get_product(prefix)
+        def progress(done, total):
+            printout(_("  %(done)s of %(total)s tickets updated", 
+                       done=done, total=total))
+        product.update_field_dict({'name':newname})
+        product.update(author=getuser(), progress=progress)
+    
+    def _do_remove(self, prefix, newprefix=None):
+        if newprefix is not None:
+            self._get_product(newprefix)
+        self._get_product(prefix).delete(resources_to=newprefix)
     
     def _render_admin_panel(self, req, cat, page, product):
         req.perm.require('PRODUCT_VIEW')
@@ -0,0 +1,588 @@
+
+#  Licensed to the Apache Software Foundation (ASF) under one
+#  or more contributor license agreements.  See the NOTICE file
+#  distributed with this work for additional information
+#  regarding copyright ownership.  The ASF licenses this file
+#  to you under the Apache License, Version 2.0 (the
+#  "License"); you may not use this file except in compliance
+#  with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing,
+#  software distributed under the License is distributed on an
+#  "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+#  KIND, either express or implied.  See the License for the
+#  specific language governing permissions and limitations
+#  under the License.
+
+"""Full-text search index for tickets, wiki pages, changesets and
+attachments"""
+from functools import partial
+from math import log
+import re
+
+from genshi.builder import tag
+from trac.admin import IAdminCommandProvider
+from trac.attachment import IAttachmentChangeListener
+from trac.cache import cached
+from trac.core import Component, TracError, implements
+from trac.db import Table, Column, Index, DatabaseManager
+from trac.env import IEnvironmentSetupParticipant
+from trac.resource import Resource, get_resource_shortname, get_resource_url
+from trac.search import ISearchIndex, shorten_result
+from trac.ticket.api import ITicketBatchChangeListener, \
+                           ITicketChangeListener, TicketSystem
+from trac.util.datefmt import from_utimestamp, to_utimestamp
+from trac.util.text import printout, shorten_line
+from trac.util.translation import _, tag_
+from trac.versioncontrol.api import IRepositoryChangeListener
+from trac.wiki.api import IWikiChangeListener
+
+DB_VERSION = 1
+DB_SYSTEM_KEY = 'bloodhound_search_index_version'
+DB_READY_KEY = 'bloodhound_search_index_ready'
+PLUGIN_NAME = 'Bloodhound search index'
+
+_word_re = re.compile(r'\w+', re.UNICODE)
+
+def get_words(text):
+    """Split a text into lowercase words"""
+    return [w.lower() for w in _word_re.findall(text or '')]
+
+def _chunks(items, size):
+    """Split a list into lists of at most `size` items"""
+    for start in xrange(0, len(items), size):
+        yield items[start:start + size]
+
+
+class SearchIndex(Component):
+    """Inverted index answering the ticket, wiki and changeset queries of
+    the search page, instead of scanning the tables for each term.
+
+    The index is kept up-to-date by change listeners. It must be built
+    once with the `search reindex` command before being used.
+    """
+
+    implements(IAdminCommandProvider, IAttachmentChangeListener,
+               IEnvironmentSetupParticipant, IRepositoryChangeListener,
+               ISearchIndex, ITicketBatchChangeListener,
+               ITicketChangeListener, IWikiChangeListener)
+
+    SCHEMA = [
+        Table('bloodhound_search_doc', key='id') [
+            Column('id', auto_increment=True),
+            Column('filter'),
+            Column('realm'),
+            Column('resource_id'),
+            Column('parent_realm'),
+            Column('parent_id'),
+            Column('product'),
+            Column('time', type='int64'),
+            Column('author'),
+            Column('title'),
+            Column('status'),
+            Column('content'),
+            Index(['realm', 'resource_id', 'parent_realm', 'parent_id']),
+            ],
+        Table('bloodhound_search_term', key=('term', 'doc')) [
+            Column('term'),
+            Column('doc', type='int'),
+            Column('freq', type='int'),
+            Index(['doc']),
+            ],
+        ]
+
+    # search filters answered by the index
+    FILTERS = ('ticket', 'wiki', 'changeset')
+
+    # permission needed to see a search result of each realm
+    PERMISSIONS = {'ticket': 'TICKET_VIEW', 'wiki': 'WIKI_VIEW',
+                   'changeset': 'CHANGESET_VIEW',
+                   'attachment': 'ATTACHMENT_VIEW'}
+
+    # weight of the words only starting with a search term
+    PREFIX_WEIGHT = 0.5
+
+    # number of tickets loaded at once when building the index
+    CHUNK_SIZE = 1000
+
+    @cached
+    def ready(self):
+        """Whether the index has been built"""
+        return bool(self.env.db_query("""
+            SELECT value FROM system WHERE name=%s
+            """, (DB_READY_KEY,)))
+
+    def get_version(self):
+        """Finds the current version of the search index schema"""
+        rows = self.env.db_query("""
+            SELECT value FROM system WHERE name = %s
+            """, (DB_SYSTEM_KEY,))
+        return int(rows[0][0]) if rows else -1
+
+    # IEnvironmentSetupParticipant methods
+    def environment_created(self):
+        """Insertion of any default data into the database."""
+        pass
+
+    def environment_needs_upgrade(self, db_dummy=None):
+        """Detects if the installed db version matches the running system"""
+        db_installed_version = self.get_version()
+
+        if db_installed_version > DB_VERSION:
+            raise TracError('''Current db version (%d) newer than supported by
+            this version of the %s (%d).''' % (db_installed_version,
+                                               PLUGIN_NAME,
+                                               DB_VERSION))
+        return db_installed_version < DB_VERSION
+
+    def upgrade_environment(self, db_dummy=None):
+        """Installs or updates tables to current version"""
+        db_installed_version = self.get_version()
+        with self.env.db_transaction as db:
+            if db_installed_version < 0:
+                db("INSERT INTO system (name, value) VALUES (%s,%s)",
+                   (DB_SYSTEM_KEY, str(DB_VERSION)))
+                db_connector, _ = DatabaseManager(self.env)._get_connector()
+                for table in self.SCHEMA:
+                    for statement in db_connector.to_sql(table):
+                        db(statement)
+
+    # IAdminCommandProvider methods
+    def get_admin_commands(self):
+        yield ('search reindex', '',
+               """Rebuild the full-text search index
+
+               The search page uses the index once it has been built.
+               """,
+               None, self._do_reindex)
+
+    def _do_reindex(self):
+        def progress(realm, count):
+            printout(_("  %(count)s %(realm)s documents indexed",
+                       count=count, realm=realm))
+        self.reindex(progress)
+
+    # ISearchIndex methods
+    def get_indexed_filters(self, req):
+        return self.FILTERS if self.ready else []
+
+    def get_search_results(self, req, terms, filters):
+        ranked = sorted(self._find_docs(req, terms, filters))
+        return SearchResults(self, req, terms,
+                             [(id, resource) for s, t, id, resource in ranked])
+
+    def get_search_results_by_date(self, req, terms, filters, limit=None):
+        docs = sorted((t, id, resource) for s, t, id, resource
+                      in self._find_docs(req, terms, filters))
+        results = SearchResults(self, req, terms,
+                                [(id, resource) for t, id, resource in docs])
+        step = limit or self.CHUNK_SIZE
+        start = 0
+        while True:
+            chunk = results[start:start + step]
+            if not chunk:
+                break
+            for result in chunk:
+                yield result
+            start += step
+
+    def _find_docs(self, req, terms, filters):
+        """Return the documents matching the search terms as a list of
+        `(-score, -time, id, resource)` tuples. Permissions are not
+        checked, see `SearchResults`."""
+        words = []
+        for term in terms:
+            words.extend(w for w in get_words(term) if w not in words)
+        if not words:
+            return []
+        where = "d.filter IN (%s)" % ','.join(['%s'] * len(filters))
+        args = list(filters)
+        product = req.args.get('product')
+        if product:
+            where += " AND (d.product IS NULL OR d.product=%s)"
+            args.append(product)
+        with self.env.db_query as db:
+            total = db("SELECT COUNT(*) FROM bloodhound_search_doc")[0][0]
+            scores = None
+            for word in words:
+                # words of the documents starting with the search term,
+                # exact matches weighting more
+                freqs = {}
+                for doc, term, freq in db("""
+                        SELECT t.doc, t.term, t.freq
+                        FROM bloodhound_search_term t
+                        INNER JOIN bloodhound_search_doc d ON d.id=t.doc
+                        WHERE t.term>=%%s AND t.term<%%s AND %s
+                        """ % where, [word, word + u'\uffff'] + args):
+                    if term != word:
+                        freq *= self.PREFIX_WEIGHT
+                    freqs[doc] = freqs.get(doc, 0) + freq
+                idf = log(1.0 + float(total) / (len(freqs) or 1))
+                if scores is None:
+                    scores = dict((doc, (1 + log(freq)) * idf)
+                                  for doc, freq in freqs.iteritems())
+                else:
+                    scores = dict((doc, score + (1 + log(freqs[doc])) * idf)
+                                  for doc, score in scores.iteritems()
+                                  if doc in freqs)
+                if not scores:
+                    return []
+            ranked = []
+            for ids in _chunks(scores.keys(), self.CHUNK_SIZE):
+                for id, realm, resource_id, parent_realm, parent_id, ts in db("""
+                        SELECT id, realm, resource_id, parent_realm,
+                               parent_id, time
+                        FROM bloodhound_search_doc WHERE id IN (%s)
+                        """ % ','.join(['%s'] * len(ids)), ids):
+                    resource = self._get_resource(realm, resource_id,
+                                                  parent_realm, parent_id)
+                    ranked.append((-scores[id], -ts, id, resource))
+        return ranked
+
+    def _get_resource(self, realm, resource_id, parent_realm, parent_id):
+        if realm == 'ticket':
+            return Resource('ticket', int(resource_id))
+        elif realm == 'changeset':
+            try:
+                resource_id = int(resource_id)
+            except ValueError:
+                pass
+            return Resource('repository', parent_id).child('changeset',
+                                                           resource_id)
+        elif realm == 'attachment':
+            if parent_realm == 'ticket':
+                parent_id = int(parent_id)
+            return Resource(parent_realm, parent_id).child('attachment',
+                                                           resource_id)
+        return Resource(realm, resource_id)
+
+    def get_result(self, req, terms, resource, row):
+        """Build a search result from the stored fields of a document"""
+        ts, author, title, status, content = row
+        if resource.realm == 'ticket':
+            href = req.href.ticket(resource.id)
+            title = tag_("%(title)s: %(message)s",
+                         title=tag.span(get_resource_shortname(self.env,
+                                                               resource),
+                                        class_=status),
+                         message=title)
+        elif resource.realm == 'changeset':
+            href = req.href.changeset(resource.id,
+                                      resource.parent.id or None)
+        elif resource.realm == 'attachment':
+            href = get_resource_url(self.env, resource, req.href)
+            title = get_resource_shortname(self.env, resource)
+        else:
+            href = get_resource_url(self.env, resource, req.href)
+        return (href, title, from_utimestamp(ts), author,
+                partial(shorten_result, content, terms))
+
+    # Indexing
+    def reindex(self, progress=None):
+        """Index all tickets, wiki pages, changesets and attachments.
+        `progress` is an optional callable receiving the realm and the
+        number of indexed documents of the realm."""
+        with self.env.db_transaction as db:
+            db("DELETE FROM bloodhound_search_term")
+            db("DELETE FROM bloodhound_search_doc")
+            ids = [id for id, in db("SELECT id FROM ticket ORDER BY id")]
+            for chunk in _chunks(ids, self.CHUNK_SIZE):
+                self._add_docs(db, self._ticket_docs(db, chunk))
+            count = len(ids)
+            if progress is not None:
+                progress('ticket', count)
+            for realm, docs in [('wiki', self._wiki_docs(db)),
+                                ('changeset', self._changeset_docs(db)),
+                                ('attachment', self._attachment_docs(db))]:
+                count = self._add_docs(db, docs)
+                if progress is not None:
+                    progress(realm, count)
+            db("DELETE FROM system WHERE name=%s", (DB_READY_KEY,))
+            db("INSERT INTO system (name, value) VALUES (%s,%s)",
+               (DB_READY_KEY, '1'))
+            del self.ready
+
+    def reindex_tickets(self, ids):
+        """Index the tickets `ids` again, e.g. after they have been
+        modified without notifying the change listeners."""
+        ids = list(ids)
+        with self.env.db_transaction as db:
+            for chunk in _chunks(ids, self.CHUNK_SIZE):
+                args = ','.join(['%s'] * len(chunk))
+                resource_ids = [unicode(id) for id in chunk]
+                db("""
+                    DELETE FROM bloodhound_search_term WHERE doc IN (
+                        SELECT id FROM bloodhound_search_doc
+                        WHERE realm='ticket' AND parent_realm=''
+                              AND resource_id IN (%s))
+                    """ % args, resource_ids)
+                db("""
+                    DELETE FROM bloodhound_search_doc
+                    WHERE realm='ticket' AND parent_realm=''
+                          AND resource_id IN (%s)
+                    """ % args, resource_ids)
+                self._add_docs(db, self._ticket_docs(db, chunk))
+                # the attachments follow the product of their ticket
+                db.executemany("""
+                    UPDATE bloodhound_search_doc SET product=%s
+                    WHERE realm='attachment' AND parent_realm='ticket'
+                          AND parent_id=%s
+                    """, [(product or '', unicode(id)) for id, product in db("""
+                        SELECT id, product FROM ticket WHERE id IN (%s)
+                        """ % args, chunk)])
+
+    def _add_docs(self, db, docs):
+        """Store documents in the index. Documents are tuples of the form
+        `(filter, realm, resource_id, parent_realm, parent_id, product,
+        time, author, title, status, content, text)`, the words of `text`
+        being indexed."""
+        cursor = db.cursor()
+        count = 0
+        for doc in docs:
+            text = doc[-1]
+            freqs = {}
+            for word in get_words(text):
+                freqs[word] = freqs.get(word, 0) + 1
+            cursor.execute("""
+                INSERT INTO bloodhound_search_doc
+                    (filter,realm,resource_id,parent_realm,parent_id,product,
+                     time,author,title,status,content)
+                VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)
+                """, doc[:-1])
+            id = db.get_last_id(cursor, 'bloodhound_search_doc')
+            db.executemany("""
+                INSERT INTO bloodhound_search_term (term,doc,freq)
+                VALUES (%s,%s,%s)
+                """, [(word, id, freq) for word, freq in freqs.iteritems()])
+            count += 1
+        return count
+
+    def _remove_doc(self, db, realm, resource_id, parent_realm='',
+                    parent_id=''):
+        for id, in db("""
+                SELECT id FROM bloodhound_search_doc
+                WHERE realm=%s AND resource_id=%s AND parent_realm=%s
+                      AND parent_id=%s
+                """, (realm, unicode(resource_id), parent_realm,
+                      unicode(parent_id))):
+            db("DELETE FROM bloodhound_search_term WHERE doc=%s", (id,))
+            db("DELETE FROM bloodhound_search_doc WHERE id=%s", (id,))
+
+    def _ticket_docs(self, db, ids):
+        args = ','.join(['%s'] * len(ids))
+        texts = {}
+        for id, value in db("""
+                SELECT ticket, newvalue FROM ticket_change
+                WHERE field='comment' AND ticket IN (%s)
+                UNION ALL
+                SELECT ticket, value FROM ticket_custom
+                WHERE ticket IN (%s)
+                """ % (args, args), ids + ids):
+            texts.setdefault(id, []).append(value or '')
+        ticketsystem = TicketSystem(self.env)
+        for (id, ts, reporter, summary, keywords, description, cc, type,
+             status, resolution, product) in db("""
+                SELECT id, time, reporter, summary, keywords, description,
+                       cc, type, status, resolution, product
+                FROM ticket WHERE id IN (%s)
+                """ % args, ids):
+            text = ' '.join([unicode(id), summary or '', keywords or '',
+                             description or '', reporter or '', cc or ''] +
+                            texts.get(id, []))
+            yield ('ticket', 'ticket', unicode(id), '', '', product or '',
+                   ts, reporter,
+                   ticketsystem.format_summary(summary, status, resolution,
+                                               type),
+                   status, description, text)
+
+    def _wiki_docs(self, db, name=None):
+        sql = """SELECT w1.name, w1.time, w1.author, w1.text
+                 FROM wiki w1,(SELECT name, max(version) AS ver
+                               FROM wiki GROUP BY name) w2
+                 WHERE w1.version = w2.ver AND w1.name = w2.name"""
+        args = []
+        if name is not None:
+            sql += " AND w1.name=%s"
+            args.append(name)
+        for name, ts, author, text in db(sql, args):
+            yield ('wiki', 'wiki', name, '', '', None, ts, author,
+                   '%s: %s' % (name, shorten_line(text)), None, text,
+                   ' '.join([name, author or '', text or '']))
+
+    def _changeset_docs(self, db):
+        reponames = dict(db("""
+            SELECT id, value FROM repository WHERE name='name'
+            """))
+        for repos, rev, ts, author, message in db("""
+                SELECT repos, rev, time, author, message FROM revision
+                """):
+            reponame = reponames.get(repos)
+            if reponame is None:
+                continue
+            try:
+                rev = unicode(int(rev))
+            except ValueError:
+                pass
+            yield self._changeset_doc(reponame, rev, ts, author, message)
+
+    def _changeset_doc(self, reponame, rev, ts, author, message):
+        return ('changeset', 'changeset', rev, 'repository', reponame, None,
+                ts, author, '[%s]: %s' % (rev, shorten_line(message)), None,
+                message, ' '.join([rev, author or '', message or '']))
+
+    def _attachment_docs(self, db, realm=None, id=None, filename=None):
+        sql = """SELECT a.type, a.id, a.filename, a.time, a.description,
+                        a.author, t.product
+                 FROM attachment a
+                 LEFT OUTER JOIN ticket t
+                 ON a.type='ticket' AND %s=a.id
+                 WHERE a.type IN ('ticket','wiki')""" % \
+              db.cast('t.id', 'text')
+        args = []
+        if realm is not None:
+            sql += " AND a.type=%s AND a.id=%s AND a.filename=%s"
+            args.extend([realm, unicode(id), filename])
+        for type, id, filename, ts, description, author, product in \
+                db(sql, args):
+            if type == 'ticket':
+                product = product or ''
+            yield (type, 'attachment', filename, type, id, product, ts,
+                   author, None, None, description,
+                   ' '.join([filename, description or '', author or '']))
+
+    # ITicketChangeListener methods
+    def ticket_created(self, ticket):
+        self._reindex_ticket(ticket.id)
+
+    def ticket_changed(self, ticket, comment, author, old_values):
+        self._reindex_ticket(ticket.id)
+
+    def ticket_deleted(self, ticket):
+        with self.env.db_transaction as db:
+            self._remove_doc(db, 'ticket', ticket.id)
+
+    def _reindex_ticket(self, id):
+        self.reindex_tickets([id])
+
+    # ITicketBatchChangeListener methods
+    def tickets_changed(self, changes, comment, author):
+        self.reindex_tickets([ticket.id for ticket, old_values in changes])
+
+    # IWikiChangeListener methods
+    def wiki_page_added(self, page):
+        self._reindex_wiki_page(page.name)
+
+    def wiki_page_changed(self, page, version, t, comment, author, ipnr):
+        self._reindex_wiki_page(page.name)
+
+    def wiki_page_deleted(self, page):
+        with self.env.db_transaction as db:
+            self._remove_doc(db, 'wiki', page.name)
+
+    def wiki_page_version_deleted(self, page):
+        self._reindex_wiki_page(page.name)
+
+    def wiki_page_renamed(self, page, old_name):
+        with self.env.db_transaction as db:
+            self._remove_doc(db, 'wiki', old_name)
+        self._reindex_wiki_page(page.name)
+
+    def _reindex_wiki_page(self, name):
+        with self.env.db_transaction as db:
+            self._remove_doc(db, 'wiki', name)
+            self._add_docs(db, self._wiki_docs(db, name))
+
+    # IRepositoryChangeListener methods
+    def changeset_added(self, repos, changeset):
+        with self.env.db_transaction as db:
+            self._remove_doc(db, 'changeset', changeset.rev, 'repository',
+                             repos.reponame)
+            self._add_docs(db, [self._changeset_doc(
+                repos.reponame, unicode(changeset.rev),
+                to_utimestamp(changeset.date), changeset.author,
+                changeset.message)])
+
+    def changeset_modified(self, repos, changeset, old_changeset):
+        self.changeset_added(repos, changeset)
+
+    # IAttachmentChangeListener methods
+    def attachment_added(self, attachment):
+        self._reindex_attachment(attachment.parent_realm,
+                                 attachment.parent_id, attachment.filename)
+
+    def attachment_deleted(self, attachment):
+        with self.env.db_transaction as db:
+            self._remove_doc(db, 'attachment', attachment.filename,
+                             attachment.parent_realm, attachment.parent_id)
+
+    def attachment_reparented(self, attachment, old_parent_realm,
+                              old_parent_id):
+        with self.env.db_transaction as db:
+            self._remove_doc(db, 'attachment', attachment.filename,
+                             old_parent_realm, old_parent_id)
+        self._reindex_attachment(attachment.parent_realm,
+                                 attachment.parent_id, attachment.filename)
+
+    def _reindex_attachment(self, realm, id, filename):
+        with self.env.db_transaction as db:
+            self._remove_doc(db, 'attachment', filename, realm, id)
+            self._add_docs(db, self._attachment_docs(db, realm, id,
+                                                     filename))
+
+
+class SearchResults(object):
+    """Ranked search results of the index. Results are built from the
+    stored documents when a slice is taken.
+
+    The permission to view the documents is only checked up to the end of
+    the requested slices, so that showing the first pages of results
+    doesn't need a check for every match. Taking the length checks all
+    the documents.
+    """
+
+    def __init__(self, index, req, terms, docs):
+        self.index = index
+        self.req = req
+        self.terms = terms
+        self.docs = docs
+        self._permitted = []
+        self._checked = 0
+
+    def _check_permissions(self, stop=None):
+        """Check the documents until `stop` of them are permitted, or all
+        of them if `stop` is `None`."""
+        docs = self.docs
+        while self._checked < len(docs) and \
+                (stop is None or len(self._permitted) < stop):
+            id, resource = docs[self._checked]
+            self._checked += 1
+            if self.index.PERMISSIONS[resource.realm] in \
+                    self.req.perm(resource):
+                self._permitted.append((id, resource))
+
+    def __len__(self):
+        self._check_permissions()
+        return len(self._permitted)
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            return self[key:key + 1 or None][0]
+        if key.stop is None or key.stop < 0 or (key.start or 0) < 0:
+            self._check_permissions()
+        else:
+            self._check_permissions(key.stop)
+        docs = self._permitted[key]
+        rows = {}
+        with self.index.env.db_query as db:
+            for ids in _chunks([id for id, resource in docs],
+                               self.index.CHUNK_SIZE):
+                for row in db("""
+                        SELECT id, time, author, title, status, content
+                        FROM bloodhound_search_doc WHERE id IN (%s)
+                        """ % ','.join(['%s'] * len(ids)), ids):
+                    rows[row[0]] = row[1:]
+        return [self.index.get_result(self.req, self.terms, resource,
+                                      rows[id])
+                for id, resource in docs if id in rows]
@@ -18,16 +18,16 @@
 
 """ Multi product support for tickets."""
 
+from functools import partial
 import re
 
 from trac.core import TracError
 from trac.ticket.model import Ticket
 from trac.ticket.web_ui import TicketModule
 from trac.ticket.report import ReportModule
-from trac.attachment import AttachmentModule
 from trac.ticket.api import TicketSystem
 from trac.resource import Resource, get_resource_shortname, ResourceNotFound
-from trac.search import search_to_sql, shorten_result
+from trac.search import search_rows, search_to_sql, shorten_result
 from trac.util.datefmt import from_utimestamp
 from trac.util.translation import _, tag_
 from genshi.builder import tag
@@ -77,10 +77,11 @@ class ProductTicketModule(TicketModule):
     #def get_search_filters(self, req):
     # override not yet required
     
-    def get_search_results(self, req, terms, filters):
+    #def get_search_results(self, req, terms, filters):
+    # override not yet required
+    
+    def _get_ticket_search_results(self, req, terms, limit=None):
         """Overriding search results for Tickets"""
-        if not 'ticket' in filters:
-            return
         ticket_realm = Resource('ticket')
         with self.env.db_query as db:
             sql, args = search_to_sql(db, ['summary', 'keywords',
@@ -90,12 +91,15 @@ class ProductTicketModule(TicketModule):
             sql3, args3 = search_to_sql(db, ['value'], terms)
             ticketsystem = TicketSystem(self.env)
             if req.args.get('product'):
-                productsql = "product='%s' AND" % req.args.get('product')
+                productsql = "product=%s AND"
+                productargs = (req.args.get('product'),)
             else:
                 productsql = ""
+                productargs = ()
             
             for summary, desc, author, type, tid, ts, status, resolution in \
-                    db("""SELECT summary, description, reporter, type, id,
+                    search_rows(db, """
+                          SELECT summary, description, reporter, type, id,
                                  time, status, resolution 
                           FROM ticket
                           WHERE (%s id IN (
@@ -106,8 +110,9 @@ class ProductTicketModule(TicketModule):
                             UNION
                               SELECT ticket FROM ticket_custom WHERE %s
                           ))
+                          ORDER BY time DESC, id DESC
                           """ % (productsql, sql, sql2, sql3),
-                          args + args2 + args3):
+                          productargs + args + args2 + args3, limit):
                 t = ticket_realm(id=tid)
                 if 'TICKET_VIEW' in req.perm(t):
                     yield (req.href.ticket(tid),
@@ -118,12 +123,7 @@ class ProductTicketModule(TicketModule):
                                 message=ticketsystem.format_summary(
                                     summary, status, resolution, type)),
                            from_utimestamp(ts), author,
-                           shorten_result(desc, terms))
-        
-        # Attachments
-        for result in AttachmentModule(self.env).get_search_results(
-            req, ticket_realm, terms):
-            yield result
+                           partial(shorten_result, desc, terms))
 
 class ProductReportModule(ReportModule):
     """Multiproduct replacement for ReportModule"""
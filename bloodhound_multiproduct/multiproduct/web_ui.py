@@ -33,6 +33,7 @@ from trac.util.translation import _
 from trac.web.api import IRequestFilter, IRequestHandler, Request, HTTPNotFound
 from trac.web.main import RequestDispatcher
 
+from multiproduct.api import MultiProductSystem
 from multiproduct.model import Product
 
 PRODUCT_RE = re.compile(r'^/products/(?P<pid>[^/]*)(?P<pathinfo>.*)')
@@ -54,6 +55,14 @@ class ProductModule(Component):
             yield ('mainnav', 'products',
                    tag.a(_('Products'), href=req.href.products(), accesskey=3))
     
+    def _find_product_handler(self, dispatcher, req):
+        """Select the handler for the given (product-less) request, i.e. 
+        the first handler of the dispatcher matching it.
+        """
+        for hndlr in dispatcher.handlers:
+            if hndlr is not self and hndlr.match_request(req):
+                return hndlr
+    
     # IRequestFilter methods
     def pre_process_request(self, req, handler):
         """pre process request filter"""
@@ -66,10 +75,10 @@ class ProductModule(Component):
             pid = match.group('pid')
         
         if pid:
-            products = Product.select(self.env, where={'prefix': pid})
-            if pid and len(products) == 1:
+            product = MultiProductSystem(self.env).get_product(prefix=pid)
+            if product is not None:
                 req.args['productid'] = pid
-                req.args['product'] = products[0].name
+                req.args['product'] = product.name
                 if handler is self and match.group('pathinfo') not in ('', '/'):
                     # select a new handler
                     environ = req.environ.copy()
@@ -78,12 +87,8 @@ class ProductModule(Component):
                     environ['PATH_INFO'] = pathinfo
                     newreq = Request(environ, lambda *args, **kwds: None)
                     
-                    new_handler = None
-                    for hndlr in dispatcher.handlers:
-                        if hndlr is not self and hndlr.match_request(newreq):
-                            new_handler = hndlr
-                            req.args.update(newreq.args)
-                            break
+                    new_handler = self._find_product_handler(dispatcher, 
+                                                             newreq)
                     if new_handler is None:
                         if req.path_info.endswith('/'):
                             target = req.path_info.rstrip('/').encode('utf-8')
@@ -92,6 +97,7 @@ class ProductModule(Component):
                             req.redirect(req.href + target, permanent=True)
                         raise HTTPNotFound('No handler matched request to %s',
                                            req.path_info)
+                    req.args.update(newreq.args)
                     handler = new_handler
             else:
                 raise ResourceNotFound(_("Product %(id)s does not exist.", 
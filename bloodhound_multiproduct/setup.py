@@ -27,6 +27,7 @@ setup(
     entry_points = {'trac.plugins': [
             'multiproduct.model = multiproduct.model',
             'multiproduct.product_admin = multiproduct.product_admin',
+            'multiproduct.search = multiproduct.search',
             'multiproduct.ticket.web_ui = multiproduct.ticket.web_ui',
             'multiproduct.web_ui = multiproduct.web_ui',
         ],},
@@ -24,17 +24,31 @@ import shutil
 from sqlite3 import OperationalError
 
 from trac.test import EnvironmentStub
-from trac.core import TracError
-from multiproduct.model import Product
-from multiproduct.model import MultiProductEnvironmentProvider
+from trac.core import Component, TracError, implements
+from trac.ticket.api import ITicketBatchChangeListener
+from trac.ticket.model import Ticket
+from multiproduct.model import Product, ProductResourceMap
+from multiproduct.api import MultiProductSystem
+
+class BatchChangeListener(Component):
+    """Records the batches of ticket changes"""
+    implements(ITicketBatchChangeListener)
+    
+    batches = []
+    
+    def tickets_changed(self, changes, comment, author):
+        self.batches.append(([(t.id, old) for t, old in changes], author))
 
 class ProductTestCase(unittest.TestCase):
     """Unit tests covering the Product model"""
     def setUp(self):
-        self.env = EnvironmentStub(enable=['trac.*', 'multiproduct.*'])
+        self.env = EnvironmentStub(enable=['trac.*', 'multiproduct.*',
+                                           BatchChangeListener],
+                                   disable=['multiproduct.search.*'])
+        BatchChangeListener.batches = []
         self.env.path = tempfile.mkdtemp('bh-product-tempenv')
         
-        self.envprovider = MultiProductEnvironmentProvider(self.env)
+        self.envprovider = MultiProductSystem(self.env)
         try:
             self.envprovider.upgrade_environment(self.env.db_transaction)
         except OperationalError:
@@ -57,11 +71,11 @@ class ProductTestCase(unittest.TestCase):
         """tests that select can search Products by fields"""
         
         p2_data = {'prefix':'tp2',
-                   'name':'test project',
-                   'description':'a different test project'}
+                   'name':'test project 2',
+                   'description':'a test project'}
         p3_data = {'prefix':'tp3',
-                   'name':'test project',
-                   'description':'test project'}
+                   'name':'test project 3',
+                   'description':'a different test project'}
         
         product2 = Product(self.env)
         product2._data.update(p2_data)
@@ -73,11 +87,15 @@ class ProductTestCase(unittest.TestCase):
         
         products = list(Product.select(self.env, where={'prefix':'tp'}))
         self.assertEqual(1, len(products))
-        products = list(Product.select(self.env, where={'name':'test project'}))
-        self.assertEqual(3, len(products))
+        products = list(Product.select(self.env,
+                                       where={'description':'a test project'}))
+        self.assertEqual(2, len(products))
         products = list(Product.select(self.env, where={'prefix':'tp3',
-                                                        'name':'test project'}))
+                                                        'name':'test project 3'}))
         self.assertEqual(1, len(products))
+        products = list(Product.select(self.env, where={'prefix':'tp3',
+                                                        'name':'test project'}))
+        self.assertEqual(0, len(products))
     
     def test_update(self):
         """tests that we can use update to push data to the database"""
@@ -124,6 +142,44 @@ class ProductTestCase(unittest.TestCase):
         product2._data.update(dupe_key_data)
         self.assertRaises(TracError, product2.insert)
     
+    def test_insert_duplicate_name(self):
+        """test attempted saving of Product with existing name fails"""
+        dupe_name_data = {'prefix':'tp2',
+                          'name':'test project',
+                          'description':'dupe name'}
+        product2 = Product(self.env)
+        product2._data.update(dupe_name_data)
+        self.assertRaises(TracError, product2.insert)
+    
+    def test_insert_many(self):
+        """test saving several Products at once"""
+        Product.insert_many(self.env, [{'prefix':'p%d' % i,
+                                        'name':'product %d' % i}
+                                       for i in range(3)])
+        products = Product.select(self.env)
+        self.assertEqual(['p0', 'p1', 'p2', 'tp'],
+                         sorted(p.prefix for p in products))
+        self.assertTrue(all(p._exists for p in products))
+    
+    def test_update_many(self):
+        """test updating several Products at once"""
+        Product.insert_many(self.env, [{'prefix':'p1', 'name':'product 1'}])
+        Product.update_many(self.env, [{'prefix':'tp', 'name':'renamed',
+                                        'description':'', 'owner':'joe'},
+                                       {'prefix':'p1', 'name':'product 1',
+                                        'description':'new', 'owner':None}])
+        product = Product(self.env, {'prefix':'tp'})
+        self.assertEqual('renamed', product.name)
+        self.assertEqual('joe', product.owner)
+        product = Product(self.env, {'prefix':'p1'})
+        self.assertEqual('new', product.description)
+    
+    def test_delete_many(self):
+        """test deleting several Products at once"""
+        Product.insert_many(self.env, [{'prefix':'p1', 'name':'product 1'}])
+        Product.delete_many(self.env, [{'prefix':'tp'}, {'prefix':'p1'}])
+        self.assertEqual([], Product.select(self.env))
+    
     def test_delete(self):
         """test that we are able to delete Products"""
         product = list(Product.select(self.env, where={'prefix':'tp'}))[0]
@@ -139,6 +195,79 @@ class ProductTestCase(unittest.TestCase):
         
         self.assertRaises(TracError, product.delete)
     
+    def _insert_ticket(self, product):
+        ticket = Ticket(self.env)
+        ticket['summary'] = 'summary'
+        ticket['reporter'] = 'joe'
+        ticket['product'] = product
+        return ticket.insert()
+    
+    def test_rename_retargets_tickets(self):
+        """test that renaming a Product moves its tickets"""
+        ids = [self._insert_ticket('test project') for i in range(3)]
+        other = self._insert_ticket('other project')
+        updates = []
+        product = Product(self.env, {'prefix':'tp'})
+        product.update_field_dict({'name':'renamed'})
+        product.update(author='jim',
+                       progress=lambda done, total: updates.append(done))
+        
+        self.assertEqual([3], updates)
+        for id in ids:
+            ticket = Ticket(self.env, id)
+            self.assertEqual('renamed', ticket['product'])
+            self.assertEqual([('jim', 'comment', '1',
+                               'Product test project renamed to renamed'),
+                              ('jim', 'product', 'test project', 'renamed')],
+                             [change[1:5] for change in ticket.get_changelog()])
+        self.assertEqual('other project', Ticket(self.env, other)['product'])
+        # the batch change listeners are notified
+        self.assertEqual([([(id, {'product':'test project'}) for id in ids],
+                           'jim')], BatchChangeListener.batches)
+    
+    def test_update_many_retargets_tickets(self):
+        """test that renaming Products at once moves their tickets"""
+        Product.insert_many(self.env, [{'prefix':'p1', 'name':'product 1'}])
+        id = self._insert_ticket('test project')
+        other = self._insert_ticket('product 1')
+        Product.update_many(self.env, [{'prefix':'tp', 'name':'renamed',
+                                        'description':'', 'owner':None},
+                                       {'prefix':'p1', 'name':'product 1',
+                                        'description':'new', 'owner':None}],
+                            author='jim')
+        ticket = Ticket(self.env, id)
+        self.assertEqual('renamed', ticket['product'])
+        self.assertEqual([('jim', 'product', 'test project', 'renamed')],
+                         [change[1:5] for change in ticket.get_changelog()
+                          if change[2] == 'product'])
+        self.assertEqual('product 1', Ticket(self.env, other)['product'])
+    
+    def test_reparent_resources(self):
+        """test that resources can be moved to another Product"""
+        ProductResourceMap.insert_many(self.env, [
+            {'id':1, 'product_id':'tp', 'resource_type':'ticket',
+             'resource_id':'1'},
+            {'id':2, 'product_id':'tp', 'resource_type':'wiki',
+             'resource_id':'WikiStart'},
+            {'id':3, 'product_id':'p1', 'resource_type':'ticket',
+             'resource_id':'2'}])
+        ProductResourceMap.reparent_resources(self.env, 'tp', 'p2')
+        self.assertEqual([('1', 'p2'), ('2', 'p2'), ('3', 'p1')],
+                         sorted((str(m._data['id']), m._data['product_id'])
+                                for m in ProductResourceMap.select(self.env)))
+    
+    def test_delete_moves_resources(self):
+        """test that deleting a Product moves its resources"""
+        Product.insert_many(self.env, [{'prefix':'p1', 'name':'product 1'}])
+        ProductResourceMap.insert_many(self.env, [
+            {'id':1, 'product_id':'tp', 'resource_type':'ticket',
+             'resource_id':'1'}])
+        self.assertRaises(TracError, Product(self.env, {'prefix':'tp'}).delete,
+                          resources_to='missing')
+        Product(self.env, {'prefix':'tp'}).delete(resources_to='p1')
+        self.assertEqual(['p1'], [m._data['product_id'] for m in
+                                  ProductResourceMap.select(self.env)])
+    
     def test_field_data_get(self):
         """tests that we can use table.field syntax to get to the field data"""
         prefix = self.default_data['prefix']
@@ -0,0 +1,100 @@
+#  Licensed to the Apache Software Foundation (ASF) under one
+#  or more contributor license agreements.  See the NOTICE file
+#  distributed with this work for additional information
+#  regarding copyright ownership.  The ASF licenses this file
+#  to you under the Apache License, Version 2.0 (the
+#  "License"); you may not use this file except in compliance
+#  with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing,
+#  software distributed under the License is distributed on an
+#  "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+#  KIND, either express or implied.  See the License for the
+#  specific language governing permissions and limitations
+#  under the License.
+
+"""Tests for multiproduct/product_admin.py"""
+import sys
+import unittest
+from StringIO import StringIO
+
+from sqlite3 import OperationalError
+
+from trac.admin.api import AdminCommandError, AdminCommandManager
+from trac.test import EnvironmentStub
+from trac.ticket.model import Ticket
+from multiproduct.api import MultiProductSystem
+from multiproduct.model import Product, ProductResourceMap
+
+class ProductAdminCommandTestCase(unittest.TestCase):
+    """Unit tests covering the product trac-admin commands"""
+    def setUp(self):
+        self.env = EnvironmentStub(enable=['trac.*', 'multiproduct.*'],
+                                   disable=['multiproduct.search.*'])
+        try:
+            MultiProductSystem(self.env).upgrade_environment()
+        except OperationalError:
+            # table remains but database version is deleted
+            pass
+        Product.insert_many(self.env, [{'prefix':'p1', 'name':'product 1'},
+                                       {'prefix':'p2', 'name':'product 2'}])
+        self.admin = AdminCommandManager(self.env)
+
+    def tearDown(self):
+        self.env.reset_db()
+
+    def _execute(self, *args):
+        stdout = sys.stdout
+        sys.stdout = out = StringIO()
+        try:
+            self.admin.execute_command('product', *args)
+        finally:
+            sys.stdout = stdout
+        return out.getvalue()
+
+    def test_list(self):
+        """products are listed with their prefix and name"""
+        output = self._execute('list')
+        self.assertTrue('p1' in output and 'product 1' in output)
+        self.assertTrue('p2' in output and 'product 2' in output)
+
+    def test_rename(self):
+        """renaming a product moves its tickets"""
+        ticket = Ticket(self.env)
+        ticket['summary'] = 'summary'
+        ticket['product'] = 'product 1'
+        ticket.insert()
+        output = self._execute('rename', 'p1', 'renamed')
+        self.assertEqual('  1 of 1 tickets updated\n', output)
+        self.assertEqual('renamed', Product(self.env, {'prefix':'p1'}).name)
+        self.assertEqual('renamed', Ticket(self.env, ticket.id)['product'])
+
+    def test_rename_missing(self):
+        """renaming a missing product fails"""
+        self.assertRaises(AdminCommandError, self._execute, 'rename',
+                          'missing', 'renamed')
+
+    def test_remove(self):
+        """removing a product moves its resources to another product"""
+        ProductResourceMap.insert_many(self.env, [
+            {'id':1, 'product_id':'p1', 'resource_type':'ticket',
+             'resource_id':'1'}])
+        self._execute('remove', 'p1', 'p2')
+        self.assertEqual(['p2'], [p.prefix for p in Product.select(self.env)])
+        self.assertEqual(['p2'], [m._data['product_id'] for m in
+                                  ProductResourceMap.select(self.env)])
+
+    def test_remove_to_missing(self):
+        """removing a product fails when the target product is missing"""
+        self.assertRaises(AdminCommandError, self._execute, 'remove', 'p1',
+                          'missing')
+        self.assertEqual(['p1', 'p2'],
+                         sorted(p.prefix for p in Product.select(self.env)))
+
+def suite():
+    return unittest.makeSuite(ProductAdminCommandTestCase, 'test')
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
@@ -0,0 +1,179 @@
+
+#  Licensed to the Apache Software Foundation (ASF) under one
+#  or more contributor license agreements.  See the NOTICE file
+#  distributed with this work for additional information
+#  regarding copyright ownership.  The ASF licenses this file
+#  to you under the Apache License, Version 2.0 (the
+#  "License"); you may not use this file except in compliance
+#  with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing,
+#  software distributed under the License is distributed on an
+#  "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+#  KIND, either express or implied.  See the License for the
+#  specific language governing permissions and limitations
+#  under the License.
+
+"""Tests for multiproduct/search.py"""
+import shutil
+import tempfile
+import unittest
+from StringIO import StringIO
+
+from sqlite3 import OperationalError
+
+from trac.attachment import Attachment
+from trac.test import EnvironmentStub, Mock, MockPerm
+from trac.ticket.model import Ticket
+from trac.web.href import Href
+from trac.wiki.model import WikiPage
+from multiproduct.api import MultiProductSystem
+from multiproduct.model import Product
+from multiproduct.search import SearchIndex
+
+class SearchIndexTestCase(unittest.TestCase):
+    """Unit tests covering the full-text search index"""
+    def setUp(self):
+        self.env = EnvironmentStub(enable=['trac.*', 'multiproduct.*'])
+        self.env.path = tempfile.mkdtemp('bh-search-tempenv')
+        try:
+            MultiProductSystem(self.env).upgrade_environment()
+        except OperationalError:
+            # table remains but database version is deleted
+            pass
+        self.index = SearchIndex(self.env)
+        self.index.upgrade_environment()
+
+    def tearDown(self):
+        with self.env.db_transaction as db:
+            for table in SearchIndex.SCHEMA:
+                db("DROP TABLE %s" % table.name)
+        self.env.reset_db()
+        shutil.rmtree(self.env.path)
+
+    def _req(self, **args):
+        return Mock(args=args, perm=MockPerm(), href=Href('/trac'),
+                    authname='anonymous')
+
+    def _insert_ticket(self, summary, description='', product=''):
+        ticket = Ticket(self.env)
+        ticket['summary'] = summary
+        ticket['description'] = description
+        ticket['reporter'] = 'joe'
+        ticket['product'] = product
+        ticket.insert()
+        return ticket
+
+    def _search(self, terms, filters=('ticket', 'wiki'), **args):
+        results = self.index.get_search_results(self._req(**args), terms,
+                                                list(filters))
+        return [href for href, title, date, author, excerpt in results[:]]
+
+    def test_not_ready(self):
+        """the index is not used before being built"""
+        self.assertEqual([], self.index.get_indexed_filters(self._req()))
+        self.index.reindex()
+        self.assertEqual(('ticket', 'wiki', 'changeset'),
+                         self.index.get_indexed_filters(self._req()))
+
+    def test_reindex(self):
+        """existing tickets and pages are indexed"""
+        self._insert_ticket('crash on startup')
+        page = WikiPage(self.env, 'StartPage')
+        page.text = 'How to start the server'
+        page.save('joe', 'created', '::1')
+        self.index.reindex()
+        self.assertEqual(['/trac/wiki/StartPage', '/trac/ticket/1'],
+                         self._search(['start']))
+        self.assertEqual(['/trac/wiki/StartPage'],
+                         self._search(['start', 'server']))
+
+    def test_ranking(self):
+        """documents with more occurrences of the terms come first"""
+        self.index.reindex()
+        self._insert_ticket('disk', 'disk is full')
+        self._insert_ticket('disk full', 'full disk, disk full')
+        self.assertEqual(['/trac/ticket/2', '/trac/ticket/1'],
+                         self._search(['disk', 'full']))
+
+    def test_ticket_changes(self):
+        """tickets are indexed again when they change"""
+        self.index.reindex()
+        ticket = self._insert_ticket('first summary')
+        ticket['summary'] = 'second summary'
+        ticket.save_changes('joe', 'a comment')
+        self.assertEqual([], self._search(['first']))
+        self.assertEqual(['/trac/ticket/1'], self._search(['second']))
+        self.assertEqual(['/trac/ticket/1'], self._search(['comment']))
+        ticket.delete()
+        self.assertEqual([], self._search(['second']))
+
+    def test_product_scope(self):
+        """tickets of other products are not found"""
+        Product.insert_many(self.env, [{'prefix':'p1', 'name':'p1'},
+                                       {'prefix':'p2', 'name':'p2'}])
+        self.index.reindex()
+        self._insert_ticket('memory leak', product='p1')
+        self._insert_ticket('memory leak', product='p2')
+        self.assertEqual(['/trac/ticket/1'],
+                         self._search(['memory'], product='p1'))
+        self.assertEqual(2, len(self._search(['memory'])))
+
+    def test_product_rename(self):
+        """tickets and their attachments follow a renamed product"""
+        Product.insert_many(self.env, [{'prefix':'p1', 'name':'p1'},
+                                       {'prefix':'p2', 'name':'p2'}])
+        self._insert_ticket('memory leak', product='p1')
+        self.index.reindex()
+        attachment = Attachment(self.env, 'ticket', 1)
+        attachment.author = 'joe'
+        attachment.insert('memory.log', StringIO(''), 0)
+        product = Product(self.env, {'prefix':'p1'})
+        product.update_field_dict({'name':'renamed'})
+        product.update(author='joe')
+        self.assertEqual(['/trac/attachment/ticket/1/memory.log',
+                          '/trac/ticket/1'],
+                         sorted(self._search(['memory'], product='renamed')))
+        self.assertEqual([], self._search(['memory'], product='p1'))
+
+    def test_permissions_checked_lazily(self):
+        """permissions are only checked for the requested results"""
+        self.index.reindex()
+        for i in range(5):
+            self._insert_ticket('memory leak')
+        perm = DenyingPerm()
+        req = Mock(args={}, perm=perm, href=Href('/trac'),
+                   authname='anonymous')
+        results = self.index.get_search_results(req, ['memory'], ['ticket'])
+        # deny the second best match
+        denied = results.docs[1][1].id
+        perm.denied.append(denied)
+        self.assertEqual(2, len(results[0:2]))
+        self.assertEqual(3, len(perm.checked))
+        self.assertFalse('/trac/ticket/%s' % denied in
+                         [href for href, title, date, author, excerpt
+                          in results[0:4]])
+        self.assertEqual(4, len(results))
+        self.assertEqual(5, len(perm.checked))
+
+class DenyingPerm(object):
+    """Denies the view of the given tickets and records the checks"""
+    def __init__(self):
+        self.denied = []
+        self.checked = []
+    
+    def __call__(self, resource):
+        self.resource = resource
+        return self
+    
+    def __contains__(self, action):
+        self.checked.append(self.resource.id)
+        return self.resource.id not in self.denied
+
+def suite():
+    return unittest.makeSuite(SearchIndexTestCase, 'test')
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
@@ -0,0 +1,67 @@
+
+#  Licensed to the Apache Software Foundation (ASF) under one
+#  or more contributor license agreements.  See the NOTICE file
+#  distributed with this work for additional information
+#  regarding copyright ownership.  The ASF licenses this file
+#  to you under the Apache License, Version 2.0 (the
+#  "License"); you may not use this file except in compliance
+#  with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing,
+#  software distributed under the License is distributed on an
+#  "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+#  KIND, either express or implied.  See the License for the
+#  specific language governing permissions and limitations
+#  under the License.
+
+"""Tests for multiproduct/web_ui.py"""
+import unittest
+
+from trac.test import EnvironmentStub, Mock
+from multiproduct.web_ui import ProductModule
+
+class PathHandler(object):
+    """Request handler matching paths starting with a given prefix"""
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.calls = 0
+
+    def match_request(self, req):
+        self.calls += 1
+        return req.path_info.startswith(self.prefix)
+
+class ProductHandlerTestCase(unittest.TestCase):
+    """Unit tests covering the selection of handlers for product paths"""
+    def setUp(self):
+        self.env = EnvironmentStub(enable=['trac.*', 'multiproduct.*'])
+        self.module = ProductModule(self.env)
+        self.page = PathHandler('/wiki/Page')
+        self.wiki = PathHandler('/wiki')
+        self.dispatcher = Mock(handlers=[self.module, self.page, self.wiki])
+
+    def tearDown(self):
+        self.env.reset_db()
+
+    def _find(self, path_info):
+        return self.module._find_product_handler(self.dispatcher,
+                                                 Mock(path_info=path_info))
+
+    def test_first_match(self):
+        """handlers are selected in the order of the dispatcher"""
+        self.assertEqual(self.wiki, self._find('/wiki/Other'))
+        self.assertEqual(self.page, self._find('/wiki/Page'))
+        self.assertEqual(self.wiki, self._find('/wiki/Other'))
+        self.assertEqual(None, self._find('/ticket/1'))
+
+    def test_skip_product_module(self):
+        """the product module itself is never selected"""
+        self.module.match_request = lambda req: True
+        self.assertEqual(self.wiki, self._find('/wiki/Other'))
+
+def suite():
+    return unittest.makeSuite(ProductHandlerTestCase, 'test')
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
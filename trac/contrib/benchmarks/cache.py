@@ -0,0 +1,71 @@
+#!/usr/bin/python
+"""Measure the overhead of cached attributes on request throughput.
+
+Each simulated request resets the per-request cache metadata and reads a
+few cached attributes, as the first cache access of a real request does.
+A small fraction of requests also invalidates one of the caches. The
+number of requests per second is reported for each cache backend with 1,
+4 and 16 threads.
+
+Usage: cache.py [requests_per_thread]
+"""
+
+from __future__ import with_statement
+
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+from trac.cache import CacheManager
+from trac.env import Environment
+from trac.ticket.api import TicketSystem
+from trac.wiki.api import WikiSystem
+
+BACKENDS = ('DatabaseCacheBackend', 'SharedMemoryCacheBackend')
+THREADS = (1, 4, 16)
+INVALIDATE_EVERY = 200
+
+
+def run(env, nthreads, nrequests):
+    cache_mgr = CacheManager(env)
+    ts = TicketSystem(env)
+    ws = WikiSystem(env)
+
+    def worker():
+        for i in xrange(nrequests):
+            cache_mgr.reset_metadata()
+            ts.fields
+            ts.custom_fields
+            ws.pages
+            if i % INVALIDATE_EVERY == INVALIDATE_EVERY - 1:
+                del ws.pages
+
+    threads = [threading.Thread(target=worker) for i in xrange(nthreads)]
+    start = time.time()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return nthreads * nrequests / (time.time() - start)
+
+
+def main(nrequests=2000):
+    print '%-26s %8s %12s' % ('backend', 'threads', 'requests/s')
+    for backend in BACKENDS:
+        path = tempfile.mkdtemp(prefix='trac-cache-bench-')
+        try:
+            env = Environment(path, create=True,
+                              options=[('trac', 'cache_backend', backend)])
+            for nthreads in THREADS:
+                rate = run(env, nthreads, nrequests)
+                print '%-26s %8d %12.0f' % (backend, nthreads, rate)
+            env.shutdown()
+        finally:
+            shutil.rmtree(path)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:2]])
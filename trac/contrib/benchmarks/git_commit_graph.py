@@ -0,0 +1,115 @@
+#!/usr/bin/python
+"""Measure the commit graph of the git backend.
+
+A synthetic repository is generated with `git fast-import`: a main line
+of commits, with a topic branch forked and merged back every `MERGE_EVERY`
+commits. The time to build, load and update the commit graph, its size,
+and the time taken by ancestry and short revision queries for a sample of
+commits are then printed.
+
+Usage: git_commit_graph.py [commits] [samples]
+"""
+
+import logging
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from tracopt.versioncontrol.git.PyGIT import Storage
+
+MERGE_EVERY = 50
+TOPIC_COMMITS = 10
+
+
+def generate(git_dir, ncommits):
+    subprocess.check_call(['git', 'init', '--quiet', '--bare', git_dir])
+    p = subprocess.Popen(['git', '--git-dir=%s' % git_dir, 'fast-import',
+                          '--quiet'], stdin=subprocess.PIPE)
+    write = p.stdin.write
+
+    def commit(mark, ref, i, parents):
+        message = 'Commit number %d\n' % i
+        content = 'revision %d\n' % i
+        write('commit %s\nmark :%d\n' % (ref, mark))
+        write('committer Joe <joe@example.org> %d +0000\n'
+              % (1000000000 + i * 60))
+        write('data %d\n%s' % (len(message), message))
+        if parents:
+            write('from :%d\n' % parents[0])
+        for parent in parents[1:]:
+            write('merge :%d\n' % parent)
+        write('M 100644 inline file%d.txt\ndata %d\n%s\n'
+              % (i % 100, len(content), content))
+
+    master = topic = None
+    for i in xrange(1, ncommits + 1):
+        if i % MERGE_EVERY == MERGE_EVERY - TOPIC_COMMITS:
+            topic = master
+        if topic is not None and i % MERGE_EVERY != 0:
+            commit(i, 'refs/heads/topic', i, [topic])
+            topic = i
+        elif topic is not None:
+            commit(i, 'refs/heads/master', i, [master, topic])
+            master, topic = i, None
+        else:
+            commit(i, 'refs/heads/master', i, master and [master] or [])
+            master = i
+    p.stdin.close()
+    p.wait()
+
+
+def timed(label, fn, args, nsamples):
+    start = time.time()
+    for arg in args:
+        fn(*arg)
+    elapsed = time.time() - start
+    print '%-28s %10.3f ms/call' % (label, 1000 * elapsed / nsamples)
+
+
+def main(ncommits=50000, nsamples=1000):
+    git_dir = tempfile.mkdtemp(prefix='trac-git-bench-')
+    cache_dir = tempfile.mkdtemp(prefix='trac-git-cache-')
+    try:
+        start = time.time()
+        generate(git_dir, ncommits)
+        print 'generated %d commits in %.1f s' % (ncommits,
+                                                  time.time() - start)
+
+        start = time.time()
+        storage = Storage(git_dir, logging, rev_cache_dir=cache_dir)
+        graph = storage.get_commits()
+        print 'built graph in %.2f s' % (time.time() - start)
+        [name] = os.listdir(cache_dir)
+        size = os.path.getsize(os.path.join(cache_dir, name))
+        print 'graph size: %d bytes, %.1f bytes/commit' % \
+              (size, float(size) / len(graph))
+
+        start = time.time()
+        Storage(git_dir, logging, rev_cache_dir=cache_dir).get_commits()
+        print 'loaded graph in %.2f ms' % (1000 * (time.time() - start))
+
+        revs = list(graph)
+        pairs = [tuple(sorted(random.sample(revs, 2),
+                              key=lambda rev: graph.index(rev)))
+                 for i in xrange(nsamples)]
+        sample = [(rev,) for rev in random.sample(revs, nsamples)]
+        timed('rev_is_anchestor_of (random)', storage.rev_is_anchestor_of,
+              pairs, nsamples)
+        timed('rev_is_anchestor_of (root)', storage.rev_is_anchestor_of,
+              [(storage.oldest_rev(), rev) for rev, in sample], nsamples)
+        timed('get_branch_contains', storage.get_branch_contains, sample,
+              nsamples)
+        timed('shortrev', storage.shortrev, sample, nsamples)
+        timed('fullrev', storage.fullrev,
+              [(rev[:7],) for rev, in sample], nsamples)
+    finally:
+        shutil.rmtree(git_dir)
+        shutil.rmtree(cache_dir)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:3]])
@@ -0,0 +1,87 @@
+#!/usr/bin/python
+"""Compare the pure Python git object reader with `git` subprocesses.
+
+A synthetic repository is generated with `git fast-import`, each commit
+modifying one file of a tree of directories. The `ls_tree`, `cat_file`
+and `get_obj_size` operations of `PyGIT.Storage` are then timed for a
+sample of commits, against the `git ls-tree` and `git cat-file` calls
+they used to make.
+
+Usage: git_objects.py [commits] [samples]
+"""
+
+from __future__ import with_statement
+
+import logging
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from tracopt.versioncontrol.git.PyGIT import Storage
+
+DIRS = 50
+FILES_PER_DIR = 20
+
+
+def generate(git_dir, ncommits):
+    subprocess.check_call(['git', 'init', '--quiet', '--bare', git_dir])
+    p = subprocess.Popen(['git', '--git-dir=%s' % git_dir, 'fast-import',
+                          '--quiet'], stdin=subprocess.PIPE)
+    write = p.stdin.write
+    for i in xrange(ncommits):
+        path = 'dir%02d/file%02d.txt' % (i % DIRS, (i // DIRS) % FILES_PER_DIR)
+        content = 'revision %d of %s\n' % (i, path) + 'x' * (i % 997) + '\n'
+        message = 'Commit number %d\n' % i
+        write('commit refs/heads/master\n')
+        write('committer Joe <joe@example.org> %d +0000\n'
+              % (1000000000 + i * 60))
+        write('data %d\n%s\n' % (len(message), message))
+        write('M 100644 inline %s\ndata %d\n%s\n'
+              % (path, len(content), content))
+    p.stdin.close()
+    p.wait()
+
+
+def timed(label, fn, revs, nsamples):
+    start = time.time()
+    for rev in revs:
+        fn(rev)
+    elapsed = time.time() - start
+    print '%-28s %10.3f ms/call' % (label, 1000 * elapsed / nsamples)
+
+
+def main(ncommits=50000, nsamples=200):
+    git_dir = tempfile.mkdtemp(prefix='trac-git-bench-')
+    try:
+        start = time.time()
+        generate(git_dir, ncommits)
+        print 'generated %d commits in %.1f s' % (ncommits,
+                                                  time.time() - start)
+        storage = Storage(git_dir, logging)
+        repo = storage.repo
+        revs = random.sample(list(storage.all_revs()), nsamples)
+        blobs = [entry[2] for rev in revs[:10]
+                 for entry in storage.ls_tree(rev, 'dir00/')]
+
+        timed('ls_tree (native)', lambda rev: storage.ls_tree(rev, 'dir07/'),
+              revs, nsamples)
+        timed('ls_tree (git)',
+              lambda rev: repo.ls_tree('-z', '-l', rev, '--', 'dir07/'),
+              revs, nsamples)
+        timed('cat_file commit (native)',
+              lambda rev: storage.cat_file('commit', rev), revs, nsamples)
+        timed('cat_file commit (git)',
+              lambda rev: repo.cat_file('commit', rev), revs, nsamples)
+        timed('get_obj_size (native)', storage.get_obj_size, blobs,
+              len(blobs))
+        timed('get_obj_size (git)', lambda sha: repo.cat_file('-s', sha),
+              blobs, len(blobs))
+    finally:
+        shutil.rmtree(git_dir)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:3]])
@@ -0,0 +1,36 @@
+#!/usr/bin/python
+"""Measure the overhead of getting a cached environment for a request.
+
+Each iteration calls `open_environment()` with the cache enabled, as
+`dispatch_request` does at the start of every request, and the number of
+calls per second is reported.
+
+Usage: open_environment.py [iterations]
+"""
+
+import shutil
+import sys
+import tempfile
+import time
+
+from trac.env import Environment, open_environment
+
+
+def main(iterations=100000):
+    path = tempfile.mkdtemp(prefix='trac-env-bench-')
+    try:
+        Environment(path, create=True).shutdown()
+        env = open_environment(path, use_cache=True)
+        start = time.time()
+        for i in xrange(iterations):
+            open_environment(path, use_cache=True)
+        rate = iterations / (time.time() - start)
+        print '%-20s %12s' % ('', 'calls/s')
+        print '%-20s %12.0f' % ('open_environment', rate)
+        env.shutdown()
+    finally:
+        shutil.rmtree(path)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:2]])
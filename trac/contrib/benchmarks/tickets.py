@@ -0,0 +1,63 @@
+#!/usr/bin/python
+"""Compare loading tickets one at a time with loading them in bulk.
+
+A temporary environment is populated with tickets having a few custom
+fields, then all the tickets are loaded with `Ticket(env, id)` and with
+`Ticket.select_many(env, ids)`. The number of tickets loaded per second
+is reported for each method.
+
+Usage: tickets.py [tickets]
+"""
+
+from __future__ import with_statement
+
+import shutil
+import sys
+import tempfile
+import time
+
+from trac.env import Environment
+from trac.ticket.model import Ticket
+
+CUSTOM_FIELDS = ('estimate', 'customer', 'version_found')
+
+
+def populate(env, count):
+    for name in CUSTOM_FIELDS:
+        env.config.set('ticket-custom', name, 'text')
+    with env.db_transaction:
+        for i in xrange(count):
+            ticket = Ticket(env)
+            ticket['summary'] = 'Ticket %d' % i
+            ticket['reporter'] = 'joe'
+            for name in CUSTOM_FIELDS:
+                ticket[name] = '%s %d' % (name, i)
+            ticket.insert()
+
+
+def measure(fn, count):
+    start = time.time()
+    loaded = fn()
+    assert loaded == count, loaded
+    return count / (time.time() - start)
+
+
+def main(count=1000):
+    path = tempfile.mkdtemp(prefix='trac-tickets-bench-')
+    try:
+        env = Environment(path, create=True)
+        populate(env, count)
+        ids = [id for id, in env.db_query("SELECT id FROM ticket")]
+        print '%-24s %12s' % ('method', 'tickets/s')
+        rate = measure(lambda: len([Ticket(env, id) for id in ids]), count)
+        print '%-24s %12.0f' % ('Ticket(env, id)', rate)
+        rate = measure(lambda: len(list(Ticket.select_many(env, ids))),
+                       count)
+        print '%-24s %12.0f' % ('Ticket.select_many()', rate)
+        env.shutdown()
+    finally:
+        shutil.rmtree(path)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:2]])
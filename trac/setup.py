@@ -136,12 +136,14 @@ facilities.
         trac.ticket.roadmap = trac.ticket.roadmap
         trac.ticket.web_ui = trac.ticket.web_ui
         trac.timeline = trac.timeline.web_ui
+        trac.timeline.store = trac.timeline.store
         trac.versioncontrol.admin = trac.versioncontrol.admin
         trac.versioncontrol.svn_authz = trac.versioncontrol.svn_authz
         trac.versioncontrol.svn_fs = trac.versioncontrol.svn_fs
         trac.versioncontrol.svn_prop = trac.versioncontrol.svn_prop
         trac.versioncontrol.web_ui = trac.versioncontrol.web_ui
         trac.web.auth = trac.web.auth
+        trac.web.gcpolicy = trac.web.gcpolicy
         trac.web.session = trac.web.session
         trac.wiki.admin = trac.wiki.admin
         trac.wiki.interwiki = trac.wiki.interwiki
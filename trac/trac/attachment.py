@@ -37,7 +37,7 @@ from trac.env import IEnvironmentSetupParticipant
 from trac.mimeview import *
 from trac.perm import PermissionError, IPermissionPolicy
 from trac.resource import *
-from trac.search import search_to_sql, shorten_result
+from trac.search import search_rows, search_to_sql, shorten_result
 from trac.util import content_disposition, get_reporter_id
 from trac.util.compat import sha1
 from trac.util.datefmt import format_datetime, from_utimestamp, \
@@ -663,20 +663,22 @@ class AttachmentModule(Component):
             return format_to(self.env, None, context.child(attachment.parent),
                              descr)
    
-    def get_search_results(self, req, resource_realm, terms):
+    def get_search_results(self, req, resource_realm, terms, limit=None):
         """Return a search result generator suitable for ISearchSource.
         
         Search results are attachments on resources of the given 
         `resource_realm.realm` whose filename, description or author match 
-        the given terms.
+        the given terms. They are generated newest first, `limit` being a
+        hint of the number of results which will be used.
         """
         with self.env.db_query as db:
             sql_query, args = search_to_sql(
                     db, ['filename', 'description', 'author'], terms)
-            for id, time, filename, desc, author in db("""
+            for id, time, filename, desc, author in search_rows(db, """
                     SELECT id, time, filename, description, author
-                    FROM attachment WHERE type = %s AND """ + sql_query, 
-                    (resource_realm.realm,) + args):
+                    FROM attachment WHERE type = %s AND """ + sql_query + """
+                    ORDER BY time DESC, id, filename""",
+                    (resource_realm.realm,) + args, limit):
                 attachment = resource_realm(id=id).child('attachment', filename)
                 if 'ATTACHMENT_VIEW' in req.perm(attachment):
                     yield (get_resource_url(self.env, attachment, req.href),
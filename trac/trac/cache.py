@@ -13,11 +13,23 @@
 
 from __future__ import with_statement
 
-from .core import Component
+import mmap
+import os
+import struct
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from .config import ExtensionOption, IntOption, PathOption
+from .core import Component, Interface, implements
+from .db.api import call_after_commit
 from .util import arity
 from .util.concurrency import ThreadLocal, threading
 
-__all__ = ['CacheManager', 'cached']
+__all__ = ['CacheManager', 'cached', 'ICacheInvalidationBackend',
+           'DatabaseCacheBackend', 'SharedMemoryCacheBackend']
 
 
 _id_to_key = {}
@@ -179,16 +191,82 @@ def cached(fn_or_attr=None):
     return decorator
 
 
+class ICacheInvalidationBackend(Interface):
+    """Extension point interface for components keeping track of the
+    generation of each cached attribute, so that processes sharing an
+    environment learn about caches invalidated by other processes.
+    """
+
+    def get_generations():
+        """Return a mapping of cache ids to their current generation.
+
+        The mapping is requested on the first cache access in each
+        request, and it must support the `get(id, default)` method.
+        Ids unknown to the backend have generation -1; a backend may also
+        know all ids from the start, like the `SharedMemoryCacheBackend`
+        whose counters start at 0.
+        """
+
+    def get_generation(id):
+        """Return the current generation of the cache with the given `id`,
+        or -1 if unknown (see `get_generations()`).
+        """
+
+    def increment_generation(id, key):
+        """Invalidate the cache with the given `id` in all processes.
+
+        `key` is the string from which `id` was computed.
+        """
+
+
 class CacheManager(Component):
     """Cache manager."""
 
     required = True
+
+    backend = ExtensionOption('trac', 'cache_backend',
+                              ICacheInvalidationBackend,
+                              'DatabaseCacheBackend',
+        """Name of the component keeping track of cache generations.
+        `DatabaseCacheBackend` stores them in the `cache` table, so each
+        request performs a database query on its first cache access.
+        `SharedMemoryCacheBackend` keeps them in a memory-mapped file,
+        which avoids these queries but only works when all processes
+        serving the environment run on the same host. (''since 0.13'')""")
     
     def __init__(self):
         self._cache = {}
         self._local = ThreadLocal(meta=None, cache=None)
-        self._lock = threading.RLock()
+        self._lock = threading.Lock()
+        self._locks = {}
+        self._backend = None
     
+    def _get_backend(self):
+        """Return the configured `ICacheInvalidationBackend`."""
+        backend = self._backend
+        if backend is None:
+            try:
+                backend = self.backend
+            except AttributeError:
+                # The default backend is needed even in environments where
+                # it has not been enabled
+                if self.config.get('trac', 'cache_backend') != \
+                        'DatabaseCacheBackend':
+                    raise
+                backend = DatabaseCacheBackend(self.env)
+            self._backend = backend
+        return backend
+
+    def _get_lock(self, id):
+        """Return the lock guarding retrieval of the cache with the given
+        `id`.
+        """
+        try:
+            return self._locks[id]
+        except KeyError:
+            with self._lock:
+                return self._locks.setdefault(id, threading.RLock())
+
     # Public interface
     
     def reset_metadata(self):
@@ -200,11 +278,11 @@ class CacheManager(Component):
         # Get cache metadata
         local_meta = self._local.meta
         local_cache = self._local.cache
+        backend = self._get_backend()
         if local_meta is None:
             # First cache usage in this request, retrieve cache metadata
-            # from the database and make a thread-local copy of the cache
-            meta = self.env.db_query("SELECT id, generation FROM cache")
-            self._local.meta = local_meta = dict(meta)
+            # from the backend and make a thread-local copy of the cache
+            self._local.meta = local_meta = backend.get_generations()
             self._local.cache = local_cache = self._cache.copy()
         
         db_generation = local_meta.get(id, -1)
@@ -218,7 +296,7 @@ class CacheManager(Component):
             pass
         
         with self.env.db_query as db:
-            with self._lock:
+            with self._get_lock(id):
                 # Get data from the process cache
                 try:
                     (data, generation) = local_cache[id] = self._cache[id]
@@ -229,11 +307,7 @@ class CacheManager(Component):
                 
                 # Check if the process cache has the newest version, as it may
                 # have been updated after the metadata retrieval
-                for db_generation, in db(
-                        "SELECT generation FROM cache WHERE id=%s", (id,)):
-                    break
-                else:
-                    db_generation = -1
+                db_generation = backend.get_generation(id)
                 if db_generation == generation:
                     return data
                 
@@ -243,27 +317,17 @@ class CacheManager(Component):
                 else:
                     data = retriever(instance)
                 local_cache[id] = self._cache[id] = (data, db_generation)
-                local_meta[id] = db_generation
+                if isinstance(local_meta, dict):
+                    local_meta[id] = db_generation
                 return data
         
     def invalidate(self, id):
         """Invalidate cached data for the given id."""
         with self.env.db_transaction as db:
-            with self._lock:
+            with self._get_lock(id):
                 # Invalidate in other processes
-
-                # The row corresponding to the cache may not exist in the table
-                # yet.
-                #  - If the row exists, the UPDATE increments the generation,
-                #    the SELECT returns a row and we're done.
-                #  - If the row doesn't exist, the UPDATE does nothing, but 
-                #    starts a transaction. The SELECT then returns nothing, 
-                #    and we can safely INSERT a new row.
-                db("UPDATE cache SET generation=generation+1 WHERE id=%s",
-                   (id,))
-                if not db("SELECT generation FROM cache WHERE id=%s", (id,)):
-                    db("INSERT INTO cache VALUES (%s, %s, %s)",
-                       (id, 0, _id_to_key.get(id, '<unknown>')))
+                self._get_backend().increment_generation(
+                    id, _id_to_key.get(id, '<unknown>'))
                 
                 # Invalidate in this process
                 self._cache.pop(id, None)
@@ -273,3 +337,149 @@ class CacheManager(Component):
                     del self._local.cache[id]
                 except (KeyError, TypeError):
                     pass
+
+
+class DatabaseCacheBackend(Component):
+    """Keep track of cache generations in the `cache` table."""
+
+    implements(ICacheInvalidationBackend)
+
+    # ICacheInvalidationBackend methods
+
+    def get_generations(self):
+        return dict(self.env.db_query("SELECT id, generation FROM cache"))
+
+    def get_generation(self, id):
+        for generation, in self.env.db_query(
+                "SELECT generation FROM cache WHERE id=%s", (id,)):
+            return generation
+        return -1
+
+    def increment_generation(self, id, key):
+        with self.env.db_transaction as db:
+            # The row corresponding to the cache may not exist in the table
+            # yet.
+            #  - If the row exists, the UPDATE increments the generation,
+            #    the SELECT returns a row and we're done.
+            #  - If the row doesn't exist, the UPDATE does nothing, but 
+            #    starts a transaction. The SELECT then returns nothing, 
+            #    and we can safely INSERT a new row.
+            db("UPDATE cache SET generation=generation+1 WHERE id=%s", (id,))
+            if not db("SELECT generation FROM cache WHERE id=%s", (id,)):
+                db("INSERT INTO cache VALUES (%s, %s, %s)", (id, 0, key))
+
+
+class SharedMemoryCacheBackend(Component):
+    """Keep track of cache generations in a memory-mapped file.
+
+    The file holds a fixed number of 32-bit generation counters, and each
+    cache id is assigned to one of them. Reading a generation is a memory
+    access, so no database query is needed to validate cached data. Ids
+    sharing a counter are invalidated together, which is harmless.
+
+    Generations are incremented once the transaction invalidating the
+    cache has been committed, so that other processes don't reload data
+    before it is visible to them. Every id has a counter, starting at 0,
+    so no id is unknown to this backend.
+    """
+
+    implements(ICacheInvalidationBackend)
+
+    board_file = PathOption('trac', 'cache_board_file', '../db/cache.board',
+        """Path of the file shared by processes using the
+        `SharedMemoryCacheBackend`. A relative path is relative to the
+        `conf` directory of the environment. (''since 0.13'')""")
+
+    board_size = IntOption('trac', 'cache_board_size', 4096,
+        """Number of generation counters in the file used by
+        `SharedMemoryCacheBackend`. This setting must be the same for all
+        processes serving the environment. (''since 0.13'')""")
+
+    _counter = struct.Struct('<I')
+
+    def __init__(self):
+        self._board = None
+        self._fd = None
+        self._lock = threading.Lock()
+
+    def _get_board(self):
+        if self._board is None:
+            with self._lock:
+                if self._board is None:
+                    self._open_board()
+        return self._board
+
+    def _open_board(self):
+        size = self.board_size * self._counter.size
+        fd = os.open(self.board_file, os.O_RDWR | os.O_CREAT, 0666)
+        try:
+            self._lock_file(fd)
+            try:
+                if os.fstat(fd).st_size < size:
+                    os.ftruncate(fd, size)
+            finally:
+                self._unlock_file(fd)
+            board = mmap.mmap(fd, size)
+        except:
+            os.close(fd)
+            raise
+        self._fd, self._board = fd, board
+
+    def _lock_file(self, fd):
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+
+    def _unlock_file(self, fd):
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+
+    def _offset(self, id):
+        return (id % self.board_size) * self._counter.size
+
+    # ICacheInvalidationBackend methods
+
+    def get_generations(self):
+        return GenerationBoard(self)
+
+    def get_generation(self, id):
+        # Read without locking, see `GenerationBoard`
+        return self._counter.unpack_from(self._get_board(),
+                                         self._offset(id))[0]
+
+    def increment_generation(self, id, key):
+        def increment():
+            board = self._get_board()
+            offset = self._offset(id)
+            with self._lock:
+                self._lock_file(self._fd)
+                try:
+                    generation = self._counter.unpack_from(board, offset)[0]
+                    self._counter.pack_into(board, offset, 
+                                            (generation + 1) & 0xffffffff)
+                finally:
+                    self._unlock_file(self._fd)
+        call_after_commit(increment)
+
+
+class GenerationBoard(object):
+    """Read-only mapping view on the counters of a
+    `SharedMemoryCacheBackend`.
+
+    Unlike the `dict` returned by the `DatabaseCacheBackend`, this is not
+    a snapshot: each lookup reads the current value of the counter. As
+    every id has a counter, `get()` never returns `default`.
+
+    Counters are read without taking the lock used for incrementing them,
+    which would require a system call for each lookup. A read racing with
+    an increment in another process returns either value, or at worst a
+    mix of both. Reading the older value is the same as reading just
+    before the increment: the invalidation is seen on the next lookup. Any
+    other value differs from the generation of the cached data, which is
+    then only retrieved again.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def get(self, id, default=None):
+        return self.backend.get_generation(id)
@@ -16,19 +16,26 @@ from __future__ import with_statement
 
 from ConfigParser import ConfigParser
 from copy import deepcopy
+import atexit
 import os.path
 
+try:
+    import pyinotify
+except ImportError:
+    pyinotify = None
+
 from trac.admin import AdminCommandError, IAdminCommandProvider
 from trac.core import *
 from trac.util import AtomicFile, as_bool
 from trac.util.compat import cleandoc
+from trac.util.concurrency import threading
 from trac.util.text import printout, to_unicode, CRLF
 from trac.util.translation import _, N_
 
 __all__ = ['Configuration', 'ConfigSection', 'Option', 'BoolOption',
            'IntOption', 'FloatOption', 'ListOption', 'ChoiceOption',
            'PathOption', 'ExtensionOption', 'OrderedExtensionsOption',
-           'ConfigurationError']
+           'ConfigurationError', 'ConfigurationWatcher']
 
 # Retained for backward-compatibility, use as_bool() instead
 _TRUE_VALUES = ('yes', 'true', 'enabled', 'on', 'aye', '1', 1, True)
@@ -251,6 +258,7 @@ class Configuration(object):
             # Revert all changes to avoid inconsistencies
             self.parser._sections = deepcopy(self._old_sections)
             raise
+        config_watcher.notify(self.filename)
 
     def parse_if_needed(self, force=False):
         if not self.filename or not os.path.isfile(self.filename):
@@ -285,10 +293,29 @@ class Configuration(object):
             self._cache = {}
         return changed
 
+    def is_modified(self):
+        """Return whether the configuration file or one of its parents
+        has changed since it was last parsed, without parsing it.
+        """
+        if not self.filename or not os.path.isfile(self.filename):
+            return False
+        if os.path.getmtime(self.filename) > self._lastmtime:
+            return True
+        return any(parent.is_modified() for parent in self.parents)
+
+    def get_filenames(self):
+        """Return the names of the configuration file and of its
+        parents."""
+        filenames = [self.filename]
+        for parent in self.parents:
+            filenames.extend(parent.get_filenames())
+        return filenames
+
     def touch(self):
         if self.filename and os.path.isfile(self.filename) \
            and os.access(self.filename, os.W_OK):
             os.utime(self.filename, None)
+            config_watcher.notify(self.filename)
 
     def set_defaults(self, compmgr=None):
         """Retrieve all default values and store them explicitly in the
@@ -306,6 +333,148 @@ class Configuration(object):
                     self.set(section, name, value)
 
 
+class ConfigurationWatcher(object):
+    """Flag configurations as stale when their files change.
+
+    The files are watched with inotify when `pyinotify` is available, and
+    otherwise checked by a background thread every `interval` seconds,
+    so that finding out whether a configuration may have changed only
+    needs an in-memory lookup. Changes saved by the current process are
+    flagged immediately. The background threads are stopped when the
+    last configuration is unwatched, or by `stop()`.
+    """
+
+    def __init__(self, interval=1):
+        self.interval = interval
+        self._configs = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stopped = threading.Event()
+        self._watch_manager = None
+        self._notifier = None
+        self._watched_dirs = set()
+
+    def watch(self, config):
+        """Start watching the files of `config`, which has been parsed."""
+        with self._lock:
+            self._configs[config] = False
+            if not self._watch_dirs(config):
+                self._start_polling()
+        # Catch the changes that happened before the watch started
+        self._check(config)
+
+    def unwatch(self, config):
+        """Stop watching the files of `config`."""
+        with self._lock:
+            self._configs.pop(config, None)
+            if self._configs:
+                return
+            threads = self._detach_threads()
+        self._stop_threads(*threads)
+
+    def stop(self):
+        """Stop watching all configurations."""
+        with self._lock:
+            self._configs.clear()
+            threads = self._detach_threads()
+        self._stop_threads(*threads)
+
+    def is_stale(self, config):
+        """Return whether `config` may have changed since it was last
+        watched. Configurations that aren't watched are always stale."""
+        return self._configs.get(config, True)
+
+    def notify(self, filename):
+        """Flag the configurations using `filename` as stale."""
+        filename = os.path.normpath(filename)
+        for config in self._configs.keys():
+            if filename in [os.path.normpath(name)
+                            for name in config.get_filenames()]:
+                self._flag(config)
+
+    def check(self):
+        """Flag the watched configurations whose files have changed."""
+        for config in self._configs.keys():
+            self._check(config)
+
+    def _check(self, config):
+        try:
+            modified = config.is_modified()
+        except (IOError, OSError):
+            modified = True
+        if modified:
+            self._flag(config)
+
+    def _flag(self, config):
+        with self._lock:
+            if config in self._configs:
+                self._configs[config] = True
+
+    def _start_polling(self):
+        if self._thread is None:
+            self._stopped = threading.Event()
+            self._thread = threading.Thread(target=self._poll,
+                                            args=(self._stopped,),
+                                            name='ConfigurationWatcher')
+            self._thread.setDaemon(True)
+            self._thread.start()
+
+    def _poll(self, stopped):
+        while True:
+            stopped.wait(self.interval)
+            if stopped.isSet():
+                break
+            self.check()
+
+    def _detach_threads(self):
+        """Signal the background threads to stop and forget about them.
+        Called with the lock held.
+        """
+        thread, notifier = self._thread, self._notifier
+        self._stopped.set()
+        self._thread = self._notifier = self._watch_manager = None
+        self._watched_dirs.clear()
+        return thread, notifier
+
+    def _stop_threads(self, thread, notifier):
+        if thread is not None and thread is not threading.currentThread():
+            thread.join()
+        if notifier is not None:
+            try:
+                notifier.stop()
+            except Exception:
+                pass
+
+    def _watch_dirs(self, config):
+        if pyinotify is None:
+            return False
+        try:
+            if self._notifier is None:
+                self._watch_manager = pyinotify.WatchManager()
+                self._notifier = pyinotify.ThreadedNotifier(
+                    self._watch_manager, self._on_event)
+                self._notifier.setDaemon(True)
+                self._notifier.start()
+            mask = pyinotify.IN_CLOSE_WRITE | pyinotify.IN_MOVED_TO | \
+                   pyinotify.IN_CREATE | pyinotify.IN_DELETE | \
+                   pyinotify.IN_ATTRIB
+            for filename in config.get_filenames():
+                dirname = os.path.dirname(filename)
+                if dirname not in self._watched_dirs:
+                    self._watch_manager.add_watch(dirname, mask, quiet=False)
+                    self._watched_dirs.add(dirname)
+            return True
+        except Exception:
+            return False
+
+    def _on_event(self, event):
+        self.notify(event.pathname)
+
+
+config_watcher = ConfigurationWatcher()
+atexit.register(config_watcher.stop)
+
+
 class Section(object):
     """Proxy for a specific configuration section.
     
@@ -30,7 +30,30 @@ from .pool import ConnectionPool
 from .util import ConnectionWrapper
 
 
-_transaction_local = ThreadLocal(wdb=None, rdb=None)
+_transaction_local = ThreadLocal(wdb=None, rdb=None, after_commit=None)
+
+def call_after_commit(fn):
+    """Call `fn` without arguments once the transaction in progress in the
+    current thread has been committed. `fn` is discarded if the transaction
+    is rolled back. If no transaction is in progress, `fn` is called right
+    away.
+    """
+    if _transaction_local.wdb is None:
+        fn()
+    else:
+        if _transaction_local.after_commit is None:
+            _transaction_local.after_commit = []
+        _transaction_local.after_commit.append(fn)
+
+def _end_transaction(committed):
+    """Run (or discard) the callbacks registered for the transaction which
+    just ended in the current thread.
+    """
+    callbacks = _transaction_local.after_commit
+    _transaction_local.after_commit = None
+    if committed and callbacks:
+        for fn in callbacks:
+            fn()
 
 def with_transaction(env, db=None):
     """Function decorator to emulate a context manager for database
@@ -76,10 +99,13 @@ def with_transaction(env, db=None):
         if db is not None:
             if ldb is None:
                 _transaction_local.wdb = db
+                committed = False
                 try:
                     fn(db)
+                    committed = True
                 finally:
                     _transaction_local.wdb = None
+                    _end_transaction(committed)
             else:
                 assert ldb is db, "Invalid transaction nesting"
                 fn(db)
@@ -93,9 +119,11 @@ def with_transaction(env, db=None):
                 _transaction_local.wdb = None
             except:
                 _transaction_local.wdb = None
+                _end_transaction(False)
                 ldb.rollback()
                 ldb = None
                 raise
+            _end_transaction(True)
     return transaction_wrapper
 
 
@@ -144,10 +172,15 @@ class TransactionContextManager(DbContextManager):
     def __exit__(self, et, ev, tb): 
         if self.db: 
             _transaction_local.wdb = None
-            if et is None: 
-                self.db.commit()
-            else: 
-                self.db.rollback()
+            try:
+                if et is None: 
+                    self.db.commit()
+                else: 
+                    self.db.rollback()
+            except:
+                _end_transaction(False)
+                raise
+            _end_transaction(et is None)
             if not _transaction_local.rdb:
                 self.db.close()
 
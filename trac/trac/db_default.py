@@ -17,7 +17,7 @@
 from trac.db import Table, Column, Index
 
 # Database version identifier. Used for automatic upgrades.
-db_version = 27
+db_version = 30
 
 def __mkreports(reports):
     """Utility function used to create report data in same syntax as the
@@ -106,6 +106,11 @@ schema = [
         Column('base_path'),
         Column('base_rev'),
         Index(['repos', 'rev'])],
+    Table('node_change_path', key=('repos', 'path', 'rev', 'change_type'))[
+        Column('repos', type='int'),
+        Column('path', key_size=255),
+        Column('rev', key_size=20),
+        Column('change_type', size=1, key_size=2)],
 
     # Ticket system
     Table('ticket', key='id')[
@@ -166,6 +171,28 @@ schema = [
         Column('title'),
         Column('query'),
         Column('description')],
+
+    # Timeline system
+    Table('timeline_event')[
+        Column('time', type='int64'),
+        Column('realm'),
+        Column('resource'),
+        Column('author'),
+        Index(['time', 'realm']),
+        Index(['realm', 'resource'])],
+
+    # Notification system
+    Table('notify_queue', key='id')[
+        Column('id', auto_increment=True),
+        Column('time', type='int64'),
+        Column('next_attempt', type='int64'),
+        Column('attempts', type='int'),
+        Column('coalesce_key'),
+        Column('from_addr'),
+        Column('recipients'),
+        Column('message'),
+        Column('error'),
+        Index(['next_attempt'])],
 ]
 
 
@@ -25,8 +25,9 @@ from urlparse import urlsplit
 
 from trac import db_default
 from trac.admin import AdminCommandError, IAdminCommandProvider
-from trac.cache import CacheManager
+from trac.cache import CacheManager, cached
 from trac.config import *
+from trac.config import config_watcher
 from trac.core import Component, ComponentManager, implements, Interface, \
                       ExtensionPoint, TracError
 from trac.db.api import (DatabaseManager, QueryContextManager, 
@@ -39,7 +40,8 @@ from trac.util.translation import _, N_
 from trac.versioncontrol import RepositoryManager
 from trac.web.href import Href
 
-__all__ = ['Environment', 'IEnvironmentSetupParticipant', 'open_environment']
+__all__ = ['Environment', 'IEnvironmentSetupParticipant', 'UserDirectory',
+           'open_environment']
 
 
 class ISystemInfoProvider(Interface):
@@ -489,6 +491,13 @@ class Environment(Component, ComponentManager):
         RepositoryManager(self).shutdown(tid)
         DatabaseManager(self).shutdown(tid)
         if tid is None:
+            config_watcher.unwatch(self.config)
+            from trac.notification import QueuedEmailSender
+            from trac.web.gcpolicy import AdaptiveCollectionPolicy
+            for cls in (QueuedEmailSender, AdaptiveCollectionPolicy):
+                component = self.components.get(cls)
+                if component is not None:
+                    component.shutdown()
             self.log.removeHandler(self._log_handler)
             self._log_handler.flush()
             self._log_handler.close()
@@ -617,19 +626,12 @@ class Environment(Component, ComponentManager):
         :param cnx: the database connection; if ommitted, a new
                     connection is retrieved
 
+        The users are read from the cached `UserDirectory`.
+
         :since 0.13: deprecation warning: the `cnx` parameter is no
                      longer used and will be removed in version 0.14
         """
-        for username, name, email in self.db_query("""
-                SELECT DISTINCT s.sid, n.value, e.value
-                FROM session AS s
-                 LEFT JOIN session_attribute AS n ON (n.sid=s.sid
-                  and n.authenticated=1 AND n.name = 'name')
-                 LEFT JOIN session_attribute AS e ON (e.sid=s.sid
-                  AND e.authenticated=1 AND e.name = 'email')
-                WHERE s.authenticated=1 ORDER BY s.sid
-                """):
-            yield username, name, email
+        return UserDirectory(self).get_known_users()
 
     def backup(self, dest=None):
         """Create a backup of the database.
@@ -696,6 +698,77 @@ class Environment(Component, ComponentManager):
         return self._abs_href
 
 
+class UserDirectory(Component):
+    """Directory of the known users, i.e. users that have logged in to this
+    Trac environment and possibly set their name and email.
+
+    The directory is read from the database once and cached until an
+    authenticated session is created or deleted, or has its name or email
+    changed. Code changing the `session` and `session_attribute` tables
+    for authenticated users directly must call `invalidate()`.
+    """
+
+    required = True
+
+    @cached
+    def _users(self):
+        """Return the user names in alpha-numerical order, and the
+        dictionaries of the names and emails of the users having one."""
+        usernames = []
+        names = {}
+        emails = {}
+        for username, name, email in self.env.db_query("""
+                SELECT DISTINCT s.sid, n.value, e.value
+                FROM session AS s
+                 LEFT JOIN session_attribute AS n ON (n.sid=s.sid
+                  and n.authenticated=1 AND n.name = 'name')
+                 LEFT JOIN session_attribute AS e ON (e.sid=s.sid
+                  AND e.authenticated=1 AND e.name = 'email')
+                WHERE s.authenticated=1 ORDER BY s.sid
+                """):
+            usernames.append(username)
+            if name is not None:
+                names[username] = name
+            if email is not None:
+                emails[username] = email
+        return tuple(usernames), names, emails
+
+    def get_known_users(self):
+        """Generator yielding a `(username, name, email)` tuple for every
+        known user, ordered alpha-numerically by username."""
+        usernames, names, emails = self._users
+        for username in usernames:
+            yield username, names.get(username), emails.get(username)
+
+    def get_usernames(self):
+        """Return the names of the known users as a tuple, ordered
+        alpha-numerically.
+
+        The same tuple is returned until the directory changes.
+        """
+        return self._users[0]
+
+    def get_name(self, username):
+        """Return the name of the user `username`, or `None`."""
+        return self._users[1].get(username)
+
+    def get_email(self, username):
+        """Return the email of the user `username`, or `None`."""
+        return self._users[2].get(username)
+
+    def get_email_map(self):
+        """Return a dictionary mapping the names of the users that have an
+        email to their email.
+
+        The dictionary is shared and must not be modified.
+        """
+        return self._users[2]
+
+    def invalidate(self):
+        """Discard the cached directory."""
+        del self._users
+
+
 class EnvironmentSetup(Component):
     """Manage automatic environment upgrades."""
     
@@ -791,16 +864,24 @@ def open_environment(env_path=None, use_cache=False):
     if use_cache:
         with env_cache_lock:
             env = env_cache.get(env_path)
-            if env and env.config.parse_if_needed():
-                # The environment configuration has changed, so shut it down
-                # and remove it from the cache so that it gets reinitialized
-                env.log.info('Reloading environment due to configuration '
-                             'change')
-                env.shutdown()
-                del env_cache[env_path]
-                env = None
+            # Only look at the configuration files when the watcher has
+            # noticed a change
+            if env and config_watcher.is_stale(env.config):
+                if env.config.parse_if_needed():
+                    # The environment configuration has changed, so shut it
+                    # down and remove it from the cache so that it gets
+                    # reinitialized
+                    env.log.info('Reloading environment due to '
+                                 'configuration change')
+                    config_watcher.unwatch(env.config)
+                    env.shutdown()
+                    del env_cache[env_path]
+                    env = None
+                else:
+                    config_watcher.watch(env.config)
             if env is None:
                 env = env_cache.setdefault(env_path, open_environment(env_path))
+                config_watcher.watch(env.config)
             else:
                 CacheManager(env).reset_metadata()
     else:
@@ -13,6 +13,9 @@
 # individuals. For the exact contribution history, see the revision
 # history and logs, available at http://trac.edgewall.org/log/.
 
+from __future__ import with_statement
+
+from datetime import datetime
 import os
 import re
 import smtplib
@@ -22,9 +25,15 @@ import time
 from genshi.builder import tag
 
 from trac import __version__
-from trac.config import BoolOption, ExtensionOption, IntOption, Option
+from trac.admin import IAdminCommandProvider, console_datetime_format
+from trac.config import BoolOption, ConfigurationError, ExtensionOption, \
+                        IntOption, Option
 from trac.core import *
-from trac.util.text import CRLF, fix_eol
+from trac.util.concurrency import threading
+from trac.util.datefmt import format_datetime, from_utimestamp, \
+                              to_utimestamp, utc
+from trac.util.text import CRLF, exception_to_unicode, fix_eol, \
+                           print_table, printout, to_unicode
 from trac.util.translation import _, deactivate, reactivate
 
 MAXHEADERLEN = 76
@@ -144,12 +153,46 @@ class SmtpEmailSender(Component):
     use_tls = BoolOption('notification', 'use_tls', 'false',
         """Use SSL/TLS to send notifications over SMTP. (''since 0.10'')""")
     
+    def __init__(self):
+        self._local = threading.local()
+
+    def open_connection(self):
+        """Keep the connection to the SMTP server open for the messages
+        sent by the current thread, until `close_connection()` is
+        called."""
+        self._local.keep = True
+
+    def close_connection(self):
+        """Close the connection kept open by `open_connection()`."""
+        self._local.keep = False
+        server = getattr(self._local, 'server', None)
+        self._local.server = None
+        if server is not None:
+            self._quit(server)
+
     def send(self, from_addr, recipients, message):
         # Ensure the message complies with RFC2822: use CRLF line endings
         message = fix_eol(message, CRLF)
         
         self.log.info("Sending notification through SMTP at %s:%d to %s"
                       % (self.smtp_server, self.smtp_port, recipients))
+        if not getattr(self._local, 'keep', False):
+            server = self._connect()
+            self._sendmail(server, from_addr, recipients, message)
+            self._quit(server)
+            return
+        server = getattr(self._local, 'server', None)
+        if server is not None:
+            try:
+                self._sendmail(server, from_addr, recipients, message)
+                return
+            except smtplib.SMTPServerDisconnected:
+                self.log.info("SMTP server closed the connection, "
+                              "reconnecting")
+        server = self._local.server = self._connect()
+        self._sendmail(server, from_addr, recipients, message)
+
+    def _connect(self):
         server = smtplib.SMTP(self.smtp_server, self.smtp_port)
         # server.set_debuglevel(True)
         if self.use_tls:
@@ -162,12 +205,17 @@ class SmtpEmailSender(Component):
         if self.smtp_user:
             server.login(self.smtp_user.encode('utf-8'),
                          self.smtp_password.encode('utf-8'))
+        return server
+
+    def _sendmail(self, server, from_addr, recipients, message):
         start = time.time()
         server.sendmail(from_addr, recipients, message)
         t = time.time() - start
         if t > 5:
             self.log.warning('Slow mail submission (%.2f s), '
                              'check your mail setup' % t)
+
+    def _quit(self, server):
         if self.use_tls:
             # avoid false failure detection when the server closes
             # the SMTP connection with TLS enabled
@@ -208,6 +256,281 @@ class SendmailEmailSender(Component):
                             % (child.returncode, err.strip(), cmdline))
 
 
+class QueuedEmailSender(Component):
+    """E-mail sender storing the messages in a queue in the database, from
+    which they are delivered in the background.
+
+    The messages are delivered by a thread of the process that queued
+    them, or by `trac-admin $ENV notification deliver`. They are handed to
+    the `queue_sender` component, which for `SmtpEmailSender` reuses a
+    single SMTP connection for all the messages of a delivery. Messages
+    about the same ticket to the same recipients queued within
+    `queue_delay` seconds are delivered as a single digest message, and
+    failed deliveries are retried with an increasing delay.
+    """
+
+    implements(IEmailSender, IAdminCommandProvider)
+
+    queue_sender = ExtensionOption('notification', 'queue_sender',
+                                   IEmailSender, 'SmtpEmailSender',
+        """Name of the component implementing `IEmailSender` used by the
+        `QueuedEmailSender` to deliver the queued messages.
+        (''since 0.13'')""")
+
+    queue_delay = IntOption('notification', 'queue_delay', 0,
+        """Number of seconds the messages wait in the queue of the
+        `QueuedEmailSender` before being delivered. Notifications about
+        the same ticket to the same recipients queued during that time
+        are delivered together as a digest. (''since 0.13'')""")
+
+    queue_retries = IntOption('notification', 'queue_retries', 5,
+        """Number of delivery attempts of a queued message before it is
+        dropped. (''since 0.13'')""")
+
+    queue_retry_delay = IntOption('notification', 'queue_retry_delay', 60,
+        """Number of seconds before the first new attempt to deliver a
+        queued message. The delay doubles after each failed attempt.
+        (''since 0.13'')""")
+
+    queue_thread = BoolOption('notification', 'queue_thread', 'true',
+        """Deliver the queued messages from a background thread of the
+        process that queued them. When disabled, the messages are only
+        delivered by running `trac-admin $ENV notification deliver`, e.g.
+        from cron. (''since 0.13'')""")
+
+    # number of seconds during which a message being delivered is left
+    # alone by the other processes
+    claim_timeout = 600
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._deliver_lock = threading.Lock()
+        self._event = threading.Event()
+        self._thread = None
+        self._stopped = False
+
+    def shutdown(self):
+        """Stop the delivery thread, called when the environment is
+        shut down."""
+        self._stopped = True
+        self._event.set()
+
+    # IEmailSender methods
+
+    def send(self, from_addr, recipients, message):
+        now = to_utimestamp(datetime.now(utc))
+        self.env.db_transaction("""
+            INSERT INTO notify_queue
+              (time,next_attempt,attempts,coalesce_key,from_addr,recipients,
+               message,error)
+            VALUES (%s,%s,0,%s,%s,%s,%s,'')
+            """, (now, now + self.queue_delay * 1000000,
+                  self._get_coalesce_key(message), from_addr,
+                  ','.join(recipients), to_unicode(message)))
+        self.log.debug("Queued notification to %s", recipients)
+        if self.queue_thread:
+            self._wake_up()
+
+    # IAdminCommandProvider methods
+
+    def get_admin_commands(self):
+        yield ('notification deliver', '',
+               'Deliver the queued notifications that are due',
+               None, self._do_deliver)
+        yield ('notification list', '',
+               'List the queued notifications',
+               None, self._do_list)
+
+    def _do_deliver(self):
+        printout(_("%(count)s message(s) delivered.", count=self.deliver()))
+
+    def _do_list(self):
+        print_table([(id, format_datetime(from_utimestamp(time),
+                                          console_datetime_format),
+                      format_datetime(from_utimestamp(next_attempt),
+                                      console_datetime_format),
+                      attempts, recipients, error)
+                     for id, time, next_attempt, attempts, recipients, error
+                     in self.env.db_query("""
+                        SELECT id,time,next_attempt,attempts,recipients,error
+                        FROM notify_queue ORDER BY id""")],
+                    [_("Id"), _("Queued"), _("Next attempt"), _("Attempts"),
+                     _("Recipients"), _("Error")])
+
+    # Public methods
+
+    def deliver(self):
+        """Deliver the queued messages that are due, and return the number
+        of messages delivered.
+
+        The messages are claimed before being sent, so that processes
+        delivering the queue at the same time don't send them twice.
+        """
+        with self._deliver_lock:
+            now = to_utimestamp(datetime.now(utc))
+            groups = []
+            coalesced = {}
+            for row in self.env.db_query("""
+                    SELECT id,next_attempt,attempts,coalesce_key,from_addr,
+                           recipients,message
+                    FROM notify_queue ORDER BY id"""):
+                id, next_attempt, attempts, key, from_addr, recipients, \
+                    message = row
+                group_key = (key or id, from_addr, recipients)
+                if group_key not in coalesced:
+                    coalesced[group_key] = dict(rows=[], next_attempt=None,
+                                                attempts=0)
+                    groups.append(group_key)
+                group = coalesced[group_key]
+                group['rows'].append((id, next_attempt,
+                                      message.encode('utf-8')))
+                if group['next_attempt'] is None:
+                    group['next_attempt'] = next_attempt
+                group['attempts'] = max(group['attempts'], attempts)
+
+            sender = self.queue_sender
+            if isinstance(sender, QueuedEmailSender):
+                raise ConfigurationError(_("The [notification] queue_sender "
+                                           "can't be the QueuedEmailSender"))
+            sent = 0
+            open_connection = getattr(sender, 'open_connection', None)
+            if open_connection:
+                open_connection()
+            try:
+                for group_key in groups:
+                    group = coalesced[group_key]
+                    if group['next_attempt'] > now:
+                        continue
+                    claimed = self._claim(group['rows'], now)
+                    if not claimed:
+                        continue
+                    group['ids'] = [id for id, next_attempt, message
+                                    in group['rows'] if id in claimed]
+                    messages = [message for id, next_attempt, message
+                                in group['rows'] if id in claimed]
+                    key, from_addr, recipients = group_key
+                    try:
+                        sender.send(from_addr, recipients.split(','),
+                                    self._coalesce(messages))
+                    except Exception, e:
+                        self._delivery_failed(group, now, e)
+                    else:
+                        self._delete(group['ids'])
+                        sent += len(group['ids'])
+            finally:
+                if open_connection:
+                    sender.close_connection()
+            return sent
+
+    # Internal methods
+
+    def _get_coalesce_key(self, message):
+        from email.Parser import HeaderParser
+        headers = HeaderParser().parsestr(message, True)
+        ticket = headers.get('X-Trac-Ticket-ID')
+        if ticket:
+            return 'ticket:%s' % ticket
+
+    def _claim(self, rows, now):
+        """Claim the queued messages given as `(id, next_attempt, message)`
+        rows and return the set of the ids that could be claimed.
+
+        A message is claimed by moving its `next_attempt` by
+        `claim_timeout` seconds, provided it hasn't been changed since it
+        was read. Messages claimed by another process are left out, and
+        the messages of a process that stopped while delivering them are
+        delivered again once the claim expires.
+        """
+        claimed = set()
+        until = now + self.claim_timeout * 1000000
+        with self.env.db_transaction as db:
+            cursor = db.cursor()
+            for id, next_attempt, message in rows:
+                cursor.execute("""
+                    UPDATE notify_queue SET next_attempt=%s
+                    WHERE id=%s AND next_attempt=%s
+                    """, (until, id, next_attempt))
+                if cursor.rowcount == 1:
+                    claimed.add(id)
+        return claimed
+
+    def _coalesce(self, messages):
+        """Combine the messages into a digest if there are several of
+        them."""
+        if len(messages) == 1:
+            return messages[0]
+        from email import message_from_string
+        from email.MIMEMessage import MIMEMessage
+        from email.MIMEMultipart import MIMEMultipart
+        parts = [message_from_string(message) for message in messages]
+        digest = MIMEMultipart('digest')
+        for name, value in parts[-1].items():
+            if name.lower() not in ('content-type',
+                                    'content-transfer-encoding',
+                                    'mime-version'):
+                digest[name] = value
+        for part in parts:
+            digest.attach(MIMEMessage(part))
+        return digest.as_string()
+
+    def _delivery_failed(self, group, now, e):
+        attempts = group['attempts'] + 1
+        if attempts >= self.queue_retries:
+            self.log.error("Dropping notification after %d failed delivery "
+                           "attempts: %s", attempts, exception_to_unicode(e))
+            self._delete(group['ids'])
+            return
+        delay = self.queue_retry_delay * 2 ** (attempts - 1)
+        self.log.warning("Delivery of a notification failed, retrying in %d "
+                         "seconds: %s", delay, exception_to_unicode(e))
+        self.env.db_transaction.executemany("""
+            UPDATE notify_queue SET attempts=%s,next_attempt=%s,error=%s
+            WHERE id=%s
+            """, [(attempts, now + delay * 1000000, exception_to_unicode(e),
+                   id) for id in group['ids']])
+
+    def _delete(self, ids):
+        self.env.db_transaction.executemany("""
+            DELETE FROM notify_queue WHERE id=%s
+            """, [(id,) for id in ids])
+
+    def _next_attempt(self):
+        """Return the number of seconds until the next queued message is
+        due, or `None` if the queue is empty."""
+        for next_attempt, in self.env.db_query("""
+                SELECT MIN(next_attempt) FROM notify_queue"""):
+            if next_attempt is not None:
+                now = to_utimestamp(datetime.now(utc))
+                return max(0, next_attempt - now) / 1000000.0
+
+    def _wake_up(self):
+        with self._lock:
+            if self._thread is None and not self._stopped:
+                self._thread = threading.Thread(target=self._run,
+                                                name='QueuedEmailSender')
+                self._thread.setDaemon(True)
+                self._thread.start()
+        self._event.set()
+
+    def _run(self):
+        while True:
+            # Clear the event before looking at the queue, so that messages
+            # queued from now on wake the thread up again
+            self._event.clear()
+            if self._stopped or not self.queue_thread:
+                break
+            try:
+                self.deliver()
+                timeout = self._next_attempt()
+            except Exception, e:
+                self.log.error("Delivery of queued notifications failed: "
+                               "%s", exception_to_unicode(e))
+                timeout = self.queue_retry_delay
+            self._event.wait(timeout)
+        with self._lock:
+            self._thread = None
+
+
 class Notify(object):
     """Generic notification class for Trac.
     
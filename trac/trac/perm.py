@@ -156,6 +156,15 @@ class IPermissionPolicy(Interface):
         Note that performing permission checks on realm resources may seem
         redundant for now as the action name itself contains the realm, but
         this will probably change in the future (e.g. `'VIEW' in ...`).
+
+        A policy whose decisions only depend on the arguments and on the
+        permissions managed by the `PermissionSystem` can declare itself
+        cacheable by setting a `cacheable` class attribute to `True`.
+        Its decisions are then shared across requests, until permissions
+        are granted or revoked, or at most for `CACHE_EXPIRY` seconds
+        (''since 0.13''). Policies checking other permissions through
+        `perm`, like the `LegacyAttachmentPolicy`, depend on the decisions
+        of all the policies and must not be declared cacheable.
         """
 
 
@@ -169,6 +178,12 @@ class DefaultPermissionStore(Component):
 
     group_providers = ExtensionPoint(IPermissionGroupProvider)
 
+    # Number of seconds the index of the users by permission is valid for.
+    INDEX_EXPIRY = 60
+
+    def __init__(self):
+        self._user_index = None
+
     def get_user_permissions(self, username):
         """Retrieve the permissions for the given user and return them in a
         dictionary.
@@ -204,17 +219,65 @@ class DefaultPermissionStore(Component):
         
         Users are returned as a list of usernames.
         """
-        # get_user_permissions() takes care of the magic 'authenticated' group.
-        # The optimized loop we had before didn't.  This is very inefficient,
-        # but it works.
-        result = set()
-        users = set([u[0] for u in self.env.get_known_users()])
-        for user in users:
-            userperms = self.get_user_permissions(user)
-            for group in permissions:
-                if group in userperms:
-                    result.add(user)
-        return list(result)
+        permissions = set(permissions)
+        result = []
+        for actions, users in self._get_user_index():
+            if permissions & actions:
+                result.extend(users)
+        return result
+
+    def _get_user_index(self):
+        """Return the known users grouped by the actions granted to them,
+        as a list of `(actions, users)` tuples.
+
+        The index is built again when the permissions or the known users
+        change, and after `INDEX_EXPIRY` seconds in case the groups given
+        by the `IPermissionGroupProvider`s have changed.
+        """
+        from trac.env import UserDirectory
+        perms = self._all_permissions
+        usernames = UserDirectory(self.env).get_usernames()
+        index = self._user_index
+        if index is not None and index[0] is perms and \
+                index[1] is usernames and time() - index[2] < self.INDEX_EXPIRY:
+            return index[3]
+
+        granted = {}
+        for subject, action in perms:
+            granted.setdefault(subject, []).append(action)
+        def expand(subjects):
+            subjects = set(subjects)
+            actions = set()
+            pending = list(subjects)
+            while pending:
+                for action in granted.get(pending.pop(), ()):
+                    if action.isupper():
+                        actions.add(action)
+                    elif action not in subjects:
+                        # action is actually the name of the permission
+                        # group here
+                        subjects.add(action)
+                        pending.append(action)
+            return frozenset(actions)
+
+        # Users that have not been granted permissions individually share
+        # the actions of their groups
+        expanded = {}
+        users_by_actions = {}
+        for username in usernames:
+            subjects = set()
+            if username in granted:
+                subjects.add(username)
+            for provider in self.group_providers:
+                subjects.update(provider.get_permission_groups(username) or [])
+            subjects = frozenset(subjects)
+            actions = expanded.get(subjects)
+            if actions is None:
+                actions = expanded[subjects] = expand(subjects)
+            users_by_actions.setdefault(actions, []).append(username)
+        result = users_by_actions.items()
+        self._user_index = (perms, usernames, time(), result)
+        return result
 
     def get_all_permissions(self):
         """Return all permissions for all users.
@@ -269,35 +332,14 @@ class DefaultPermissionPolicy(Component):
 
     implements(IPermissionPolicy)
 
-    # Number of seconds a cached user permission set is valid for.
-    CACHE_EXPIRY = 5
-    # How frequently to clear the entire permission cache
-    CACHE_REAP_TIME = 60
-
-    def __init__(self):
-        self.permission_cache = {}
-        self.last_reap = time()
+    # decisions only depend on the permissions of the `PermissionSystem`
+    cacheable = True
 
     # IPermissionPolicy methods
 
     def check_permission(self, action, username, resource, perm):
-        now = time()
-
-        if now - self.last_reap > self.CACHE_REAP_TIME:
-            self.permission_cache = {}
-            self.last_reap = time()
-
-        timestamp, permissions = self.permission_cache.get(username, (0, None))
-
-        # Cache hit?
-        if now - timestamp > self.CACHE_EXPIRY:
-            # No, pull permissions from database.
-            permissions = PermissionSystem(self.env). \
-                          get_user_permissions(username)
-            self.permission_cache[username] = (now, permissions)
-
-        return action in permissions or None
-
+        actions = PermissionSystem(self.env).get_user_actions(username)
+        return action in actions or None
 
 
 class PermissionSystem(Component):
@@ -329,10 +371,13 @@ class PermissionSystem(Component):
     CACHE_EXPIRY = 5
     # How frequently to clear the entire permission cache
     CACHE_REAP_TIME = 60
+    # Maximum number of policy decisions kept in the shared cache
+    DECISION_CACHE_SIZE = 10000
 
     def __init__(self):
         self.permission_cache = {}
         self.last_reap = time()
+        self._shared_cache = None
 
     # Public API
 
@@ -343,10 +388,21 @@ class PermissionSystem(Component):
             raise TracError(_('%(name)s is not a valid action.', name=action))
 
         self.store.grant_permission(username, action)
+        self.invalidate_cache()
 
     def revoke_permission(self, username, action):
         """Revokes the permission of the specified user to perform an action."""
         self.store.revoke_permission(username, action)
+        self.invalidate_cache()
+
+    def invalidate_cache(self):
+        """Drop the expanded user actions and the policy decisions shared
+        across requests, in all processes (''since 0.13'').
+
+        This is done automatically when permissions are granted or revoked
+        through the `PermissionSystem`.
+        """
+        del self._cache_generation
 
     def get_actions_dict(self):
         """Get all actions from permission requestors as a `dict`.
@@ -388,16 +444,24 @@ class PermissionSystem(Component):
             return dict.fromkeys(self.get_actions(), True)
 
         # Return all permissions that the given user has
-        actions = self.get_actions_dict()
-        permissions = {}
-        def expand_meta(action):
-            if action not in permissions:
-                permissions[action] = True
-                for a in actions.get(action, ()):
-                    expand_meta(a)
-        for perm in self.store.get_user_permissions(username) or []:
-            expand_meta(perm)
-        return permissions
+        return dict.fromkeys(self.get_user_actions(username), True)
+
+    def get_user_actions(self, username):
+        """Return the actions granted to the specified user, with the meta
+        actions expanded, as a `frozenset` (''since 0.13'').
+
+        The set is computed once per user and then shared across requests
+        until permissions are granted or revoked, or at most for
+        `CACHE_EXPIRY` seconds, so that changes in the groups given by the
+        `IPermissionGroupProvider`s are still picked up quickly.
+        """
+        user_actions = self._get_shared_cache()[2]
+        actions = user_actions.get(username)
+        if actions is None:
+            actions = self.expand_actions(
+                          self.store.get_user_permissions(username) or [])
+            actions = user_actions[username] = frozenset(actions)
+        return actions
 
     def get_all_permissions(self):
         """Return all permissions for all users.
@@ -452,14 +516,36 @@ class PermissionSystem(Component):
 
     def check_permission(self, action, username=None, resource=None, perm=None):
         """Return True if permission to perform action for the given resource
-        is allowed."""
+        is allowed.
+
+        The decisions of the policies declared as `cacheable` are looked up
+        in and stored to a cache shared across requests.
+        """
         if username is None:
             username = 'anonymous'
         if resource and resource.realm is None:
             resource = None
+        decisions = None
         for policy in self.policies:
-            decision = policy.check_permission(action, username, resource,
-                                               perm)
+            if getattr(policy, 'cacheable', False):
+                if decisions is None:
+                    decisions = self._get_shared_cache()[1]
+                    key = _resource_key(resource)
+                pkey = (policy.__class__, action, username, key)
+                try:
+                    decision = decisions[pkey]
+                except KeyError:
+                    decision = policy.check_permission(action, username,
+                                                       resource, perm)
+                    if len(decisions) >= self.DECISION_CACHE_SIZE:
+                        decisions.clear()
+                    decisions[pkey] = decision
+                except TypeError: # unhashable resource id
+                    decision = policy.check_permission(action, username,
+                                                       resource, perm)
+            else:
+                decision = policy.check_permission(action, username, resource,
+                                                   perm)
             if decision is not None:
                 if not decision:
                     self.log.debug("%s denies %s performing %s on %r",
@@ -470,6 +556,28 @@ class PermissionSystem(Component):
                        username, action, resource)
         return False
 
+    # Internal methods
+
+    @cached
+    def _cache_generation(self):
+        return object()
+
+    def _get_shared_cache(self):
+        """Return the `(generation, decisions, user_actions)` tuple shared
+        by all requests of this process.
+
+        A new tuple is created when the cache generation changes, and
+        after `CACHE_EXPIRY` seconds in case the groups given by the
+        `IPermissionGroupProvider`s have changed.
+        """
+        generation = self._cache_generation
+        cache = self._shared_cache
+        now = time()
+        if cache is None or cache[0][0] is not generation or \
+                now - cache[0][1] > self.CACHE_EXPIRY:
+            cache = self._shared_cache = ((generation, now), {}, {})
+        return cache
+
     # IPermissionRequestor methods
 
     def get_permission_actions(self):
@@ -484,6 +592,15 @@ class PermissionSystem(Component):
         return [('TRAC_ADMIN', actions), 'EMAIL_VIEW']
 
 
+def _resource_key(resource):
+    """Return a hashable key identifying `resource` and its parents."""
+    key = ()
+    while resource:
+        key += (resource.realm, resource.id, resource.version)
+        resource = resource.parent
+    return key
+
+
 class PermissionCache(object):
     """Cache that maintains the permissions of a single user.
 
@@ -573,6 +690,18 @@ class PermissionCache(object):
 
     __contains__ = has_permission
 
+    def filter_permitted(self, action, resources, key=None):
+        """Return the list of items from `resources` on which `action` is
+        permitted (''since 0.13'').
+
+        If given, `key` is called on each item to get the `Resource` to
+        check, e.g. for filtering the rows of a query result. The checks
+        share this permission cache.
+        """
+        return [item for item in resources
+                if self._has_permission(action,
+                                        item if key is None else key(item))]
+
     def require(self, action, realm_or_resource=None, id=False, version=False):
         resource = self._normalize_resource(realm_or_resource, id, version)
         if not self._has_permission(action, resource):
@@ -11,7 +11,10 @@
 # individuals. For the exact contribution history, see the revision
 # history and logs, available at http://trac.edgewall.org/log/.
 
+import heapq
+
 from trac.core import *
+from trac.util.datefmt import to_utimestamp
 
 
 class ISearchSource(Interface):
@@ -38,6 +41,53 @@ class ISearchSource(Interface):
         `(href, title, date, author, excerpt).`
         """
 
+    def get_search_results_by_date(req, terms, filters, limit=None):
+        """Return an iterator over the results matching each search term
+        in `terms`, newest first.
+
+        `limit` is a hint of the number of results which will be used,
+        though more results can be retrieved. The `excerpt` of the results
+        can be a callable returning the excerpt, so that it is only built
+        for the results which are shown (see `render_excerpts`).
+
+        This method is optional, `get_search_results` is used when a
+        source doesn't implement it. (since 0.13)
+        """
+
+
+class ISearchIndex(Interface):
+    """Extension point interface for full-text indexes answering search
+    queries in place of the search sources.
+    """
+
+    def get_indexed_filters(req):
+        """Return the names of the search filters for which the index can
+        answer queries.
+
+        The search sources are not queried for these filters.
+        """
+
+    def get_search_results(req, terms, filters):
+        """Return the results matching each search term in `terms`, best
+        matches first.
+
+        The `filters` parameter is the list of the enabled filters which
+        were returned by `get_indexed_filters`.
+
+        The returned sequence must support slicing. Only the results up to
+        the requested page are sliced, so its items, tuples of the form
+        `(href, title, date, author, excerpt)`, should only be built (and
+        their permissions checked) when a slice is taken.
+        """
+
+    def get_search_results_by_date(req, terms, filters, limit=None):
+        """Return an iterator over the same results as
+        `get_search_results`, newest first.
+
+        This is used when results of the index are merged with results of
+        search sources. See `ISearchSource.get_search_results_by_date`.
+        """
+
 
 def search_to_sql(db, columns, terms):
     """Convert a search query into an SQL WHERE clause and corresponding
@@ -55,6 +105,44 @@ def search_to_sql(db, columns, terms):
         args.extend(['%' + db.like_escape(t) + '%'] * len(columns))
     return sql, tuple(args)
 
+def search_rows(db, sql, args, limit=None):
+    """Iterate over the rows returned by an ordered query.
+
+    If `limit` is given, rows are retrieved `limit` at a time, and the
+    following rows are only retrieved when the iteration goes on.
+    """
+    if not limit:
+        for row in db(sql, args):
+            yield row
+        return
+    offset = 0
+    while True:
+        rows = db(sql + " LIMIT %s OFFSET %s", tuple(args) + (limit, offset))
+        for row in rows:
+            yield row
+        if len(rows) < limit:
+            return
+        offset += limit
+
+def merge_search_results(*iterables):
+    """Merge iterators over search results ordered by date, newest first,
+    into a single iterator over the results, newest first.
+
+    Results are pulled from the iterators as the iteration goes on.
+    """
+    def decorate(idx, results):
+        for n, result in enumerate(results):
+            yield -to_utimestamp(result[2]), idx, n, result
+    for item in heapq.merge(*[decorate(idx, results)
+                              for idx, results in enumerate(iterables)]):
+        yield item[-1]
+
+def render_excerpts(results):
+    """Return the search results with their lazy excerpts built."""
+    return [(href, title, date, author,
+             excerpt() if callable(excerpt) else excerpt)
+            for href, title, date, author, excerpt in results]
+
 def shorten_result(text='', keywords=[], maxlen=240, fuzz=60):
     if not text:
         text = ''
@@ -0,0 +1,105 @@
+from datetime import datetime, timedelta
+
+from trac.core import Component, implements
+from trac.search.api import ISearchSource, merge_search_results
+from trac.search.web_ui import SearchModule
+from trac.test import EnvironmentStub, Mock, MockPerm
+from trac.util.datefmt import utc
+from trac.web.href import Href
+
+import unittest
+
+
+t0 = datetime(2012, 1, 1, tzinfo=utc)
+
+def _results(prefix, hours, pulled):
+    for h in hours:
+        pulled.append('%s%d' % (prefix, h))
+        yield ('/%s/%d' % (prefix, h), 'title', t0 - timedelta(hours=h),
+               'joe', lambda: 'excerpt')
+
+
+class OrderedSource(Component):
+
+    implements(ISearchSource)
+
+    pulled = []
+
+    def get_search_filters(self, req):
+        yield ('ordered', 'Ordered')
+
+    def get_search_results(self, req, terms, filters):
+        return list(self.get_search_results_by_date(req, terms, filters))
+
+    def get_search_results_by_date(self, req, terms, filters, limit=None):
+        return _results('ordered', range(0, 100, 2), self.pulled)
+
+
+class UnorderedSource(Component):
+
+    implements(ISearchSource)
+
+    def get_search_filters(self, req):
+        yield ('unordered', 'Unordered')
+
+    def get_search_results(self, req, terms, filters):
+        return [('/unordered/%d' % h, 'title', t0 - timedelta(hours=h),
+                 'joe', 'excerpt') for h in (5, 1, 3)]
+
+
+class SearchModuleTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.env = EnvironmentStub(enable=[SearchModule, OrderedSource,
+                                           UnorderedSource])
+        self.search = SearchModule(self.env)
+        self.req = Mock(args={}, perm=MockPerm(), authname='anonymous')
+        del OrderedSource.pulled[:]
+
+    def _hrefs(self, results):
+        return [result[0] for result in results]
+
+    def test_merge_search_results(self):
+        merged = merge_search_results(_results('a', [1, 4], []),
+                                      _results('b', [0, 2, 3], []))
+        self.assertEqual(['/b/0', '/a/1', '/b/2', '/b/3', '/a/4'],
+                         self._hrefs(merged))
+
+    def test_first_page(self):
+        results = self.search._do_search(self.req, ['term'],
+                                         ['ordered', 'unordered'])
+        self.assertEqual(['/ordered/0', '/unordered/1', '/ordered/2',
+                          '/unordered/3', '/ordered/4', '/unordered/5',
+                          '/ordered/6', '/ordered/8', '/ordered/10',
+                          '/ordered/12'], self._hrefs(results))
+        self.assertTrue(results.has_next_page)
+        # only the results needed for the page are retrieved
+        self.assertEqual(8, len(OrderedSource.pulled))
+        # so the total is not known
+        self.assertFalse(results.num_items_known)
+        self.assertEqual('1 - 10', results.displayed_items())
+
+    def test_last_page(self):
+        results = self.search._do_search(self.req, ['term'],
+                                         ['ordered', 'unordered'], 5)
+        self.assertEqual(['/ordered/94', '/ordered/96', '/ordered/98'],
+                         self._hrefs(results))
+        self.assertFalse(results.has_next_page)
+        self.assertTrue(results.has_previous_page)
+        self.assertTrue(results.num_items_known)
+        self.assertEqual('51 - 53 of 53', results.displayed_items())
+
+    def test_lazy_excerpts(self):
+        results = self.search._do_search(self.req, ['term'], ['ordered'])
+        self.search._prepare_results(Mock(args={}, href=Href('/trac'),
+                                          tz=utc, locale=None, chrome={},
+                                          lc_time=None),
+                                     ['ordered'], results)
+        self.assertEqual('excerpt', results.items[0]['excerpt'])
+
+
+def suite():
+    return unittest.makeSuite(SearchModuleTestCase, 'test')
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
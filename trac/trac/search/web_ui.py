@@ -14,6 +14,7 @@
 #
 # Author: Jonas Borgström <jonas@edgewall.com>
 
+from itertools import islice
 import pkg_resources
 import re
 
@@ -23,7 +24,8 @@ from trac.config import IntOption, ListOption
 from trac.core import *
 from trac.mimeview import RenderingContext
 from trac.perm import IPermissionRequestor
-from trac.search.api import ISearchSource
+from trac.search.api import ISearchIndex, ISearchSource, \
+                            merge_search_results, render_excerpts
 from trac.util.datefmt import format_datetime, user_time
 from trac.util.html import find_element
 from trac.util.presentation import Paginator
@@ -43,6 +45,8 @@ class SearchModule(Component):
                ITemplateProvider, IWikiSyntaxProvider)
 
     search_sources = ExtensionPoint(ISearchSource)
+
+    search_indexes = ExtensionPoint(ISearchIndex)
     
     RESULTS_PER_PAGE = 10
 
@@ -103,7 +107,8 @@ class SearchModule(Component):
 
             terms = self._parse_query(req, query)
             if terms:
-                results = self._do_search(req, terms, filters)
+                page = int(req.args.get('page', '1')) - 1
+                results = self._do_search(req, terms, filters, page)
                 if results:
                     data.update(self._prepare_results(req, filters, results))
 
@@ -207,17 +212,55 @@ class SearchModule(Component):
                            'Query must be at least %(num)s characters long.',
                            num=self.min_query_length))
 
-    def _do_search(self, req, terms, filters):
-        results = []
-        for source in self.search_sources:
-            results.extend(source.get_search_results(req, terms, filters)
-                           or [])
-        return sorted(results, key=lambda x: x[2], reverse=True)
+    def _do_search(self, req, terms, filters, page=0):
+        """Return a `Paginator` over the results of the requested page.
+
+        Results are merged by date from the indexes and the sources, and
+        only the results up to the requested page are retrieved. Results
+        are ranked by relevance instead when a single index answers the
+        query.
+        """
+        indexed = []
+        remaining = filters
+        for index in self.search_indexes:
+            index_filters = [f for f in index.get_indexed_filters(req) or []
+                             if f in remaining]
+            if index_filters:
+                indexed.append((index, index_filters))
+                remaining = [f for f in remaining if f not in index_filters]
+        # Retrieve one more result to know if there's a next page
+        offset = page * self.RESULTS_PER_PAGE
+        limit = offset + self.RESULTS_PER_PAGE + 1
+        if len(indexed) == 1 and not remaining:
+            # Ranked results from the index, built one page at a time
+            index, index_filters = indexed[0]
+            results = index.get_search_results(req, terms,
+                                               index_filters)[offset:limit]
+        else:
+            iterables = []
+            for index, index_filters in indexed:
+                iterables.append(index.get_search_results_by_date(
+                    req, terms, index_filters, limit))
+            if remaining:
+                for source in self.search_sources:
+                    if hasattr(source, 'get_search_results_by_date'):
+                        results = source.get_search_results_by_date(
+                            req, terms, remaining, limit)
+                    else:
+                        results = sorted(source.get_search_results(
+                                             req, terms, remaining) or [],
+                                         key=lambda x: x[2], reverse=True)
+                    iterables.append(results)
+            results = list(islice(merge_search_results(*iterables), offset,
+                                  limit))
+        # The total is only known once the last page is reached
+        return Paginator(results[:self.RESULTS_PER_PAGE], page,
+                         self.RESULTS_PER_PAGE, offset + len(results),
+                         len(results) <= self.RESULTS_PER_PAGE)
 
     def _prepare_results(self, req, filters, results):
-        page = int(req.args.get('page', '1'))
-        results = Paginator(results, page - 1, self.RESULTS_PER_PAGE)
-        for idx, result in enumerate(results):
+        page = results.page + 1
+        for idx, result in enumerate(render_excerpts(results)):
             results[idx] = {'href': result[0], 'title': result[1],
                             'date': user_time(req, format_datetime, result[2]),
                             'author': result[3], 'excerpt': result[4]}
@@ -116,6 +116,9 @@ class MockPerm(object):
         pass
     assert_permission = require
 
+    def filter_permitted(self, action, resources, key=None):
+        return list(resources)
+
 
 class TestSetup(unittest.TestSuite):
     """
@@ -411,7 +414,9 @@ def suite():
     import trac.admin.tests
     import trac.db.tests
     import trac.mimeview.tests
+    import trac.search.tests
     import trac.ticket.tests
+    import trac.timeline.tests
     import trac.util.tests
     import trac.versioncontrol.tests
     import trac.versioncontrol.web_ui.tests
@@ -427,7 +432,9 @@ def suite():
     suite.addTest(trac.admin.tests.suite())
     suite.addTest(trac.db.tests.suite())
     suite.addTest(trac.mimeview.tests.suite())
+    suite.addTest(trac.search.tests.suite())
     suite.addTest(trac.ticket.tests.suite())
+    suite.addTest(trac.timeline.tests.suite())
     suite.addTest(trac.util.tests.suite())
     suite.addTest(trac.versioncontrol.tests.suite())
     suite.addTest(trac.versioncontrol.web_ui.tests.suite())
@@ -0,0 +1,133 @@
+from __future__ import with_statement
+
+from trac.cache import CacheManager, SharedMemoryCacheBackend, cached
+from trac.core import Component
+from trac.test import EnvironmentStub
+
+import os.path
+import shutil
+import tempfile
+import unittest
+
+
+class Cached(Component):
+
+    def __init__(self):
+        self.retrieved = 0
+
+    @cached
+    def value(self):
+        self.retrieved += 1
+        return self.retrieved
+
+
+class DatabaseCacheBackendTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.env = EnvironmentStub(enable=[Cached])
+
+    def tearDown(self):
+        self.env.reset_db()
+
+    def _next_request(self):
+        CacheManager(self.env).reset_metadata()
+
+    def test_cached_value(self):
+        cache = Cached(self.env)
+        self.assertEqual(1, cache.value)
+        self._next_request()
+        self.assertEqual(1, cache.value)
+        self.assertEqual(1, cache.retrieved)
+
+    def test_invalidate(self):
+        cache = Cached(self.env)
+        self.assertEqual(1, cache.value)
+        del cache.value
+        self._next_request()
+        self.assertEqual(2, cache.value)
+
+    def test_invalidate_in_transaction(self):
+        cache = Cached(self.env)
+        self.assertEqual(1, cache.value)
+        with self.env.db_transaction:
+            del cache.value
+            self.assertEqual(2, cache.value)
+        self._next_request()
+        self.assertEqual(2, cache.value)
+
+
+class SharedMemoryCacheBackendTestCase(DatabaseCacheBackendTestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.env = EnvironmentStub(enable=[Cached, SharedMemoryCacheBackend])
+        self.env.config.set('trac', 'cache_backend',
+                            'SharedMemoryCacheBackend')
+        self.env.config.set('trac', 'cache_board_file',
+                            os.path.join(self.dir, 'cache.board'))
+
+    def tearDown(self):
+        self.env.reset_db()
+        shutil.rmtree(self.dir)
+
+    def test_invalidate_in_transaction(self):
+        cache = Cached(self.env)
+        self.assertEqual(1, cache.value)
+        with self.env.db_transaction:
+            del cache.value
+            self.assertEqual(2, cache.value)
+        # Data retrieved before commit is retrieved again
+        self._next_request()
+        self.assertEqual(3, cache.value)
+
+    def test_no_database_query(self):
+        cache = Cached(self.env)
+        self.assertEqual(1, cache.value)
+        self.env.db_transaction("DROP TABLE cache")
+        self._next_request()
+        self.assertEqual(1, cache.value)
+
+    def test_generation_after_commit(self):
+        backend = SharedMemoryCacheBackend(self.env)
+        generation = backend.get_generation(42)
+        with self.env.db_transaction:
+            backend.increment_generation(42, 'key')
+            self.assertEqual(generation, backend.get_generation(42))
+        self.assertEqual(generation + 1, backend.get_generation(42))
+
+    def test_no_generation_after_rollback(self):
+        backend = SharedMemoryCacheBackend(self.env)
+        generation = backend.get_generation(42)
+        try:
+            with self.env.db_transaction:
+                backend.increment_generation(42, 'key')
+                raise ValueError
+        except ValueError:
+            pass
+        self.assertEqual(generation, backend.get_generation(42))
+
+    def test_initial_generation(self):
+        backend = SharedMemoryCacheBackend(self.env)
+        self.assertEqual(0, backend.get_generation(42))
+        self.assertEqual(0, backend.get_generations().get(42, -1))
+
+    def test_shared_board(self):
+        cache = Cached(self.env)
+        self.assertEqual(1, cache.value)
+        other_env = EnvironmentStub(enable=[Cached,
+                                            SharedMemoryCacheBackend])
+        for name, value in self.env.config.options('trac'):
+            other_env.config.set('trac', name, value)
+        del Cached(other_env).value
+        self._next_request()
+        self.assertEqual(2, cache.value)
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(DatabaseCacheBackendTestCase, 'test'))
+    suite.addTest(unittest.makeSuite(SharedMemoryCacheBackendTestCase, 'test'))
+    return suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
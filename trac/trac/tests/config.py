@@ -382,6 +382,53 @@ class ConfigurationTestCase(unittest.TestCase):
         config.parse_if_needed()
         self.assertEquals('y', config.get('a', 'option'))
 
+    def test_watcher(self):
+        self._write(['[a]', 'option = x'])
+        config = self._read()
+        watcher = ConfigurationWatcher(interval=3600)
+        self.assertEqual(True, watcher.is_stale(config))
+        watcher.watch(config)
+        self.assertEqual(False, watcher.is_stale(config))
+        watcher.check()
+        self.assertEqual(False, watcher.is_stale(config))
+
+        self._write(['[a]', 'option = y'])
+        mtime = time.time() + 10
+        os.utime(self.filename, (mtime, mtime))
+        watcher.check()
+        self.assertEqual(True, watcher.is_stale(config))
+        self.assertEqual(True, config.parse_if_needed())
+        self.assertEqual('y', config.get('a', 'option'))
+        watcher.watch(config)
+        self.assertEqual(False, watcher.is_stale(config))
+
+        watcher.notify(self.filename)
+        self.assertEqual(True, watcher.is_stale(config))
+        watcher.unwatch(config)
+        watcher.notify(self.filename)
+        self.assertEqual(True, watcher.is_stale(config))
+
+    def test_watcher_stop(self):
+        self._write(['[a]', 'option = x'])
+        config = self._read()
+        watcher = ConfigurationWatcher(interval=0.01)
+        watcher.watch(config)
+        thread = watcher._thread or watcher._notifier
+        self.assertTrue(thread.isAlive())
+        watcher.unwatch(config)
+        thread.join(1)
+        self.assertFalse(thread.isAlive())
+        self.assertEqual(None, watcher._thread)
+        self.assertEqual(None, watcher._notifier)
+        # Watching again starts new threads
+        watcher.watch(config)
+        thread = watcher._thread or watcher._notifier
+        self.assertTrue(thread.isAlive())
+        watcher.stop()
+        thread.join(1)
+        self.assertFalse(thread.isAlive())
+        self.assertEqual(True, watcher.is_stale(config))
+
     def test_inherit_one_level(self):
         def testcb():
             config = self._read()
@@ -1,12 +1,14 @@
 from __future__ import with_statement
 
 from trac import db_default
-from trac.env import Environment
+from trac.config import config_watcher
+from trac.env import Environment, env_cache, open_environment
 
 import os.path
 import unittest
 import tempfile
 import shutil
+import time
 
 
 class EnvironmentTestCase(unittest.TestCase):
@@ -46,8 +48,46 @@ class EnvironmentTestCase(unittest.TestCase):
         self.assertEqual(('Jane', None), users['jane'])
 
 
+class EnvironmentCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.env_path = os.path.join(tempfile.gettempdir(), 'trac-tempenv')
+        env = Environment(self.env_path, create=True)
+        env.shutdown()
+        self.env_path = os.path.normcase(os.path.normpath(self.env_path))
+
+    def tearDown(self):
+        env = env_cache.pop(self.env_path, None)
+        if env:
+            config_watcher.unwatch(env.config)
+            env.shutdown()
+        shutil.rmtree(self.env_path)
+
+    def test_cached_environment(self):
+        env = open_environment(self.env_path, use_cache=True)
+        self.assertEqual(False, config_watcher.is_stale(env.config))
+        self.assertTrue(env is open_environment(self.env_path,
+                                                use_cache=True))
+
+    def test_reload_after_save(self):
+        env = open_environment(self.env_path, use_cache=True)
+        env.config.set('project', 'name', 'Changed')
+        env.config.save()
+        self.assertEqual(True, config_watcher.is_stale(env.config))
+        # needed because of low mtime granularity
+        mtime = time.time() + 10
+        os.utime(env.config.filename, (mtime, mtime))
+        env2 = open_environment(self.env_path, use_cache=True)
+        self.assertTrue(env is not env2)
+        self.assertEqual('Changed', env2.project_name)
+        self.assertEqual(False, config_watcher.is_stale(env2.config))
+
+
 def suite():
-    return unittest.makeSuite(EnvironmentTestCase,'test')
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(EnvironmentTestCase, 'test'))
+    suite.addTest(unittest.makeSuite(EnvironmentCacheTestCase, 'test'))
+    return suite
 
 if __name__ == '__main__':
     unittest.main(defaultTest='suite')
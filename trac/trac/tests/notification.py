@@ -267,13 +267,16 @@ class SMTPServerStore(SMTPServerInterface):
 
     def __init__(self):
         self.reset(None)
+        self.clear()
 
     def helo(self, args):
         self.reset(None)
+        self.connections += 1
     
     def mail_from(self, args):
         if args.lower().startswith('from:'):
             self.sender = strip_address(args[5:].replace('\r\n','').strip())
+            self.recipients = []
         
     def rcpt_to(self, args):
         if args.lower().startswith('to:'):
@@ -282,6 +285,7 @@ class SMTPServerStore(SMTPServerInterface):
 
     def data(self, args):
         self.message = args
+        self.messages.append((self.sender, self.recipients, self.message))
 
     def quit(self, args):
         pass
@@ -290,6 +294,10 @@ class SMTPServerStore(SMTPServerInterface):
         self.sender = None
         self.recipients = []
         self.message = None
+
+    def clear(self):
+        self.connections = 0
+        self.messages = []
         
 
 class SMTPThreadedServer(threading.Thread):
@@ -336,9 +344,18 @@ class SMTPThreadedServer(threading.Thread):
 
     def get_message(self):
         return self.store.message
+
+    def get_messages(self):
+        """Return the `(sender, recipients, message)` tuples of all the
+        messages received since the last cleanup."""
+        return self.store.messages
+
+    def get_connections(self):
+        return self.store.connections
         
     def cleanup(self):
         self.store.reset(None)
+        self.store.clear()
 
 
 def smtp_address(fulladdr):
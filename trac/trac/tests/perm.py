@@ -1,5 +1,7 @@
 from trac import perm
 from trac.core import *
+from trac.env import UserDirectory
+from trac.resource import Resource
 from trac.test import EnvironmentStub
 
 import unittest
@@ -78,6 +80,29 @@ class DefaultPermissionStoreTestCase(unittest.TestCase):
         for res in self.store.get_all_permissions():
             self.failIf(res not in expected)
 
+    def test_get_users_with_permissions(self):
+        self.env.db_transaction.executemany(
+            "INSERT INTO session VALUES (%s,1,0)",
+            [('john',), ('jane',), ('kate',)])
+        self.env.db_transaction.executemany(
+            "INSERT INTO permission VALUES (%s,%s)",
+            [('authenticated', 'WIKI_VIEW'),
+             ('dev', 'TICKET_MODIFY'),
+             ('john', 'dev'),
+             ('jane', 'REPORT_ADMIN')])
+        self.assertEquals(['jane', 'john', 'kate'], sorted(
+            self.store.get_users_with_permissions(['WIKI_VIEW'])))
+        self.assertEquals(['jane', 'john'], sorted(
+            self.store.get_users_with_permissions(['TICKET_MODIFY',
+                                                   'REPORT_ADMIN'])))
+        self.store.grant_permission('kate', 'dev')
+        self.assertEquals(['john', 'kate'], sorted(
+            self.store.get_users_with_permissions(['TICKET_MODIFY'])))
+        self.env.db_transaction("INSERT INTO session VALUES ('bob',1,0)")
+        UserDirectory(self.env).invalidate()
+        self.assertEquals(['bob', 'jane', 'john', 'kate'], sorted(
+            self.store.get_users_with_permissions(['WIKI_VIEW'])))
+
 
 class TestPermissionRequestor(Component):
     implements(perm.IPermissionRequestor)
@@ -132,6 +157,19 @@ class PermissionSystemTestCase(unittest.TestCase):
         for res in self.perm.get_all_permissions():
             self.failIf(res not in expected)
     
+    def test_get_user_actions(self):
+        self.perm.grant_permission('bob', 'TEST_CREATE')
+        actions = self.perm.get_user_actions('bob')
+        self.assertEqual(frozenset(['TEST_CREATE']), actions)
+        self.assert_(actions is self.perm.get_user_actions('bob'))
+        self.perm.grant_permission('bob', 'TEST_ADMIN')
+        self.assertEqual(frozenset(['TEST_ADMIN', 'TEST_CREATE',
+                                    'TEST_DELETE', 'TEST_MODIFY']),
+                         self.perm.get_user_actions('bob'))
+        self.perm.revoke_permission('bob', 'TEST_ADMIN')
+        self.assertEqual(frozenset(['TEST_CREATE']),
+                         self.perm.get_user_actions('bob'))
+
     def test_expand_actions_iter_7467(self):
         # Check that expand_actions works with iterators (#7467)
         perms = set(['EMAIL_VIEW', 'TRAC_ADMIN', 'TEST_DELETE', 'TEST_MODIFY',
@@ -147,8 +185,6 @@ class PermissionCacheTestCase(unittest.TestCase):
                                            perm.DefaultPermissionPolicy,
                                            TestPermissionRequestor])
         self.perm_system = perm.PermissionSystem(self.env)
-        # by-pass DefaultPermissionPolicy cache:
-        perm.DefaultPermissionPolicy.CACHE_EXPIRY = -1 
         self.perm_system.grant_permission('testuser', 'TEST_MODIFY')
         self.perm_system.grant_permission('testuser', 'TEST_ADMIN')
         self.perm = perm.PermissionCache(self.env, 'testuser')
@@ -184,6 +220,17 @@ class PermissionCacheTestCase(unittest.TestCase):
         # Using cached GRANT here
         self.perm.assert_permission('TEST_ADMIN')
 
+    def test_filter_permitted(self):
+        self.perm_system.grant_permission('testuser', 'TEST_CREATE')
+        resources = [Resource('wiki', 'WikiStart'), Resource('ticket', 1)]
+        self.assertEqual(resources,
+                         self.perm.filter_permitted('TEST_CREATE', resources))
+        self.assertEqual([], self.perm.filter_permitted('TRAC_ADMIN',
+                                                        resources))
+        rows = [{'id': 1}, {'id': 2}]
+        self.assertEqual(rows, self.perm.filter_permitted(
+            'TEST_MODIFY', rows, lambda row: Resource('ticket', row['id'])))
+
     def test_cache_shared(self):
         # we need to start with an empty cache here (#7201)
         perm1 = perm.PermissionCache(self.env, 'testcache')
@@ -215,11 +262,32 @@ class TestPermissionPolicy(Component):
         return result
 
 
+class CacheablePermissionPolicy(TestPermissionPolicy):
+    cacheable = True
+
+    def check_permission(self, action, username, resource, perm):
+        self.results.setdefault((username, action, resource), 0)
+        self.results[(username, action, resource)] += 1
+        return action in self.allowed.get(username, set()) or None
+
+
+class TestGroupProvider(Component):
+    implements(perm.IPermissionGroupProvider)
+
+    def __init__(self):
+        self.groups = {}
+
+    def get_permission_groups(self, username):
+        return self.groups.get(username, [])
+
+
 class PermissionPolicyTestCase(unittest.TestCase):
     def setUp(self):
         self.env = EnvironmentStub(enable=[perm.DefaultPermissionStore,
                                            perm.DefaultPermissionPolicy,
                                            TestPermissionPolicy,
+                                           CacheablePermissionPolicy,
+                                           TestGroupProvider,
                                            TestPermissionRequestor])
         self.env.config.set('trac', 'permission_policies', 'TestPermissionPolicy')
         self.policy = TestPermissionPolicy(self.env)
@@ -259,6 +327,49 @@ class PermissionPolicyTestCase(unittest.TestCase):
         self.assertEqual(self.policy.results,
                          {('testuser', 'TEST_MODIFY'): True,
                           ('testuser', 'TEST_ADMIN'): None})
+    def test_cacheable_policy(self):
+        self.env.config.set('trac', 'permission_policies',
+                            'CacheablePermissionPolicy, DefaultPermissionPolicy')
+        policy = CacheablePermissionPolicy(self.env)
+        policy.grant('testuser', ['TEST_MODIFY'])
+        system = perm.PermissionSystem(self.env)
+        resource = Resource('ticket', 1)
+        for i in range(3):
+            perm_cache = perm.PermissionCache(self.env, 'testuser')
+            self.assertEqual(True, 'TEST_MODIFY' in perm_cache(resource))
+            self.assertEqual(False, 'TEST_ADMIN' in perm_cache(resource))
+        self.assertEqual({('testuser', 'TEST_MODIFY', resource): 1,
+                          ('testuser', 'TEST_ADMIN', resource): 1},
+                         policy.results)
+        # Granting a permission invalidates the cached decisions
+        system.grant_permission('testuser', 'TEST_ADMIN')
+        perm_cache = perm.PermissionCache(self.env, 'testuser')
+        self.assertEqual(True, 'TEST_ADMIN' in perm_cache(resource))
+        self.assertEqual(2, policy.results[('testuser', 'TEST_ADMIN',
+                                            resource)])
+
+    def test_default_policy_cached(self):
+        self.env.config.set('trac', 'permission_policies',
+                            'DefaultPermissionPolicy')
+        provider = TestGroupProvider(self.env)
+        provider.groups['testuser'] = ['group1']
+        system = perm.PermissionSystem(self.env)
+        system.grant_permission('group1', 'TEST_MODIFY')
+        resource = Resource('ticket', 1)
+        self.assertEqual(True, 'TEST_MODIFY' in self.perm(resource))
+        self.assertEqual(True, system._get_shared_cache()[1][
+            (perm.DefaultPermissionPolicy, 'TEST_MODIFY', 'testuser',
+             ('ticket', 1, None))])
+        # Changes in the groups are only seen once the decisions expire
+        del provider.groups['testuser']
+        perm_cache = perm.PermissionCache(self.env, 'testuser')
+        self.assertEqual(True, 'TEST_MODIFY' in perm_cache(resource))
+        generation, timestamp = system._shared_cache[0]
+        system._shared_cache = ((generation,
+                                 timestamp - system.CACHE_EXPIRY - 1), {}, {})
+        perm_cache = perm.PermissionCache(self.env, 'testuser')
+        self.assertEqual(False, 'TEST_MODIFY' in perm_cache(resource))
+
 def suite():
     suite = unittest.TestSuite()
     suite.addTest(unittest.makeSuite(DefaultPermissionStoreTestCase, 'test'))
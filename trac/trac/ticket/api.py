@@ -26,7 +26,7 @@ from trac.perm import IPermissionRequestor, PermissionCache, PermissionSystem
 from trac.resource import IResourceManager
 from trac.util import Ranges, as_int
 from trac.util.text import shorten_line
-from trac.util.translation import _, N_, gettext
+from trac.util.translation import _, N_, get_active_locale, gettext
 from trac.wiki import IWikiSyntaxProvider, WikiParser
 
 
@@ -123,6 +123,22 @@ class ITicketChangeListener(Interface):
         """Called when a ticket is deleted."""
 
 
+class ITicketBatchChangeListener(Interface):
+    """Extension point interface for components that require notification
+    when a batch of tickets is modified at once.
+
+    Components implementing both this interface and `ITicketChangeListener`
+    are notified once per batch instead of once per ticket."""
+
+    def tickets_changed(changes, comment, author):
+        """Called when a batch of tickets has been modified.
+
+        `changes` is a list of `(ticket, old_values)` tuples, where
+        `old_values` is a dictionary containing the previous values of the
+        fields of `ticket` that have changed.
+        """
+
+
 class ITicketManipulator(Interface):
     """Miscellaneous manipulation of ticket workflow features."""
 
@@ -185,12 +201,100 @@ class ITicketFieldProvider(Interface):
         specified as optional.
         """
 
+class TicketField(object):
+    """Read-only description of a ticket field.
+
+    The field behaves like a read-only `dict` with the same keys as the
+    fields returned by `TicketSystem.get_ticket_fields()`. Use `copy()`
+    to get a `dict` that can be modified.
+    """
+
+    __slots__ = ('name', 'type', '_attrs')
+
+    def __init__(self, attrs):
+        self.name = attrs['name']
+        self.type = attrs['type']
+        self._attrs = attrs
+
+    def __getitem__(self, key):
+        return self._attrs[key]
+
+    def __contains__(self, key):
+        return key in self._attrs
+
+    def __iter__(self):
+        return iter(self._attrs)
+
+    def __len__(self):
+        return len(self._attrs)
+
+    def __repr__(self):
+        return '<%s %r>' % (self.__class__.__name__, self.name)
+
+    def get(self, key, default=None):
+        return self._attrs.get(key, default)
+
+    def keys(self):
+        return self._attrs.keys()
+
+    def items(self):
+        return self._attrs.items()
+
+    def iteritems(self):
+        return self._attrs.iteritems()
+
+    def copy(self):
+        """Return the field as a `dict` that can be modified without
+        affecting the shared description."""
+        return dict((key, list(value) if isinstance(value, tuple) else value)
+                    for key, value in self._attrs.iteritems())
+
+
+class TicketFieldList(object):
+    """Read-only list of `TicketField`s, indexed by field name and
+    shared by all the callers of `TicketSystem.get_frozen_ticket_fields()`
+    using the same locale.
+    """
+
+    __slots__ = ('_fields', 'by_name', 'types', 'std_names', 'custom_names',
+                 'time_names')
+
+    def __init__(self, fields):
+        self._fields = tuple(fields)
+        self.by_name = dict((f.name, f) for f in self._fields)
+        self.types = dict((f.name, f.type) for f in self._fields)
+        self.std_names = tuple(f.name for f in self._fields
+                               if not f.get('custom'))
+        self.custom_names = tuple(f.name for f in self._fields
+                                  if f.get('custom'))
+        self.time_names = tuple(f.name for f in self._fields
+                                if f.type == 'time')
+
+    def __getitem__(self, index):
+        return self._fields[index]
+
+    def __iter__(self):
+        return iter(self._fields)
+
+    def __len__(self):
+        return len(self._fields)
+
+    def get(self, name, default=None):
+        """Return the field called `name`."""
+        return self.by_name.get(name, default)
+
+    def copy(self):
+        """Return the fields as a list of `dict`s that can be modified."""
+        return [f.copy() for f in self._fields]
+
+
 class TicketSystem(Component):
     implements(IPermissionRequestor, IWikiSyntaxProvider, IResourceManager,
                ITicketFieldProvider)
 
     ticket_field_providers = ExtensionPoint(ITicketFieldProvider)
     change_listeners = ExtensionPoint(ITicketChangeListener)
+    batch_change_listeners = ExtensionPoint(ITicketBatchChangeListener)
     milestone_change_listeners = ExtensionPoint(IMilestoneChangeListener)
     
     ticket_custom_section = ConfigSection('ticket-custom',
@@ -214,6 +318,14 @@ class TicketSystem(Component):
         e-mail addresses must remain protected.
         (''since 0.9'')""")
 
+    restrict_owner_max_options = IntOption('ticket',
+                                           'restrict_owner_max_options', 0,
+        """Maximum number of users listed in the drop-down menu of the owner
+        field when `restrict_owner` is enabled. When more users can own
+        tickets, the owner field is a text field suggesting the matching
+        users as their name is typed. `0` means no maximum.
+        (''since 0.13'')""")
+
     default_version = Option('ticket', 'default_version', '',
         """Default version for newly created tickets.""")
 
@@ -295,11 +407,38 @@ class TicketSystem(Component):
         It may in addition contain the 'custom' key, the 'optional' and the
         'options' keys. When present 'custom' and 'optional' are always `True`.
         """
-        fields = copy.deepcopy(self.fields)
+        return self.get_frozen_ticket_fields().copy()
+
+    def get_frozen_ticket_fields(self):
+        """Return the fields available for tickets as a read-only
+        `TicketFieldList`, with labels translated to the active locale.
+
+        The list is built once per locale and shared until the fields are
+        reset, so it must not be modified; `get_ticket_fields()` returns
+        a copy that can be.
+        """
+        fields = self.fields
+        locale = get_active_locale()
+        frozen = self._frozen_fields
+        if frozen[0] is not fields:
+            frozen = self._frozen_fields = (fields, {})
+        try:
+            return frozen[1][locale]
+        except KeyError:
+            pass
         label = 'label' # workaround gettext extraction bug
+        field_list = []
         for f in fields:
-            f[label] = gettext(f[label])
-        return fields
+            attrs = dict((key, tuple(value) if isinstance(value, list)
+                                            else value)
+                         for key, value in f.iteritems())
+            if locale is not None:
+                attrs[label] = gettext(attrs[label])
+            field_list.append(TicketField(attrs))
+        field_list = frozen[1][locale] = TicketFieldList(field_list)
+        return field_list
+
+    _frozen_fields = (None, {})
 
     def reset_ticket_fields(self):
         """Invalidate ticket field cache."""
@@ -431,6 +570,9 @@ class TicketSystem(Component):
         the TICKET_MODIFY permission (for the given ticket)
         """
         if self.restrict_owner:
+            if self.use_owner_suggestions():
+                field['suggest'] = True
+                return
             field['type'] = 'select'
             possible_owners = []
             for user in PermissionSystem(self.env) \
@@ -444,6 +586,38 @@ class TicketSystem(Component):
             field['options'] = possible_owners
             field['optional'] = True
 
+    def use_owner_suggestions(self):
+        """Return whether the owner field should suggest the users allowed
+        to own tickets as their name is typed, rather than list all of them
+        in a drop-down menu.
+        """
+        if not self.restrict_owner or self.restrict_owner_max_options <= 0:
+            return False
+        users = PermissionSystem(self.env) \
+                .get_users_with_permission('TICKET_MODIFY')
+        return len(users) > self.restrict_owner_max_options
+
+    def get_owner_suggestions(self, prefix, ticket=None, limit=20):
+        """Return the sorted names of the users having the TICKET_MODIFY
+        permission (for the given ticket) and starting with `prefix`, up to
+        `limit` of them.
+
+        The permission on the ticket is only checked for the matching
+        users.
+        """
+        prefix = prefix.lower()
+        owners = []
+        for user in sorted(PermissionSystem(self.env)
+                           .get_users_with_permission('TICKET_MODIFY')):
+            if user.lower().startswith(prefix) and \
+                    (not ticket or
+                     'TICKET_MODIFY' in PermissionCache(self.env, user,
+                                                        ticket.resource)):
+                owners.append(user)
+                if len(owners) >= limit:
+                    break
+        return owners
+
     # IPermissionRequestor methods
 
     def get_permission_actions(self):
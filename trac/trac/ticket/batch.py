@@ -20,9 +20,11 @@ from datetime import datetime
 
 from genshi.builder import tag
 
+from trac.config import IntOption
 from trac.core import *
 from trac.ticket import TicketSystem, Ticket
 from trac.ticket.notification import BatchTicketNotifyEmail
+from trac.util import hex_entropy
 from trac.util.datefmt import utc
 from trac.util.text import exception_to_unicode, to_unicode
 from trac.util.translation import _, tag_
@@ -45,6 +47,11 @@ class BatchModifyModule(Component):
     list_separator_re =  re.compile(r'[;\s,]+')
     list_connector_string = ', '
 
+    chunk_size = IntOption('batch-modify', 'chunk_size', 100,
+        """Number of tickets saved per transaction by a batch modification.
+        Smaller chunks hold the database write lock for a shorter time.
+        (''since 0.13'')""")
+
     # IRequestHandler methods
 
     def match_request(self, req):
@@ -58,9 +65,10 @@ class BatchModifyModule(Component):
         
         new_values = self._get_new_ticket_values(req) 
         selected_tickets = self._get_selected_tickets(req)
+        token = req.args.get('batchmod_token')
 
         self._save_ticket_changes(req, selected_tickets,
-                                  new_values, comment, action) 
+                                  new_values, comment, action, token)
                 
         #Always redirect back to the query page we came from.
         req.redirect(req.session['query_href'])
@@ -91,6 +99,7 @@ class BatchModifyModule(Component):
     def add_template_data(self, req, data, tickets):
         data['batch_modify'] = True
         data['query_href'] = req.session['query_href'] or req.href.query()
+        data['batchmod_token'] = hex_entropy(16)
         data['action_controls'] = self._get_action_controls(req, tickets)
         batch_list_modes = [
             {'name': _("add"), 'value': "+"},
@@ -106,8 +115,8 @@ class BatchModifyModule(Component):
         action_controls = []
         ts = TicketSystem(self.env)        
         tickets_by_action = {}
-        for t in tickets:
-            ticket = Ticket(self.env, t['id'])
+        for ticket in Ticket.select_many(self.env,
+                                         [t['id'] for t in tickets]):
             actions = ts.get_available_actions(req, ticket)
             for action in actions:
                 tickets_by_action.setdefault(action, []).append(ticket)
@@ -136,33 +145,35 @@ class BatchModifyModule(Component):
             if action in actions:
                 yield controller
 
-    def _save_ticket_changes(self, req, selected_tickets, 
-                             new_values, comment, action):
-        """Save all of the changes to tickets."""
+    def _save_ticket_changes(self, req, selected_tickets,
+                             new_values, comment, action, token=None):
+        """Save all of the changes to tickets.
+
+        The tickets are saved `chunk_size` at a time, each chunk in its
+        own transaction. When a `token` identifies the submitted form, the
+        tickets already saved are remembered in the session, so that
+        submitting the same form again after an interrupted request only
+        saves the remaining tickets.
+        """
         when = datetime.now(utc)
-        with self.env.db_transaction as db:
-            for id in selected_tickets:
-                t = Ticket(self.env, int(id))
-                _values = new_values.copy()
-                for field in self.fields_as_list:
-                    if field in new_values:
-                        old = t.values[field] if field in t.values else ''
-                        new = new_values[field]
-                        mode = req.args.get('batchmod_value_' + field +
-                                            '_mode')
-                        new2 = req.args.get('batchmod_value_' + field +
-                                            '_secondary', '')
-                        _values[field] = self._change_list(old, new, new2,
-                                                           mode)
-                controllers = list(self._get_action_controllers(req, t,
-                                                                action))
-                for controller in controllers:
-                    _values.update(controller.get_ticket_changes(req, t, 
-                                                                 action))
-                t.populate(_values)
-                t.save_changes(req.authname, comment, when=when)
-                for controller in controllers:
-                    controller.apply_action_side_effects(req, t, action)
+        saved = self._get_saved_tickets(req, token)
+        pending = [t for t in selected_tickets if str(t) not in saved]
+        if len(pending) < len(selected_tickets):
+            self.log.info("Resuming batch modification of %d tickets, %d "
+                          "already saved", len(selected_tickets),
+                          len(selected_tickets) - len(pending))
+        chunk_size = max(1, self.chunk_size)
+        for start in xrange(0, len(pending), chunk_size):
+            chunk = pending[start:start + chunk_size]
+            with self.env.db_transaction:
+                self._save_chunk(req, chunk, new_values, comment, action,
+                                 when)
+            saved.update(str(t) for t in chunk)
+            self._set_saved_tickets(req, token, saved)
+            self.log.info("Batch modification: %d of %d tickets saved",
+                          len(saved & set(str(t) for t in selected_tickets)),
+                          len(selected_tickets))
+        self._set_saved_tickets(req, token, None)
         try:
             tn = BatchTicketNotifyEmail(self.env)
             tn.notify(selected_tickets, new_values, comment, action,
@@ -174,7 +185,54 @@ class BatchModifyModule(Component):
                                   "error occurred while sending "
                                   "notifications: %(message)s",
                                   message=to_unicode(e)))
-    
+
+    def _save_chunk(self, req, selected_tickets, new_values, comment, action,
+                    when):
+        """Compute the changes of a chunk of tickets and save them in
+        batch."""
+        tickets = []
+        for t in Ticket.select_many(self.env, selected_tickets):
+            _values = new_values.copy()
+            for field in self.fields_as_list:
+                if field in new_values:
+                    old = t.values[field] if field in t.values else ''
+                    new = new_values[field]
+                    mode = req.args.get('batchmod_value_' + field + '_mode')
+                    new2 = req.args.get('batchmod_value_' + field +
+                                        '_secondary', '')
+                    _values[field] = self._change_list(old, new, new2, mode)
+            controllers = list(self._get_action_controllers(req, t, action))
+            for controller in controllers:
+                _values.update(controller.get_ticket_changes(req, t, action))
+            t.populate(_values)
+            tickets.append((t, controllers))
+        Ticket.save_many(self.env, [t for t, controllers in tickets],
+                         req.authname, comment, when)
+        for t, controllers in tickets:
+            for controller in controllers:
+                controller.apply_action_side_effects(req, t, action)
+
+    def _get_saved_tickets(self, req, token):
+        """Return the set of tickets already saved for the form submission
+        identified by `token`."""
+        if token and req.session.get('batchmod_token') == token:
+            return set(t for t in
+                       req.session.get('batchmod_saved', '').split(',') if t)
+        return set()
+
+    def _set_saved_tickets(self, req, token, saved):
+        """Remember the tickets saved for the form submission identified by
+        `token`, or forget them if `saved` is `None`."""
+        if not token:
+            return
+        if saved is None:
+            req.session.pop('batchmod_token', None)
+            req.session.pop('batchmod_saved', None)
+        else:
+            req.session['batchmod_token'] = token
+            req.session['batchmod_saved'] = ','.join(sorted(saved, key=int))
+        req.session.save()
+
     def _change_list(self, old_list, new_list, new_list2, mode):
         changed_list = [k.strip()
                         for k in self.list_separator_re.split(old_list)
@@ -248,6 +248,10 @@ Read TracWorkflow for more information (don't forget to 'wiki upgrade' as well)
             if this_action.has_key('set_owner'):
                 owners = [x.strip() for x in
                           this_action['set_owner'].split(',')]
+            elif TicketSystem(self.env).use_owner_suggestions():
+                from trac.ticket.web_ui import add_owner_suggestions
+                add_owner_suggestions(req, ticket)
+                owners = None
             elif self.config.getbool('ticket', 'restrict_owner'):
                 perm = PermissionSystem(self.env)
                 owners = perm.get_users_with_permission('TICKET_MODIFY')
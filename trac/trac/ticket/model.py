@@ -44,6 +44,20 @@ def _fixup_cc_list(cc_value):
     return ', '.join(cclist)
 
 
+def _next_cnum(oldvalues):
+    """Return the number of the next comment of a ticket, given the
+    `oldvalue` of its changes from the most recent to the oldest."""
+    num = 0
+    for old in oldvalues:
+        # Use oldvalue if available, else count edits
+        try:
+            num += int(old.rsplit('.', 1)[-1])
+            break
+        except ValueError:
+            num += 1
+    return str(num + 1)
+
+
 class Ticket(object):
 
     # Fields that must not be modified directly by the user
@@ -62,31 +76,88 @@ class Ticket(object):
         :since 0.13: the `db` parameter is no longer needed and will be removed
         in version 0.14
         """
-        self.env = env
         if tkt_id is not None:
             tkt_id = int(tkt_id)
-        self.resource = Resource('ticket', tkt_id, version)
-        self.fields = TicketSystem(self.env).get_ticket_fields()
-        self.std_fields, self.custom_fields, self.time_fields = [], [], []
-        for f in self.fields: 
-            if f.get('custom'): 
-                self.custom_fields.append(f['name']) 
-            else: 
-                self.std_fields.append(f['name']) 
-            if f['type'] == 'time': 
-                self.time_fields.append(f['name'])
-        self.values = {}
+        self._init(env, tkt_id, version)
         if tkt_id is not None:
             self._fetch_ticket(tkt_id)
         else:
             self._init_defaults()
             self.id = None
+
+    def _init(self, env, tkt_id=None, version=None):
+        self.env = env
+        self.resource = Resource('ticket', tkt_id, version)
+        self._fields = TicketSystem(self.env).get_frozen_ticket_fields()
+        self.std_fields = self._fields.std_names
+        self.custom_fields = self._fields.custom_names
+        self.time_fields = self._fields.time_names
+        self.values = {}
         self._old = {}
 
     exists = property(lambda self: self.id is not None)
 
+    @classmethod
+    def select_many(cls, env, ids, chunk_size=500):
+        """Return an iterator over the existing tickets of `ids`.
+
+        The tickets are retrieved `chunk_size` at a time, with one query
+        on the `ticket` table and one on the `ticket_custom` table per
+        chunk, and yielded in the order of `ids`.
+        """
+        ids = [int(id) for id in ids if cls.id_is_valid(id)]
+        fields = TicketSystem(env).get_frozen_ticket_fields()
+        columns = ','.join(fields.std_names)
+        for start in xrange(0, len(ids), chunk_size):
+            chunk = ids[start:start + chunk_size]
+            holders = ','.join(['%s'] * len(chunk))
+            tickets = {}
+            with env.db_query as db:
+                for row in db("SELECT id,%s FROM ticket WHERE id IN (%s)"
+                              % (columns, holders), chunk):
+                    ticket = cls.__new__(cls)
+                    ticket._init(env, row[0])
+                    ticket._set_std_values(row[0], row[1:])
+                    tickets[ticket.id] = ticket
+                for tkt_id, name, value in db("""
+                        SELECT ticket,name,value FROM ticket_custom
+                        WHERE ticket IN (%s)
+                        """ % holders, chunk):
+                    ticket = tickets.get(tkt_id)
+                    if ticket is not None:
+                        ticket._set_custom_value(name, value)
+            for id in chunk:
+                if id in tickets:
+                    yield tickets[id]
+
+    def _get_fields(self):
+        # The shared fields are only copied when they are accessed, as
+        # callers are allowed to modify them
+        fields = self.__dict__.get('fields')
+        if fields is None:
+            fields = self.__dict__['fields'] = self._fields.copy()
+        return fields
+
+    def _set_fields(self, fields):
+        self.__dict__['fields'] = fields
+
+    fields = property(_get_fields, _set_fields,
+                      doc="List of the ticket fields, as `dict`s")
+
+    def _current_fields(self):
+        # The fields of this ticket if they were accessed, and possibly
+        # customized, the shared ones otherwise
+        fields = self.__dict__.get('fields')
+        return self._fields if fields is None else fields
+
+    def _current_custom_fields(self):
+        fields = self.__dict__.get('fields')
+        if fields is None:
+            return self.custom_fields
+        return [f['name'] for f in fields if f.get('custom')]
+
     def _init_defaults(self):
-        for field in self.fields:
+        for field in self._fields:
             default = None
             if field['name'] in self.protected_fields:
                 # Ignore for new - only change through workflow
@@ -118,6 +189,15 @@ class Ticket(object):
             raise ResourceNotFound(_("Ticket %(id)s does not exist.", 
                                      id=tkt_id), _("Invalid ticket number"))
 
+        self._set_std_values(tkt_id, row)
+
+        # Fetch custom fields if available
+        for name, value in self.env.db_query("""
+                SELECT name, value FROM ticket_custom WHERE ticket=%s
+                """, (tkt_id,)):
+            self._set_custom_value(name, value)
+
+    def _set_std_values(self, tkt_id, row):
         self.id = tkt_id
         for i, field in enumerate(self.std_fields):
             value = row[i]
@@ -128,15 +208,12 @@ class Ticket(object):
             else:
                 self.values[field] = value
 
-        # Fetch custom fields if available
-        for name, value in self.env.db_query("""
-                SELECT name, value FROM ticket_custom WHERE ticket=%s
-                """, (tkt_id,)):
-            if name in self.custom_fields:
-                if value is None:
-                    self.values[name] = empty
-                else:
-                    self.values[name] = value
+    def _set_custom_value(self, name, value):
+        if name in self.custom_fields:
+            if value is None:
+                self.values[name] = empty
+            else:
+                self.values[name] = value
 
     def __getitem__(self, name):
         return self.values.get(name)
@@ -153,8 +230,8 @@ class Ticket(object):
         if value:
             if isinstance(value, list):
                 raise TracError(_("Multi-values fields not supported yet"))
-            field = [field for field in self.fields if field['name'] == name]
-            if field and field[0].get('type') != 'textarea':
+            field = self._fields.get(name)
+            if field and field.type != 'textarea':
                 value = value.strip()
         self.values[name] = value
 
@@ -165,15 +242,15 @@ class Ticket(object):
             value = self.values[name]
             if value is not empty:
                 return value
-            field = [field for field in self.fields if field['name'] == name]
+            field = self._fields.get(name)
             if field:
-                return field[0].get('value', '')
+                return field.get('value', '')
         except KeyError:
             pass
 
     def populate(self, values):
         """Populate the ticket with 'suitable' values from a dictionary"""
-        field_names = [f['name'] for f in self.fields]
+        field_names = self._fields.by_name
         for name in [name for name in values.keys() if name in field_names]:
             self[name] = values.get(name, '')
 
@@ -222,7 +299,7 @@ class Ticket(object):
         # Insert ticket record
         std_fields = []
         custom_fields = []
-        for f in self.fields:
+        for f in self._current_fields():
             fname = f['name']
             if fname in self.values:
                 if f.get('custom'):
@@ -278,24 +355,7 @@ class Ticket(object):
             when = datetime.now(utc)
         when_ts = to_utimestamp(when)
 
-        if 'component' in self.values:
-            # If the component is changed on a 'new' ticket
-            # then owner field is updated accordingly. (#623).
-            if self.values.get('status') == 'new' \
-                    and 'component' in self._old \
-                    and 'owner' not in self._old:
-                try:
-                    old_comp = Component(self.env, self._old['component'])
-                    old_owner = old_comp.owner or ''
-                    current_owner = self.values.get('owner') or ''
-                    if old_owner == current_owner:
-                        new_comp = Component(self.env, self['component'])
-                        if new_comp.owner:
-                            self['owner'] = new_comp.owner
-                except TracError:
-                    # If the old component has been removed from the database
-                    # we just leave the owner as is.
-                    pass
+        self._update_component_owner()
 
         with self.env.db_transaction as db:
             db("UPDATE ticket SET changetime=%s WHERE id=%s",
@@ -303,28 +363,21 @@ class Ticket(object):
             
             # find cnum if it isn't provided
             if not cnum:
-                num = 0
-                for ts, old in db("""
+                cnum = _next_cnum(old for ts, old in db("""
                         SELECT DISTINCT tc1.time, COALESCE(tc2.oldvalue,'')
                         FROM ticket_change AS tc1
                         LEFT OUTER JOIN ticket_change AS tc2
                         ON tc2.ticket=%s AND tc2.time=tc1.time
                            AND tc2.field='comment'
                         WHERE tc1.ticket=%s ORDER BY tc1.time DESC
-                        """, (self.id, self.id)):
-                    # Use oldvalue if available, else count edits
-                    try:
-                        num += int(old.rsplit('.', 1)[-1])
-                        break
-                    except ValueError:
-                        num += 1
-                cnum = str(num + 1)
+                        """, (self.id, self.id)))
                 if replyto:
                     cnum = '%s.%s' % (replyto, cnum)
 
             # store fields
+            custom_fields = self._current_custom_fields()
             for name in self._old.keys():
-                if name in self.custom_fields:
+                if name in custom_fields:
                     for row in db("""SELECT * FROM ticket_custom 
                                      WHERE ticket=%s and name=%s
                                      """, (self.id, name)):
@@ -360,6 +413,136 @@ class Ticket(object):
             listener.ticket_changed(self, comment, author, old_values)
         return int(cnum.rsplit('.', 1)[-1])
 
+    @classmethod
+    def save_many(cls, env, tickets, author=None, comment=None, when=None,
+                  chunk_size=500):
+        """Store the changes of many existing tickets made by `author` at
+        the same time, with the same `comment`.
+
+        The changes of `chunk_size` tickets at a time are computed in
+        memory and written with a few `executemany()` statements, all
+        within a single transaction. The `ITicketBatchChangeListener`s are
+        notified once for the whole batch, the other
+        `ITicketChangeListener`s once per modified ticket.
+
+        Return the list of the modified tickets, as `(ticket, old_values)`
+        tuples.
+        """
+        if when is None:
+            when = datetime.now(utc)
+        when_ts = to_utimestamp(when)
+        tickets = list(tickets)
+        changes = []
+        with env.db_transaction as db:
+            for start in xrange(0, len(tickets), chunk_size):
+                modified = []
+                for ticket in tickets[start:start + chunk_size]:
+                    assert ticket.exists, "Cannot update a new ticket"
+                    if 'cc' in ticket.values:
+                        ticket['cc'] = _fixup_cc_list(ticket.values['cc'])
+                    if ticket._old or comment:
+                        ticket._update_component_owner()
+                        modified.append(ticket)
+                if modified:
+                    cls._write_changes(db, modified, author, comment,
+                                       when_ts)
+                for ticket in modified:
+                    changes.append((ticket, ticket._old))
+                    ticket._old = {}
+                    ticket.values['changetime'] = when
+
+        ts = TicketSystem(env)
+        batch_listeners = ts.batch_change_listeners
+        if changes:
+            for listener in batch_listeners:
+                listener.tickets_changed(changes, comment, author)
+            for listener in ts.change_listeners:
+                if listener not in batch_listeners:
+                    for ticket, old_values in changes:
+                        listener.ticket_changed(ticket, comment, author,
+                                                old_values)
+        return changes
+
+    @staticmethod
+    def _write_changes(db, tickets, author, comment, when_ts):
+        ids = [ticket.id for ticket in tickets]
+        holders = ','.join(['%s'] * len(ids))
+        comments = {}
+        for tkt_id, ts, old in db("""
+                SELECT DISTINCT tc1.ticket, tc1.time,
+                                COALESCE(tc2.oldvalue,'')
+                FROM ticket_change AS tc1
+                LEFT OUTER JOIN ticket_change AS tc2
+                ON tc2.ticket=tc1.ticket AND tc2.time=tc1.time
+                   AND tc2.field='comment'
+                WHERE tc1.ticket IN (%s) ORDER BY tc1.ticket, tc1.time DESC
+                """ % holders, ids):
+            comments.setdefault(tkt_id, []).append(old)
+        existing = set(db("""
+            SELECT ticket,name FROM ticket_custom WHERE ticket IN (%s)
+            """ % holders, ids))
+
+        std_values = {}
+        custom_updates = []
+        custom_inserts = []
+        ticket_changes = []
+        for ticket in tickets:
+            custom_fields = ticket._current_custom_fields()
+            for name in ticket._old:
+                if name in custom_fields:
+                    if (ticket.id, name) in existing:
+                        custom_updates.append((ticket[name], ticket.id, name))
+                    else:
+                        custom_inserts.append((ticket.id, name, ticket[name]))
+                else:
+                    std_values.setdefault(name, []).append((ticket[name],
+                                                            ticket.id))
+                ticket_changes.append((ticket.id, when_ts, author, name,
+                                       ticket._old[name], ticket[name]))
+            # always save comment, even if empty
+            # (numbering support for timeline)
+            ticket_changes.append((ticket.id, when_ts, author, 'comment',
+                                   _next_cnum(comments.get(ticket.id, ())),
+                                   comment))
+
+        db("UPDATE ticket SET changetime=%%s WHERE id IN (%s)" % holders,
+           [when_ts] + ids)
+        for name, args in std_values.iteritems():
+            db.executemany("UPDATE ticket SET %s=%%s WHERE id=%%s" % name,
+                           args)
+        if custom_updates:
+            db.executemany("""UPDATE ticket_custom SET value=%s
+                              WHERE ticket=%s AND name=%s
+                              """, custom_updates)
+        if custom_inserts:
+            db.executemany("""INSERT INTO ticket_custom (ticket,name,value)
+                              VALUES(%s,%s,%s)
+                              """, custom_inserts)
+        db.executemany("""INSERT INTO ticket_change
+                            (ticket,time,author,field,oldvalue,newvalue)
+                          VALUES (%s,%s,%s,%s,%s,%s)
+                          """, ticket_changes)
+
+    def _update_component_owner(self):
+        if 'component' in self.values:
+            # If the component is changed on a 'new' ticket
+            # then owner field is updated accordingly. (#623).
+            if self.values.get('status') == 'new' \
+                    and 'component' in self._old \
+                    and 'owner' not in self._old:
+                try:
+                    old_comp = Component(self.env, self._old['component'])
+                    old_owner = old_comp.owner or ''
+                    current_owner = self.values.get('owner') or ''
+                    if old_owner == current_owner:
+                        new_comp = Component(self.env, self['component'])
+                        if new_comp.owner:
+                            self['owner'] = new_comp.owner
+                except TracError:
+                    # If the old component has been removed from the database
+                    # we just leave the owner as is.
+                    pass
+
     def get_changelog(self, when=None, db=None):
         """Return the changelog as a list of tuples of the form
         (time, author, field, oldvalue, newvalue, permanent).
@@ -664,6 +847,13 @@ def simplify_whitespace(name):
     return name
         
 
+def _invalidate_query_counts(env):
+    """Forget the cached counts of ticket queries after renaming a value
+    of a ticket field."""
+    from trac.ticket.query import QueryModule
+    QueryModule(env).invalidate_counts()
+
+
 class AbstractEnum(object):
     type = None
     ticket_col = None
@@ -758,6 +948,7 @@ class AbstractEnum(object):
                 db("UPDATE ticket SET %s=%%s WHERE %s=%%s" 
                    % (self.ticket_col, self.ticket_col),
                    (self.name, self._old_name))
+                _invalidate_query_counts(self.env)
             TicketSystem(self.env).reset_ticket_fields()
 
         self._old_name = self.name
@@ -885,6 +1076,7 @@ class Component(object):
                 # Update tickets
                 db("UPDATE ticket SET component=%s WHERE component=%s",
                    (self.name, self._old_name))
+                _invalidate_query_counts(self.env)
                 self._old_name = self.name
             TicketSystem(self.env).reset_ticket_fields()
 
@@ -962,8 +1154,7 @@ class Milestone(object):
             tkt_ids = [int(row[0]) for row in 
                        db("SELECT id FROM ticket WHERE milestone=%s",
                           (self.name,))]
-            for tkt_id in tkt_ids:
-                ticket = Ticket(self.env, tkt_id, db)
+            for ticket in Ticket.select_many(self.env, tkt_ids):
                 ticket['milestone'] = retarget_to
                 comment = "Milestone %s deleted" % self.name # don't translate
                 ticket.save_changes(author, comment, now)
@@ -1142,6 +1333,7 @@ class Version(object):
                 # Update tickets
                 db("UPDATE ticket SET version=%s WHERE version=%s",
                    (self.name, self._old_name))
+                _invalidate_query_counts(self.env)
                 self._old_name = self.name
             TicketSystem(self.env).reset_ticket_fields()
 
@@ -25,13 +25,17 @@ from genshi.template.text import NewTextTemplate
 from trac.core import *
 from trac.config import *
 from trac.notification import NotifyEmail
-from trac.ticket.api import TicketSystem
+from trac.ticket.api import ITicketChangeListener, TicketSystem
+from trac.util.concurrency import threading
 from trac.util.datefmt import to_utimestamp
 from trac.util.text import obfuscate_email_address, text_width, wrap
 from trac.util.translation import deactivate, reactivate
 
 
 class TicketNotificationSystem(Component):
+    """Resolve the recipients of the ticket notifications."""
+
+    implements(ITicketChangeListener)
 
     always_notify_owner = BoolOption('notification', 'always_notify_owner',
                                      'false',
@@ -73,47 +77,114 @@ class TicketNotificationSystem(Component):
         US-ASCII characters.  This is expected by CJK users. ''(since
         0.12.2)''""")
 
-def get_ticket_notification_recipients(env, config, tktid, prev_cc):
-    notify_reporter = config.getbool('notification', 'always_notify_reporter')
-    notify_owner = config.getbool('notification', 'always_notify_owner')
-    notify_updater = config.getbool('notification', 'always_notify_updater')
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._updaters = {}
+
+    # ITicketChangeListener methods
+
+    def ticket_created(self, ticket):
+        with self._lock:
+            self._updaters[ticket.id] = (to_utimestamp(ticket['changetime']),
+                                         frozenset(), None)
+
+    def ticket_changed(self, ticket, comment, author, old_values):
+        with self._lock:
+            entry = self._updaters.get(ticket.id)
+            if entry is not None:
+                changetime, authors, updater = entry
+                self._updaters[ticket.id] = \
+                    (to_utimestamp(ticket['changetime']),
+                     authors | frozenset([author]), author)
+
+    def ticket_deleted(self, ticket):
+        with self._lock:
+            self._updaters.pop(ticket.id, None)
+
+    # Public methods
+
+    def get_recipients(self, tktids, prev_cc=None, chunk_size=500):
+        """Return the recipients of the notifications about the tickets
+        `tktids`, as a dictionary mapping the id of each existing ticket to
+        a `(torecipients, ccrecipients, reporter, owner)` tuple.
+
+        The tickets are read `chunk_size` at a time. The authors of the
+        changes of each ticket are remembered along with its `changetime`,
+        and are only read again from the `ticket_change` table once the
+        ticket has been changed by another process.
+        """
+        recipients = {}
+        tktids = [int(id) for id in tktids]
+        for start in xrange(0, len(tktids), chunk_size):
+            chunk = tktids[start:start + chunk_size]
+            for id, (cc, reporter, owner, authors, updater) in \
+                    self._get_subscribers(chunk).iteritems():
+                recipients[id] = self._resolve(cc, reporter, owner, authors,
+                                               updater, prev_cc or [])
+        return recipients
+
+    # Internal methods
+
+    def _get_subscribers(self, tktids):
+        holders = ','.join(['%s'] * len(tktids))
+        subscribers = {}
+        with self.env.db_query as db:
+            tickets = db("""
+                SELECT id,cc,reporter,owner,changetime FROM ticket
+                WHERE id IN (%s)
+                """ % holders, tktids)
+            with self._lock:
+                updaters = dict((id, self._updaters.get(id))
+                                for id, cc, reporter, owner, changetime
+                                in tickets)
+            stale = set(id for id, cc, reporter, owner, changetime in tickets
+                        if updaters[id] is None or
+                           updaters[id][0] != changetime)
+            if stale:
+                changes = {}
+                for id, author, time in db("""
+                        SELECT ticket,author,MAX(time) FROM ticket_change
+                        WHERE ticket IN (%s) GROUP BY ticket,author
+                        """ % ','.join(['%s'] * len(stale)), list(stale)):
+                    changes.setdefault(id, []).append((time, author))
+                for id, cc, reporter, owner, changetime in tickets:
+                    if id in stale:
+                        authors = changes.get(id, [])
+                        updaters[id] = (changetime,
+                                        frozenset(a for t, a in authors),
+                                        max(authors)[1] if authors else None)
+                with self._lock:
+                    if len(self._updaters) + len(stale) > 10000:
+                        self._updaters.clear()
+                    for id in stale:
+                        self._updaters[id] = updaters[id]
+        for id, cc, reporter, owner, changetime in tickets:
+            changetime, authors, updater = updaters[id]
+            subscribers[id] = (cc, reporter, owner, authors, updater)
+        return subscribers
+
+    def _resolve(self, cc, reporter, owner, authors, updater, prev_cc):
+        notify_reporter = self.always_notify_reporter
+        notify_owner = self.always_notify_owner
+        notify_updater = self.always_notify_updater
 
-    ccrecipients = prev_cc
-    torecipients = []
-    with env.db_query as db:
         # Harvest email addresses from the cc, reporter, and owner fields
-        for row in db("SELECT cc, reporter, owner FROM ticket WHERE id=%s",
-                      (tktid,)):
-            if row[0]:
-                ccrecipients += row[0].replace(',', ' ').split() 
-            reporter = row[1]
-            owner = row[2]
-            if notify_reporter:
-                torecipients.append(row[1])
-            if notify_owner:
-                torecipients.append(row[2])
-            break
+        ccrecipients = list(prev_cc)
+        if cc:
+            ccrecipients += cc.replace(',', ' ').split()
+        torecipients = []
+        if notify_reporter:
+            torecipients.append(reporter)
+        if notify_owner:
+            torecipients.append(owner)
 
         # Harvest email addresses from the author field of ticket_change(s)
         if notify_updater:
-            for author, ticket in db("""
-                    SELECT DISTINCT author, ticket FROM ticket_change
-                    WHERE ticket=%s
-                    """, (tktid,)):
-                torecipients.append(author)
+            torecipients.extend(sorted(authors))
 
         # Suppress the updater from the recipients
-        updater = None
-        for updater, in db("""
-                SELECT author FROM ticket_change WHERE ticket=%s
-                ORDER BY time DESC LIMIT 1
-                """, (tktid,)):
-            break
-        else:
-            for updater, in db("SELECT reporter FROM ticket WHERE id=%s",
-                               (tktid,)):
-                break
-
+        if updater is None:
+            updater = reporter
         if not notify_updater:
             filter_out = True
             if notify_reporter and (updater == reporter):
@@ -121,12 +192,23 @@ def get_ticket_notification_recipients(env, config, tktid, prev_cc):
             if notify_owner and (updater == owner):
                 filter_out = False
             if filter_out:
-                torecipients = [r for r in torecipients 
+                torecipients = [r for r in torecipients
                                 if r and r != updater]
         elif updater:
             torecipients.append(updater)
 
-    return (torecipients, ccrecipients, reporter, owner)
+        return (torecipients, ccrecipients, reporter, owner)
+
+
+def get_ticket_notification_recipients(env, config, tktid, prev_cc):
+    """Return the `(torecipients, ccrecipients, reporter, owner)` recipients
+    of the notifications about the ticket `tktid`.
+
+    The `prev_cc` recipients are added to the Cc: recipients.
+    """
+    tktid = int(tktid)
+    return TicketNotificationSystem(env).get_recipients([tktid],
+                                                        prev_cc)[tktid]
         
 
 class TicketNotifyEmail(NotifyEmail):
@@ -481,10 +563,9 @@ class BatchTicketNotifyEmail(NotifyEmail):
     def get_recipients(self, tktids):
         alltorecipients = []
         allccrecipients = []
-        for t in tktids:
-            (torecipients, ccrecipients, reporter, owner) = \
-                get_ticket_notification_recipients(self.env, self.config, 
-                    t, [])
+        recipients = TicketNotificationSystem(self.env).get_recipients(tktids)
+        for torecipients, ccrecipients, reporter, owner in \
+                recipients.itervalues():
             alltorecipients.extend(torecipients)
             allccrecipients.extend(ccrecipients)
         return (list(set(alltorecipients)), list(set(allccrecipients)))
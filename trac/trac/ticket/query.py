@@ -18,7 +18,7 @@
 from __future__ import with_statement
 
 import csv
-from itertools import groupby
+from itertools import groupby, izip
 from math import ceil
 from datetime import datetime, timedelta
 import re
@@ -26,12 +26,15 @@ from StringIO import StringIO
 
 from genshi.builder import tag
 
-from trac.config import Option, IntOption 
+from trac.cache import cached
+from trac.config import ChoiceOption, Option, IntOption
 from trac.core import *
 from trac.db import get_column_names
 from trac.mimeview.api import IContentConverter, Mimeview
 from trac.resource import Resource
-from trac.ticket.api import TicketSystem
+from trac.ticket.api import IMilestoneChangeListener, \
+                           ITicketBatchChangeListener, \
+                           ITicketChangeListener, TicketSystem
 from trac.ticket.model import Milestone, group_milestones, Ticket
 from trac.util import Ranges, as_bool
 from trac.util.datefmt import format_date, format_datetime, from_utimestamp, \
@@ -286,68 +289,126 @@ class Query(object):
         self.env.log.debug("Count results in Query: %d", cnt)
         return cnt
 
+    def _get_row_converter(self, columns, href=None):
+        """Return a function converting a result row of the query to a
+        ticket `dict`.
+
+        The conversion of each column is chosen once for all the rows.
+        """
+        fields = dict((f['name'], f) for f in self.fields)
+        def reporter(val):
+            return val or 'anonymous'
+        def checkbox(val):
+            try:
+                return bool(int(val))
+            except (TypeError, ValueError):
+                return False
+        def default(val):
+            return '' if val is None else val
+        converters = []
+        for name in columns:
+            field = fields.get(name)
+            if name == 'reporter':
+                converters.append(reporter)
+            elif name == 'id':
+                converters.append(int)
+            elif name in self.time_fields:
+                converters.append(from_utimestamp)
+            elif field and field['type'] == 'checkbox':
+                converters.append(checkbox)
+            else:
+                converters.append(default)
+        converters = zip(columns, converters)
+        with_href = href is not None and 'id' in columns
+
+        def convert(row):
+            result = dict((name, conv(val))
+                          for (name, conv), val in izip(converters, row))
+            if with_href:
+                result['href'] = href.ticket(result['id'])
+            return result
+        return convert
+
     def execute(self, req=None, db=None, cached_ids=None, authname=None,
                 tzinfo=None, href=None, locale=None):
         """Retrieve the list of matching tickets.
 
+        The total number of matching tickets is stored in `num_items`.
+        Depending on the `[query] count_strategy` option, it is computed
+        by a separate `COUNT(*)` query, by a window function or taken
+        from a cache of counts that is invalidated whenever a ticket
+        changes. The separate query is skipped when the current page
+        isn't full.
+
         :since 0.13: the `db` parameter is no longer needed and will be removed
         in version 0.14
         """
         if req is not None:
             href = req.href
-        with self.env.db_query as db:
-            cursor = db.cursor()
-
-            self.num_items = 0
-            sql, args = self.get_sql(req, cached_ids, authname, tzinfo, locale)
-            self.num_items = self._count(sql, args)
-
+        strategy = QueryModule(self.env).count_strategy
+        sql, args = self.get_sql(req, cached_ids, authname, tzinfo, locale)
+        self.num_items = None
+        if strategy == 'cached' and self.has_more_pages:
+            self.num_items = self._get_cached_count(sql, args)
             if self.num_items <= self.max:
                 self.has_more_pages = False
+            self._check_page()
 
+        with self.env.db_query as db:
+            cursor = db.cursor()
+            window = strategy == 'window' and self.has_more_pages
+            query_sql = sql
+            if window:
+                query_sql = "SELECT COUNT(*) OVER () AS query_total," + \
+                            sql[len("SELECT "):]
+            limit = 0
             if self.has_more_pages:
-                max = self.max
+                limit = self.max
                 if self.group:
-                    max += 1
-                sql = sql + " LIMIT %d OFFSET %d" % (max, self.offset)
-                if (self.page > int(ceil(float(self.num_items) / self.max)) and
-                    self.num_items != 0):
-                    raise TracError(_("Page %(page)s is beyond the number of "
-                                      "pages in the query", page=self.page))
+                    limit += 1
+                query_sql += " LIMIT %d OFFSET %d" % (limit, self.offset)
 
             # self.env.log.debug("SQL: " + sql % tuple([repr(a) for a in args]))
-            cursor.execute(sql, args)
+            cursor.execute(query_sql, args)
             columns = get_column_names(cursor)
-            fields = []
-            for column in columns:
-                fields += [f for f in self.fields if f['name'] == column] or \
-                          [None]
-            results = []
-
-            column_indices = range(len(columns))
-            for row in cursor:
-                result = {}
-                for i in column_indices:
-                    name, field, val = columns[i], fields[i], row[i]
-                    if name == 'reporter':
-                        val = val or 'anonymous'
-                    elif name == 'id':
-                        val = int(val)
-                        if href is not None:
-                            result['href'] = href.ticket(val)
-                    elif name in self.time_fields:
-                        val = from_utimestamp(val)
-                    elif field and field['type'] == 'checkbox':
-                        try:
-                            val = bool(int(val))
-                        except (TypeError, ValueError):
-                            val = False
-                    elif val is None:
-                        val = ''
-                    result[name] = val
-                results.append(result)
+            rows = cursor.fetchall()
             cursor.close()
-            return results
+        if window:
+            columns = columns[1:]
+            if rows:
+                self.num_items = rows[0][0]
+            rows = [row[1:] for row in rows]
+
+        if self.num_items is None:
+            if not limit or rows and len(rows) < limit or \
+                    not rows and not self.offset:
+                # All the remaining tickets have been retrieved
+                self.num_items = self.offset + len(rows)
+            else:
+                self.num_items = self._count(sql, args)
+            if self.num_items <= self.max:
+                self.has_more_pages = False
+            self._check_page()
+
+        convert = self._get_row_converter(columns, href)
+        return [convert(row) for row in rows]
+
+    def _check_page(self):
+        if self.has_more_pages and self.num_items != 0 and \
+                self.page > int(ceil(float(self.num_items) / self.max)):
+            raise TracError(_("Page %(page)s is beyond the number of "
+                              "pages in the query", page=self.page))
+
+    def _get_cached_count(self, sql, args):
+        counts = QueryModule(self.env).ticket_counts
+        key = (sql, tuple(args))
+        try:
+            return counts[key]
+        except KeyError:
+            if len(counts) >= QueryModule.max_cached_counts:
+                counts.clear()
+            cnt = counts[key] = self._count(sql, args)
+            return cnt
 
     def get_href(self, href, id=None, order=None, desc=None, format=None,
                  max=None, page=None):
@@ -448,20 +509,39 @@ class Query(object):
         cols.extend([c for c in self.constraint_cols if not c in cols])
 
         custom_fields = [f['name'] for f in self.fields if f.get('custom')]
+        custom_cols = [k for k in cols if k in custom_fields]
+        pivot = len(custom_cols) > 1 and \
+                QueryModule(self.env).custom_field_strategy == 'pivot'
+
+        def custom_col(k):
+            if pivot:
+                return 'tc.%s' % db.quote(k)
+            return '%s.value' % db.quote(k)
 
         sql = []
         sql.append("SELECT " + ",".join(['t.%s AS %s' % (c, c) for c in cols
                                          if c not in custom_fields]))
         sql.append(",priority.value AS priority_value")
-        for k in [db.quote(k) for k in cols if k in custom_fields]:
-            sql.append(",%s.value AS %s" % (k, k))
+        for k in custom_cols:
+            sql.append(",%s AS %s" % (custom_col(k), db.quote(k)))
         sql.append("\nFROM ticket AS t")
 
         # Join with ticket_custom table as necessary
-        for k in [k for k in cols if k in custom_fields]:
-            qk = db.quote(k)
-            sql.append("\n  LEFT OUTER JOIN ticket_custom AS %s ON " \
-                       "(id=%s.ticket AND %s.name='%s')" % (qk, qk, qk, k))
+        if pivot:
+            # A single join with the custom fields pivoted to columns
+            sql.append("\n  LEFT OUTER JOIN (SELECT ticket,")
+            sql.append(",".join("MAX(CASE WHEN name='%s' THEN value END) "
+                                "AS %s" % (k, db.quote(k))
+                                for k in custom_cols))
+            sql.append(" FROM ticket_custom WHERE name IN (%s) "
+                       "GROUP BY ticket) AS tc ON (tc.ticket=id)"
+                       % ",".join("'%s'" % k for k in custom_cols))
+        else:
+            for k in custom_cols:
+                qk = db.quote(k)
+                sql.append("\n  LEFT OUTER JOIN ticket_custom AS %s ON "
+                           "(id=%s.ticket AND %s.name='%s')"
+                           % (qk, qk, qk, k))
 
         # Join with the enum table for proper sorting
         for col in [c for c in enum_columns
@@ -488,7 +568,7 @@ class Query(object):
             if name not in custom_fields:
                 col = 't.' + name
             else:
-                col = '%s.value' % db.quote(name)
+                col = custom_col(name)
             value = value[len(mode) + neg:]
 
             if name in self.time_fields:
@@ -590,7 +670,7 @@ class Query(object):
                     if k not in custom_fields:
                         col = 't.' + k
                     else:
-                        col = '%s.value' % db.quote(k)
+                        col = custom_col(k)
                     clauses.append("COALESCE(%s,'') %sIN (%s)"
                                    % (col, 'NOT ' if neg else '',
                                       ','.join(['%s' for val in v])))
@@ -631,7 +711,7 @@ class Query(object):
             if name in enum_columns:
                 col = name + '.value'
             elif name in custom_fields:
-                col = '%s.value' % db.quote(name)
+                col = custom_col(name)
             else:
                 col = 't.' + name
             desc = ' DESC' if desc else ''
@@ -821,7 +901,8 @@ class Query(object):
 class QueryModule(Component):
 
     implements(IRequestHandler, INavigationContributor, IWikiSyntaxProvider,
-               IContentConverter)
+               IContentConverter, IMilestoneChangeListener,
+               ITicketBatchChangeListener, ITicketChangeListener)
                
     default_query = Option('query', 'default_query',
         default='status!=closed&owner=$USER', 
@@ -843,6 +924,68 @@ class QueryModule(Component):
         """Number of tickets displayed per page in ticket queries,
         by default (''since 0.11'')""")
 
+    count_strategy = ChoiceOption('query', 'count_strategy',
+                                  ['query', 'window', 'cached'],
+        """How the total number of matching tickets of a paged query is
+        computed. `query` runs a separate `COUNT(*)` query when the page
+        is full, `window` gets the total from a `COUNT(*) OVER ()` window
+        function (requires SQLite 3.25, PostgreSQL 8.4 or MySQL 8.0) and
+        `cached` keeps the counts of the queries until a ticket changes.
+        (''since 0.13'')""")
+
+    custom_field_strategy = ChoiceOption('query', 'custom_field_strategy',
+                                         ['join', 'pivot'],
+        """How custom fields are retrieved by ticket queries. `join` joins
+        the `ticket_custom` table once for each custom field of the query,
+        `pivot` joins it once as a subquery aggregating the values of all
+        the fields into columns, which is usually faster for queries
+        involving many custom fields. (''since 0.13'')""")
+
+    max_cached_counts = 1000
+
+    @cached
+    def ticket_counts(self):
+        """Number of matching tickets by query SQL and arguments, used by
+        the `cached` count strategy.
+        """
+        return {}
+
+    # ITicketChangeListener methods
+
+    def ticket_created(self, ticket):
+        self.invalidate_counts()
+
+    def ticket_changed(self, ticket, comment, author, old_values):
+        self.invalidate_counts()
+
+    def ticket_deleted(self, ticket):
+        self.invalidate_counts()
+
+    # ITicketBatchChangeListener methods
+
+    def tickets_changed(self, changes, comment, author):
+        self.invalidate_counts()
+
+    # IMilestoneChangeListener methods
+
+    def milestone_created(self, milestone):
+        pass
+
+    def milestone_changed(self, milestone, old_values):
+        # Renaming a milestone retargets its tickets
+        if 'name' in old_values:
+            self.invalidate_counts()
+
+    def milestone_deleted(self, milestone):
+        self.invalidate_counts()
+
+    def invalidate_counts(self):
+        """Forget the cached counts of ticket queries. Needed when
+        tickets are modified without notifying the change listeners, e.g.
+        when renaming a component."""
+        if self.count_strategy == 'cached':
+            del self.ticket_counts
+
     # IContentConverter methods
 
     def get_supported_conversions(self):
@@ -1387,8 +1530,9 @@ class TicketQueryMacro(WikiMacroBase):
         # Formats above had their own permission checks, here we need to
         # do it explicitly:
 
-        tickets = [t for t in tickets 
-                   if 'TICKET_VIEW' in req.perm('ticket', t['id'])]
+        tickets = req.perm.filter_permitted('TICKET_VIEW', tickets,
+                                            lambda t: Resource('ticket',
+                                                               t['id']))
 
         if not tickets:
             return tag.span(_("No results"), class_='query_no_results')
@@ -316,8 +316,8 @@ def get_tickets_for_milestone(env, db=None, milestone=None, field='component'):
 def apply_ticket_permissions(env, req, tickets):
     """Apply permissions to a set of milestone tickets as returned by
     `get_tickets_for_milestone()`."""
-    return [t for t in tickets
-            if 'TICKET_VIEW' in req.perm('ticket', t['id'])]
+    return req.perm.filter_permitted('TICKET_VIEW', tickets,
+                                     lambda t: Resource('ticket', t['id']))
 
 def milestone_stats_data(env, req, stat, name, grouped_by='component',
                          group=None):
@@ -423,8 +423,8 @@ class RoadmapModule(Component):
         if 'noduedate' in show:
             milestones = [m for m in milestones
                           if m.due is not None or m.completed]
-        milestones = [m for m in milestones
-                      if 'MILESTONE_VIEW' in req.perm(m.resource)]
+        milestones = req.perm.filter_permitted('MILESTONE_VIEW', milestones,
+                                               lambda m: m.resource)
 
         stats = []
         queries = []
@@ -543,9 +543,10 @@ class RoadmapModule(Component):
             tickets = get_tickets_for_milestone(
                     self.env, milestone=milestone.name, field='owner')
             tickets = apply_ticket_permissions(self.env, req, tickets)
-            for tkt_id in [ticket['id'] for ticket in tickets
-                           if ticket['owner'] == user]:
-                ticket = Ticket(self.env, tkt_id)
+            for ticket in Ticket.select_many(self.env,
+                                             [t['id'] for t in tickets
+                                              if t['owner'] == user]):
+                tkt_id = ticket.id
                 write_prop('BEGIN', 'VTODO')
                 write_prop('UID', '<%s/ticket/%s@%s>' % (req.base_path,
                                                          tkt_id, host))
@@ -875,8 +876,9 @@ class MilestoneModule(Component):
             add_link(req, rel, href, _('Milestone "%(name)s"',
                                        name=milestone.name))
 
-        milestones = [m for m in Milestone.select(self.env)
-                      if 'MILESTONE_VIEW' in req.perm(m.resource)]
+        milestones = req.perm.filter_permitted('MILESTONE_VIEW',
+                                               Milestone.select(self.env),
+                                               lambda m: m.resource)
         idx = [i for i, m in enumerate(milestones) if m.name == milestone.name]
         if idx:
             idx = idx[0]
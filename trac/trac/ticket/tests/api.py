@@ -78,6 +78,39 @@ class TicketSystemTestCase(unittest.TestCase):
         self.assertEqual('test2', fields[0]['name'])
         self.assertEqual('test1', fields[1]['name'])
 
+    def test_frozen_ticket_fields(self):
+        self.env.config.set('ticket-custom', 'test', 'select')
+        self.env.config.set('ticket-custom', 'test.options', 'a|b')
+        fields = self.ticket_system.get_frozen_ticket_fields()
+        self.assertTrue(fields is self.ticket_system.get_frozen_ticket_fields())
+        self.assertEqual('select', fields.types['test'])
+        self.assertEqual(('a', 'b'), fields.get('test')['options'])
+        self.assertEqual(('test',), fields.custom_names)
+        self.assertEqual(['summary', 'reporter'],
+                         [f.name for f in fields][:2])
+
+    def test_ticket_fields_are_copies(self):
+        self.env.config.set('ticket-custom', 'test', 'select')
+        self.env.config.set('ticket-custom', 'test.options', 'a|b')
+        fields = self.ticket_system.get_ticket_fields()
+        test = [f for f in fields if f['name'] == 'test'][0]
+        self.assertEqual(['a', 'b'], test['options'])
+        test['options'].append('c')
+        test['label'] = 'Changed'
+        test = [f for f in self.ticket_system.get_ticket_fields()
+                if f['name'] == 'test'][0]
+        self.assertEqual(['a', 'b'], test['options'])
+        self.assertEqual('Test', test['label'])
+
+    def test_frozen_ticket_fields_reset(self):
+        fields = self.ticket_system.get_frozen_ticket_fields()
+        self.env.config.set('ticket-custom', 'test', 'text')
+        self.ticket_system.reset_ticket_fields()
+        del self.ticket_system.custom_fields
+        new_fields = self.ticket_system.get_frozen_ticket_fields()
+        self.assertTrue(fields is not new_fields)
+        self.assertEqual('text', new_fields.types['test'])
+
     def test_available_actions_full_perms(self):
         self.perm.grant_permission('anonymous', 'TICKET_CREATE')
         self.perm.grant_permission('anonymous', 'TICKET_MODIFY')
@@ -121,6 +154,36 @@ class TicketSystemTestCase(unittest.TestCase):
         self.assertEqual(['leave'], self._get_actions({'status': 'reopened'}))
         self.assertEqual(['leave'], self._get_actions({'status': 'closed'}))
 
+    def _insert_users(self, *usernames):
+        self.env.db_transaction.executemany(
+            "INSERT INTO session VALUES (%s,1,0)",
+            [(username,) for username in usernames])
+        self.perm.grant_permission('joe', 'TICKET_MODIFY')
+        self.perm.grant_permission('jane', 'TICKET_MODIFY')
+
+    def test_restrict_owner(self):
+        self.env.config.set('ticket', 'restrict_owner', 'true')
+        self._insert_users('joe', 'jane', 'bob')
+        field = {'name': 'owner', 'type': 'text'}
+        self.ticket_system.eventually_restrict_owner(field)
+        self.assertEqual('select', field['type'])
+        self.assertEqual(['< default >', 'jane', 'joe'], field['options'])
+
+    def test_restrict_owner_suggestions(self):
+        self.env.config.set('ticket', 'restrict_owner', 'true')
+        self.env.config.set('ticket', 'restrict_owner_max_options', '1')
+        self._insert_users('joe', 'jane', 'bob')
+        field = {'name': 'owner', 'type': 'text'}
+        self.ticket_system.eventually_restrict_owner(field)
+        self.assertEqual('text', field['type'])
+        self.assertTrue(field['suggest'])
+        self.assertEqual(['jane', 'joe'],
+                         self.ticket_system.get_owner_suggestions('J'))
+        self.assertEqual(['joe'],
+                         self.ticket_system.get_owner_suggestions('jo'))
+        self.assertEqual(['jane'],
+                         self.ticket_system.get_owner_suggestions('', limit=1))
+
 
 def suite():
     return unittest.makeSuite(TicketSystemTestCase, 'test')
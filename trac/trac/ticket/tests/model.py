@@ -12,7 +12,8 @@ from trac.attachment import Attachment
 from trac.core import TracError, implements
 from trac.resource import ResourceNotFound
 from trac.ticket.model import Ticket, Component, Milestone, Priority, Type, Version
-from trac.ticket.api import IMilestoneChangeListener, ITicketChangeListener
+from trac.ticket.api import IMilestoneChangeListener, \
+                           ITicketBatchChangeListener, ITicketChangeListener
 from trac.test import EnvironmentStub
 from trac.util.datefmt import from_utimestamp, to_utimestamp, utc
 
@@ -37,6 +38,26 @@ class TestTicketChangeListener(core.Component):
         self.ticket = ticket
 
 
+class TestTicketBatchChangeListener(core.Component):
+    implements(ITicketBatchChangeListener, ITicketChangeListener)
+
+    def __init__(self):
+        self.batches = []
+        self.changed = []
+
+    def tickets_changed(self, changes, comment, author):
+        self.batches.append((changes, comment, author))
+
+    def ticket_created(self, ticket):
+        pass
+
+    def ticket_changed(self, ticket, comment, author, old_values):
+        self.changed.append(ticket)
+
+    def ticket_deleted(self, ticket):
+        pass
+
+
 class TicketTestCase(unittest.TestCase):
 
     def setUp(self):
@@ -51,6 +72,7 @@ class TicketTestCase(unittest.TestCase):
     def _insert_ticket(self, summary, **kw):
         """Helper for inserting a ticket into the database"""
         ticket = Ticket(self.env)
+        ticket['summary'] = summary
         for k, v in kw.items():
             ticket[k] = v
         return ticket.insert()
@@ -72,6 +94,85 @@ class TicketTestCase(unittest.TestCase):
         self.assertRaises(ResourceNotFound, Ticket, self.env, -1)
         self.assertRaises(ResourceNotFound, Ticket, self.env, 1L << 32)
 
+    def test_customized_fields(self):
+        """The changes made to the fields of a ticket are honoured when it
+        is inserted and saved"""
+        ticket = self._create_a_ticket()
+        ticket.fields.append({'name': 'bar', 'type': 'text', 'custom': True,
+                              'label': 'Bar'})
+        ticket['bar'] = 'value'
+        tkt_id = ticket.insert()
+        ticket['bar'] = 'changed'
+        ticket.save_changes('joe')
+        self.assertEqual('changed', self.env.db_query("""
+            SELECT value FROM ticket_custom WHERE ticket=%s AND name='bar'
+            """, (tkt_id,))[0][0])
+        ticket['bar'] = 'batch'
+        Ticket.save_many(self.env, [ticket], 'joe', 'batch')
+        self.assertEqual([('bar', 'batch'),
+                          ('foo', 'This is a custom field')],
+                         self.env.db_query("""
+                             SELECT name, value FROM ticket_custom
+                             WHERE ticket=%s ORDER BY name""", (tkt_id,)))
+
+    def test_select_many(self):
+        for i in range(5):
+            self._insert_ticket('Ticket %d' % i, foo='foo %d' % i,
+                                reporter='joe')
+        tickets = list(Ticket.select_many(self.env, [4, 42, 2, '1', 0],
+                                          chunk_size=2))
+        self.assertEqual([4, 2, 1], [ticket.id for ticket in tickets])
+        for ticket in tickets:
+            single = Ticket(self.env, ticket.id)
+            self.assertEqual(single.values, ticket.values)
+            self.assertEqual(ticket.id, ticket.resource.id)
+        self.assertEqual('foo 3', tickets[0]['foo'])
+        tickets[0]['summary'] = 'Changed'
+        tickets[0].save_changes('joe')
+        self.assertEqual('Changed', Ticket(self.env, 4)['summary'])
+
+    def test_save_many(self):
+        self._insert_ticket('Ticket 1', reporter='joe', foo='foo 1')
+        self._insert_ticket('Ticket 2', reporter='joe')
+        self._insert_ticket('Ticket 3', reporter='joe')
+        ticket = Ticket(self.env, 1)
+        ticket.save_changes('joe', 'first comment')
+        tickets = list(Ticket.select_many(self.env, [1, 2, 3]))
+        tickets[0]['foo'] = 'foo 2'
+        tickets[0]['cc'] = 'bob;alice, bob'
+        tickets[1]['foo'] = 'new foo'
+        tickets[1]['summary'] = 'Changed'
+        when = datetime(2001, 1, 1, 1, 1, 1, 0, utc)
+
+        changes = Ticket.save_many(self.env, tickets[:2], 'joe', 'batch',
+                                   when, chunk_size=1)
+        self.assertEqual([(tickets[0], {'foo': 'foo 1', 'cc': ''}),
+                          (tickets[1], {'foo': None,
+                                        'summary': 'Ticket 2'})], changes)
+        ticket = Ticket(self.env, 1)
+        self.assertEqual('foo 2', ticket['foo'])
+        self.assertEqual('bob, alice', ticket['cc'])
+        self.assertEqual(when, ticket['changetime'])
+        self.assertEqual([(when, 'joe', 'comment', '2', 'batch', True)],
+                         [c for c in ticket.get_changelog(when)
+                          if c[2] == 'comment'])
+        ticket = Ticket(self.env, 2)
+        self.assertEqual('Changed', ticket['summary'])
+        self.assertEqual('new foo', ticket['foo'])
+        self.assertEqual([(when, 'joe', 'comment', '1', 'batch', True),
+                          (when, 'joe', 'foo', '', 'new foo', True),
+                          (when, 'joe', 'summary', 'Ticket 2', 'Changed',
+                           True)],
+                         ticket.get_changelog(when))
+        self.assertEqual([], Ticket(self.env, 3).get_changelog())
+        self.assertEqual({}, tickets[0]._old)
+
+    def test_save_many_no_changes(self):
+        self._insert_ticket('Ticket 1', reporter='joe')
+        tickets = list(Ticket.select_many(self.env, [1]))
+        self.assertEqual([], Ticket.save_many(self.env, tickets, 'joe'))
+        self.assertEqual([], Ticket(self.env, 1).get_changelog())
+
     def test_create_ticket_1(self):
         ticket = self._create_a_ticket()
         self.assertEqual('santa', ticket['reporter'])
@@ -383,6 +484,27 @@ class TicketTestCase(unittest.TestCase):
         for key, value in data.iteritems():
             self.assertEqual(value, listener.old_values[key])
 
+    def test_batch_change_listener(self):
+        listener = TestTicketChangeListener(self.env)
+        batch_listener = TestTicketBatchChangeListener(self.env)
+        self._insert_ticket('Ticket 1', reporter='joe', component='foo')
+        self._insert_ticket('Ticket 2', reporter='joe', component='foo')
+        tickets = list(Ticket.select_many(self.env, [1, 2]))
+        for ticket in tickets:
+            ticket['component'] = 'bar'
+
+        Ticket.save_many(self.env, tickets, 'author', 'comment')
+
+        self.assertEqual(1, len(batch_listener.batches))
+        changes, comment, author = batch_listener.batches[0]
+        self.assertEqual([1, 2], [ticket.id for ticket, old in changes])
+        self.assertEqual({'component': 'foo'}, changes[0][1])
+        self.assertEqual(('comment', 'author'), (comment, author))
+        self.assertEqual([], batch_listener.changed)
+        self.assertEqual('changed', listener.action)
+        self.assertEqual(tickets[1], listener.ticket)
+        self.assertEqual({'component': 'foo'}, listener.old_values)
+
     def test_change_listener_deleted(self):
         listener = TestTicketChangeListener(self.env)
         ticket = self._create_a_ticket()
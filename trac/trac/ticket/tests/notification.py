@@ -16,9 +16,11 @@
 # (lsmithson@open-networks.co.uk) extensible Python SMTP Server
 #
 
+from trac.notification import QueuedEmailSender
 from trac.util.datefmt import utc
 from trac.ticket.model import Ticket
-from trac.ticket.notification import TicketNotifyEmail
+from trac.ticket.notification import TicketNotificationSystem, \
+                                    TicketNotifyEmail
 from trac.test import EnvironmentStub, Mock, MockPerm
 from trac.tests.notification import SMTPThreadedServer, parse_smtp_message, \
                                     smtp_address
@@ -1070,6 +1072,198 @@ Resolution:  fixed                   |"""
         tn.get_message_id('foo')
         
 
+class QueuedNotificationTestCase(unittest.TestCase):
+    """Notification test cases that queue email before sending it over
+    SMTP"""
+
+    def setUp(self):
+        self.env = EnvironmentStub(default_data=True)
+        self.env.config.set('project', 'name', 'TracTest')
+        self.env.config.set('notification', 'smtp_enabled', 'true')
+        self.env.config.set('notification', 'always_notify_owner', 'true')
+        self.env.config.set('notification', 'always_notify_reporter', 'true')
+        self.env.config.set('notification', 'smtp_port', str(SMTP_TEST_PORT))
+        self.env.config.set('notification', 'smtp_server','localhost')
+        self.env.config.set('notification', 'email_sender',
+                            'QueuedEmailSender')
+        self.env.config.set('notification', 'queue_thread', 'false')
+        self.sender = QueuedEmailSender(self.env)
+
+    def tearDown(self):
+        notifysuite.tear_down()
+        self.env.reset_db()
+
+    def _create_ticket(self, summary, owner='joe.user@example.net'):
+        ticket = Ticket(self.env)
+        ticket['reporter'] = 'joe.user@example.org'
+        ticket['owner'] = owner
+        ticket['summary'] = summary
+        ticket.insert()
+        return ticket
+
+    def _get_queue(self):
+        return self.env.db_query("""
+            SELECT attempts, coalesce_key, next_attempt, error
+            FROM notify_queue ORDER BY id""")
+
+    def test_deliver(self):
+        tn = TicketNotifyEmail(self.env)
+        tn.notify(self._create_ticket('Foo'), newticket=True)
+        tn = TicketNotifyEmail(self.env)
+        tn.notify(self._create_ticket('Bar', 'joe.bar@example.net'),
+                  newticket=True)
+        self.assertEqual([], notifysuite.smtpd.get_messages())
+        self.assertEqual([0, 0], [row[0] for row in self._get_queue()])
+
+        self.assertEqual(2, self.sender.deliver())
+        messages = notifysuite.smtpd.get_messages()
+        self.assertEqual(2, len(messages))
+        self.assertEqual(1, notifysuite.smtpd.get_connections())
+        self.assertEqual(set(['joe.user@example.org', 'joe.user@example.net']),
+                         set(messages[0][1]))
+        self.assertEqual(set(['joe.user@example.org', 'joe.bar@example.net']),
+                         set(messages[1][1]))
+        headers, body = parse_smtp_message(messages[1][2])
+        self.assertEqual('2', headers['X-Trac-Ticket-ID'])
+        self.assertEqual([], self._get_queue())
+        self.assertEqual(0, self.sender.deliver())
+
+    def test_coalesce_ticket_changes(self):
+        ticket = self._create_ticket('Foo')
+        tn = TicketNotifyEmail(self.env)
+        tn.notify(ticket, newticket=True)
+        ticket['summary'] = 'Bar'
+        ticket.save_changes('joe.user@example.org', 'Changed')
+        tn = TicketNotifyEmail(self.env)
+        tn.notify(ticket, newticket=False)
+        self.assertEqual(['ticket:1', 'ticket:1'],
+                         [row[1] for row in self._get_queue()])
+
+        self.assertEqual(2, self.sender.deliver())
+        messages = notifysuite.smtpd.get_messages()
+        self.assertEqual(1, len(messages))
+        headers, body = parse_smtp_message(messages[0][2])
+        self.assertTrue(headers['Content-Type'].startswith(
+                        'multipart/digest'))
+        self.assertTrue('1: Bar' in headers['Subject'])
+        self.assertEqual(2, body.count('Content-Type: message/rfc822'))
+
+    def test_queue_delay(self):
+        self.env.config.set('notification', 'queue_delay', '60')
+        tn = TicketNotifyEmail(self.env)
+        tn.notify(self._create_ticket('Foo'), newticket=True)
+        self.assertEqual(0, self.sender.deliver())
+        self.assertEqual(1, len(self._get_queue()))
+
+    def test_claimed_by_other_process(self):
+        tn = TicketNotifyEmail(self.env)
+        tn.notify(self._create_ticket('Foo'), newticket=True)
+        claim = self.sender._claim
+        def claim_elsewhere(rows, now):
+            # Another process claims the messages after they have been read
+            self.env.db_transaction("""
+                UPDATE notify_queue SET next_attempt=next_attempt+1""")
+            return claim(rows, now)
+        self.sender._claim = claim_elsewhere
+        self.assertEqual(0, self.sender.deliver())
+        self.assertEqual([], notifysuite.smtpd.get_messages())
+        self.assertEqual(1, len(self._get_queue()))
+
+    def test_retry_failed_delivery(self):
+        self.env.config.set('notification', 'smtp_port',
+                            str(SMTP_TEST_PORT + 1))
+        self.env.config.set('notification', 'queue_retries', '2')
+        tn = TicketNotifyEmail(self.env)
+        tn.notify(self._create_ticket('Foo'), newticket=True)
+        self.assertEqual(0, self.sender.deliver())
+        (attempts, key, next_attempt, error), = self._get_queue()
+        self.assertEqual(1, attempts)
+        self.assertNotEqual('', error)
+        # Not due before the retry delay
+        self.assertEqual(0, self.sender.deliver())
+        self.assertEqual(1, self._get_queue()[0][0])
+
+        self.env.db_transaction("UPDATE notify_queue SET next_attempt=0")
+        self.assertEqual(0, self.sender.deliver())
+        self.assertEqual([], self._get_queue())
+
+
+    def test_shutdown_stops_thread(self):
+        self.env.config.set('notification', 'queue_thread', 'true')
+        self.env.config.set('notification', 'queue_delay', '60')
+        tn = TicketNotifyEmail(self.env)
+        tn.notify(self._create_ticket('Foo'), newticket=True)
+        thread = self.sender._thread
+        self.assertTrue(thread.isAlive())
+        self.sender.shutdown()
+        thread.join(10)
+        self.assertFalse(thread.isAlive())
+        self.assertEqual(None, self.sender._thread)
+        # No new thread is started once the environment is shut down
+        tn = TicketNotifyEmail(self.env)
+        tn.notify(self._create_ticket('Bar'), newticket=True)
+        self.assertEqual(None, self.sender._thread)
+        self.assertEqual(2, len(self._get_queue()))
+
+
+class RecipientsTestCase(unittest.TestCase):
+    """Resolution of the recipients of ticket notifications"""
+
+    def setUp(self):
+        self.env = EnvironmentStub(default_data=True)
+        self.env.config.set('notification', 'always_notify_owner', 'true')
+        self.env.config.set('notification', 'always_notify_reporter', 'true')
+        self.tns = TicketNotificationSystem(self.env)
+
+    def tearDown(self):
+        notifysuite.tear_down()
+        self.env.reset_db()
+
+    def _create_ticket(self, reporter, owner, cc=''):
+        ticket = Ticket(self.env)
+        ticket['reporter'] = reporter
+        ticket['owner'] = owner
+        ticket['cc'] = cc
+        ticket['summary'] = 'Foo'
+        ticket.insert()
+        return ticket
+
+    def test_get_recipients(self):
+        self._create_ticket('joe', 'bob', 'alice, carol')
+        ticket = self._create_ticket('joe', 'bob')
+        ticket.save_changes('dave', 'Comment',
+                            datetime(2001, 1, 1, tzinfo=utc))
+        ticket.save_changes('erin', 'Comment',
+                            datetime(2001, 1, 2, tzinfo=utc))
+        self.assertEqual({
+            1: (['joe', 'bob', 'joe'], ['alice', 'carol'], 'joe', 'bob'),
+            2: (['joe', 'bob', 'dave', 'erin', 'erin'], [], 'joe', 'bob'),
+            }, self.tns.get_recipients([1, 2, 3]))
+
+    def test_get_recipients_without_updater(self):
+        self.env.config.set('notification', 'always_notify_updater',
+                            'false')
+        ticket = self._create_ticket('joe', 'bob')
+        ticket.save_changes('dave', 'Comment')
+        self.assertEqual({1: (['joe', 'bob'], ['fred'], 'joe', 'bob')},
+                         self.tns.get_recipients([1], ['fred']))
+
+    def test_changes_of_other_processes(self):
+        ticket = self._create_ticket('joe', 'bob')
+        self.tns.get_recipients([1])
+        ticket.save_changes('dave', 'Comment',
+                            datetime(2001, 1, 1, tzinfo=utc))
+        self.assertEqual(['joe', 'bob', 'dave', 'dave'],
+                         self.tns.get_recipients([1])[1][0])
+        # Simulate a change saved by another process
+        self.env.db_transaction.executemany("""
+            INSERT INTO ticket_change (ticket,time,author,field)
+            VALUES (%s,%s,%s,%s)
+            """, [(1, 1000, 'erin', 'comment')])
+        self.env.db_transaction("UPDATE ticket SET changetime=1000")
+        self.assertEqual(['joe', 'bob', 'dave', 'erin', 'dave'],
+                         self.tns.get_recipients([1])[1][0])
+
 
 class NotificationTestSuite(unittest.TestSuite):
     """Thin test suite wrapper to start and stop the SMTP test server"""
@@ -1080,6 +1274,8 @@ class NotificationTestSuite(unittest.TestSuite):
         self.smtpd = SMTPThreadedServer(SMTP_TEST_PORT)
         self.smtpd.start()
         self.addTest(unittest.makeSuite(NotificationTestCase, 'test'))
+        self.addTest(unittest.makeSuite(QueuedNotificationTestCase, 'test'))
+        self.addTest(unittest.makeSuite(RecipientsTestCase, 'test'))
         self.remaining = self.countTestCases()
 
     def tear_down(self):
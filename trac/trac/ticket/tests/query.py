@@ -1,4 +1,6 @@
+from trac.core import TracError
 from trac.test import Mock, EnvironmentStub, MockPerm
+from trac.ticket.model import Component, Priority, Ticket, Version
 from trac.ticket.query import Query, QueryModule, TicketQueryMacro
 from trac.util.datefmt import utc
 from trac.web.chrome import web_context
@@ -287,6 +289,33 @@ ORDER BY COALESCE(%s.value,'')='',%s.value,COALESCE(t.id,0)=0,t.id""" %
         self.assertEqual([], args)
         tickets = query.execute(self.req)
 
+    def test_pivoted_custom_fields(self):
+        self.env.config.set('ticket-custom', 'foo', 'text')
+        self.env.config.set('ticket-custom', 'bar', 'text')
+        self.env.config.set('query', 'custom_field_strategy', 'pivot')
+        query = Query.from_string(self.env, 'foo=something&col=id&col=bar',
+                                  order='bar')
+        sql, args = query.get_sql()
+        foo = self.env.get_read_db().quote('foo')
+        bar = self.env.get_read_db().quote('bar')
+        self.assertEqualSQL(sql,
+"""SELECT t.id AS id,t.status AS status,t.priority AS priority,t.time AS time,t.changetime AS changetime,priority.value AS priority_value,tc.%(bar)s AS %(bar)s,tc.%(foo)s AS %(foo)s
+FROM ticket AS t
+  LEFT OUTER JOIN (SELECT ticket,MAX(CASE WHEN name='bar' THEN value END) AS %(bar)s,MAX(CASE WHEN name='foo' THEN value END) AS %(foo)s FROM ticket_custom WHERE name IN ('bar','foo') GROUP BY ticket) AS tc ON (tc.ticket=id)
+  LEFT OUTER JOIN enum AS priority ON (priority.type='priority' AND priority.name=priority)
+WHERE ((COALESCE(tc.%(foo)s,'')=%%s))
+ORDER BY COALESCE(tc.%(bar)s,'')='',tc.%(bar)s,t.id""" %
+        {'foo': foo, 'bar': bar})
+        self.assertEqual(['something'], args)
+        for foo, bar in [('something', 'b'), ('other', 'c'),
+                         ('something', 'a')]:
+            ticket = Ticket(self.env)
+            ticket.populate({'summary': 'test', 'foo': foo, 'bar': bar})
+            ticket.insert()
+        tickets = query.execute(self.req)
+        self.assertEqual([(3, 'a'), (1, 'b')],
+                         [(t['id'], t['bar']) for t in tickets])
+
     def test_constrained_by_multiple_owners(self):
         query = Query.from_string(self.env, 'owner=someone|someone_else',
                                   order='id')
@@ -524,6 +553,97 @@ ORDER BY COALESCE(t.id,0)=0,t.id""")
         data = query.template_data(context, tickets)
         self.assertEqual(['$USER'], data['clauses'][0]['owner']['values'])
 
+    def _insert_tickets(self, n):
+        for i in range(n):
+            ticket = Ticket(self.env)
+            ticket['summary'] = 'Ticket %d' % (i + 1)
+            ticket['reporter'] = i % 2 and 'joe' or ''
+            ticket['status'] = 'new'
+            ticket.insert()
+
+    def _execute_pages(self, n, max=2):
+        pages = []
+        page = 1
+        while True:
+            query = Query(self.env, order='id', max=max, page=page)
+            tickets = query.execute(self.req)
+            pages.append(([t['id'] for t in tickets], query.num_items))
+            if not query.has_more_pages or page * max >= query.num_items:
+                return pages
+            page += 1
+
+    def test_execute_converts_values(self):
+        self._insert_tickets(2)
+        query = Query(self.env, cols=['id', 'reporter', 'milestone',
+                                          'time'], order='id')
+        tickets = query.execute(self.req)
+        self.assertEqual([1, 2], [t['id'] for t in tickets])
+        self.assertEqual(['anonymous', 'joe'],
+                         [t['reporter'] for t in tickets])
+        self.assertEqual('/trac.cgi/ticket/1', tickets[0]['href'])
+        self.assertEqual(utc, tickets[0]['time'].tzinfo)
+        self.assertEqual('', tickets[0]['milestone'])
+
+    def test_execute_count_strategies(self):
+        self._insert_tickets(5)
+        expected = [([1, 2], 5), ([3, 4], 5), ([5], 5)]
+        for strategy in ('query', 'window', 'cached'):
+            self.env.config.set('query', 'count_strategy', strategy)
+            self.assertEqual(expected, self._execute_pages(5), strategy)
+
+    def test_execute_page_beyond_results(self):
+        self._insert_tickets(3)
+        for strategy in ('query', 'window', 'cached'):
+            self.env.config.set('query', 'count_strategy', strategy)
+            query = Query(self.env, order='id', max=2, page=3)
+            self.assertRaises(TracError, query.execute, self.req)
+
+    def test_cached_count_invalidated(self):
+        self.env.config.set('query', 'count_strategy', 'cached')
+        self._insert_tickets(3)
+        query = Query(self.env, order='id', max=2)
+        query.execute(self.req)
+        self.assertEqual(3, query.num_items)
+        self._insert_tickets(1)
+        query = Query(self.env, order='id', max=2)
+        query.execute(self.req)
+        self.assertEqual(4, query.num_items)
+
+    def test_cached_count_invalidated_by_batch(self):
+        self.env.config.set('query', 'count_strategy', 'cached')
+        self._insert_tickets(3)
+        query = Query.from_string(self.env, 'status=new', order='id', max=2)
+        query.execute(self.req)
+        self.assertEqual(3, query.num_items)
+        tickets = list(Ticket.select_many(self.env, [1, 2]))
+        for ticket in tickets:
+            ticket['status'] = 'closed'
+        Ticket.save_many(self.env, tickets, 'joe')
+        query = Query.from_string(self.env, 'status=new', order='id', max=2)
+        query.execute(self.req)
+        self.assertEqual(1, query.num_items)
+
+    def test_cached_count_invalidated_by_rename(self):
+        self.env.config.set('query', 'count_strategy', 'cached')
+        self._insert_tickets(3)
+        self.env.db_transaction("""
+            UPDATE ticket SET component='component1', version='1.0',
+                              priority='major'""")
+        for field, model, name in [('component', Component, 'component1'),
+                                   ('version', Version, '1.0'),
+                                   ('priority', Priority, 'major')]:
+            query = Query.from_string(self.env, '%s=renamed' % field,
+                                      order='id', max=2)
+            query.execute(self.req)
+            self.assertEqual(0, query.num_items)
+            item = model(self.env, name)
+            item.name = 'renamed'
+            item.update()
+            query = Query.from_string(self.env, '%s=renamed' % field,
+                                      order='id', max=2)
+            query.execute(self.req)
+            self.assertEqual(3, query.num_items)
+
 
 class QueryLinksTestCase(unittest.TestCase):
 
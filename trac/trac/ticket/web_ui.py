@@ -18,6 +18,7 @@ from __future__ import with_statement
 
 import csv
 from datetime import datetime
+from functools import partial
 import pkg_resources
 import re
 from StringIO import StringIO
@@ -31,7 +32,9 @@ from trac.core import *
 from trac.mimeview.api import Mimeview, IContentConverter
 from trac.resource import Resource, ResourceNotFound, get_resource_url, \
                          render_resource_link, get_resource_shortname
-from trac.search import ISearchSource, search_to_sql, shorten_result
+from trac.search import ISearchSource, merge_search_results, \
+                         render_excerpts, search_rows, search_to_sql, \
+                         shorten_result
 from trac.ticket.api import TicketSystem, ITicketManipulator
 from trac.ticket.model import Milestone, Ticket, group_milestones
 from trac.ticket.notification import TicketNotifyEmail
@@ -58,6 +61,14 @@ class InvalidTicket(TracError):
     title = N_("Invalid Ticket")
 
 
+def add_owner_suggestions(req, ticket):
+    """Make the owner fields of the ticket page suggest the users who can
+    own `ticket` as their name is typed."""
+    add_script(req, 'common/js/suggest.js')
+    add_script_data(req, owner_suggest_url=req.href.ticket('owners',
+                                                           id=ticket.id))
+
+
 class TicketModule(Component):
 
     implements(IContentConverter, INavigationContributor, IRequestHandler,
@@ -158,7 +169,7 @@ class TicketModule(Component):
     # IRequestHandler methods
 
     def match_request(self, req):
-        if req.path_info == "/newticket":
+        if req.path_info in ("/newticket", "/ticket/owners"):
             return True
         match = re.match(r'/ticket/([0-9]+)$', req.path_info)
         if match:
@@ -166,6 +177,8 @@ class TicketModule(Component):
             return True
 
     def process_request(self, req):
+        if req.path_info == '/ticket/owners':
+            return self._process_owners_request(req)
         if 'id' in req.args:
             if req.path_info == '/newticket':
                 raise TracError(_("id can't be set for a new ticket request."))
@@ -187,8 +200,19 @@ class TicketModule(Component):
             yield ('ticket', _("Tickets"))
 
     def get_search_results(self, req, terms, filters):
+        return render_excerpts(self.get_search_results_by_date(req, terms,
+                                                               filters))
+
+    def get_search_results_by_date(self, req, terms, filters, limit=None):
         if not 'ticket' in filters:
-            return
+            return []
+        return merge_search_results(
+            self._get_ticket_search_results(req, terms, limit),
+            AttachmentModule(self.env).get_search_results(
+                req, Resource('ticket'), terms, limit))
+
+    def _get_ticket_search_results(self, req, terms, limit=None):
+        """Generate the tickets matching the search terms, newest first."""
         ticket_realm = Resource('ticket')
         with self.env.db_query as db:
             sql, args = search_to_sql(db, ['summary', 'keywords',
@@ -198,7 +222,8 @@ class TicketModule(Component):
             sql3, args3 = search_to_sql(db, ['value'], terms)
             ticketsystem = TicketSystem(self.env)
             for summary, desc, author, type, tid, ts, status, resolution in \
-                    db("""SELECT summary, description, reporter, type, id,
+                    search_rows(db, """
+                          SELECT summary, description, reporter, type, id,
                                  time, status, resolution 
                           FROM ticket
                           WHERE id IN (
@@ -209,8 +234,9 @@ class TicketModule(Component):
                             UNION
                               SELECT ticket FROM ticket_custom WHERE %s
                           )
+                          ORDER BY time DESC, id DESC
                           """ % (sql, sql2, sql3),
-                          args + args2 + args3):
+                          args + args2 + args3, limit):
                 t = ticket_realm(id=tid)
                 if 'TICKET_VIEW' in req.perm(t):
                     yield (req.href.ticket(tid),
@@ -221,12 +247,7 @@ class TicketModule(Component):
                                 message=ticketsystem.format_summary(
                                     summary, status, resolution, type)),
                            from_utimestamp(ts), author,
-                           shorten_result(desc, terms))
-        
-        # Attachments
-        for result in AttachmentModule(self.env).get_search_results(
-            req, ticket_realm, terms):
-            yield result        
+                           partial(shorten_result, desc, terms))
 
     # ITimelineEventProvider methods
 
@@ -1410,6 +1431,20 @@ class TicketModule(Component):
                     items.append(rendered)
         return tag(items)
 
+    def _process_owners_request(self, req):
+        """Return the users who can own the ticket and whose name starts
+        with the `q` argument, as an HTML list for `suggest.js`."""
+        ticket = None
+        if req.args.get('id'):
+            ticket = Ticket(self.env, req.args['id'])
+            req.perm(ticket.resource).require('TICKET_MODIFY')
+        else:
+            req.perm('ticket').require('TICKET_MODIFY')
+        owners = TicketSystem(self.env).get_owner_suggestions(
+            req.args.get('q', ''), ticket)
+        req.send(tag.ul([tag.li(owner) for owner in owners])
+                 .generate().render('xhtml', encoding='utf-8'))
+
     def _prepare_fields(self, req, ticket):
         context = web_context(req, ticket.resource)
         fields = []
@@ -1428,6 +1463,8 @@ class TicketModule(Component):
                 field['skip'] = True
             elif name == 'owner':
                 TicketSystem(self.env).eventually_restrict_owner(field, ticket)
+                if field.get('suggest'):
+                    add_owner_suggestions(req, ticket)
                 type_ = field['type']
                 field['skip'] = True
                 if not ticket.exists:
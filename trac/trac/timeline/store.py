@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2012 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.org/wiki/TracLicense.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://trac.edgewall.org/log/.
+
+from __future__ import with_statement
+
+from datetime import datetime, timedelta
+import time
+
+from trac.attachment import IAttachmentChangeListener
+from trac.config import IntOption
+from trac.core import *
+from trac.ticket.api import IMilestoneChangeListener, \
+                           ITicketBatchChangeListener, ITicketChangeListener
+from trac.util.datefmt import from_utimestamp, to_utimestamp, utc
+from trac.versioncontrol.api import IRepositoryChangeListener
+from trac.wiki.api import IWikiChangeListener
+
+
+class TimelineEventStore(Component):
+    """Record the time of the events shown in the timeline.
+
+    The `timeline_event` table lets the timeline find the time range of
+    the latest events without asking every event provider for all the
+    events of the period. Events are recorded by timeline filter (the
+    `realm` column) and resource.
+
+    The recorded events only need to approximate the events of the
+    providers: the timeline asks the providers for older events when
+    they return fewer events than recorded, and events which are not
+    recorded are still returned by the providers for the time range
+    asked. Changes made without notifying the change listeners (e.g.
+    direct database updates or `repository resync`) therefore only make
+    the timeline ask the providers for larger time ranges.
+
+    Events older than `[timeline] event_store_max_age` days are pruned
+    from time to time. The providers are asked for all the events of the
+    period when it is older than the recorded events.
+    """
+
+    implements(IAttachmentChangeListener, IMilestoneChangeListener,
+               IRepositoryChangeListener, ITicketBatchChangeListener,
+               ITicketChangeListener, IWikiChangeListener)
+
+    max_age = IntOption('timeline', 'event_store_max_age', 365,
+        """Number of days during which the time of the timeline events is
+        recorded, for bounding the number of events of the timeline and of
+        its RSS feed. A negative value keeps the events forever.
+        (''since 0.13'')""")
+
+    # Minimum number of seconds between two prunings of the old events
+    prune_interval = 3600
+
+    def __init__(self):
+        self._last_prune = 0
+
+    def add_event(self, time, realm, resource, author=None):
+        """Record an event of the timeline filter `realm` at `time`."""
+        self.add_events([(time, realm, resource, author)])
+
+    def add_events(self, events):
+        """Record many events at once, given as `(time, realm, resource,
+        author)` tuples."""
+        self.env.db_transaction.executemany("""
+            INSERT INTO timeline_event (time,realm,resource,author)
+            VALUES (%s,%s,%s,%s)
+            """, [(to_utimestamp(t), realm, unicode(resource), author)
+                  for t, realm, resource, author in events])
+        now = time.time()
+        if now - self._last_prune >= self.prune_interval:
+            self._last_prune = now
+            self.prune()
+
+    def prune(self):
+        """Forget the events older than `[timeline] event_store_max_age`
+        days."""
+        if self.max_age >= 0:
+            oldest = datetime.now(utc) - timedelta(days=self.max_age)
+            self.env.db_transaction("""
+                DELETE FROM timeline_event WHERE time<%s
+                """, (to_utimestamp(oldest),))
+
+    def remove_events(self, realm, resource):
+        """Forget the events of the timeline filter `realm` for
+        `resource`."""
+        self.env.db_transaction("""
+            DELETE FROM timeline_event WHERE realm=%s AND resource=%s
+            """, (realm, unicode(resource)))
+
+    def get_range_start(self, start, stop, realms, count):
+        """Return the time of the `count`-th latest event of `realms`
+        between `start` and `stop`, or `start` if there are fewer events.
+        """
+        if not realms or count <= 0:
+            return start
+        for ts, in self.env.db_query("""
+                SELECT time FROM timeline_event
+                WHERE time>=%%s AND time<=%%s AND realm IN (%s)
+                ORDER BY time DESC LIMIT 1 OFFSET %%s
+                """ % ','.join(['%s'] * len(realms)),
+                [to_utimestamp(start), to_utimestamp(stop)] + list(realms) +
+                [count - 1]):
+            return max(start, from_utimestamp(ts))
+        return start
+
+    # ITicketChangeListener methods
+
+    def ticket_created(self, ticket):
+        self.add_event(ticket['time'], 'ticket', ticket.id,
+                       ticket['reporter'])
+
+    def ticket_changed(self, ticket, comment, author, old_values):
+        self.tickets_changed([(ticket, old_values)], comment, author)
+
+    def ticket_deleted(self, ticket):
+        with self.env.db_transaction:
+            self.remove_events('ticket', ticket.id)
+            self.remove_events('ticket_details', ticket.id)
+
+    # ITicketBatchChangeListener methods
+
+    def tickets_changed(self, changes, comment, author):
+        events = []
+        for ticket, old_values in changes:
+            if 'status' in old_values and \
+                    ticket['status'] in ('closed', 'reopened'):
+                realm = 'ticket'
+            else:
+                realm = 'ticket_details'
+            events.append((ticket['changetime'], realm, ticket.id, author))
+        self.add_events(events)
+
+    # IMilestoneChangeListener methods
+
+    def milestone_created(self, milestone):
+        if milestone.completed:
+            self.add_event(milestone.completed, 'milestone', milestone.name)
+
+    def milestone_changed(self, milestone, old_values):
+        if 'name' in old_values or 'completed' in old_values:
+            with self.env.db_transaction:
+                self.remove_events('milestone',
+                                   old_values.get('name', milestone.name))
+                self.milestone_created(milestone)
+
+    def milestone_deleted(self, milestone):
+        self.remove_events('milestone', milestone.name)
+
+    # IWikiChangeListener methods
+
+    def wiki_page_added(self, page):
+        self.add_event(page.time, 'wiki', page.name, page.author)
+
+    def wiki_page_changed(self, page, version, t, comment, author, ipnr):
+        self.add_event(t, 'wiki', page.name, author)
+
+    def wiki_page_deleted(self, page):
+        self.remove_events('wiki', page.name)
+
+    def wiki_page_version_deleted(self, page):
+        pass
+
+    def wiki_page_renamed(self, page, old_name):
+        self.env.db_transaction("""
+            UPDATE timeline_event SET resource=%s
+            WHERE realm='wiki' AND resource=%s
+            """, (page.name, old_name))
+
+    # IRepositoryChangeListener methods
+
+    def changeset_added(self, repos, changeset):
+        self.add_event(changeset.date, 'changeset', changeset.rev,
+                       changeset.author)
+
+    def changeset_modified(self, repos, changeset, old_changeset):
+        pass
+
+    # IAttachmentChangeListener methods
+
+    def attachment_added(self, attachment):
+        self.add_event(attachment.date, attachment.parent_realm,
+                       attachment.parent_id, attachment.author)
+
+    def attachment_deleted(self, attachment):
+        pass
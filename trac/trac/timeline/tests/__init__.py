@@ -1 +1,13 @@
+import unittest
+
+from trac.timeline.tests import web_ui
 from trac.timeline.tests.functional import functionalSuite
+
+def suite():
+
+    suite = unittest.TestSuite()
+    suite.addTest(web_ui.suite())
+    return suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
@@ -0,0 +1,139 @@
+from datetime import datetime, timedelta
+
+from trac.core import Component, implements
+from trac.test import EnvironmentStub, Mock, MockPerm
+from trac.ticket.model import Ticket
+from trac.timeline.api import ITimelineEventProvider
+from trac.timeline.store import TimelineEventStore
+from trac.timeline.web_ui import TimelineModule
+from trac.util.datefmt import utc
+
+import unittest
+
+
+t0 = datetime(2012, 1, 1, tzinfo=utc)
+
+
+class EventProvider(Component):
+
+    implements(ITimelineEventProvider)
+
+    def __init__(self):
+        self.hidden = set()
+        self.ranges = []
+
+    def get_timeline_filters(self, req):
+        yield ('ticket', 'Tickets')
+
+    def get_timeline_events(self, req, start, stop, filters):
+        self.ranges.append((start, stop))
+        for h in range(100):
+            date = t0 - timedelta(hours=h)
+            if start <= date <= stop and h not in self.hidden:
+                yield ('ticket', date, 'joe', h)
+
+
+class TimelineModuleTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.env = EnvironmentStub(enable=[TimelineModule, EventProvider,
+                                           TimelineEventStore])
+        self.env.config.set('timeline', 'event_store_max_age', -1)
+        self.timeline = TimelineModule(self.env)
+        self.provider = EventProvider(self.env)
+        self.store = TimelineEventStore(self.env)
+        self.req = Mock(args={}, perm=MockPerm(), authname='anonymous')
+        self.start = t0 - timedelta(days=30)
+
+    def tearDown(self):
+        self.env.reset_db()
+
+    def _record_events(self):
+        for h in range(100):
+            self.store.add_event(t0 - timedelta(hours=h), 'ticket', h)
+
+    def _gather_events(self, maxrows):
+        events = self.timeline._gather_events(self.req, self.start, t0,
+                                              ['ticket'], set(), set(), [],
+                                              maxrows)
+        return [event['data'] for event in events]
+
+    def test_no_recorded_events(self):
+        self.assertEqual(range(10), self._gather_events(10))
+        self.assertEqual([(self.start, t0)], self.provider.ranges)
+
+    def test_range_of_recorded_events(self):
+        self._record_events()
+        self.assertEqual(range(10), self._gather_events(10))
+        self.assertEqual([(t0 - timedelta(hours=9), t0)],
+                         self.provider.ranges)
+
+    def test_fewer_events_than_recorded(self):
+        self._record_events()
+        self.provider.hidden.update(range(0, 20, 2))
+        self.assertEqual(range(1, 20, 2), self._gather_events(10))
+        self.assertEqual(2, len(self.provider.ranges))
+
+    def test_all_events(self):
+        self._record_events()
+        self.assertEqual(range(100), self._gather_events(0))
+        self.assertEqual([(self.start, t0)], self.provider.ranges)
+
+    def test_ticket_events_recorded(self):
+        ticket = Ticket(self.env)
+        ticket['summary'] = 'summary'
+        ticket['reporter'] = 'joe'
+        ticket.insert()
+        ticket['status'] = 'closed'
+        ticket.save_changes('jim', 'closed')
+        ticket['summary'] = 'changed'
+        ticket.save_changes('jim', 'changed')
+        self.assertEqual([('ticket', 'joe'), ('ticket', 'jim'),
+                          ('ticket_details', 'jim')],
+                         self.env.db_query("""
+                            SELECT realm, author FROM timeline_event
+                            ORDER BY time"""))
+        ticket.delete()
+        self.assertEqual([], self.env.db_query("""
+                            SELECT * FROM timeline_event"""))
+
+    def test_batch_events_recorded(self):
+        for i in range(3):
+            ticket = Ticket(self.env)
+            ticket['summary'] = 'summary'
+            ticket['reporter'] = 'joe'
+            ticket.insert()
+        tickets = list(Ticket.select_many(self.env, [1, 2, 3]))
+        tickets[0]['status'] = 'closed'
+        tickets[1]['summary'] = 'changed'
+        Ticket.save_many(self.env, tickets[:2], 'jim', 'batch')
+        self.assertEqual([(u'1', 'ticket'), (u'2', 'ticket_details')],
+                         self.env.db_query("""
+                            SELECT resource, realm FROM timeline_event
+                            WHERE author='jim' ORDER BY resource"""))
+
+
+    def test_prune(self):
+        now = datetime.now(utc)
+        self.env.config.set('timeline', 'event_store_max_age', 10)
+        self.store.add_event(now - timedelta(days=11), 'ticket', 1)
+        self.store.add_event(now - timedelta(days=9), 'ticket', 2)
+        self.assertEqual([(u'2',)], self.env.db_query("""
+                            SELECT resource FROM timeline_event"""))
+        # pruned at most once per interval
+        self.store.add_event(now - timedelta(days=11), 'ticket', 3)
+        self.assertEqual(2, len(self.env.db_query("""
+                            SELECT * FROM timeline_event""")))
+        self.store.prune()
+        self.assertEqual([(u'2',)], self.env.db_query("""
+                            SELECT resource FROM timeline_event"""))
+        # the providers are asked for the period older than the events
+        self.assertEqual(range(10), self._gather_events(10))
+        self.assertEqual([(self.start, t0)], self.provider.ranges)
+
+
+def suite():
+    return unittest.makeSuite(TimelineModuleTestCase, 'test')
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
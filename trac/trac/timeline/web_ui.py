@@ -27,6 +27,7 @@ from trac.config import IntOption, BoolOption
 from trac.core import *
 from trac.perm import IPermissionRequestor
 from trac.timeline.api import ITimelineEventProvider
+from trac.timeline.store import TimelineEventStore
 from trac.util import as_int
 from trac.util.datefmt import format_date, format_datetime, format_time, \
                               parse_date, to_utimestamp, utc, \
@@ -182,25 +183,8 @@ class TimelineModule(Component):
             else:
                 include.add(name)
         
-        # gather all events for the given period of time
-        events = []
-        for provider in self.event_providers:
-            try:
-                for event in provider.get_timeline_events(req, start, stop,
-                                                          filters) or []:
-                    # Check for 0.10 events
-                    author = (event[2 if len(event) < 6 else 4] or '').lower()
-                    if (not include or author in include) \
-                       and not author in exclude:
-                        events.append(self._event_data(provider, event))
-            except Exception, e: # cope with a failure of that provider
-                self._provider_failure(e, req, provider, filters,
-                                       [f[0] for f in available_filters])
-
-        # prepare sorted global list
-        events = sorted(events, key=lambda e: e['date'], reverse=True)
-        if maxrows:
-            events = events[:maxrows]
+        events = self._gather_events(req, start, stop, filters, include,
+                                     exclude, available_filters, maxrows)
 
         data['events'] = events
         
@@ -337,6 +321,56 @@ class TimelineModule(Component):
 
     # Internal methods
 
+    def _gather_events(self, req, start, stop, filters, include, exclude,
+                       available_filters, maxrows=0):
+        """Return the latest `maxrows` events (or all the events if
+        `maxrows` is 0) for the given period of time, newest first.
+
+        The providers are first asked for the events in the time range of
+        the latest `maxrows` events recorded by the `TimelineEventStore`,
+        then for older events if needed.
+        """
+        events = []
+        event_store = self.env[TimelineEventStore]
+        range_stop = stop
+        factor = 1
+        while range_stop >= start and not (maxrows and
+                                           len(events) >= maxrows):
+            range_start = start
+            if maxrows and event_store:
+                # ask for more events when the providers return fewer
+                # events than recorded (e.g. filtered out by permissions)
+                range_start = event_store.get_range_start(
+                    start, range_stop, filters,
+                    (maxrows - len(events)) * factor)
+                factor *= 2
+            events.extend(self._get_events(req, range_start, range_stop,
+                                           filters, include, exclude,
+                                           available_filters))
+            range_stop = range_start - timedelta(microseconds=1)
+        if maxrows:
+            events = events[:maxrows]
+        return events
+
+    def _get_events(self, req, start, stop, filters, include, exclude,
+                    available_filters):
+        """Return the sorted list of the events of the providers for the
+        given period of time."""
+        events = []
+        for provider in self.event_providers:
+            try:
+                for event in provider.get_timeline_events(req, start, stop,
+                                                          filters) or []:
+                    # Check for 0.10 events
+                    author = (event[2 if len(event) < 6 else 4] or '').lower()
+                    if (not include or author in include) \
+                       and not author in exclude:
+                        events.append(self._event_data(provider, event))
+            except Exception, e: # cope with a failure of that provider
+                self._provider_failure(e, req, provider, filters,
+                                       [f[0] for f in available_filters])
+        return sorted(events, key=lambda e: e['date'], reverse=True)
+
     def _event_data(self, provider, event):
         """Compose the timeline event date from the event tuple and prepared
         provider methods"""
@@ -0,0 +1,39 @@
+from trac.db import Table, Column, Index, DatabaseManager
+
+def do_upgrade(env, ver, cursor):
+    """Add the timeline_event table and fill it with the existing events."""
+    table = Table('timeline_event')[
+        Column('time', type='int64'),
+        Column('realm'),
+        Column('resource'),
+        Column('author'),
+        Index(['time', 'realm']),
+        Index(['realm', 'resource'])]
+    db_connector, _ = DatabaseManager(env).get_connector()
+    for stmt in db_connector.to_sql(table):
+        cursor.execute(stmt)
+
+    db = env.get_read_db()
+    id_text = db.cast('id', 'text')
+    ticket_text = db.cast('ticket', 'text')
+    for sql in ["""
+            SELECT time, 'ticket', %s, reporter FROM ticket
+            """ % id_text, """
+            SELECT DISTINCT time, 'ticket_details', %s, author
+            FROM ticket_change
+            """ % ticket_text, """
+            SELECT time, 'ticket', %s, author FROM ticket_change
+            WHERE field='status' AND newvalue IN ('closed', 'reopened')
+            """ % ticket_text, """
+            SELECT time, 'wiki', name, author FROM wiki
+            """, """
+            SELECT time, 'changeset', rev, author FROM revision
+            """, """
+            SELECT completed, 'milestone', name, '' FROM milestone
+            WHERE completed>0
+            """, """
+            SELECT time, type, id, author FROM attachment
+            """]:
+        cursor.execute("""
+            INSERT INTO timeline_event (time,realm,resource,author)
+            """ + sql)
@@ -0,0 +1,18 @@
+from trac.db import Table, Column, Index, DatabaseManager
+
+def do_upgrade(env, ver, cursor):
+    """Add the notify_queue table."""
+    table = Table('notify_queue', key='id')[
+        Column('id', auto_increment=True),
+        Column('time', type='int64'),
+        Column('next_attempt', type='int64'),
+        Column('attempts', type='int'),
+        Column('coalesce_key'),
+        Column('from_addr'),
+        Column('recipients'),
+        Column('message'),
+        Column('error'),
+        Index(['next_attempt'])]
+    db_connector, _ = DatabaseManager(env).get_connector()
+    for stmt in db_connector.to_sql(table):
+        cursor.execute(stmt)
@@ -0,0 +1,40 @@
+from trac.db import Table, Column, DatabaseManager
+
+def do_upgrade(env, ver, cursor):
+    """Add the node_change_path table and fill it from the node_change table
+    of the repository cache."""
+    table = Table('node_change_path', key=('repos', 'path', 'rev',
+                                           'change_type'))[
+        Column('repos', type='int'),
+        Column('path', key_size=255),
+        Column('rev', key_size=20),
+        Column('change_type', size=1, key_size=2)]
+    db_connector, _ = DatabaseManager(env).get_connector()
+    for stmt in db_connector.to_sql(table):
+        cursor.execute(stmt)
+
+    # The changed paths and their parent directories are inserted for a
+    # few hundred revisions at a time, to keep memory usage bounded
+    cursor.execute("SELECT DISTINCT repos FROM node_change")
+    for repos, in cursor.fetchall():
+        cursor.execute("SELECT DISTINCT rev FROM node_change WHERE repos=%s",
+                       (repos,))
+        revs = [rev for rev, in cursor.fetchall()]
+        for i in range(0, len(revs), 500):
+            chunk = revs[i:i + 500]
+            cursor.execute("""
+                SELECT rev, path, change_type FROM node_change
+                WHERE repos=%%s AND rev IN (%s)
+                """ % ','.join(['%s'] * len(chunk)), [repos] + chunk)
+            rows = set()
+            for rev, path, change_type in cursor.fetchall():
+                rows.add((repos, path, rev, change_type))
+                components = path.split('/')
+                for j in range(1, len(components)):
+                    rows.add((repos, '/'.join(components[:j]), rev, ''))
+            if rows:
+                cursor.executemany("""
+                    INSERT INTO node_change_path
+                      (repos, path, rev, change_type)
+                    VALUES (%s, %s, %s, %s)
+                    """, list(rows))
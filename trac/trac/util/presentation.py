@@ -190,8 +190,14 @@ def paginate(items, page=0, max_per_page=10):
 
 
 class Paginator(object):
+    """Pagination controller.
 
-    def __init__(self, items, page=0, max_per_page=10, num_items=None):
+    When `num_items_known` is `False`, `num_items` is only a lower bound of
+    the number of items (''since 0.13'').
+    """
+
+    def __init__(self, items, page=0, max_per_page=10, num_items=None,
+                 num_items_known=True):
         if not page:
             page = 0
 
@@ -208,6 +214,7 @@ class Paginator(object):
         self.num_pages = num_pages
         self.span = offset, offset + len(items)
         self.show_index = True
+        self.num_items_known = num_items_known
 
     def __iter__(self):
         return iter(self.items)
@@ -255,6 +262,10 @@ class Paginator(object):
         from trac.util.translation import _
         start, stop = self.span
         total = self.num_items
+        if not self.num_items_known:
+            if start+1 == stop:
+                return _("%(last)d", last=stop)
+            return _("%(start)d - %(stop)d", start=start+1, stop=stop)
         if start+1 == stop:
             return _("%(last)d of %(total)d", last=stop, total=total)
         else:
@@ -123,7 +123,8 @@ try:
         """
 
         def __init__(self):
-            self._current = ThreadLocal(args=None, translations=None)
+            self._current = ThreadLocal(args=None, translations=None,
+                                        locale=None)
             self._null_translations = NullTranslationsBabel()
             self._plugin_domains = {}
             self._plugin_domains_lock = threading.RLock()
@@ -158,6 +159,7 @@ try:
                     for domain, dirname in domains:
                         t.add(Translations.load(dirname, locale, domain))
             self._current.translations = t
+            self._current.locale = str(locale or 'en_US')
             self._activate_failed = False
          
         def deactivate(self):
@@ -184,6 +186,11 @@ try:
             return self._current.translations is not None \
                    or self._activate_failed
 
+        @property
+        def active_locale(self):
+            if self.isactive and self._current.translations is not None:
+                return self._current.locale
+
         # Delegated methods
 
         def __getattr__(self, name):
@@ -330,6 +337,12 @@ try:
     def get_translations():
         return translations
 
+    def get_active_locale():
+        """Return the identifier of the locale of the active translations,
+        or `None` if no translations are active.
+        """
+        return translations.active_locale
+
     def get_available_locales():
         """Return a list of locale identifiers of the locales for which
         translations are available.
@@ -376,6 +389,9 @@ except ImportError: # fall back on 0.11 behavior, i18n functions are no-ops
     def get_translations():
         return translations
 
+    def get_active_locale():
+        return None
+
     def get_available_locales():
         return []
 
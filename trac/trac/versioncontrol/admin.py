@@ -13,16 +13,19 @@
 
 import os.path
 import sys
+import threading
 
 from genshi.builder import tag
 
 from trac.admin import IAdminCommandProvider, IAdminPanelProvider
 from trac.config import ListOption
 from trac.core import *
+from trac.db import DatabaseManager
 from trac.perm import IPermissionRequestor
 from trac.util import as_bool, is_path_below
 from trac.util.compat import any
-from trac.util.text import breakable_path, normalize_whitespace, print_table, \
+from trac.util.text import breakable_path, exception_to_unicode, \
+                           normalize_whitespace, print_table, printerr, \
                            printout
 from trac.util.translation import _, ngettext, tag_
 from trac.versioncontrol import DbRepositoryProvider, RepositoryManager, \
@@ -67,6 +70,10 @@ class VersionControlAdmin(Component):
                using the `sync` command.
                
                To synchronize all repositories, specify "*" as the repository.
+               Specify `--parallel` instead of [rev] to synchronize them
+               concurrently, with up to 4 threads. This is not supported
+               with an SQLite database, which only allows one writer at a
+               time.
                """,
                self._complete_repos, self._do_resync)
         yield ('repository sync', '<repos> [rev]',
@@ -74,7 +81,8 @@ class VersionControlAdmin(Component):
 
                It works like `resync`, except that it doesn't clear the already
                synchronized changesets, so it's a better way to resume an
-               interrupted `resync`.
+               interrupted `resync`. `--parallel` can be specified as well
+               when synchronizing all repositories.
                
                See `resync` help for detailed usage.
                """,
@@ -115,6 +123,13 @@ class VersionControlAdmin(Component):
     def _sync(self, reponame, rev, clean):
         rm = RepositoryManager(self.env)
         if reponame == '*':
+            if rev in ('-p', '--parallel'):
+                if DatabaseManager(self.env).connection_uri \
+                        .startswith('sqlite:'):
+                    raise TracError(_('Cannot synchronize repositories in '
+                                      'parallel with an SQLite database'))
+                self._sync_parallel(rm.get_real_repositories(), clean)
+                return
             if rev is not None:
                 raise TracError(_('Cannot synchronize a single revision '
                                   'on multiple repositories'))
@@ -137,13 +152,68 @@ class VersionControlAdmin(Component):
             printout(_('Resyncing repository history for %(reponame)s... ',
                        reponame=repos.reponame or '(default)'))
             repos.sync(self._sync_feedback, clean=clean)
-            for cnt, in self.env.db_query(
-                    "SELECT count(rev) FROM revision WHERE repos=%s",
-                    (repos.id,)):
-                printout(ngettext('%(num)s revision cached.',
-                                  '%(num)s revisions cached.', num=cnt))
+            self._print_revision_count(repos)
         printout(_('Done.'))
 
+    # Maximum number of repositories synchronized at the same time
+    max_parallel_syncs = 4
+
+    def _sync_parallel(self, repositories, clean):
+        rm = RepositoryManager(self.env)
+        failures = []
+        repositories = sorted(repositories, key=lambda r: r.reponame)
+        pending = [repos.reponame for repos in reversed(repositories)]
+
+        def sync():
+            # repositories are bound to the thread which retrieved them
+            try:
+                while True:
+                    try:
+                        reponame = pending.pop()
+                    except IndexError:
+                        break
+                    try:
+                        rm.get_repository(reponame).sync(clean=clean)
+                    except Exception, e:
+                        self.log.error("Failed to synchronize repository "
+                                       "%s: %s", reponame or '(default)',
+                                       exception_to_unicode(e,
+                                                            traceback=True))
+                        failures.append((reponame, e))
+            finally:
+                rm.shutdown(threading._get_ident())
+
+        for repos in repositories:
+            printout(_('Resyncing repository history for %(reponame)s... ',
+                       reponame=repos.reponame or '(default)'))
+        threads = []
+        for i in xrange(min(self.max_parallel_syncs, len(repositories))):
+            thread = threading.Thread(target=sync)
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+        for repos in repositories:
+            printout('%s: ' % (repos.reponame or '(default)'), newline=False)
+            self._print_revision_count(repos)
+        for reponame, e in failures:
+            printerr(_('Failed to synchronize %(reponame)s: %(error)s',
+                       reponame=reponame or '(default)',
+                       error=exception_to_unicode(e)))
+        if failures:
+            raise TracError(ngettext('Synchronization failed for %(num)d '
+                                     'repository',
+                                     'Synchronization failed for %(num)d '
+                                     'repositories', num=len(failures)))
+        printout(_('Done.'))
+
+    def _print_revision_count(self, repos):
+        for cnt, in self.env.db_query(
+                "SELECT count(rev) FROM revision WHERE repos=%s",
+                (repos.id,)):
+            printout(ngettext('%(num)s revision cached.',
+                              '%(num)s revisions cached.', num=cnt))
+
     def _sync_feedback(self, rev):
         sys.stdout.write(' [%s]\r' % rev)
         sys.stdout.flush()
@@ -244,6 +244,7 @@ class DbRepositoryProvider(Component):
             db("DELETE FROM repository WHERE id=%s", (id,))
             db("DELETE FROM revision WHERE repos=%s", (id,))
             db("DELETE FROM node_change WHERE repos=%s", (id,))
+            db("DELETE FROM node_change_path WHERE repos=%s", (id,))
         rm.reload_repositories()
     
     def modify_repository(self, reponame, changes):
@@ -890,6 +891,21 @@ class Repository(object):
         """
         raise NotImplementedError
 
+    def iter_changesets(self, rev):
+        """Generate the changesets from `rev` to the youngest revision, in
+        the order given by `next_rev()`.
+
+        The generated items are `(changeset, changes)` tuples, where
+        `changes` is the list of changes returned by
+        `changeset.get_changes()`. This is used to populate the cache, and
+        backends may override it to read the history in a single pass.
+        (''since 0.13'')
+        """
+        while rev is not None:
+            changeset = self.get_changeset(rev)
+            yield changeset, list(changeset.get_changes())
+            rev = self.next_rev(rev)
+
     def parent_revs(self, rev):
         """Return a list of parents of the specified revision."""
         parent = self.previous_rev(rev)
@@ -16,6 +16,7 @@
 
 from __future__ import with_statement
 
+from itertools import islice
 import os
 
 from trac.cache import cached
@@ -36,10 +37,24 @@ CACHE_YOUNGEST_REV = 'youngest_rev'
 CACHE_METADATA_KEYS = (CACHE_REPOSITORY_DIR, CACHE_YOUNGEST_REV)
 
 
+def _node_change_paths(repos, srev, path, change_type):
+    """Return the `node_change_path` rows for a change on `path`: the path
+    itself with the type of change, and each of its parent directories.
+    """
+    rows = [(repos, path, srev, change_type)]
+    components = path.split('/')
+    for i in range(1, len(components)):
+        rows.append((repos, '/'.join(components[:i]), srev, ''))
+    return rows
+
+
 class CachedRepository(Repository):
 
     has_linear_changesets = False
 
+    # Number of changesets written to the cache in a single transaction
+    sync_batch_size = 1000
+
     scope = property(lambda self: self.repos.scope)
     
     def __init__(self, env, repos, log):
@@ -112,6 +127,8 @@ class CachedRepository(Repository):
                    (self.id,))
                 db("DELETE FROM node_change WHERE repos=%s",
                    (self.id,))
+                db("DELETE FROM node_change_path WHERE repos=%s",
+                   (self.id,))
                 db.executemany("DELETE FROM repository WHERE id=%s AND name=%s",
                                [(self.id, k) for k in CACHE_METADATA_KEYS])
                 db.executemany("""
@@ -220,24 +237,45 @@ class CachedRepository(Repository):
 
             kindmap = dict(zip(_kindmap.values(), _kindmap.keys()))
             actionmap = dict(zip(_actionmap.values(), _actionmap.keys()))
+            changesets = self.repos.iter_changesets(next_youngest)
+
+            while True:
+                batch = list(islice(changesets, self.sync_batch_size))
+                if not batch:
+                    break
+                revisions = []
+                node_changes = []
+                node_paths = set()
+                for cset, changes in batch:
+                    srev = self.db_rev(cset.rev)
+                    revisions.append((self.id, srev, to_utimestamp(cset.date),
+                                      cset.author, cset.message))
+                    for path, kind, action, bpath, brev in changes:
+                        self.log.debug("Caching node change in [%s]: %r",
+                                       cset.rev,
+                                       (path, kind, action, bpath, brev))
+                        action = actionmap[action]
+                        node_changes.append((self.id, srev, path,
+                                             kindmap[kind], action, bpath,
+                                             brev))
+                        node_paths.update(_node_change_paths(self.id, srev,
+                                                             path, action))
+                next_youngest = batch[-1][0].rev
 
-            while next_youngest is not None:
-                srev = self.db_rev(next_youngest)
-                
                 with self.env.db_transaction as db:
-                    
+
                     # 1.1 Attempt to resync the 'revision' table
-                    self.log.info("Trying to sync revision [%s]",
-                                  next_youngest)
-                    cset = self.repos.get_changeset(next_youngest)
+                    self.log.info("Trying to sync revisions [%s] to [%s]",
+                                  batch[0][0].rev, next_youngest)
                     try:
-                        db("""INSERT INTO revision
-                                (repos, rev, time, author, message)
-                              VALUES (%s, %s, %s, %s, %s)
-                              """, (self.id, srev, to_utimestamp(cset.date),
-                                    cset.author, cset.message))
-                    except Exception, e: # *another* 1.1. resync attempt won 
-                        self.log.warning('Revision %s already cached: %r',
+                        db.executemany("""
+                            INSERT INTO revision
+                              (repos, rev, time, author, message)
+                            VALUES (%s, %s, %s, %s, %s)
+                            """, revisions)
+                    except Exception, e: # *another* 1.1. resync attempt won
+                        self.log.warning('Revisions %s to %s already cached: '
+                                         '%r', batch[0][0].rev,
                                          next_youngest, e)
                         # also potentially in progress, so keep ''previous''
                         # notion of 'youngest'
@@ -245,38 +283,38 @@ class CachedRepository(Repository):
                         # FIXME: This aborts a containing transaction
                         db.rollback()
                         return
-    
+
                     # 1.2. now *only* one process was able to get there
                     #      (i.e. there *shouldn't* be any race condition here)
-    
-                    for path, kind, action, bpath, brev in cset.get_changes():
-                        self.log.debug("Caching node change in [%s]: %r",
-                                       next_youngest,
-                                       (path, kind, action, bpath, brev))
-                        kind = kindmap[kind]
-                        action = actionmap[action]
-                        db("""INSERT INTO node_change
-                                (repos, rev, path, node_type, change_type,
-                                 base_path, base_rev)
-                              VALUES (%s, %s, %s, %s, %s, %s, %s)
-                              """, (self.id, srev, path, kind, action, bpath,
-                                    brev))
-    
-                    # 1.3. update 'youngest_rev' metadata 
+                    if node_changes:
+                        db.executemany("""
+                            INSERT INTO node_change
+                              (repos, rev, path, node_type, change_type,
+                               base_path, base_rev)
+                            VALUES (%s, %s, %s, %s, %s, %s, %s)
+                            """, node_changes)
+                        db.executemany("""
+                            INSERT INTO node_change_path
+                              (repos, path, rev, change_type)
+                            VALUES (%s, %s, %s, %s)
+                            """, list(node_paths))
+
+                    # 1.3. update 'youngest_rev' metadata, which is also the
+                    #      checkpoint an interrupted sync resumes from
                     #      (minimize possibility of failures at point 0.)
                     db("""UPDATE repository SET value=%s
                           WHERE id=%s AND name=%s
-                          """, (str(next_youngest), 
+                          """, (str(next_youngest),
                                 self.id, CACHE_YOUNGEST_REV))
                     del self.metadata
 
                 # 1.4. iterate (1.1 should always succeed now)
                 youngest = next_youngest
-                next_youngest = self.repos.next_rev(next_youngest)
 
                 # 1.5. provide some feedback
                 if feedback:
-                    feedback(youngest)
+                    for cset, changes in batch:
+                        feedback(cset.rev)
 
     def get_node(self, path, rev=None):
         return self.repos.get_node(path, self.normalize_rev(rev))
@@ -291,19 +329,18 @@ class CachedRepository(Repository):
         with self.env.db_query as db:
             if first is None:
                 first = db("""
-                    SELECT rev FROM node_change
-                    WHERE repos=%s AND rev<=%s AND path=%s
+                    SELECT rev FROM node_change_path
+                    WHERE repos=%s AND path=%s AND rev<=%s
                       AND change_type IN ('A', 'C', 'M')
                     ORDER BY rev DESC LIMIT 1
-                    """, (self.id, slast, path))
+                    """, (self.id, path, slast))
                 first = int(first[0][0]) if first else 0
             sfirst = self.db_rev(first)
+            # changes on path itself or below it
             return [int(rev) for rev, in db("""
-                    SELECT DISTINCT rev FROM node_change
-                    WHERE repos=%%s AND rev>=%%s AND rev<=%%s
-                      AND (path=%%s OR path %s)""" % db.like(),
-                    (self.id, sfirst, slast, path,
-                     db.like_escape(path + '/') + '%'))]
+                    SELECT DISTINCT rev FROM node_change_path
+                    WHERE repos=%s AND path=%s AND rev>=%s AND rev<=%s
+                    """, (self.id, path, sfirst, slast))]
 
     def has_node(self, path, rev=None):
         return self.repos.has_node(path, self.normalize_rev(rev))
@@ -328,29 +365,36 @@ class CachedRepository(Repository):
 
     def _next_prev_rev(self, direction, rev, path=''):
         srev = self.db_rev(rev)
+        order = " ORDER BY rev" + (" DESC" if direction == '<' else "") + \
+                " LIMIT 1"
         with self.env.db_query as db:
             # the changeset revs are sequence of ints:
-            sql = "SELECT rev FROM node_change WHERE repos=%s AND " + \
-                  "rev" + direction + "%s"
-            args = [self.id, srev]
-
-            if path:
-                path = path.lstrip('/')
-                # changes on path itself or its children
-                sql += " AND (path=%s OR path " + db.like()
-                args.extend((path, db.like_escape(path + '/') + '%'))
-                # deletion of path ancestors
-                components = path.lstrip('/').split('/')
-                parents = ','.join(('%s',) * len(components))
-                sql += " OR (path IN (" + parents + ") AND change_type='D'))"
-                for i in range(1, len(components) + 1):
-                    args.append('/'.join(components[:i]))
-
-            sql += " ORDER BY rev" + (" DESC" if direction == '<' else "") \
-                   + " LIMIT 1"
-            
-            for rev, in db(sql, args):
-                return int(rev)
+            if not path:
+                for rev, in db("SELECT rev FROM node_change WHERE repos=%s "
+                               "AND rev" + direction + "%s" + order,
+                               (self.id, srev)):
+                    return int(rev)
+                return None
+
+            path = path.lstrip('/')
+            # changes on path itself or below it
+            revs = [int(rev) for rev, in db("""
+                SELECT rev FROM node_change_path
+                WHERE repos=%s AND path=%s AND rev""" + direction + "%s" +
+                order, (self.id, path, srev))]
+            # deletion of path ancestors
+            components = path.split('/')
+            ancestors = ['/'.join(components[:i])
+                         for i in range(1, len(components))]
+            if ancestors:
+                revs.extend(int(rev) for rev, in db("""
+                    SELECT rev FROM node_change_path
+                    WHERE repos=%%s AND path IN (%s) AND change_type='D'
+                      AND rev""" % ','.join(('%s',) * len(ancestors)) +
+                    direction + "%s" + order,
+                    [self.id] + ancestors + [srev]))
+            if revs:
+                return max(revs) if direction == '<' else min(revs)
 
     def rev_older_than(self, rev1, rev2):
         return self.repos.rev_older_than(self.normalize_rev(rev1),
@@ -190,6 +190,74 @@ class CacheTestCase(unittest.TestCase):
         self.assertEquals(('2', 'trunk/README', 'F', 'E', 'trunk/README', '1'),
                           rows[2])
 
+    def test_sync_in_batches(self):
+        t1 = datetime(2001, 1, 1, 1, 1, 1, 0, utc)
+        repos = self.get_repos(get_changeset=lambda x: changesets[int(x)],
+                               youngest_rev=4)
+        def get_changes(rev):
+            if rev in failing:
+                raise IOError('failed to read %d' % rev)
+            return [('file%d' % rev, Node.FILE, Changeset.ADD, None, None)]
+        failing = set([3])
+        changesets = [Mock(Changeset, repos, rev, 'Change %d' % rev, 'joe',
+                           t1, get_changes=lambda rev=rev: get_changes(rev))
+                      for rev in range(5)]
+        cache = CachedRepository(self.env, repos, self.log)
+        cache.sync_batch_size = 2
+        synced = []
+        self.assertRaises(IOError, cache.sync, synced.append)
+
+        # the first batch is committed, and the sync resumes after it
+        self.assertEquals([0, 1], synced)
+        self.assertEquals('1', cache.metadata['youngest_rev'])
+        failing.clear()
+        cache.sync(synced.append)
+        self.assertEquals([0, 1, 2, 3, 4], synced)
+        self.assertEquals([('0', 'file0'), ('1', 'file1'), ('2', 'file2'),
+                           ('3', 'file3'), ('4', 'file4')],
+                          self.env.db_query("""
+                              SELECT rev, path FROM node_change
+                              ORDER BY rev"""))
+
+    def test_path_history(self):
+        t1 = datetime(2001, 1, 1, 1, 1, 1, 0, utc)
+        repos = self.get_repos(get_changeset=lambda x: changesets[int(x)],
+                               youngest_rev=5)
+        repos.get_node = lambda path, rev: None
+        changes = [
+            [],
+            [('trunk', Node.DIRECTORY, Changeset.ADD, None, None),
+             ('trunk/README', Node.FILE, Changeset.ADD, None, None),
+             ('trunk/src', Node.DIRECTORY, Changeset.ADD, None, None),
+             ('trunk/src/main.c', Node.FILE, Changeset.ADD, None, None)],
+            [('trunk/src/main.c', Node.FILE, Changeset.EDIT,
+              'trunk/src/main.c', 1)],
+            [('trunk/README', Node.FILE, Changeset.EDIT, 'trunk/README', 2)],
+            [('trunk/src', Node.DIRECTORY, Changeset.DELETE, 'trunk/src',
+              3)],
+            [('branches', Node.DIRECTORY, Changeset.ADD, None, None)]]
+        changesets = [Mock(Changeset, repos, rev, 'Change %d' % rev, 'joe',
+                           t1, get_changes=lambda rev=rev: changes[rev])
+                      for rev in range(6)]
+        cache = CachedRepository(self.env, repos, self.log)
+        cache.has_linear_changesets = True
+        cache.sync()
+
+        self.assertEquals(2, cache.next_rev(1))
+        self.assertEquals(2, cache.next_rev(1, 'trunk/src/main.c'))
+        self.assertEquals(4, cache.next_rev(2, 'trunk/src/main.c'))
+        self.assertEquals(3, cache.next_rev(1, '/trunk/README'))
+        self.assertEquals(None, cache.next_rev(3, 'trunk/README'))
+        self.assertEquals(2, cache.previous_rev(4, 'trunk/src/main.c'))
+        self.assertEquals(3, cache.previous_rev(4, 'trunk'))
+        self.assertEquals(4, cache.previous_rev(5, 'trunk/src'))
+        self.assertEquals([1, 2, 3, 4],
+                          sorted(cache._get_node_revs('trunk', 4)))
+        self.assertEquals([1, 2],
+                          sorted(cache._get_node_revs('trunk/src/main.c', 3)))
+        self.assertEquals([2, 3],
+                          sorted(cache._get_node_revs('trunk', 3, 2)))
+
     def test_sync_changeset(self):
         t1 = datetime(2001, 1, 1, 1, 1, 1, 0, utc)
         t2 = datetime(2002, 1, 1, 1, 1, 1, 0, utc)
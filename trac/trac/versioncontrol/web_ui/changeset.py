@@ -20,6 +20,7 @@
 
 from __future__ import with_statement
 
+from functools import partial
 from itertools import groupby
 import os
 import posixpath
@@ -33,7 +34,8 @@ from trac.core import *
 from trac.mimeview.api import Mimeview
 from trac.perm import IPermissionRequestor
 from trac.resource import Resource, ResourceNotFound
-from trac.search import ISearchSource, search_to_sql, shorten_result
+from trac.search import ISearchSource, render_excerpts, search_rows, \
+                         search_to_sql, shorten_result
 from trac.timeline.api import ITimelineEventProvider
 from trac.util import as_bool, content_disposition, embedded_numbers, pathjoin
 from trac.util.datefmt import from_utimestamp, pretty_timedelta
@@ -1145,6 +1147,10 @@ class ChangesetModule(Component):
             yield ('changeset', _('Changesets'))
 
     def get_search_results(self, req, terms, filters):
+        return render_excerpts(self.get_search_results_by_date(req, terms,
+                                                               filters))
+
+    def get_search_results_by_date(self, req, terms, filters, limit=None):
         if not 'changeset' in filters:
             return
         rm = RepositoryManager(self.env)
@@ -1152,10 +1158,11 @@ class ChangesetModule(Component):
                             for repos in rm.get_real_repositories())
         with self.env.db_query as db:
             sql, args = search_to_sql(db, ['rev', 'message', 'author'], terms)
-            for id, rev, ts, author, log in db("""
+            for id, rev, ts, author, log in search_rows(db, """
                     SELECT repos, rev, time, author, message 
-                    FROM revision WHERE """ + sql,
-                    args):
+                    FROM revision WHERE """ + sql + """
+                    ORDER BY time DESC, repos, rev""",
+                    args, limit):
                 try:
                     rev = int(rev)
                 except ValueError:
@@ -1168,7 +1175,7 @@ class ChangesetModule(Component):
                     yield (req.href.changeset(rev, repos.reponame or None),
                            '[%s]: %s' % (rev, shorten_line(log)),
                            from_utimestamp(ts), author,
-                           shorten_result(log, terms))
+                           partial(shorten_result, log, terms))
 
 
 class AnyDiffModule(Component):
@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2012 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.org/wiki/TracLicense.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://trac.edgewall.org/log/.
+
+from __future__ import with_statement
+
+import gc
+import time
+
+from trac.config import ExtensionOption, IntOption
+from trac.core import *
+from trac.env import ISystemInfoProvider
+from trac.util.concurrency import threading
+from trac.util.text import exception_to_unicode
+
+__all__ = ['IGarbageCollectionPolicy', 'GarbageCollector',
+           'FullCollectionPolicy', 'AdaptiveCollectionPolicy']
+
+
+class IGarbageCollectionPolicy(Interface):
+    """Decide when the garbage collector runs in a web front-end
+    process."""
+
+    def request_finished(collector):
+        """Called after a request has been processed and its database
+        connections released.
+
+        `collector` is the `GarbageCollector`, whose `collect()` method
+        runs and measures a collection.
+        """
+
+
+class GarbageCollector(Component):
+    """Run garbage collections according to the configured policy and
+    keep statistics about them.
+
+    The statistics are logged at the debug level after each collection
+    and summarized in the system information of the "About Trac" page.
+    """
+
+    required = True
+
+    implements(ISystemInfoProvider)
+
+    policy = ExtensionOption('gc', 'policy', IGarbageCollectionPolicy,
+                             'FullCollectionPolicy',
+        """Name of the component deciding when garbage collections run
+        after requests. `FullCollectionPolicy` runs a full collection
+        after each request. `AdaptiveCollectionPolicy` only collects the
+        youngest generations after requests, and runs full collections
+        after a number of requests, allocations or seconds, as
+        configured in the `[gc]` section. (''since 0.13'')""")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = [dict(collections=0, pause=0.0, max_pause=0.0,
+                            unreachable=0) for generation in range(3)]
+        self._policy = self._policy_name = None
+
+    def request_finished(self):
+        """Give the policy a chance to collect garbage at the end of a
+        request."""
+        self._get_policy().request_finished(self)
+
+    def _get_policy(self):
+        """Return the configured policy, resolved again only when the
+        `[gc] policy` option changes. An invalid policy is logged once
+        and replaced by `FullCollectionPolicy`, so that it doesn't make
+        every request fail.
+        """
+        name = self.config.get('gc', 'policy')
+        if self._policy is None or name != self._policy_name:
+            try:
+                policy = self.policy
+            except AttributeError, e:
+                self.log.error("Invalid [gc] policy, using "
+                               "FullCollectionPolicy instead: %s",
+                               exception_to_unicode(e))
+                policy = FullCollectionPolicy(self.env)
+            self._policy, self._policy_name = policy, name
+        return self._policy
+
+    def collect(self, generation=2):
+        """Collect `generation` and the younger generations, and return
+        the number of unreachable objects found."""
+        start = time.time()
+        unreachable = gc.collect(generation)
+        pause = time.time() - start
+        with self._lock:
+            stats = self._stats[generation]
+            stats['collections'] += 1
+            stats['pause'] += pause
+            stats['max_pause'] = max(stats['max_pause'], pause)
+            stats['unreachable'] += unreachable
+        self.log.debug("Collected generation %d in %.1f ms, %d unreachable "
+                       "objects found", generation, pause * 1000,
+                       unreachable)
+        return unreachable
+
+    def get_stats(self):
+        """Return a list of the collection statistics of each generation.
+
+        Each item is a `dict` with the number of `collections`, the total
+        and maximal `pause` in seconds and the number of `unreachable`
+        objects found by the collections run through `collect()`.
+        """
+        with self._lock:
+            return [stats.copy() for stats in self._stats]
+
+    # ISystemInfoProvider methods
+
+    def get_system_info(self):
+        info = []
+        for generation, stats in enumerate(self.get_stats()):
+            if stats['collections']:
+                info.append("gen%d: %d collections, %.1f ms average pause, "
+                            "%.1f ms max pause, %d unreachable"
+                            % (generation, stats['collections'],
+                               stats['pause'] * 1000 / stats['collections'],
+                               stats['max_pause'] * 1000,
+                               stats['unreachable']))
+        if info:
+            yield 'Garbage collection', '; '.join(info)
+
+
+class FullCollectionPolicy(Component):
+    """Run a full collection after each request."""
+
+    implements(IGarbageCollectionPolicy)
+
+    def request_finished(self, collector):
+        collector.collect()
+
+
+class AdaptiveCollectionPolicy(Component):
+    """Only collect the youngest generations after requests and run full
+    collections when enough garbage may have accumulated.
+
+    A full collection runs after `full_collection_requests` requests or
+    when about `full_collection_allocations` objects have been allocated
+    since the last full collection. When `full_collection_interval` is
+    set, full collections run in a background thread instead, so that
+    requests never wait for them.
+    """
+
+    implements(IGarbageCollectionPolicy)
+
+    young_generation = IntOption('gc', 'young_generation', 0,
+        """Generation collected after each request by the
+        `AdaptiveCollectionPolicy`: `0` or `1`, or `-1` to leave the
+        young generations to the automatic collection of Python.
+        (''since 0.13'')""")
+
+    full_collection_requests = IntOption('gc', 'full_collection_requests',
+                                         100,
+        """Number of requests after which the `AdaptiveCollectionPolicy`
+        runs a full collection, or `0` to disable. (''since 0.13'')""")
+
+    full_collection_allocations = IntOption('gc',
+                                            'full_collection_allocations', 0,
+        """Estimated number of objects allocated since the last full
+        collection after which the `AdaptiveCollectionPolicy` runs a full
+        collection, or `0` to disable. (''since 0.13'')""")
+
+    full_collection_interval = IntOption('gc', 'full_collection_interval',
+                                         0,
+        """Number of seconds between the full collections that the
+        `AdaptiveCollectionPolicy` runs in a background thread, or `0` to
+        run them after requests. (''since 0.13'')""")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._thread = None
+        self._stopped = False
+        self._event = threading.Event()
+
+    def shutdown(self):
+        """Stop the collection thread, called when the environment is
+        shut down."""
+        self._stopped = True
+        self._event.set()
+
+    def request_finished(self, collector):
+        if self.full_collection_interval > 0:
+            self._start_timer(collector)
+        elif self._is_full_collection_due():
+            collector.collect(2)
+            return
+        if self.young_generation in (0, 1):
+            collector.collect(self.young_generation)
+
+    def _is_full_collection_due(self):
+        with self._lock:
+            self._requests += 1
+            due = 0 < self.full_collection_requests <= self._requests
+            if not due and self.full_collection_allocations > 0:
+                due = allocations() >= self.full_collection_allocations
+            if due:
+                self._requests = 0
+            return due
+
+    def _start_timer(self, collector):
+        with self._lock:
+            if self._thread is not None or self._stopped:
+                return
+            self._thread = threading.Thread(target=self._run_timer,
+                                            args=(collector,),
+                                            name='GarbageCollector')
+            self._thread.setDaemon(True)
+            self._thread.start()
+
+    def _run_timer(self, collector):
+        while self.full_collection_interval > 0:
+            self._event.wait(self.full_collection_interval)
+            if self._stopped:
+                break
+            try:
+                collector.collect(2)
+            except Exception, e:
+                self.log.error("Garbage collection failed: %s",
+                               exception_to_unicode(e))
+        with self._lock:
+            self._thread = None
+
+
+def allocations():
+    """Estimate the number of objects allocated since the last full
+    collection from the collection counts of each generation."""
+    count0, count1, count2 = gc.get_count()
+    threshold0, threshold1 = gc.get_threshold()[:2]
+    return count0 + (count1 + count2 * threshold1) * threshold0
@@ -50,6 +50,7 @@ from trac.util.translation import _, get_negotiated_locale, has_babel, \
                                   safefmt, tag_
 from trac.web.api import *
 from trac.web.chrome import Chrome
+from trac.web.gcpolicy import GarbageCollector
 from trac.web.href import Href
 from trac.web.session import Session
 
@@ -360,7 +361,7 @@ def dispatch_request(environ, start_response):
                        os.getenv('TRAC_BASE_URL'))
     
 
-    locale.setlocale(locale.LC_ALL, environ['trac.locale'])
+    _set_process_locale(environ['trac.locale'])
 
     # Determine the environment
     env_path = environ.get('trac.env_path')
@@ -450,21 +451,32 @@ def dispatch_request(environ, start_response):
         translation.deactivate()
         if env and not run_once:
             env.shutdown(threading._get_ident())
-            # Now it's a good time to do some clean-ups
+            # Now it's a good time to do some clean-ups, as decided by the
+            # `[gc] policy`
             #
             # Note: enable the '##' lines as soon as there's a suspicion
             #       of memory leak due to uncollectable objects (typically
             #       objects with a __del__ method caught in a cycle)
             #
             ##gc.set_debug(gc.DEBUG_UNCOLLECTABLE)
-            unreachable = gc.collect()
-            ##env.log.debug("%d unreachable objects found.", unreachable)
+            GarbageCollector(env).request_finished()
             ##uncollectable = len(gc.garbage)
             ##if uncollectable:
             ##    del gc.garbage[:]
             ##    env.log.warn("%d uncollectable objects found.", uncollectable)
 
 
+_process_locale = None
+
+def _set_process_locale(name):
+    """Set the locale of the process, unless it was already set to `name`
+    by a previous request."""
+    global _process_locale
+    if name != _process_locale:
+        locale.setlocale(locale.LC_ALL, name)
+        _process_locale = name
+
+
 def _dispatch_request(req, env, env_error):
     resp = []
 
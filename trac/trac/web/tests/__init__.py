@@ -13,8 +13,8 @@
 
 import unittest
 
-from trac.web.tests import api, auth, cgi_frontend, chrome, href, session, \
-                           wikisyntax, main
+from trac.web.tests import api, auth, cgi_frontend, chrome, gcpolicy, href, \
+                           session, wikisyntax, main
 
 def suite():
     suite = unittest.TestSuite()
@@ -22,6 +22,7 @@ def suite():
     suite.addTest(auth.suite())
     suite.addTest(cgi_frontend.suite())
     suite.addTest(chrome.suite())
+    suite.addTest(gcpolicy.suite())
     suite.addTest(href.suite())
     suite.addTest(session.suite())
     suite.addTest(wikisyntax.suite())
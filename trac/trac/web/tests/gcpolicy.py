@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2012 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.org/wiki/TracLicense.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://trac.edgewall.org/log/.
+
+from trac.test import EnvironmentStub
+from trac.web.gcpolicy import AdaptiveCollectionPolicy, GarbageCollector
+
+import unittest
+
+
+class GarbageCollectorTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.env = EnvironmentStub()
+        self.collector = GarbageCollector(self.env)
+
+    def _collections(self):
+        return [stats['collections'] for stats in self.collector.get_stats()]
+
+    def test_full_collection_policy(self):
+        self.collector.request_finished()
+        self.collector.request_finished()
+        self.assertEqual([0, 0, 2], self._collections())
+
+    def test_invalid_policy(self):
+        self.env.config.set('gc', 'policy', 'NoSuchPolicy')
+        self.collector.request_finished()
+        self.assertEqual([0, 0, 1], self._collections())
+        self.env.config.set('gc', 'policy', 'AdaptiveCollectionPolicy')
+        self.env.config.set('gc', 'full_collection_requests', 0)
+        self.collector.request_finished()
+        self.assertEqual([1, 0, 1], self._collections())
+
+    def test_stats(self):
+        class Cycle(object):
+            pass
+        cycle = Cycle()
+        cycle.cycle = cycle
+        del cycle
+        self.assertTrue(self.collector.collect() >= 1)
+        stats = self.collector.get_stats()[2]
+        self.assertEqual(1, stats['collections'])
+        self.assertTrue(stats['unreachable'] >= 1)
+        self.assertTrue(stats['max_pause'] <= stats['pause'])
+        name, info = list(self.collector.get_system_info())[0]
+        self.assertEqual('Garbage collection', name)
+        self.assertTrue(info.startswith('gen2: 1 collections'))
+
+    def test_adaptive_policy_requests(self):
+        self.env.config.set('gc', 'policy', 'AdaptiveCollectionPolicy')
+        self.env.config.set('gc', 'full_collection_requests', 3)
+        for i in range(7):
+            self.collector.request_finished()
+        self.assertEqual([5, 0, 2], self._collections())
+
+    def test_adaptive_policy_young_generation(self):
+        self.env.config.set('gc', 'policy', 'AdaptiveCollectionPolicy')
+        self.env.config.set('gc', 'young_generation', 1)
+        self.env.config.set('gc', 'full_collection_requests', 0)
+        for i in range(3):
+            self.collector.request_finished()
+        self.assertEqual([0, 3, 0], self._collections())
+
+    def test_adaptive_policy_allocations(self):
+        self.env.config.set('gc', 'policy', 'AdaptiveCollectionPolicy')
+        self.env.config.set('gc', 'young_generation', -1)
+        self.env.config.set('gc', 'full_collection_requests', 0)
+        self.env.config.set('gc', 'full_collection_allocations', 1)
+        garbage = [[] for i in range(10)]
+        self.collector.request_finished()
+        self.assertEqual([0, 0, 1], self._collections())
+
+    def test_adaptive_policy_shutdown(self):
+        self.env.config.set('gc', 'policy', 'AdaptiveCollectionPolicy')
+        self.env.config.set('gc', 'full_collection_interval', 3600)
+        self.collector.request_finished()
+        policy = AdaptiveCollectionPolicy(self.env)
+        thread = policy._thread
+        self.assertTrue(thread.isAlive())
+        policy.shutdown()
+        thread.join(10)
+        self.assertFalse(thread.isAlive())
+        self.assertEqual(None, policy._thread)
+        # No new thread is started once the environment is shut down
+        self.collector.request_finished()
+        self.assertEqual(None, policy._thread)
+
+
+def suite():
+    return unittest.makeSuite(GarbageCollectorTestCase, 'test')
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
@@ -5,6 +5,7 @@ import time
 from datetime import datetime
 import unittest
 
+from trac.env import UserDirectory
 from trac.test import EnvironmentStub, Mock
 from trac.web.session import DetachedSession, Session, PURGE_AGE, \
                              UPDATE_INTERVAL, SessionAdmin
@@ -332,6 +333,22 @@ class SessionTestCase(unittest.TestCase):
             SELECT value FROM session_attribute WHERE sid='john' AND name='foo'
             """)[0][0])
 
+    def test_known_users_of_authenticated_session(self):
+        directory = UserDirectory(self.env)
+        self.assertEqual([], list(directory.get_known_users()))
+
+        req = Mock(authname='john', base_path='/', incookie=Cookie())
+        session = Session(self.env, req)
+        session['name'] = 'John'
+        session.save()
+        self.assertEqual([('john', 'John', None)],
+                         list(directory.get_known_users()))
+        session['email'] = 'john@example.org'
+        session.save()
+        self.assertEqual('john@example.org', directory.get_email('john'))
+        self.assertEqual({'john': 'john@example.org'},
+                         directory.get_email_map())
+
     def test_authenticated_session_independence_var(self):
         """
         Verify that an anonymous session with the same name as an authenticated
@@ -502,6 +519,19 @@ class SessionTestCase(unittest.TestCase):
         result = get_session_info(self.env, 'name00')
         self.assertEqual(result, ('name00', 'john', 'john@example.org'))
 
+    def test_session_admin_known_users(self):
+        _prep_session_table(self.env)
+        directory = UserDirectory(self.env)
+        self.assertEqual('val00', directory.get_name('name00'))
+        sess_admin = SessionAdmin(self.env)
+        sess_admin._do_set('name', 'name00', 'john')
+        self.assertEqual('john', directory.get_name('name00'))
+        sess_admin._do_add('john', 'John', 'john@example.org')
+        self.assertEqual('john@example.org', directory.get_email('john'))
+        sess_admin._do_delete('name00')
+        self.assertEqual(None, directory.get_name('name00'))
+        self.assertEqual(10, len(list(directory.get_known_users())))
+
     def test_session_admin_delete(self):
         auth_list, anon_list, all_list = _prep_session_table(self.env)
         sess_admin = SessionAdmin(self.env)
@@ -18,6 +18,7 @@
 
 from __future__ import with_statement
 
+from functools import partial
 import pkg_resources
 import re
 
@@ -29,7 +30,9 @@ from trac.core import *
 from trac.mimeview.api import IContentConverter, Mimeview 
 from trac.perm import IPermissionRequestor
 from trac.resource import *
-from trac.search import ISearchSource, search_to_sql, shorten_result
+from trac.search import ISearchSource, merge_search_results, \
+                         render_excerpts, search_rows, search_to_sql, \
+                         shorten_result
 from trac.timeline.api import ITimelineEventProvider
 from trac.util import get_reporter_id
 from trac.util.datefmt import from_utimestamp, to_utimestamp
@@ -756,26 +759,34 @@ class WikiModule(Component):
             yield ('wiki', _('Wiki'))
 
     def get_search_results(self, req, terms, filters):
+        return render_excerpts(self.get_search_results_by_date(req, terms,
+                                                               filters))
+
+    def get_search_results_by_date(self, req, terms, filters, limit=None):
         if not 'wiki' in filters:
-            return
+            return []
+        return merge_search_results(
+            self._get_page_search_results(req, terms, limit),
+            AttachmentModule(self.env).get_search_results(
+                req, Resource('wiki'), terms, limit))
+
+    def _get_page_search_results(self, req, terms, limit=None):
+        """Generate the wiki pages matching the search terms, newest
+        first."""
         with self.env.db_query as db:
             sql_query, args = search_to_sql(db, ['w1.name', 'w1.author',
                                                  'w1.text'], terms)
             wiki_realm = Resource('wiki')
-            for name, ts, author, text in db("""
+            for name, ts, author, text in search_rows(db, """
                     SELECT w1.name, w1.time, w1.author, w1.text
                     FROM wiki w1,(SELECT name, max(version) AS ver 
                                   FROM wiki GROUP BY name) w2
                     WHERE w1.version = w2.ver AND w1.name = w2.name
-                    AND """ + sql_query, args):
+                    AND """ + sql_query + """
+                    ORDER BY w1.time DESC, w1.name""", args, limit):
                 page = wiki_realm(id=name)
                 if 'WIKI_VIEW' in req.perm(page):
                     yield (get_resource_url(self.env, page, req.href),
                            '%s: %s' % (name, shorten_line(text)),
                            from_utimestamp(ts), author,
-                           shorten_result(text, terms))
-        
-        # Attachments
-        for result in AttachmentModule(self.env).get_search_results(
-            req, wiki_realm, terms):
-            yield result
+                           partial(shorten_result, text, terms))
@@ -14,22 +14,30 @@
 
 from __future__ import with_statement
 
+from array import array
+import binascii
 import os
 import codecs
 from collections import deque
 from contextlib import contextmanager
 import cStringIO
+from hashlib import sha1
 from functools import partial
+import mmap
 from operator import itemgetter
 import re
+import struct
 from subprocess import Popen, PIPE
 import sys
+import tempfile
 from threading import Lock
 import time
 import weakref
+import zlib
 
 
-__all__ = ['GitError', 'GitErrorSha', 'Storage', 'StorageFactory']
+__all__ = ['GitError', 'GitErrorSha', 'GitObjectStore', 'Storage',
+           'StorageFactory']
 
 class GitError(Exception):
     pass
@@ -37,6 +45,21 @@ class GitError(Exception):
 class GitErrorSha(GitError):
     pass
 
+def _split_stream(stream, separator, bufsize=65536):
+    """Generate the `separator`-terminated items read from `stream`"""
+    rest = ''
+    while True:
+        data = stream.read(bufsize)
+        if not data:
+            break
+        items = (rest + data).split(separator)
+        rest = items.pop()
+        for item in items:
+            yield item
+    if rest:
+        yield rest
+
+
 class GitCore(object):
     """Low-level wrapper around git executable"""
 
@@ -84,8 +107,12 @@ class GitCore(object):
     def log_pipe(self, *cmd_args):
         return self.__pipe('log', stdout=PIPE, *cmd_args)
 
+    def diff_tree_pipe(self, stdin, *cmd_args):
+        return self.__pipe('diff-tree', stdin=stdin, stdout=PIPE, *cmd_args)
+
     def __getattr__(self, name):
-        if name[0] == '_' or name in ['cat_file_batch', 'log_pipe']:
+        if name[0] == '_' or name in ['cat_file_batch', 'log_pipe',
+                                      'diff_tree_pipe']:
             raise AttributeError, name
         return partial(self.__execute, name.replace('_','-'))
 
@@ -133,20 +160,937 @@ class SizedDict(dict):
         raise NotImplemented("SizedDict has no setdefault() method")
 
 
+class GitPack(object):
+    """Read-only access to a pack file and its version 1 or 2 index
+
+    Both files are memory-mapped; objects are looked up by binary search
+    in the sorted object names of the index.
+    """
+
+    def __init__(self, idx_path, pack_path):
+        self.idx_path = idx_path
+        self.pack_path = pack_path
+        self.__idx = self.__map(idx_path)
+        self.__pack = self.__map(pack_path)
+
+        idx = self.__idx
+        if idx[:4] == '\377tOc':
+            version = struct.unpack('>L', idx[4:8])[0]
+            if version != 2:
+                raise GitError("unsupported pack index version %d in '%s'"
+                               % (version, idx_path))
+            fanout_ofs = 8
+        else:
+            version = 1
+            fanout_ofs = 0
+        self.__fanout = struct.unpack('>256L',
+                                      idx[fanout_ofs:fanout_ofs + 1024])
+        self.count = count = self.__fanout[255]
+        if version == 2:
+            self.__sha_ofs, self.__sha_size = fanout_ofs + 1024, 20
+            self.__ofs_ofs = fanout_ofs + 1024 + 24 * count
+            self.__large_ofs = self.__ofs_ofs + 4 * count
+        else:
+            # v1 entries are (4-byte offset, 20-byte name) records
+            self.__sha_ofs, self.__sha_size = fanout_ofs + 1024 + 4, 24
+        self.__version = version
+
+        if self.__pack[:4] != 'PACK':
+            raise GitError("invalid pack file '%s'" % pack_path)
+
+    @staticmethod
+    def __map(path):
+        f = open(path, 'rb')
+        try:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            f.close()
+
+    def close(self):
+        self.__idx.close()
+        self.__pack.close()
+
+    def find(self, binsha):
+        """Return the offset in the pack file of the object with the given
+        20-byte name, or `None` if the pack doesn't contain it
+        """
+        idx = self.__idx
+        first = ord(binsha[0])
+        lo = first and self.__fanout[first - 1] or 0
+        hi = self.__fanout[first]
+        sha_ofs, sha_size = self.__sha_ofs, self.__sha_size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            pos = sha_ofs + mid * sha_size
+            name = idx[pos:pos + 20]
+            if name < binsha:
+                lo = mid + 1
+            elif name > binsha:
+                hi = mid
+            else:
+                return self.__offset(mid)
+        return None
+
+    def __offset(self, i):
+        idx = self.__idx
+        if self.__version == 1:
+            pos = self.__sha_ofs - 4 + i * 24
+            return struct.unpack('>L', idx[pos:pos + 4])[0]
+        pos = self.__ofs_ofs + i * 4
+        offset = struct.unpack('>L', idx[pos:pos + 4])[0]
+        if offset & 0x80000000:
+            pos = self.__large_ofs + (offset & 0x7fffffff) * 8
+            offset = struct.unpack('>Q', idx[pos:pos + 8])[0]
+        return offset
+
+    def read_header(self, offset):
+        """Return `(type, size, data_offset, base)` for the object entry
+        at `offset`.
+
+        `base` is the offset of the base object for offset deltas (type 6)
+        and the 20-byte name of the base object for reference deltas
+        (type 7), `None` otherwise.
+        """
+        data = self.__pack
+        c = ord(data[offset])
+        pos = offset + 1
+        type_ = (c >> 4) & 7
+        size = c & 15
+        shift = 4
+        while c & 0x80:
+            c = ord(data[pos])
+            pos += 1
+            size |= (c & 0x7f) << shift
+            shift += 7
+        base = None
+        if type_ == 6:
+            c = ord(data[pos])
+            pos += 1
+            rel = c & 0x7f
+            while c & 0x80:
+                c = ord(data[pos])
+                pos += 1
+                rel = ((rel + 1) << 7) | (c & 0x7f)
+            base = offset - rel
+        elif type_ == 7:
+            base = data[pos:pos + 20]
+            pos += 20
+        return type_, size, pos, base
+
+    def inflate(self, pos, size, max_length=None):
+        """Decompress the zlib stream starting at `pos`, which inflates to
+        `size` bytes; only the first `max_length` bytes are returned if
+        given.
+        """
+        data = self.__pack
+        d = zlib.decompressobj()
+        if max_length:
+            return d.decompress(data[pos:pos + max_length + 512], max_length)
+        step = max(size + 64, 4096)
+        chunks = []
+        end = len(data)
+        while pos < end:
+            chunks.append(d.decompress(data[pos:pos + step]))
+            pos += step
+            if d.unused_data:
+                break
+        chunks.append(d.flush())
+        return ''.join(chunks)
+
+
+def _parse_tree(data):
+    """Iterate over the `(mode, name, sha)` entries of a raw tree object"""
+    pos = 0
+    end = len(data)
+    while pos < end:
+        sp = data.index(' ', pos)
+        nul = data.index('\0', sp)
+        yield (data[pos:sp], data[sp + 1:nul],
+               binascii.hexlify(data[nul + 1:nul + 21]))
+        pos = nul + 21
+
+def _delta_header_size(delta, pos):
+    size = shift = 0
+    while True:
+        c = ord(delta[pos])
+        pos += 1
+        size |= (c & 0x7f) << shift
+        shift += 7
+        if not c & 0x80:
+            return size, pos
+
+def _apply_delta(base, delta):
+    """Apply a git binary delta to `base` and return the result"""
+    src_size, pos = _delta_header_size(delta, 0)
+    dst_size, pos = _delta_header_size(delta, pos)
+    if src_size != len(base):
+        raise GitError("delta base size mismatch")
+    chunks = []
+    append = chunks.append
+    end = len(delta)
+    while pos < end:
+        op = ord(delta[pos])
+        pos += 1
+        if op & 0x80:
+            offset = size = 0
+            for i in (0, 1, 2, 3):
+                if op & (1 << i):
+                    offset |= ord(delta[pos]) << (8 * i)
+                    pos += 1
+            for i in (0, 1, 2):
+                if op & (0x10 << i):
+                    size |= ord(delta[pos]) << (8 * i)
+                    pos += 1
+            append(base[offset:offset + (size or 0x10000)])
+        elif op:
+            append(delta[pos:pos + op])
+            pos += op
+        else:
+            raise GitError("invalid delta opcode")
+    result = ''.join(chunks)
+    if len(result) != dst_size:
+        raise GitError("delta result size mismatch")
+    return result
+
+
+class GitObjectStore(object):
+    """Pure Python reader for the objects and references of a repository
+
+    Objects are read from the loose object files and from the pack files,
+    resolving deltas, without forking a `git` process. Pack files added
+    later on (e.g. by `git gc`) are picked up when an object can't be
+    found. Pack files that disappeared (e.g. after `git repack -a -d`)
+    are closed at the following rescan, so that the threads still reading
+    them can finish.
+
+    Only full 40 characters sha ids and reference names are resolved;
+    other revision expressions must be handled by `git rev-parse`.
+    """
+
+    __TYPES = {1: 'commit', 2: 'tree', 3: 'blob', 4: 'tag'}
+    __sha_pat = re.compile(r'[0-9a-f]{40}$')
+
+    def __init__(self, git_dir):
+        self.git_dir = git_dir
+        objects_dir = os.path.join(git_dir, 'objects')
+        if not os.path.isdir(objects_dir):
+            raise GitError("no object directory in '%s'" % git_dir)
+        self.__objects_dirs = [objects_dir]
+        alternates = os.path.join(objects_dir, 'info', 'alternates')
+        if os.path.exists(alternates):
+            f = open(alternates)
+            try:
+                for line in f:
+                    line = line.strip()
+                    if line and not line.startswith('#'):
+                        self.__objects_dirs.append(
+                            os.path.join(objects_dir, line))
+            finally:
+                f.close()
+        self.__packs = []
+        self.__retired_packs = []
+        self.__packs_mtimes = None
+        self.__packs_lock = Lock()
+        self.__packed_refs = ({}, None)
+        # resolved delta bases, by (pack path, offset)
+        self.__base_cache = SizedDict(64)
+        self.__base_lock = Lock()
+        self.__refresh_packs()
+
+    def close(self):
+        with self.__packs_lock:
+            for pack in self.__packs + self.__retired_packs:
+                pack.close()
+            self.__packs = []
+            self.__retired_packs = []
+
+    def __pack_dirs(self):
+        return [os.path.join(d, 'pack') for d in self.__objects_dirs]
+
+    def __refresh_packs(self):
+        """Rescan the pack directories if they changed, returns whether new
+        packs were found"""
+        with self.__packs_lock:
+            mtimes = []
+            for pack_dir in self.__pack_dirs():
+                try:
+                    mtimes.append(os.stat(pack_dir).st_mtime)
+                except OSError:
+                    mtimes.append(None)
+            if mtimes == self.__packs_mtimes:
+                return False
+            current = dict((p.idx_path, p) for p in self.__packs)
+            packs = []
+            for pack_dir in self.__pack_dirs():
+                try:
+                    names = sorted(os.listdir(pack_dir))
+                except OSError:
+                    continue
+                for name in names:
+                    if not name.endswith('.idx'):
+                        continue
+                    idx_path = os.path.join(pack_dir, name)
+                    pack = current.pop(idx_path, None)
+                    if pack is None:
+                        pack_path = idx_path[:-4] + '.pack'
+                        if not os.path.exists(pack_path):
+                            continue
+                        pack = GitPack(idx_path, pack_path)
+                    packs.append(pack)
+            for pack in self.__retired_packs:
+                pack.close()
+            self.__retired_packs = current.values()
+            self.__packs = packs
+            self.__packs_mtimes = mtimes
+            return True
+
+    def __find(self, binsha):
+        for pack in self.__packs:
+            offset = pack.find(binsha)
+            if offset is not None:
+                return pack, offset
+        return None, None
+
+    def __loose_path(self, sha):
+        for objects_dir in self.__objects_dirs:
+            path = os.path.join(objects_dir, sha[:2], sha[2:])
+            if os.path.exists(path):
+                return path
+        return None
+
+    def __lookup(self, sha):
+        """Return `(pack, offset, loose_path)` for the object `sha`"""
+        sha = str(sha).lower()
+        if not self.__sha_pat.match(sha):
+            raise GitErrorSha("not a sha id: '%s'" % sha)
+        binsha = binascii.unhexlify(sha)
+        pack, offset = self.__find(binsha)
+        if pack is None:
+            path = self.__loose_path(sha)
+            if path:
+                return None, None, path
+            if self.__refresh_packs():
+                pack, offset = self.__find(binsha)
+            if pack is None:
+                raise GitErrorSha("object '%s' not found" % sha)
+        return pack, offset, None
+
+    def __read_loose(self, path, header_only=False):
+        f = open(path, 'rb')
+        try:
+            if header_only:
+                data = zlib.decompressobj().decompress(f.read(512), 64)
+            else:
+                data = zlib.decompress(f.read())
+        finally:
+            f.close()
+        header, data = data.split('\0', 1)
+        type_, size = header.split()
+        return type_, int(size), data
+
+    def __read_packed(self, pack, offset):
+        """Return the type and content of the object at `offset`, resolving
+        delta chains iteratively"""
+        deltas = []
+        while True:
+            key = (pack.pack_path, offset)
+            with self.__base_lock:
+                cached = self.__base_cache.get(key)
+            if cached is not None:
+                type_, data = cached
+                break
+            type_, size, pos, base = pack.read_header(offset)
+            if type_ == 6:
+                deltas.append((key, pack.inflate(pos, size)))
+                offset = base
+            elif type_ == 7:
+                deltas.append((key, pack.inflate(pos, size)))
+                pack, offset = self.__find(base)
+                if pack is None:
+                    type_, data = self.get_object(binascii.hexlify(base))
+                    break
+            elif type_ in self.__TYPES:
+                type_, data = self.__TYPES[type_], pack.inflate(pos, size)
+                if deltas:
+                    with self.__base_lock:
+                        self.__base_cache[key] = (type_, data)
+                break
+            else:
+                raise GitError("invalid object type %d in '%s'"
+                               % (type_, pack.pack_path))
+        while deltas:
+            key, delta = deltas.pop()
+            data = _apply_delta(data, delta)
+            if deltas:
+                with self.__base_lock:
+                    self.__base_cache[key] = (type_, data)
+        return type_, data
+
+    def get_object(self, sha):
+        """Return the `(type, content)` of the object with the given sha id
+
+        Raises `GitErrorSha` if the object can't be found, and `GitError`
+        if it can't be read.
+        """
+        pack, offset, path = self.__lookup(sha)
+        try:
+            if path:
+                type_, size, data = self.__read_loose(path)
+                return type_, data
+            return self.__read_packed(pack, offset)
+        except (EnvironmentError, IndexError, ValueError, zlib.error), e:
+            raise GitError("failed to read object '%s' (%s)" % (sha, e))
+
+    def get_size(self, sha):
+        """Return the size of the object with the given sha id, without
+        reading its content if possible
+        """
+        pack, offset, path = self.__lookup(sha)
+        try:
+            if path:
+                return self.__read_loose(path, header_only=True)[1]
+            type_, size, pos, base = pack.read_header(offset)
+            if type_ in (6, 7):
+                # the size of the result is the second field of the delta
+                delta = pack.inflate(pos, size, 32)
+                size = _delta_header_size(delta,
+                                          _delta_header_size(delta, 0)[1])[0]
+            return size
+        except (EnvironmentError, IndexError, ValueError, zlib.error), e:
+            raise GitError("failed to read object '%s' (%s)" % (sha, e))
+
+    # references
+
+    def __get_packed_refs(self):
+        path = os.path.join(self.git_dir, 'packed-refs')
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            return {}
+        refs, last_mtime = self.__packed_refs
+        if mtime != last_mtime:
+            refs = {}
+            f = open(path)
+            try:
+                for line in f:
+                    if line.startswith('#') or line.startswith('^'):
+                        continue
+                    fields = line.split()
+                    if len(fields) == 2:
+                        refs[fields[1]] = fields[0]
+            finally:
+                f.close()
+            self.__packed_refs = (refs, mtime)
+        return refs
+
+    def read_ref(self, name, depth=5):
+        """Return the sha id the reference `name` (e.g. `HEAD` or
+        `refs/heads/master`) points to, following symbolic references,
+        or `None` if there's no such reference
+        """
+        if not name or '..' in name or name.startswith('/') or depth < 0:
+            return None
+        path = os.path.join(self.git_dir, *name.split('/'))
+        if os.path.isfile(path):
+            f = open(path)
+            try:
+                value = f.read().strip()
+            finally:
+                f.close()
+            if value.startswith('ref:'):
+                return self.read_ref(value[4:].strip(), depth - 1)
+            if self.__sha_pat.match(value):
+                return value
+            return None
+        return self.__get_packed_refs().get(name)
+
+    def resolve_ref(self, name):
+        """Resolve a short or full reference name, using the same rules as
+        `git rev-parse`"""
+        for fmt in ('%s', 'refs/%s', 'refs/tags/%s', 'refs/heads/%s',
+                    'refs/remotes/%s', 'refs/remotes/%s/HEAD'):
+            sha = self.read_ref(fmt % name)
+            if sha:
+                return sha
+        return None
+
+    def get_symbolic_ref(self, name='HEAD'):
+        """Return the name of the reference a symbolic reference points to,
+        or `None` if it's not a symbolic reference"""
+        path = os.path.join(self.git_dir, name)
+        try:
+            f = open(path)
+        except IOError:
+            return None
+        try:
+            value = f.read().strip()
+        finally:
+            f.close()
+        if value.startswith('ref:'):
+            return value[4:].strip()
+        return None
+
+    def get_refs(self, prefix='refs/'):
+        """Return a dictionary of the names of all references starting with
+        `prefix`, mapped to their sha id"""
+        refs = dict((name, sha)
+                    for name, sha in self.__get_packed_refs().iteritems()
+                    if name.startswith(prefix))
+        top = os.path.join(self.git_dir, 'refs')
+        for dirpath, dirnames, filenames in os.walk(top):
+            rel = dirpath[len(self.git_dir):].strip(os.sep).split(os.sep)
+            for filename in filenames:
+                name = '/'.join(rel + [filename])
+                if name.startswith(prefix):
+                    sha = self.read_ref(name)
+                    if sha:
+                        refs[name] = sha
+        return refs
+
+
+def _skip_depth(depth):
+    """Return the depth of the ancestor the skip pointer of a commit at
+    the given first parent `depth` points to
+
+    The skip pointers form a skew-binary structure, which allows reaching
+    any ancestor along the first parent chain in a logarithmic number of
+    steps while keeping a single pointer per commit.
+    """
+    if depth < 2:
+        return 0
+    if depth & 1:
+        depth -= 1
+        depth &= depth - 1
+        return (depth & (depth - 1)) + 1
+    return depth & (depth - 1)
+
+
+def _first_parent_ancestor(i, depth, first_parent, depth_of, skip_of):
+    """Return the ancestor of commit `i` at the given `depth` of its first
+    parent chain, using the skip pointers"""
+    current = depth_of(i)
+    while current > depth:
+        skip = _skip_depth(current)
+        skip_prev = _skip_depth(current - 1)
+        if skip == depth or (skip > depth and not (skip_prev < skip - 2 and
+                                                   skip_prev >= depth)):
+            i = skip_of(i)
+            current = skip
+        else:
+            i = first_parent(i)
+            current -= 1
+    return i
+
+
+class CommitGraph(object):
+    """Compact, read-only representation of the commit graph
+
+    Commits are identified by integers, from 0 for the oldest commit to
+    `N - 1` for the youngest one, in reverse topological order; parents
+    therefore always have a lower id than their children, and new commits
+    are appended to the graph when it is updated.
+
+    Each commit also has a generation number (1 for root commits, one more
+    than the highest generation of its parents otherwise), a skip pointer
+    to one of its ancestors along the first parent chain, which only
+    depends on its depth in that chain, and a pointer to the closest merge
+    commit on that chain. Together they answer ancestry queries by only
+    visiting the merge commits between the two commits.
+
+    The graph is stored in a single buffer, which is either a string or a
+    memory-mapped file, with the following layout (little-endian 32 bits
+    integers):
+
+     * header: magic, format version, number of commits `N`, number of
+       parent links `E` and number of tips `T`
+     * `N` 20-byte binary sha ids, by commit id
+     * `N` commit ids, sorted by sha id
+     * `N` generation numbers, `N` first parent depths, `N` skip pointers
+       and `N` merge pointers (-1 for none)
+     * `N + 1` start positions followed by `E` commit ids, for the parents
+       of each commit
+     * the same for the children of each commit
+     * `T` 20-byte sha ids of the refs the graph was built from
+    """
+
+    MAGIC = 'TCGR'
+    VERSION = 2
+
+    __header = '<4sIIII'
+    __header_size = struct.calcsize(__header)
+
+    def __init__(self, data):
+        try:
+            magic, version, n, nlinks, ntips = \
+                struct.unpack_from(self.__header, data, 0)
+        except struct.error:
+            raise GitError("invalid commit graph")
+        if magic != self.MAGIC or version != self.VERSION:
+            raise GitError("unsupported commit graph format")
+        self.__data = data
+        self.__count = n
+        self.__nlinks = nlinks
+        self.__shas = self.__header_size
+        self.__sorted = self.__shas + 20 * n
+        self.__generation = self.__sorted + 4 * n
+        self.__depth = self.__generation + 4 * n
+        self.__skip = self.__depth + 4 * n
+        self.__merge = self.__skip + 4 * n
+        self.__parent_start = self.__merge + 4 * n
+        self.__parent_ids = self.__parent_start + 4 * (n + 1)
+        self.__child_start = self.__parent_ids + 4 * nlinks
+        self.__child_ids = self.__child_start + 4 * (n + 1)
+        self.__tips = self.__child_ids + 4 * nlinks
+        if len(data) != self.__tips + 20 * ntips:
+            raise GitError("truncated commit graph")
+        self.tips = frozenset(binascii.hexlify(data[pos:pos + 20])
+                              for pos in xrange(self.__tips,
+                                                self.__tips + 20 * ntips, 20))
+
+    @classmethod
+    def build(cls, revs, tips):
+        """Create a graph from a list of `(binsha, parents)` tuples in
+        topological order, youngest first, and the sha ids of the refs
+        """
+        return cls.__build('', array('i'), array('i'), array('i'),
+                           array('i'), array('i'), array('i', [0]),
+                           array('i'), array('i', [0]), array('i'), revs,
+                           tips)
+
+    def update(self, revs, tips):
+        """Return a new graph with the `(binsha, parents)` tuples of `revs`
+        (in topological order, youngest first) added as the youngest
+        commits"""
+        n = self.__count
+        return self.__build(self.__data[self.__shas:self.__sorted],
+                            self.__array(self.__sorted, n),
+                            self.__array(self.__generation, n),
+                            self.__array(self.__depth, n),
+                            self.__array(self.__skip, n),
+                            self.__array(self.__merge, n),
+                            self.__array(self.__parent_start, n + 1),
+                            self.__array(self.__parent_ids, self.__nlinks),
+                            self.__array(self.__child_start, n + 1),
+                            self.__array(self.__child_ids, self.__nlinks),
+                            [rev for rev in revs if rev[0] not in self],
+                            tips)
+
+    @classmethod
+    def __build(cls, shas, sorted_ids, generations, depths, skips, merges,
+                parent_start, parent_ids, child_start, child_ids, revs,
+                tips):
+        """Append the new commits `revs` to the arrays of a graph"""
+        n = len(sorted_ids)
+        count = n + len(revs)
+        revs = revs[::-1]
+        ids = dict((sha, n + i) for i, (sha, parents) in enumerate(revs))
+
+        def lookup(sha):
+            """return the id of an existing commit, by binary search"""
+            pos = bisect(sha)
+            if pos < n and shas_by_pos(pos) == sha:
+                return sorted_ids[pos]
+        def shas_by_pos(pos):
+            i = sorted_ids[pos] * 20
+            return shas[i:i + 20]
+        def bisect(sha):
+            lo, hi = 0, n
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if shas_by_pos(mid) < sha:
+                    lo = mid + 1
+                else:
+                    hi = mid
+            return lo
+
+        # parents of the new commits, and the children they add
+        new_children = {}
+        first_parent = lambda i: parent_ids[parent_start[i]]
+        for i, (sha, parents) in enumerate(revs):
+            first = len(parent_ids)
+            generation = 0
+            for p in parents:
+                pid = ids.get(p)
+                if pid is None and n:
+                    pid = lookup(p)
+                if pid is not None:
+                    parent_ids.append(pid)
+                    new_children.setdefault(pid, []).append(n + i)
+                    generation = max(generation, generations[pid])
+            parent_start.append(len(parent_ids))
+            generations.append(generation + 1)
+            if first < len(parent_ids):
+                pid = parent_ids[first]
+                depths.append(depths[pid] + 1)
+                skips.append(_first_parent_ancestor(
+                    pid, _skip_depth(depths[pid] + 1), first_parent,
+                    depths.__getitem__, skips.__getitem__))
+            else:
+                depths.append(0)
+                skips.append(-1)
+            if len(parent_ids) - first > 1:
+                merges.append(n + i)
+            elif first < len(parent_ids):
+                merges.append(merges[parent_ids[first]])
+            else:
+                merges.append(-1)
+
+        # insert the new sha ids in the sorted ids
+        inserted = sorted((bisect(sha), sha, n + i)
+                          for i, (sha, parents) in enumerate(revs))
+        new_sorted = array('i')
+        prev = 0
+        for pos, sha, i in inserted:
+            new_sorted.extend(sorted_ids[prev:pos])
+            new_sorted.append(i)
+            prev = pos
+        new_sorted.extend(sorted_ids[prev:])
+
+        # splice the new children in the children of the existing commits
+        new_child_start = array('i')
+        new_child_ids = array('i')
+        shift = prev = 0
+        for pid in sorted(pid for pid in new_children if pid < n):
+            segment = child_start[prev:pid + 1]
+            if shift:
+                segment = array('i', [v + shift for v in segment])
+            new_child_start.extend(segment)
+            new_child_ids.extend(child_ids[child_start[prev]:
+                                           child_start[pid + 1]])
+            new_child_ids.extend(new_children[pid])
+            shift += len(new_children[pid])
+            prev = pid + 1
+        segment = child_start[prev:]
+        if shift:
+            segment = array('i', [v + shift for v in segment])
+        new_child_start.extend(segment)
+        new_child_ids.extend(child_ids[child_start[prev]:])
+        for i in xrange(n, count):
+            new_child_ids.extend(new_children.get(i, ()))
+            new_child_start.append(len(new_child_ids))
+
+        blocks = [new_sorted, generations, depths, skips, merges,
+                  parent_start, parent_ids, new_child_start, new_child_ids]
+        if sys.byteorder != 'little':
+            for block in blocks:
+                block.byteswap()
+        tips = sorted(tips)
+        data = ''.join([struct.pack(cls.__header, cls.MAGIC, cls.VERSION,
+                                    count, len(parent_ids), len(tips)),
+                        shas, ''.join(sha for sha, parents in revs)] +
+                       [block.tostring() for block in blocks] +
+                       [binascii.unhexlify(tip) for tip in tips])
+        return cls(data)
+
+    @classmethod
+    def load(cls, path):
+        """Map the graph stored in the file at `path`"""
+        f = open(path, 'rb')
+        try:
+            return cls(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+        finally:
+            f.close()
+
+    def save(self, path):
+        """Atomically replace the file at `path` with this graph"""
+        dirname = os.path.dirname(path)
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        tmp_path = '%s.%d.tmp' % (path, os.getpid())
+        f = open(tmp_path, 'wb')
+        try:
+            f.write(self.__data[:])
+        finally:
+            f.close()
+        if sys.platform == 'win32' and os.path.exists(path):
+            os.remove(path)
+        os.rename(tmp_path, path)
+
+    # low-level accessors
+
+    def __array(self, pos, count):
+        a = array('i')
+        a.fromstring(self.__data[pos:pos + 4 * count])
+        if sys.byteorder != 'little':
+            a.byteswap()
+        return a
+
+    def __ints(self, pos, count):
+        return struct.unpack_from('<%di' % count, self.__data, pos)
+
+    def __int(self, pos):
+        return struct.unpack_from('<i', self.__data, pos)[0]
+
+    def __binsha(self, i):
+        pos = self.__shas + 20 * i
+        return self.__data[pos:pos + 20]
+
+    def __sorted_binsha(self, pos):
+        return self.__binsha(self.__int(self.__sorted + 4 * pos))
+
+    def __links(self, start, ids, i):
+        first, last = struct.unpack_from('<2i', self.__data, start + 4 * i)
+        return self.__ints(ids + 4 * first, last - first)
+
+    def __bisect(self, binsha):
+        lo, hi = 0, self.__count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.__sorted_binsha(mid) < binsha:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    # public API, commits are given by id
+
+    def __len__(self):
+        return self.__count
+
+    def __contains__(self, sha):
+        return self.index(sha) is not None
+
+    def __iter__(self):
+        """Iterate over the sha ids in topological order"""
+        for i in xrange(self.__count - 1, -1, -1):
+            yield self.sha(i)
+
+    def index(self, sha):
+        """Return the id of the commit with the given 40 characters or
+        20 bytes sha id, or `None`"""
+        if len(sha) == 40:
+            try:
+                sha = binascii.unhexlify(sha)
+            except TypeError:
+                return None
+        elif len(sha) != 20:
+            return None
+        pos = self.__bisect(sha)
+        if pos < self.__count and self.__sorted_binsha(pos) == sha:
+            return self.__int(self.__sorted + 4 * pos)
+        return None
+
+    def sha(self, i):
+        return binascii.hexlify(self.__binsha(i))
+
+    def ordinal(self, i):
+        """Return the 1-based position of the commit in topological order,
+        youngest first"""
+        return self.__count - i
+
+    def by_ordinal(self, ordinal):
+        return self.__count - ordinal
+
+    def parents(self, i):
+        return self.__links(self.__parent_start, self.__parent_ids, i)
+
+    def children(self, i):
+        return self.__links(self.__child_start, self.__child_ids, i)
+
+    def find_prefix(self, prefix):
+        """Return the ids of the commits whose sha id starts with the
+        hexadecimal `prefix` (at most two)"""
+        prefix = prefix.lower()
+        size = len(prefix)
+        lo, hi = 0, self.__count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if binascii.hexlify(self.__sorted_binsha(mid))[:size] < prefix:
+                lo = mid + 1
+            else:
+                hi = mid
+        return [self.__int(self.__sorted + 4 * pos)
+                for pos in xrange(lo, min(lo + 2, self.__count))
+                if binascii.hexlify(self.__sorted_binsha(pos))
+                           .startswith(prefix)]
+
+    def unique_prefix_len(self, i):
+        """Return the length of the shortest prefix identifying the commit
+        `i` among all commits"""
+        sha = self.sha(i)
+        pos = self.__bisect(self.__binsha(i))
+        length = 1
+        for other in (pos - 1, pos + 1):
+            if 0 <= other < self.__count:
+                other = binascii.hexlify(self.__sorted_binsha(other))
+                common = 0
+                while common < 40 and sha[common] == other[common]:
+                    common += 1
+                length = max(length, common + 1)
+        return length
+
+    def generation(self, i):
+        return self.__int(self.__generation + 4 * i)
+
+    def is_ancestor(self, i, j):
+        """Return whether commit `i` is an ancestor of commit `j`
+
+        The first parent chains are followed with the skip pointers, so
+        that only the merge commits on these chains need to be visited.
+        Ancestors always have a lower id and a lower generation number than
+        their descendants, which bounds the walk from `j`.
+        """
+        if j <= i:
+            return False
+        generation = self.generation(i)
+        if self.generation(j) <= generation:
+            return False
+        depth = self.__depth_of(i)
+        seen = set()
+        work_list = [j]
+        while work_list:
+            chain = work_list.pop()
+            if self.__on_first_parent_chain(i, depth, chain):
+                return True
+            merge = self.__merge_of(chain)
+            while merge > i and merge not in seen and \
+                    self.generation(merge) > generation:
+                seen.add(merge)
+                parents = self.parents(merge)
+                for p in parents[1:]:
+                    if p == i:
+                        return True
+                    if p > i and self.generation(p) > generation:
+                        work_list.append(p)
+                merge = self.__merge_of(parents[0])
+        return False
+
+    def __depth_of(self, i):
+        return self.__int(self.__depth + 4 * i)
+
+    def __on_first_parent_chain(self, i, depth, j):
+        """Return whether commit `i`, at the given `depth`, is reached from
+        commit `j` by following first parents"""
+        return self.__depth_of(j) > depth and \
+               _first_parent_ancestor(j, depth, self.__first_parent,
+                                      self.__depth_of, self.__skip_of) == i
+
+    def __first_parent(self, i):
+        return self.__int(self.__parent_ids + 4 *
+                          self.__int(self.__parent_start + 4 * i))
+
+    def __skip_of(self, i):
+        return self.__int(self.__skip + 4 * i)
+
+    def __merge_of(self, i):
+        return self.__int(self.__merge + 4 * i)
+
+
 class StorageFactory(object):
     __dict = weakref.WeakValueDictionary()
     __dict_nonweak = dict()
     __dict_lock = Lock()
 
     def __init__(self, repo, log, weak=True, git_bin='git',
-                 git_fs_encoding=None):
+                 git_fs_encoding=None, rev_cache_dir=None):
         self.logger = log
 
         with StorageFactory.__dict_lock:
             try:
                 i = StorageFactory.__dict[repo]
             except KeyError:
-                i = Storage(repo, log, git_bin, git_fs_encoding)
+                i = Storage(repo, log, git_bin, git_fs_encoding,
+                            rev_cache_dir)
                 StorageFactory.__dict[repo] = i
 
                 # create or remove additional reference depending on 'weak'
@@ -175,53 +1119,55 @@ class Storage(object):
 
     __SREV_MIN = 4 # minimum short-rev length
 
+    # maximum number of refs given to `git rev-list` for incremental updates
+    # of the commit graph
+    __REV_LIST_MAX_ARGS = 1000
+
 
     class RevCache(tuple):
-        """RevCache(youngest_rev, oldest_rev, rev_dict, tag_set, srev_dict,
-                    branch_dict)
+        """RevCache(youngest_rev, oldest_rev, rev_graph, tag_set, branch_dict)
 
         In Python 2.7 this class could be defined by:
             from collections import namedtuple
             RevCache = namedtuple('RevCache', 'youngest_rev oldest_rev '
-                                              'rev_dict tag_set srev_dict '
+                                              'rev_graph tag_set '
                                               'branch_dict')
         This implementation is what that code generator would produce.
         """
 
         __slots__ = () 
 
-        _fields = ('youngest_rev', 'oldest_rev', 'rev_dict', 'tag_set',
-                   'srev_dict', 'branch_dict') 
+        _fields = ('youngest_rev', 'oldest_rev', 'rev_graph', 'tag_set',
+                   'branch_dict') 
 
-        def __new__(cls, youngest_rev, oldest_rev, rev_dict, tag_set,
-                    srev_dict, branch_dict):
-            return tuple.__new__(cls, (youngest_rev, oldest_rev, rev_dict,
-                                 tag_set, srev_dict, branch_dict)) 
+        def __new__(cls, youngest_rev, oldest_rev, rev_graph, tag_set,
+                    branch_dict):
+            return tuple.__new__(cls, (youngest_rev, oldest_rev, rev_graph,
+                                 tag_set, branch_dict)) 
 
         @classmethod
         def _make(cls, iterable, new=tuple.__new__, len=len):
             """Make a new RevCache object from a sequence or iterable"""
             result = new(cls, iterable)
-            if len(result) != 6:
-                raise TypeError('Expected 6 arguments, got %d' % len(result))
+            if len(result) != 5:
+                raise TypeError('Expected 5 arguments, got %d' % len(result))
             return result 
 
         def __repr__(self):
-            return 'RevCache(youngest_rev=%r, oldest_rev=%r, rev_dict=%r, ' \
-                   'tag_set=%r, srev_dict=%r, branch_dict=%r)' % self 
+            return 'RevCache(youngest_rev=%r, oldest_rev=%r, rev_graph=%r, ' \
+                   'tag_set=%r, branch_dict=%r)' % self 
 
         def _asdict(t):
             """Return a new dict which maps field names to their values"""
             return {'youngest_rev': t[0], 'oldest_rev': t[1],
-                    'rev_dict': t[2], 'tag_set': t[3], 'srev_dict': t[4],
-                    'branch_dict': t[5]} 
+                    'rev_graph': t[2], 'tag_set': t[3], 'branch_dict': t[4]} 
 
         def _replace(self, **kwds):
             """Return a new RevCache object replacing specified fields with
             new values
             """
             result = self._make(map(kwds.pop, ('youngest_rev', 'oldest_rev',
-                'rev_dict', 'tag_set', 'srev_dict', 'branch_dict'), self))
+                'rev_graph', 'tag_set', 'branch_dict'), self))
             if kwds:
                 raise ValueError("Got unexpected field names: %r"
                                  % kwds.keys())
@@ -232,20 +1178,11 @@ class Storage(object):
 
         youngest_rev = property(itemgetter(0))
         oldest_rev = property(itemgetter(1))
-        rev_dict = property(itemgetter(2))
+        rev_graph = property(itemgetter(2))
         tag_set = property(itemgetter(3))
-        srev_dict = property(itemgetter(4))
-        branch_dict = property(itemgetter(5))
+        branch_dict = property(itemgetter(4))
 
 
-    @staticmethod
-    def __rev_key(rev):
-        assert len(rev) >= 4
-        #assert GitCore.is_sha(rev)
-        srev_key = int(rev[:4], 16)
-        assert srev_key >= 0 and srev_key <= 0xffff
-        return srev_key
-
     @staticmethod
     def git_version(git_bin='git'):
         GIT_VERSION_MIN_REQUIRED = (1, 5, 6)
@@ -280,7 +1217,8 @@ class Storage(object):
                            "execute/parse '%s --version' but got %s)"
                            % (git_bin, repr(e)))
 
-    def __init__(self, git_dir, log, git_bin='git', git_fs_encoding=None):
+    def __init__(self, git_dir, log, git_bin='git', git_fs_encoding=None,
+                 rev_cache_dir=None):
         """Initialize PyGit.Storage instance
 
         `git_dir`: path to .git folder;
@@ -295,6 +1233,10 @@ class Storage(object):
                 if `None`, no implicit decoding/encoding to/from
                 unicode objects is performed, and bytestrings are
                 returned instead
+
+        `rev_cache_dir`: directory where the commit graph is persisted,
+                so that it can be updated incrementally and shared between
+                processes; if `None`, it is only kept in memory
         """
 
         self.logger = log
@@ -327,11 +1269,26 @@ class Storage(object):
 
         self.repo = GitCore(git_dir, git_bin=git_bin)
 
+        # objects and references are read without forking `git` processes
+        # when possible
+        try:
+            self.odb = GitObjectStore(git_dir)
+        except (GitError, EnvironmentError), e:
+            self.logger.warning("pure Python object reader not available "
+                                "for '%s' (%s)" % (git_dir, e))
+            self.odb = None
+
         self.commit_encoding = None
 
         # caches
         self.__rev_cache = None
         self.__rev_cache_lock = Lock()
+        self.__rev_graph = None
+        self.__rev_graph_path = None
+        if rev_cache_dir:
+            key = sha1(os.path.abspath(git_dir)).hexdigest()
+            self.__rev_graph_path = os.path.join(rev_cache_dir,
+                                                 key + '.graph')
 
         # cache the last 200 commit messages
         self.__commit_msg_cache = SizedDict(200)
@@ -349,16 +1306,15 @@ class Storage(object):
     #
 
     # called by Storage.sync()
-    def __rev_cache_sync(self, youngest_rev=None):
+    def __rev_cache_sync(self, tips):
         """invalidates revision db cache if necessary"""
 
         with self.__rev_cache_lock:
             need_update = False
             if self.__rev_cache:
-                last_youngest_rev = self.__rev_cache.youngest_rev
-                if last_youngest_rev != youngest_rev:
-                    self.logger.debug("invalidated caches (%s != %s)"
-                                      % (last_youngest_rev, youngest_rev))
+                last_tips = self.__rev_cache.rev_graph.tips
+                if last_tips != tips:
+                    self.logger.debug("invalidated caches (refs changed)")
                     need_update = True
             else:
                 need_update = True # almost NOOP
@@ -368,6 +1324,86 @@ class Storage(object):
 
             return need_update
 
+    def __get_tips(self):
+        """return the set of sha ids the refs and HEAD point to"""
+        if self.odb is not None:
+            tips = set(self.odb.get_refs().itervalues())
+            head = self.odb.read_ref('HEAD')
+        else:
+            tips = set(self.repo.rev_parse('--all').split())
+            head = self.repo.rev_parse('--verify', 'HEAD').strip()
+        if head:
+            tips.add(head)
+        return frozenset(tips)
+
+    def __read_rev_list(self, *args):
+        """return a list of `(binsha, parents)` tuples in topological order"""
+        unhexlify = binascii.unhexlify
+        revs = []
+        for line in self.repo.rev_list('--parents', '--topo-order',
+                                       *args).splitlines():
+            shas = [unhexlify(sha) for sha in line.split()]
+            if shas:
+                revs.append((shas[0], shas[1:]))
+        return revs
+
+    def __has_objects(self, shas):
+        """return whether all the given objects exist in the repository"""
+        for sha in shas:
+            try:
+                self.get_obj_size(sha)
+            except GitErrorSha:
+                return False
+        return True
+
+    def __get_rev_graph(self, tips):
+        """return the commit graph for the given tips, loading it from the
+        persistent cache and updating it as needed"""
+        graph = self.__rev_graph
+        path = self.__rev_graph_path
+        if path and (graph is None or graph.tips != tips) and \
+                os.path.exists(path):
+            try:
+                graph = CommitGraph.load(path)
+            except (GitError, EnvironmentError, ValueError), e:
+                self.logger.warning("failed to load commit graph from '%s' "
+                                    "(%s)" % (path, e))
+        if graph is not None and graph.tips == tips:
+            return graph
+
+        if graph is not None and \
+                len(graph.tips) + len(tips) <= self.__REV_LIST_MAX_ARGS:
+            # only read the new commits, unless some of the previous tips
+            # are not reachable anymore (e.g. deleted branches). As the exit
+            # status of `git rev-list` is not available, tips whose commits
+            # have been pruned are checked for separately.
+            removed = list(graph.tips - tips)
+            added = list(tips - graph.tips)
+            if removed and (not self.__has_objects(removed) or
+                            self.repo.rev_list('--max-count=1',
+                                               *(removed + ['--not'] +
+                                                 list(tips)))):
+                self.logger.debug("commits removed, rebuilding commit graph")
+                graph = None
+            else:
+                revs = []
+                if added:
+                    revs = self.__read_rev_list(*(added + ['--not'] +
+                                                  list(graph.tips)))
+                graph = graph.update(revs, tips)
+        else:
+            graph = None
+        if graph is None:
+            graph = CommitGraph.build(self.__read_rev_list('--all'), tips)
+
+        if path:
+            try:
+                graph.save(path)
+            except EnvironmentError, e:
+                self.logger.warning("failed to save commit graph to '%s' "
+                                    "(%s)" % (path, e))
+        return graph
+
     def get_rev_cache(self):
         """Retrieve revision cache
 
@@ -383,111 +1419,30 @@ class Storage(object):
                                   "for %d" % id(self))
                 ts0 = time.time()
 
-                youngest = None
-                oldest = None
-                new_db = {} # db
-                new_sdb = {} # short_rev db
-
-                # helper for reusing strings
-                __rev_seen = {}
-                def __rev_reuse(rev):
-                    rev = str(rev)
-                    return __rev_seen.setdefault(rev, rev)
-
-                new_tags = set(__rev_reuse(rev.strip())
-                               for rev in self.repo.rev_parse('--tags')
-                                                   .splitlines())
-
-                new_branches = [(k, __rev_reuse(v))
-                                for k, v in self._get_branches()]
-                head_revs = set(v for _, v in new_branches)
-
-                rev = ord_rev = 0
-                for ord_rev, revs in enumerate(
-                                        self.repo.rev_list('--parents',
-                                                           '--topo-order',
-                                                           '--all')
-                                                 .splitlines()):
-                    revs = map(__rev_reuse, revs.strip().split())
-
-                    rev = revs[0]
-
-                    # first rev seen is assumed to be the youngest one
-                    if not ord_rev:
-                        youngest = rev
-
-                    # shortrev "hash" map
-                    srev_key = self.__rev_key(rev)
-                    new_sdb.setdefault(srev_key, []).append(rev)
-
-                    # parents
-                    parents = tuple(revs[1:])
-
-                    # new_db[rev] = (children(rev), parents(rev),
-                    #                ordinal_id(rev), rheads(rev))
-                    if rev in new_db:
-                        # (incomplete) entry was already created by children
-                        _children, _parents, _ord_rev, _rheads = new_db[rev]
-                        assert _children
-                        assert not _parents
-                        assert _ord_rev == 0
-
-                        if rev in head_revs and rev not in _rheads:
-                            _rheads.append(rev)
-
-                    else: # new entry
-                        _children = []
-                        _rheads = [rev] if rev in head_revs else []
-
-                    # create/update entry
-                    # transform lists into tuples since entry will be final
-                    new_db[rev] = tuple(_children), tuple(parents), \
-                                  ord_rev + 1, tuple(_rheads)
-
-                    # update parents(rev)s
-                    for parent in parents:
-                        # by default, a dummy ordinal_id is used
-                        # for the mean-time
-                        _children, _parents, _ord_rev, _rheads2 = \
-                            new_db.setdefault(parent, ([], [], 0, []))
-
-                        # update parent(rev)'s children
-                        if rev not in _children:
-                            _children.append(rev)
-
-                        # update parent(rev)'s rheads
-                        for rev in _rheads:
-                            if rev not in _rheads2:
-                                _rheads2.append(rev)
-
-                # last rev seen is assumed to be the oldest
-                # one (with highest ord_rev)
-                oldest = rev
-
-                __rev_seen = None
-
-                # convert sdb either to dict or array depending on size
-                tmp = [()]*(max(new_sdb.keys())+1) \
-                      if len(new_sdb) > 5000 else {}
+                if self.odb is not None:
+                    tags = self.odb.get_refs('refs/tags/').itervalues()
+                else:
+                    tags = self.repo.rev_parse('--tags').splitlines()
+                new_tags = set(rev.strip() for rev in tags)
+                new_branches = self._get_branches()
 
-                try:
-                    while True:
-                        k, v = new_sdb.popitem()
-                        tmp[k] = tuple(v)
-                except KeyError:
-                    pass
+                graph = self.__rev_graph = \
+                        self.__get_rev_graph(self.__get_tips())
 
-                assert len(new_sdb) == 0
-                new_sdb = tmp
+                # first rev is assumed to be the youngest one, and the last
+                # one the oldest
+                youngest = oldest = None
+                if graph:
+                    youngest = graph.sha(graph.by_ordinal(1))
+                    oldest = graph.sha(graph.by_ordinal(len(graph)))
 
                 # atomically update self.__rev_cache
-                self.__rev_cache = Storage.RevCache(youngest, oldest, new_db,
-                                                    new_tags, new_sdb,
-                                                    new_branches)
+                self.__rev_cache = Storage.RevCache(youngest, oldest, graph,
+                                                    new_tags, new_branches)
                 ts1 = time.time()
                 self.logger.debug("rebuilt commit tree db for %d with %d "
                                   "entries (took %.1f ms)"
-                                  % (id(self), len(new_db), 1000*(ts1-ts0)))
+                                  % (id(self), len(graph), 1000*(ts1-ts0)))
 
             assert all(e is not None for e in self.__rev_cache) \
                    or not any(self.__rev_cache)
@@ -504,6 +1459,16 @@ class Storage(object):
         """
 
         result = []
+        if self.odb is not None:
+            head = self.odb.get_symbolic_ref('HEAD')
+            for name, sha in sorted(self.odb.get_refs('refs/heads/')
+                                            .iteritems()):
+                if name == head:
+                    result.insert(0, (name[11:], sha))
+                else:
+                    result.append((name[11:], sha))
+            return result
+
         for e in self.repo.branch('-v', '--no-abbrev').splitlines():
             bname, bsha = e[1:].strip().split()[:2]
             if e.startswith('*'):
@@ -520,7 +1485,8 @@ class Storage(object):
         return self.rev_cache.branch_dict
 
     def get_commits(self):
-        return self.rev_cache.rev_dict
+        """returns the `CommitGraph` of the repository"""
+        return self.rev_cache.rev_graph
 
     def oldest_rev(self):
         return self.rev_cache.oldest_rev
@@ -536,37 +1502,52 @@ class Storage(object):
         """
 
         _rev_cache = self.rev_cache
+        graph = _rev_cache.rev_graph
 
-        try:
-            rheads = _rev_cache.rev_dict[sha][3]
-        except KeyError:
+        i = graph.index(sha)
+        if i is None:
             return []
 
+        branches = []
+        for k, v in _rev_cache.branch_dict:
+            j = graph.index(v)
+            if j is not None and (i == j or graph.is_ancestor(i, j)):
+                branches.append((k, v))
+
         if resolve:
-            return [(k, v) for k, v in _rev_cache.branch_dict if v in rheads]
+            return branches
 
+        rheads = []
+        for k, v in branches:
+            if v not in rheads:
+                rheads.append(v)
         return rheads
 
     def history_relative_rev(self, sha, rel_pos):
-        db = self.get_commits()
+        graph = self.get_commits()
 
-        if sha not in db:
+        i = graph.index(sha)
+        if i is None:
             raise GitErrorSha()
 
         if rel_pos == 0:
             return sha
 
-        lin_rev = db[sha][2] + rel_pos
+        lin_rev = graph.ordinal(i) + rel_pos
 
-        if lin_rev < 1 or lin_rev > len(db):
+        if lin_rev < 1 or lin_rev > len(graph):
             return None
 
-        for k, v in db.iteritems():
-            if v[2] == lin_rev:
-                return k
+        return graph.sha(graph.by_ordinal(lin_rev))
 
-        # should never be reached if db is consistent
-        raise GitError("internal inconsistency detected")
+    def history_from(self, sha):
+        """return the sha ids of the commits from `sha` to the youngest
+        one, in the order followed by `hist_next_revision()`"""
+        graph = self.get_commits()
+        i = graph.index(sha)
+        if i is None:
+            raise GitErrorSha()
+        return [graph.sha(n) for n in xrange(i, len(graph))]
 
     def hist_next_revision(self, sha):
         return self.history_relative_rev(sha, -1)
@@ -587,6 +1568,19 @@ class Storage(object):
         return self.verifyrev('HEAD')
 
     def cat_file(self, kind, sha):
+        if self.odb is not None:
+            try:
+                _type, data = self.odb.get_object(sha)
+            except GitErrorSha:
+                pass # not a sha id, let `git cat-file` resolve it
+            except GitError, e:
+                self.logger.warning(e)
+            else:
+                if _type != kind:
+                    raise GitError("internal error (got unexpected object "
+                                   "kind '%s')" % _type)
+                return data
+
         if self.__cat_file_pipe is None:
             self.__cat_file_pipe = self.repo.cat_file_batch()
 
@@ -595,8 +1589,8 @@ class Storage(object):
         _sha, _type, _size = self.__cat_file_pipe.stdout.readline().split()
 
         if _type != kind:
-            raise TracError("internal error (got unexpected object kind "
-                            "'%s')" % k)
+            raise GitError("internal error (got unexpected object kind "
+                           "'%s')" % _type)
 
         size = int(_size)
         return self.__cat_file_pipe.stdout.read(size + 1)[:size]
@@ -615,12 +1609,15 @@ class Storage(object):
             if fullrev:
                 return fullrev
 
-        # fall back to external git calls
-        rc = self.repo.rev_parse('--verify', rev).strip()
+        # resolve references, fall back to external git calls for other
+        # revision expressions
+        rc = self.odb is not None and self.odb.resolve_ref(rev)
+        if not rc:
+            rc = self.repo.rev_parse('--verify', rev).strip()
         if not rc:
             return None
 
-        if rc in _rev_cache.rev_dict:
+        if rc in _rev_cache.rev_graph:
             return rc
 
         if rc in _rev_cache.tag_set:
@@ -642,49 +1639,31 @@ class Storage(object):
         if min_len < self.__SREV_MIN:
             min_len = self.__SREV_MIN
 
-        _rev_cache = self.rev_cache
+        graph = self.rev_cache.rev_graph
 
-        if rev not in _rev_cache.rev_dict:
+        i = graph.index(rev)
+        if i is None:
             return None
 
-        srev = rev[:min_len]
-        srevs = set(_rev_cache.srev_dict[self.__rev_key(rev)])
-
-        if len(srevs) == 1:
-            return srev # we already got a unique id
-
-        # find a shortened id for which rev doesn't conflict with
-        # the other ones from srevs
-        crevs = srevs - set([rev])
-
-        for l in range(min_len+1, 40):
-            srev = rev[:l]
-            if srev not in [ r[:l] for r in crevs ]:
-                return srev
-
-        return rev # worst-case, all except the last character match
+        # the neighbours in sort order share the longest prefixes
+        return rev[:max(min_len, graph.unique_prefix_len(i))]
 
     def fullrev(self, srev):
         """try to reverse shortrev()"""
         srev = str(srev)
 
-        _rev_cache = self.rev_cache
+        graph = self.rev_cache.rev_graph
 
         # short-cut
-        if len(srev) == 40 and srev in _rev_cache.rev_dict:
+        if len(srev) == 40 and srev in graph:
             return srev
 
         if not GitCore.is_sha(srev):
             return None
 
-        try:
-            srevs = _rev_cache.srev_dict[self.__rev_key(srev)]
-        except KeyError:
-            return None
-
-        srevs = filter(lambda s: s.startswith(srev), srevs)
-        if len(srevs) == 1:
-            return srevs[0]
+        matches = graph.find_prefix(srev)
+        if len(matches) == 1:
+            return graph.sha(matches[0])
 
         return None
 
@@ -699,6 +1678,17 @@ class Storage(object):
         if path.startswith('/'):
             path = path[1:]
 
+        if self.odb is not None:
+            try:
+                result = self.__ls_tree_native(rev, path)
+            except GitErrorSha:
+                result = None
+            except GitError, e:
+                self.logger.warning(e)
+                result = None
+            if result is not None:
+                return result
+
         tree = self.repo.ls_tree('-z', '-l', rev, '--', path).split('\0')
 
         def split_ls_tree_line(l):
@@ -716,14 +1706,71 @@ class Storage(object):
 
         return [ split_ls_tree_line(e) for e in tree if e ]
 
+    def __get_tree(self, rev):
+        """return the content of the tree object `rev` refers to, or `None`
+        if `rev` can't be resolved without `git rev-parse`"""
+        if len(rev) == 40 and GitCore.is_sha(rev):
+            sha = rev
+        else:
+            sha = self.odb.resolve_ref(rev)
+        while sha:
+            _type, data = self.odb.get_object(sha)
+            if _type == 'tree':
+                return data
+            elif _type == 'commit' and data.startswith('tree '):
+                sha = data[5:45]
+            elif _type == 'tag' and data.startswith('object '):
+                sha = data[7:47]
+            else:
+                break
+        return None
+
+    def __ls_tree_native(self, rev, path):
+        """`ls_tree` using the object store, returns `None` if the revision
+        can't be resolved"""
+        tree = self.__get_tree(rev)
+        if tree is None:
+            return None
+
+        if not path or path.endswith('/'):
+            dirname, name = path.rstrip('/'), None
+        else:
+            dirname, _, name = path.rpartition('/')
+
+        prefix = ''
+        if dirname:
+            for part in dirname.split('/'):
+                for mode, fname, sha in _parse_tree(tree):
+                    if fname == part:
+                        break
+                else:
+                    return []
+                if mode != '40000':
+                    return []
+                _type, tree = self.odb.get_object(sha)
+            prefix = dirname + '/'
+
+        result = []
+        for mode, fname, sha in _parse_tree(tree):
+            if name is not None and fname != name:
+                continue
+            if mode == '40000':
+                _type, size = 'tree', None
+            elif mode == '160000':
+                _type, size = 'commit', None
+            else:
+                _type, size = 'blob', self.odb.get_size(sha)
+            result.append((mode.zfill(6), _type, sha, size,
+                           self._fs_to_unicode(prefix + fname)))
+        return result
+
     def read_commit(self, commit_id):
         if not commit_id:
             raise GitError("read_commit called with empty commit_id")
 
         commit_id, commit_id_orig = self.fullrev(commit_id), commit_id
 
-        db = self.get_commits()
-        if commit_id not in db:
+        if commit_id not in self.get_commits():
             self.logger.info("read_commit failed for '%s' ('%s')" %
                              (commit_id, commit_id_orig))
             raise GitErrorSha
@@ -761,6 +1808,14 @@ class Storage(object):
     def get_obj_size(self, sha):
         sha = str(sha)
 
+        if self.odb is not None:
+            try:
+                return self.odb.get_size(sha)
+            except GitErrorSha:
+                pass
+            except GitError, e:
+                self.logger.warning(e)
+
         try:
             obj_size = int(self.repo.cat_file('-s', sha).strip())
         except ValueError:
@@ -769,30 +1824,35 @@ class Storage(object):
         return obj_size
 
     def children(self, sha):
-        db = self.get_commits()
+        graph = self.get_commits()
 
-        try:
-            return list(db[sha][0])
-        except KeyError:
+        i = graph.index(sha)
+        if i is None:
             return []
+        return [graph.sha(c) for c in graph.children(i)]
 
-    def children_recursive(self, sha, rev_dict=None):
+    def children_recursive(self, sha, rev_graph=None):
         """Recursively traverse children in breadth-first order"""
 
-        if rev_dict is None:
-            rev_dict = self.get_commits()
+        if rev_graph is None:
+            rev_graph = self.get_commits()
 
         work_list = deque()
         seen = set()
 
-        seen.update(rev_dict[sha][0])
-        work_list.extend(rev_dict[sha][0])
+        i = rev_graph.index(sha)
+        if i is None:
+            return
+
+        _children = rev_graph.children(i)
+        seen.update(_children)
+        work_list.extend(_children)
 
         while work_list:
             p = work_list.popleft()
-            yield p
+            yield rev_graph.sha(p)
 
-            _children = set(rev_dict[p][0]) - seen
+            _children = set(rev_graph.children(p)) - seen
 
             seen.update(_children)
             work_list.extend(_children)
@@ -800,20 +1860,18 @@ class Storage(object):
         assert len(work_list) == 0
 
     def parents(self, sha):
-        db = self.get_commits()
+        graph = self.get_commits()
 
-        try:
-            return list(db[sha][1])
-        except KeyError:
+        i = graph.index(sha)
+        if i is None:
             return []
+        return [graph.sha(p) for p in graph.parents(i)]
 
     def all_revs(self):
-        return self.get_commits().iterkeys()
+        return iter(self.get_commits())
 
     def sync(self):
-        rev = self.repo.rev_list('--max-count=1', '--topo-order', '--all') \
-                       .strip()
-        return self.__rev_cache_sync(rev)
+        return self.__rev_cache_sync(self.__get_tips())
 
     @contextmanager
     def get_historian(self, sha, base_path):
@@ -916,10 +1974,67 @@ class Storage(object):
         rev1 = rev1.strip()
         rev2 = rev2.strip()
 
-        rev_dict = self.get_commits()
+        graph = self.get_commits()
+
+        i = graph.index(rev1)
+        j = graph.index(rev2)
+        return i is not None and j is not None and graph.is_ancestor(i, j)
 
-        return (rev2 in rev_dict and
-                rev2 in self.children_recursive(rev1, rev_dict))
+    def diff_tree_commits(self, revs, find_renames=False):
+        """generate `(sha, parent, changes)` tuples for each parent of the
+        given commits, where `changes` is the list of tuples `diff_tree()`
+        returns for that parent, and `parent` is `None` for root commits
+
+        A single `git diff-tree --stdin` process compares all the commits.
+        """
+        pairs = []
+        for rev in revs:
+            for parent in self.parents(rev) or [None]:
+                pairs.append((rev, parent))
+
+        # the commits are read from a temporary file, so that git doesn't
+        # block writing its output while we are writing its input
+        revs_file = tempfile.TemporaryFile()
+        try:
+            for rev, parent in pairs:
+                revs_file.write(parent and '%s %s\n' % (rev, parent) or
+                                '%s\n' % rev)
+            revs_file.seek(0)
+            args = ['-z', '-r', '--root', '--always', '--stdin']
+            if find_renames:
+                args.append('-M')
+            p = self.repo.diff_tree_pipe(revs_file, *args)
+        finally:
+            revs_file.close()
+
+        try:
+            # each commit line of the input results in a header with the
+            # commit sha, followed by `:<old-mode> <new-mode> <old-sha>
+            # <new-sha> <change>` records, each followed by one path, or
+            # two for copies and renames
+            tokens = _split_stream(p.stdout, '\0')
+            pairs = iter(pairs)
+            current = None
+            for token in tokens:
+                if token.startswith(':'):
+                    chg = token[1:].split()
+                    assert len(chg) == 5
+                    path1 = self._fs_to_unicode(tokens.next())
+                    path2 = None
+                    if chg[4][0] in 'RC':
+                        path2 = self._fs_to_unicode(tokens.next())
+                    current[2].append(tuple(chg + [path1, path2]))
+                    continue
+                if current:
+                    yield current
+                rev, parent = pairs.next()
+                assert token == rev
+                current = (rev, parent, [])
+            if current:
+                yield current
+        finally:
+            p.stdout.close()
+            p.wait()
 
     def blame(self, commit_sha, path):
         in_metadata = False
@@ -956,8 +2071,10 @@ class Storage(object):
         if find_renames:
             diff_tree_args.append('-M')
         diff_tree_args.extend([str(tree1) if tree1 else '--root',
-                               str(tree2),
-                               '--', path])
+                               str(tree2)])
+        if path:
+            # recent git versions reject empty pathspecs
+            diff_tree_args.extend(['--', path])
 
         lines = self.repo.diff_tree(*diff_tree_args).split('\0')
 
@@ -15,6 +15,8 @@
 from __future__ import with_statement 
 
 from datetime import datetime
+from itertools import groupby
+from operator import itemgetter
 import os
 import sys
 
@@ -201,6 +203,13 @@ class GitConnector(Component):
     _git_bin = PathOption('git', 'git_bin', '/usr/bin/git',
         """path to git executable (relative to trac project folder!)""")
 
+    _rev_cache_dir = PathOption('git', 'rev_cache_dir', '',
+        """directory where the commit graphs of the repositories are
+        stored, so that they are updated incrementally and shared between
+        processes (relative to the `conf` folder of the environment). If
+        empty, the commit graphs are only kept in memory.
+        (''since 0.13'')""")
+
 
     def get_supported_types(self):
         yield ('git', 8)
@@ -253,6 +262,7 @@ class GitConnector(Component):
                               persistent_cache=self._persistent_cache,
                               git_bin=self._git_bin,
                               git_fs_encoding=self._git_fs_encoding,
+                              rev_cache_dir=self._rev_cache_dir or None,
                               shortrev_len=self._shortrev_len,
                               rlookup_uid=rlookup_uid,
                               use_committer_id=self._use_committer_id,
@@ -360,6 +370,7 @@ class GitRepository(Repository):
                  persistent_cache=False,
                  git_bin='git',
                  git_fs_encoding='utf-8',
+                 rev_cache_dir=None,
                  shortrev_len=7,
                  rlookup_uid=lambda _: None,
                  use_committer_id=False,
@@ -376,7 +387,8 @@ class GitRepository(Repository):
 
         self.git = PyGIT.StorageFactory(path, log, not persistent_cache,
                                         git_bin=git_bin,
-                                        git_fs_encoding=git_fs_encoding) \
+                                        git_fs_encoding=git_fs_encoding,
+                                        rev_cache_dir=rev_cache_dir) \
                         .getInstance()
 
         Repository.__init__(self, 'git:'+path, self.params, log)
@@ -465,6 +477,16 @@ class GitRepository(Repository):
     def previous_rev(self, rev, path=''):
         return self.git.hist_prev_revision(rev)
 
+    def iter_changesets(self, rev):
+        diffs = groupby(self.git.diff_tree_commits(self.git.history_from(rev),
+                                                   find_renames=True),
+                        itemgetter(0))
+        for rev, rev_diffs in diffs:
+            changeset = GitChangeset(self, rev)
+            changes = changeset._get_changes((parent, diff_tree) for
+                                             _, parent, diff_tree in rev_diffs)
+            yield changeset, list(changes)
+
     def parent_revs(self, rev):
         return self.git.parents(rev)
 
@@ -688,11 +710,17 @@ class GitChangeset(Changeset):
         return properties
 
     def get_changes(self):
+        return self._get_changes(
+            (parent, self.repos.git.diff_tree(parent, self.rev,
+                                              find_renames=True))
+            for parent in self.props.get('parent', [None]))
+
+    def _get_changes(self, diffs):
+        """Generate the changes from the `(parent, diff_tree)` pairs of
+        the changeset"""
         paths_seen = set()
-        for parent in self.props.get('parent', [None]):
-            for mode1, mode2, obj1, obj2, action, path1, path2 in \
-                    self.repos.git.diff_tree(parent, self.rev,
-                                             find_renames=True):
+        for parent, diff_tree in diffs:
+            for mode1, mode2, obj1, obj2, action, path1, path2 in diff_tree:
                 path = path2 or path1
                 p_path, p_rev = path1, parent
 
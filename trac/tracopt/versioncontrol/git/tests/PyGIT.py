@@ -11,10 +11,18 @@
 # individuals. For the exact contribution history, see the revision
 # history and logs, available at http://trac.edgewall.org/log/.
 
+import logging
+import os
+import random
+import shutil
+import tempfile
 import unittest
+from hashlib import sha1
+from subprocess import Popen, PIPE
 
 from trac.test import locate
-from tracopt.versioncontrol.git.PyGIT import GitCore, Storage
+from tracopt.versioncontrol.git.PyGIT import CommitGraph, GitCore, \
+                                            GitObjectStore, GitPack, Storage
 
 
 class GitTestCase(unittest.TestCase):
@@ -32,6 +40,281 @@ class GitTestCase(unittest.TestCase):
         self.assertTrue(v['v_compatible'])
 
 
+class GitRepositoryTestCase(unittest.TestCase):
+    """Base class for tests on a small repository created with git"""
+
+    def setUp(self):
+        self.repos_path = tempfile.mkdtemp(prefix='trac-gitrepos-')
+        self._git('init', '--quiet')
+        self._git('config', 'user.name', 'Joe')
+        self._git('config', 'user.email', 'joe@example.org')
+        os.mkdir(os.path.join(self.repos_path, 'dir'))
+        for i in range(1, 21):
+            self._write('dir/file.txt', ''.join('line %d\n' % n
+                                                for n in range(i * 20)))
+            self._write('README', 'revision %d\n' % i)
+            self._git('add', 'README', 'dir/file.txt')
+            self._git('commit', '--quiet', '-m', 'change %d' % i)
+        self._git('tag', '-a', '-m', 'a tag', 'v1', 'HEAD~2')
+        self._git('branch', 'stable', 'HEAD~5')
+        self.git_dir = os.path.join(self.repos_path, '.git')
+        self.storage = Storage(self.git_dir, logging)
+
+    def tearDown(self):
+        shutil.rmtree(self.repos_path)
+
+    def _git(self, *args, **env):
+        if env:
+            env.update((k, v) for k, v in os.environ.iteritems()
+                       if k not in env)
+        p = Popen(('git',) + args, stdout=PIPE, stderr=PIPE,
+                  cwd=self.repos_path, env=env or None)
+        stdout, stderr = p.communicate()
+        self.assertEqual(0, p.returncode, stderr)
+        return stdout
+
+    def _write(self, path, content):
+        f = open(os.path.join(self.repos_path, path), 'w')
+        try:
+            f.write(content)
+        finally:
+            f.close()
+
+
+class GitObjectStoreTestCase(GitRepositoryTestCase):
+
+    def _assert_same_objects(self):
+        odb = GitObjectStore(self.git_dir)
+        for rev in self._git('rev-list', '--all').split():
+            self.assertEqual(('commit', self._git('cat-file', 'commit', rev)),
+                             odb.get_object(rev))
+            for entry in self._git('ls-tree', '-r', '-t', '-l', '-z',
+                                   rev).split('\0'):
+                if not entry:
+                    continue
+                mode, type_, sha, size = entry.split('\t')[0].split()
+                self.assertEqual((type_, self._git('cat-file', type_, sha)),
+                                 odb.get_object(sha))
+                if size != '-':
+                    self.assertEqual(int(size), odb.get_size(sha))
+
+    def test_loose_objects(self):
+        self._assert_same_objects()
+
+    def test_packed_objects(self):
+        self._git('gc', '--quiet', '--aggressive')
+        self._assert_same_objects()
+
+    def test_new_pack(self):
+        odb = GitObjectStore(self.git_dir)
+        self._git('repack', '-a', '-d', '--quiet')
+        self._git('prune')
+        head = self._git('rev-parse', 'HEAD').strip()
+        self.assertEqual('commit', odb.get_object(head)[0])
+
+    def test_removed_packs_closed(self):
+        self._git('gc', '--quiet')
+        pack_dir = os.path.join(self.git_dir, 'objects', 'pack')
+        first = [name for name in os.listdir(pack_dir)
+                 if name.endswith('.idx')]
+        closed = []
+        close = GitPack.__dict__['close']
+        def record_close(pack):
+            closed.append(os.path.basename(pack.idx_path))
+            close(pack)
+        GitPack.close = record_close
+        try:
+            odb = GitObjectStore(self.git_dir)
+            for i in range(2):
+                self._write('README', 'repacked %d\n' % i)
+                self._git('commit', '--quiet', '-a', '-m', 'repack %d' % i)
+                self._git('repack', '-a', '-d', '--quiet')
+                self._git('prune')
+                head = self._git('rev-parse', 'HEAD').strip()
+                self.assertEqual('commit', odb.get_object(head)[0])
+                # the removed pack is closed at the following rescan
+                self.assertEqual(i and first or [], closed)
+            odb.close()
+            self.assertEqual(3, len(closed))
+        finally:
+            GitPack.close = close
+
+    def test_refs(self):
+        head = self._git('rev-parse', 'HEAD').strip()
+        stable = self._git('rev-parse', 'stable').strip()
+        tag = self._git('rev-parse', 'v1').strip()
+        for packed in (False, True):
+            if packed:
+                self._git('pack-refs', '--all')
+            odb = GitObjectStore(self.git_dir)
+            self.assertEqual(head, odb.resolve_ref('HEAD'))
+            self.assertEqual(head, odb.resolve_ref('master'))
+            self.assertEqual(stable, odb.resolve_ref('heads/stable'))
+            self.assertEqual(tag, odb.resolve_ref('v1'))
+            self.assertEqual(None, odb.resolve_ref('HEAD~1'))
+            self.assertEqual({'refs/heads/master': head,
+                              'refs/heads/stable': stable},
+                             odb.get_refs('refs/heads/'))
+            self.assertEqual('refs/heads/master',
+                             odb.get_symbolic_ref('HEAD'))
+        self.assertEqual([('master', head), ('stable', stable)],
+                         self.storage._get_branches())
+
+    def test_ls_tree(self):
+        self._git('gc', '--quiet')
+        head = self._git('rev-parse', 'HEAD').strip()
+        for path in ('dir', 'dir/', 'dir/file.txt', 'README', 'missing',
+                     'dir/missing/'):
+            expected = []
+            for entry in self._git('ls-tree', '-z', '-l', head, '--',
+                                   path).split('\0'):
+                if entry:
+                    meta, name = entry.split('\t', 1)
+                    mode, type_, sha, size = meta.split()
+                    expected.append((mode, type_, sha,
+                                     size != '-' and int(size) or None, name))
+            self.assertEqual(expected, self.storage.ls_tree(head, path))
+        self.assertEqual(['README', 'dir'],
+                         [entry[4] for entry in self.storage.ls_tree('HEAD')])
+
+
+class CommitGraphTestCase(GitRepositoryTestCase):
+
+    def _assert_graph(self, storage):
+        graph = storage.get_commits()
+        revs = self._git('rev-list', '--parents', '--topo-order',
+                         '--all').splitlines()
+        self.assertEqual(len(revs), len(graph))
+        for line in revs:
+            rev, parents = line.split()[0], line.split()[1:]
+            self.assertTrue(rev in graph)
+            self.assertEqual(parents, storage.parents(rev))
+            for parent in parents:
+                self.assertTrue(rev in storage.children(parent))
+                self.assertTrue(storage.rev_is_anchestor_of(parent, rev))
+                self.assertFalse(storage.rev_is_anchestor_of(rev, parent))
+            self.assertEqual(rev, storage.fullrev(storage.shortrev(rev, 4)))
+        self.assertEqual(revs[-1].split()[0], storage.oldest_rev())
+
+    def test_build(self):
+        self._assert_graph(self.storage)
+        head = self._git('rev-parse', 'HEAD').strip()
+        stable = self._git('rev-parse', 'stable').strip()
+        self.assertEqual(head, self.storage.youngest_rev())
+        self.assertEqual([('master', head), ('stable', stable)],
+                         self.storage.get_branch_contains(stable, True))
+        self.assertEqual([head], self.storage.get_branch_contains(head))
+        self.assertEqual(None, self.storage.fullrev('0000'))
+
+    def test_persistent_cache(self):
+        cache_dir = os.path.join(self.repos_path, 'cache')
+        storage = Storage(self.git_dir, logging, rev_cache_dir=cache_dir)
+        self._assert_graph(storage)
+        [name] = os.listdir(cache_dir)
+        path = os.path.join(cache_dir, name)
+        self.assertEqual(storage.get_commits().tips,
+                         CommitGraph.load(path).tips)
+
+        # new commits are added incrementally
+        self._write('README', 'new revision\n')
+        self._git('commit', '--quiet', '-a', '-m', 'new revision')
+        self._git('checkout', '--quiet', 'stable')
+        self._write('README', 'stable revision\n')
+        self._git('commit', '--quiet', '-a', '-m', 'stable revision',
+                  GIT_COMMITTER_DATE='2030-01-01 00:00:00 +0000')
+        self.assertTrue(storage.sync())
+        self._assert_graph(storage)
+        head = self._git('rev-parse', 'HEAD').strip()
+        self.assertEqual(head, storage.youngest_rev())
+
+        # ... and shared with other instances
+        other = Storage(self.git_dir, logging, rev_cache_dir=cache_dir)
+        self.assertEqual(list(storage.get_commits()),
+                         list(other.get_commits()))
+
+        # the graph is rebuilt when commits are removed
+        self._git('reset', '--quiet', '--hard', 'HEAD~1')
+        self.assertTrue(storage.sync())
+        self._assert_graph(storage)
+        self.assertFalse(head in storage.get_commits())
+
+    def test_pruned_branch(self):
+        cache_dir = os.path.join(self.repos_path, 'cache')
+        storage = Storage(self.git_dir, logging, rev_cache_dir=cache_dir)
+        self._git('checkout', '--quiet', '-b', 'topic')
+        self._write('README', 'topic revision\n')
+        self._git('commit', '--quiet', '-a', '-m', 'topic revision')
+        topic = self._git('rev-parse', 'HEAD').strip()
+        self._git('checkout', '--quiet', 'master')
+        self._assert_graph(storage)
+        self.assertTrue(topic in storage.get_commits())
+
+        # the graph is rebuilt when the removed tips can't be found anymore
+        self._git('branch', '-D', 'topic')
+        self._git('reflog', 'expire', '--expire=now', '--all')
+        self._git('gc', '--quiet', '--prune=now')
+        self.assertTrue(storage.sync())
+        self._assert_graph(storage)
+        self.assertFalse(topic in storage.get_commits())
+
+    def test_ancestry(self):
+        # random history with merges, built in several updates
+        rand = random.Random(42)
+        parents = [[]]
+        for i in range(1, 120):
+            parents.append([rand.randrange(max(0, i - 3), i)])
+            if rand.random() < 0.3:
+                merged = rand.randrange(i)
+                if merged != parents[i][0]:
+                    parents[i].append(merged)
+        binsha = lambda i: sha1(str(i)).digest()
+        revs = [(binsha(i), [binsha(p) for p in parents[i]])
+                for i in reversed(range(len(parents)))]
+        graph = CommitGraph.build(revs[80:], [])
+        graph = graph.update(revs[20:80], [])
+        graph = graph.update(revs[:20], [])
+        self.assertEqual([sha1(str(i)).hexdigest()
+                          for i in reversed(range(len(parents)))],
+                         list(graph))
+        ancestors = []
+        for ps in parents:
+            ancestors.append(set(ps).union(*[ancestors[p] for p in ps]))
+        ids = [graph.index(binsha(i)) for i in range(len(parents))]
+        for i in range(len(parents)):
+            for j in range(len(parents)):
+                self.assertEqual(i in ancestors[j],
+                                 graph.is_ancestor(ids[i], ids[j]))
+
+
+class StorageTestCase(GitRepositoryTestCase):
+
+    def test_diff_tree_commits(self):
+        self._git('checkout', '--quiet', 'stable')
+        self._git('mv', 'README', 'README.txt')
+        self._git('commit', '--quiet', '-m', 'rename')
+        self._git('checkout', '--quiet', 'master')
+        self._git('merge', '--quiet', '--no-edit', '-s', 'ours', 'stable')
+        self.storage.sync()
+
+        oldest = self.storage.oldest_rev()
+        revs = self.storage.history_from(oldest)
+        self.assertEqual(oldest, revs[0])
+        self.assertEqual(self.storage.youngest_rev(), revs[-1])
+        expected = []
+        for rev in revs:
+            for parent in self.storage.parents(rev) or [None]:
+                changes = self.storage.diff_tree(parent, rev,
+                                                 find_renames=True)
+                expected.append((rev, parent, list(changes)))
+        self.assertEqual(expected,
+                         list(self.storage.diff_tree_commits(revs, True)))
+        rename = self._git('rev-parse', 'stable').strip()
+        [changes] = [changes for rev, parent, changes in expected
+                     if rev == rename]
+        self.assertEqual([('R100', u'README', u'README.txt')],
+                         [change[4:] for change in changes])
+
+
 #class GitPerformanceTestCase(unittest.TestCase):
 #    """Performance test. Not really a unit test.
 #    Not self-contained: Needs a git repository and prints performance result
@@ -185,6 +468,9 @@ def suite():
     git = locate("git")
     if git:
         suite.addTest(unittest.makeSuite(GitTestCase, 'test'))
+        suite.addTest(unittest.makeSuite(GitObjectStoreTestCase, 'test'))
+        suite.addTest(unittest.makeSuite(CommitGraphTestCase, 'test'))
+        suite.addTest(unittest.makeSuite(StorageTestCase, 'test'))
     else:
         print("SKIP: tracopt/versioncontrol/git/tests/PyGIT.py (git cli "
               "binary, 'git', not found)")